@@ -20,18 +20,20 @@
 #    MA 02111-1307  USA
 #
 """
-Contains several logging utilities, such as NGAS log definition loading logic
-and file rotation with renaming.
+Contains several logging utilities, such as NGAS log definition loading logic,
+file rotation with renaming, and asynchronous logging.
 """
 import collections
 import logging.handlers
 import os
 import re
 import shutil
+import threading
 import time
 import xml.dom.minidom
 
 import six
+from six.moves import queue  # @UnresolvedImport
 
 
 # A single log definition
@@ -212,4 +214,70 @@ class ForwarderHandler(logging.Handler):
         try:
             self.fwd(self._format_record(record))
         except:
-            self.handleError(record)
\ No newline at end of file
+            self.handleError(record)
+
+class AsyncHandler(ForwarderHandler):
+    """
+    A handler that passes records down to ``handlers`` through a queue of at
+    most ``maxsize`` records, which is consumed by a dedicated writer thread.
+    Threads logging records thus never block on the I/O done by ``handlers``.
+    Records arriving while the queue is full are dropped and counted, and the
+    amount of dropped records is periodically logged.
+    """
+
+    _stop = object()
+
+    def __init__(self, handlers, maxsize=10000):
+        super(AsyncHandler, self).__init__(self._enqueue)
+        self.handlers = list(handlers)
+        self.queue = queue.Queue(maxsize)
+        self.dropped = 0
+        self._reported_drops = 0
+        self._writer = threading.Thread(target=self._write, name='LogWriter')
+        self._writer.daemon = True
+        self._writer.start()
+
+    def _enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _write(self):
+        while True:
+            record = self.queue.get()
+            if record is self._stop:
+                self._report_drops()
+                return
+            self._handle(record)
+            if self.dropped != self._reported_drops and self.queue.empty():
+                self._report_drops()
+
+    def _handle(self, record):
+        for h in self.handlers:
+            if record.levelno >= h.level:
+                h.handle(record)
+
+    def _report_drops(self):
+        dropped = self.dropped
+        if dropped == self._reported_drops:
+            return
+        msg = "Dropped %d log records because the logging queue was full"
+        record = logging.getLogger(__name__).makeRecord(
+            __name__, logging.WARNING, __file__, 0, msg,
+            (dropped - self._reported_drops,), None, func='AsyncHandler')
+        self._reported_drops = dropped
+        self._handle(record)
+
+    def flush(self):
+        for h in self.handlers:
+            h.flush()
+
+    def close(self):
+        """Writes all queued records and closes the underlying handlers"""
+        if self._writer.is_alive():
+            self.queue.put(self._stop)
+            self._writer.join()
+        for h in self.handlers:
+            h.close()
+        super(AsyncHandler, self).close()
@@ -0,0 +1,211 @@
+#
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2019
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+#
+"""
+Simple counters, gauges and histograms that can be rendered using the
+Prometheus text exposition format.
+
+Metrics are kept in a registry, and are identified by their name. Each metric
+can have a fixed set of label names, and keeps one value (or set of buckets)
+per combination of label values, which are given as keyword arguments when
+the metric is updated. Alternatively, the values of counters and gauges can be
+obtained from a function when they are rendered. Metrics are created through
+the registry, which returns the existing metric if one with the same name was
+already created.
+"""
+
+import bisect
+import collections
+import threading
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Suitable for most latencies we measure, from DB queries to file transfers
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5,
+                   5, 10, 30, 60, 120, 300)
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+def _fmt_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+def _fmt_labels(names, values):
+    if not names:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (n, _escape(v)) for n, v in zip(names, values))
+
+class _metric(object):
+
+    typ = None
+
+    def __init__(self, name, doc, labelnames=(), function=None):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self.function = function
+        self._values = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError("%s expects labels %r, got %r" % (self.name, self.labelnames, tuple(labels)))
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def get(self, **labels):
+        """The current value of this metric for the given labels"""
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def set_function(self, function):
+        """
+        Sets the function that gives the values of this metric. It returns a
+        single value for metrics without labels, or a dictionary of tuples of
+        label values to values otherwise.
+        """
+        self.function = function
+
+    def samples(self):
+        """Yields the (suffix, label names, label values, value) samples of this metric"""
+        if self.function is not None:
+            values = self.function()
+            if not self.labelnames:
+                values = {(): values}
+            values = [(tuple(str(k) for k in key), value) for key, value in values.items()]
+        else:
+            with self._lock:
+                values = list(self._values.items())
+        for key, value in values:
+            yield '', self.labelnames, key, value
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.doc),
+                 '# TYPE %s %s' % (self.name, self.typ)]
+        for suffix, names, values, value in self.samples():
+            lines.append('%s%s%s %s' % (self.name, suffix, _fmt_labels(names, values), _fmt_value(value)))
+        return '\n'.join(lines)
+
+class counter(_metric):
+    """A value that only increases"""
+
+    typ = 'counter'
+
+    def __init__(self, name, doc, labelnames=(), function=None):
+        _metric.__init__(self, name, doc, labelnames, function)
+        if not self.labelnames:
+            self._values[()] = 0
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class gauge(_metric):
+    """A value that can go up and down"""
+
+    typ = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+class histogram(_metric):
+    """Counts observed values in a fixed set of buckets, keeping also their sum"""
+
+    typ = 'histogram'
+
+    def __init__(self, name, doc, labelnames=(), buckets=DEFAULT_BUCKETS):
+        _metric.__init__(self, name, doc, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        if not self.labelnames:
+            self._values[()] = ([0] * (len(self.buckets) + 1), 0)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key, (None, 0))
+            if counts is None:
+                counts = [0] * (len(self.buckets) + 1)
+            counts[idx] += 1
+            self._values[key] = (counts, total + value)
+
+    def get(self, **labels):
+        """The (count, sum) of the values observed for the given labels"""
+        with self._lock:
+            counts, total = self._values.get(self._key(labels), ((), 0))
+            return sum(counts), total
+
+    def samples(self):
+        with self._lock:
+            values = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        bucket_names = self.labelnames + ('le',)
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield '_bucket', bucket_names, key + (_fmt_value(bound),), cumulative
+            yield '_sum', self.labelnames, key, total
+            yield '_count', self.labelnames, key, cumulative
+
+class registry(object):
+    """A collection of metrics, which are rendered together"""
+
+    def __init__(self):
+        self._metrics = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError("Metric %s already exists as a %s" % (name, metric.typ))
+            return metric
+
+    def counter(self, name, doc, labelnames=(), function=None):
+        return self._get_or_create_with_function(counter, name, doc, labelnames, function)
+
+    def gauge(self, name, doc, labelnames=(), function=None):
+        return self._get_or_create_with_function(gauge, name, doc, labelnames, function)
+
+    def _get_or_create_with_function(self, cls, name, doc, labelnames, function):
+        metric = self._get_or_create(cls, name, doc, labelnames)
+        if function is not None:
+            metric.set_function(function)
+        return metric
+
+    def histogram(self, name, doc, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(histogram, name, doc, labelnames, buckets=buckets)
+
+    def render(self):
+        """Renders all metrics using the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return ''.join(m.render() + '\n' for m in metrics)
+
+# The registry used by default by the server and the database layer
+default_registry = registry()
@@ -743,9 +743,27 @@ class ngamsConfig:
                  * 0: ``crc32`` (using python's binascii implementation w/o masking)
                  * 1: ``crc32c`` (using Intel's SSE 4.2 implementation via the ``crc32c`` module)
                  * 2: ``crc32z`` (using python's binascii implementation w/ masking)
+                 * 3: ``xxhash64`` (via the ``xxhash`` module)
+                 * 4: ``blake3`` (via the ``blake3`` module)
+                 * 5: ``crc64`` (via the ``crcmod`` module)
+                 * The name of any of the above variants, or of any other
+                   registered variant or tree variant (e.g., ``crc32c-tree``)
         """
         par = "ArchiveHandling[1].CRCVariant"
-        return getInt(par, self.getVal(par), 0)
+        val = self.getVal(par)
+        if val is not None and not str(val).strip().lstrip('-').isdigit():
+            return str(val).strip()
+        return getInt(par, val, 0)
+
+    def getChecksumWorkers(self):
+        """
+        Get the number of threads calculating in parallel the checksums of
+        the chunks of a file when using tree checksum variants.
+
+        Returns:   Number of checksum threads (integer).
+        """
+        par = "ArchiveHandling[1].ChecksumWorkers"
+        return getInt(par, self.getVal(par), 4)
 
 
     def getBlockSize(self):
@@ -1192,6 +1210,50 @@ class ngamsConfig:
         return self.getVal("DataCheckThread[1].MinCycle")
 
 
+    def getDataCheckCycleDuration(self):
+        """
+        Return the time the Data Check Service should take to complete
+        a check cycle. If not given, the checks are carried out as fast
+        as possible.
+
+        Returns:     Data Check Cycle Duration (string|None).
+        """
+        return self.getVal("DataCheckThread[1].CycleDuration")
+
+
+    def getDataCheckMaxRate(self):
+        """
+        Return the maximum rate at which data is read from each device
+        while checking its files. 0 means no limit.
+
+        Returns:     Maximum read rate in MB/s (integer).
+        """
+        par = "DataCheckThread[1].MaxRate"
+        return getInt(par, self.getVal(par), 0)
+
+
+    def getDataCheckIdleIoPrio(self):
+        """
+        Return whether data is read with the idle I/O scheduling class
+        while checking files.
+
+        Returns:     Idle I/O priority flag (integer/0|1).
+        """
+        par = "DataCheckThread[1].IdleIoPrio"
+        return getInt(par, self.getVal(par), 0)
+
+
+    def getDataCheckDropCache(self):
+        """
+        Return whether the data read while checking files should be dropped
+        from the page cache afterwards.
+
+        Returns:     Drop Cache flag (integer/0|1).
+        """
+        par = "DataCheckThread[1].DropCache"
+        return getInt(par, self.getVal(par), 0)
+
+
     def getStreamList(self):
         """
         Get list containing the Stream objects
@@ -1325,6 +1387,24 @@ class ngamsConfig:
         return getInt(par, self.getVal(par), 0)
 
 
+    def getAsyncLogging(self):
+        """Whether log records are written by a dedicated thread or not"""
+        par = "Log[1].AsyncLogging"
+        return getInt(par, self.getVal(par), 0)
+
+
+    def getAsyncLoggingQueueSize(self):
+        """Maximum number of log records waiting to be written"""
+        par = "Log[1].AsyncLoggingQueueSize"
+        return getInt(par, self.getVal(par), 10000)
+
+
+    def getAccessLog(self):
+        """Whether a line is logged for each HTTP request or not"""
+        par = "Log[1].AccessLog"
+        return getInt(par, self.getVal(par), 0)
+
+
     def getNotifSmtpHost(self):
         """
         Return the SMTP Host for sending Notification e-mails.
@@ -1610,6 +1690,51 @@ class ngamsConfig:
         return getInt(par, self.getVal(par))
 
 
+    def getSubscrQueueBatchSize(self):
+        """
+        Return the maximum number of entries of the persistent subscription
+        queue written together in a single transaction.
+
+        Returns:         Batch size (integer).
+        """
+        par = "SubscriptionDef[1].QueueBatchSize"
+        val = getInt(par, self.getVal(par), 100)
+        return val if val > 0 else 100
+
+
+    def getSubscrQueueFlushInterval(self):
+        """
+        Return the maximum time, in seconds, status updates of the persistent
+        subscription queue are kept in memory before being written.
+
+        Returns:         Flush interval (float).
+        """
+        val = float_value(self.getVal("SubscriptionDef[1].QueueFlushInterval") or '')
+        return val if val is not None and val > 0 else 0.5
+
+
+    def getSubscrAdaptiveStreams(self):
+        """
+        Return whether the number of files delivered in parallel to each
+        Subscriber should adapt to the observed throughput and errors.
+
+        Returns:         1 = adaptive, 0 = fixed (integer/0|1).
+        """
+        par = "SubscriptionDef[1].AdaptiveStreams"
+        return getInt(par, self.getVal(par), 0)
+
+
+    def getSubscrFilterWorkers(self):
+        """
+        Return the number of threads used to evaluate the Filter Plug-Ins of
+        the Subscribers on the files that are candidates for delivery.
+
+        Returns:         Number of threads (integer).
+        """
+        par = "SubscriptionDef[1].FilterWorkers"
+        return getInt(par, self.getVal(par), 1)
+
+
     def getSubscriptionsDic(self):
         """
         Get reference to list with Subscriptions Objects.
@@ -1879,6 +2004,16 @@ class ngamsConfig:
             return 0
 
 
+    def getCachingEvictionPolicy(self):
+        """
+        Return the policy used to choose which files are removed first from
+        the cache when it exceeds its maximum size or number of files.
+
+        Returns:    FIFO, LRU, LFU or SIZE (string).
+        """
+        return (self.getVal("Caching[1].EvictionPolicy") or 'FIFO').upper()
+
+
     def _check_str(self, prop, value):
         """Check that ``value`` is of type string, and is not empty"""
         if not isinstance(value, six.string_types):
@@ -2157,7 +2292,7 @@ class ngamsConfig:
         val = self.getVal("Server[1].RequestDbBackend")
 
         # Check and normalize
-        allowed_values = (None, '', 'null', 'bsddb', 'memory')
+        allowed_values = (None, '', 'null', 'bsddb', 'memory', 'sqlite')
         if val not in allowed_values:
             raise Exception('RequestDbBackend %s not one of %s' % (val, allowed_values))
         if not val:
@@ -2165,6 +2300,149 @@ class ngamsConfig:
 
         return val
 
+    def getRequestDbSyncInterval(self):
+        """
+        Returns the interval, in seconds, at which requests are written into
+        the request database by the ``sqlite`` backend.
+        """
+        val = float_value(self.getVal("Server[1].RequestDbSyncInterval") or '')
+        return val if val is not None and val > 0 else 1.0
+
+    def getHttpServerBackend(self):
+        """
+        Returns the implementation of the HTTP server used to serve requests.
+        """
+        val = self.getVal("Server[1].HttpServerBackend")
+
+        # Check and normalize
+        allowed_values = (None, '', 'threads', 'asyncio')
+        if val not in allowed_values:
+            raise Exception('HttpServerBackend %s not one of %s' % (val, allowed_values))
+        if not val:
+            val = 'threads'
+
+        return val
+
+    def getMaxConnections(self):
+        """
+        Get the maximum number of requests that can be kept waiting
+        for a free worker when using the asyncio HTTP server backend.
+
+        Returns:   Maximum number of waiting requests (integer).
+        """
+        par = "Server[1].MaxConnections"
+        return getInt(par, self.getVal(par), 1024)
+
+    def getKeepAliveTimeout(self):
+        """
+        Get the number of seconds a persistent HTTP connection is kept open
+        waiting for a new request. 0 disables persistent connections.
+
+        Returns:   Keep-alive timeout in seconds (integer).
+        """
+        par = "Server[1].KeepAliveTimeout"
+        return getInt(par, self.getVal(par), 5)
+
+    def getChecksumCacheMaxAge(self):
+        """
+        Get the maximum age, in seconds, of the checksums kept in the
+        checksum cache of each volume. 0 disables the cache.
+
+        Returns:   Maximum age of cached checksums (integer).
+        """
+        par = "Server[1].ChecksumCacheMaxAge"
+        return getInt(par, self.getVal(par), 0)
+
+    def getFileLocationCacheSize(self):
+        """
+        Get the maximum number of file locations kept in memory to speed up
+        retrievals. 0 disables the cache.
+
+        Returns:   Maximum number of cached file locations (integer).
+        """
+        par = "Server[1].FileLocationCacheSize"
+        return getInt(par, self.getVal(par), 10000)
+
+    def getFileLocationCacheTTL(self):
+        """
+        Get the number of seconds a file location is kept in the cache of
+        file locations.
+
+        Returns:   Time-to-live of cached file locations in seconds (integer).
+        """
+        par = "Server[1].FileLocationCacheTTL"
+        return getInt(par, self.getVal(par), 60)
+
+    def getCloneWorkers(self):
+        """
+        Get the number of files cloned in parallel by a CLONE request.
+
+        Returns:   Number of cloning workers (integer).
+        """
+        par = "Server[1].CloneWorkers"
+        return getInt(par, self.getVal(par), 4)
+
+    def getCloneMaxPerSourceDisk(self):
+        """
+        Get the maximum number of files read in parallel from a single disk
+        by a CLONE request.
+
+        Returns:   Maximum number of concurrent clones per source disk (integer).
+        """
+        par = "Server[1].CloneMaxPerSourceDisk"
+        return getInt(par, self.getVal(par), 2)
+
+    def getCloneMaxPerTargetDisk(self):
+        """
+        Get the maximum number of files written in parallel into a single
+        disk by a CLONE request.
+
+        Returns:   Maximum number of concurrent clones per target disk (integer).
+        """
+        par = "Server[1].CloneMaxPerTargetDisk"
+        return getInt(par, self.getVal(par), 2)
+
+    def getRegisterWorkers(self):
+        """
+        Get the number of processes computing in parallel the checksums of
+        the files handled by a REGISTER request.
+
+        Returns:   Number of checksum processes (integer).
+        """
+        par = "Server[1].RegisterWorkers"
+        return getInt(par, self.getVal(par), 4)
+
+    def getRegisterBatchSize(self):
+        """
+        Get the number of files whose information is written into the DB
+        in a single transaction by a REGISTER request.
+
+        Returns:   Number of files per DB transaction (integer).
+        """
+        par = "Server[1].RegisterBatchSize"
+        return getInt(par, self.getVal(par), 100)
+
+    def getPreallocateFiles(self):
+        """
+        Get flag indicating if disk space for incoming files should be
+        reserved before writing their contents.
+
+        Returns:   Flag indicating if files are preallocated (integer/0|1).
+        """
+        par = "Server[1].PreallocateFiles"
+        return getInt(par, self.getVal(par), 0)
+
+    def getSpliceIncomingData(self):
+        """
+        Get flag indicating if incoming data that is not checksummed while
+        being received should be moved straight from the network into the
+        staging file by the kernel (using splice(2)) when possible.
+
+        Returns:   Flag indicating if data is spliced (integer/0|1).
+        """
+        par = "Server[1].SpliceIncomingData"
+        return getInt(par, self.getVal(par), 1)
+
     def getSubscriptionAuth(self, filename, url):
         plugin_name = self.getVal("NgamsCfg.SubscriptionAuth[1].PlugInName")
         if plugin_name is None:
@@ -41,6 +41,7 @@ import time
 from DBUtils.PooledDB import PooledDB
 import six
 
+from . import metrics
 from .ngamsCore import toiso8601, fromiso8601
 
 # Global DB Semaphore to protect critical, global DB interaction.
@@ -48,6 +49,13 @@ _globalDbSem = threading.Semaphore(1)
 
 logger = logging.getLogger(__name__)
 
+_query_time = metrics.default_registry.histogram(
+    'ngas_db_query_duration_seconds', 'Time spent running database queries',
+    ('operation',))
+_pool_wait_time = metrics.default_registry.histogram(
+    'ngas_db_pool_wait_seconds', 'Time spent waiting for a connection from the database pool')
+_sql_operations = {'SELECT', 'INSERT', 'UPDATE', 'DELETE'}
+
 # Define lay-out of ngas_disks table
 _ngasDisksDef = [["nd.disk_id",               "NGAS_DISKS_DISK_ID"],
                  ["nd.archive",               "NGAS_DISKS_ARCHIVE"],
@@ -416,6 +424,10 @@ class ngamsDbTimer:
     def __exit__(self, typ, value, traceback):
         deltaTime = (time.time() - self.__startTime)
         self.__dbConObj.updateDbTime(deltaTime)
+        operation = (self.__query.split(None, 1) or [''])[0].upper()
+        if operation not in _sql_operations:
+            operation = 'OTHER'
+        _query_time.observe(deltaTime, operation=operation)
         logger.debug("DB-TIME: Time spent for DB query: |%s|: %.6fs", self.__query, deltaTime)
 
 def cleanSrvList(srvList):
@@ -441,6 +453,13 @@ def cleanSrvList(srvList):
 
     return srvList
 
+def _get_connection(pool):
+    """Gets a connection from ``pool``, keeping track of how long it took"""
+    start = time.time()
+    conn = pool.connection()
+    _pool_wait_time.observe(time.time() - start)
+    return conn
+
 
 class ngamsDbCursor(object):
     """
@@ -452,7 +471,7 @@ class ngamsDbCursor(object):
         self.conn = None
         self.cursor = None
         try:
-            self.conn = pool.connection()
+            self.conn = _get_connection(pool)
             self.cursor = self.conn.cursor()
             self.cursor.execute(query, args)
         except:
@@ -525,7 +544,7 @@ class transaction(object):
         self.pool = pool
 
     def __enter__(self):
-        self.conn = self.pool.connection()
+        self.conn = _get_connection(self.pool)
         self.cursor = self.conn.cursor()
         return self
 
@@ -583,6 +602,19 @@ class transaction(object):
                 res = cursor.fetchall()
             return res
 
+    def executemany(self, sql, args_list):
+        """Executes `sql` once for each element of `args_list`"""
+
+        args_list = list(args_list)
+        if not args_list:
+            return
+        logger.debug("Performing SQL query %d times with parameters: %s / %r ...",
+                     len(args_list), sql, args_list[0])
+        sql, _ = self.db_core._prepare_query(sql, args_list[0])
+        args_list = [self.db_core._data_to_bind(args) for args in args_list]
+        with ngamsDbTimer(self.db_core, sql):
+            self.cursor.executemany(sql, args_list)
+
 class ngamsDbCore(object):
     """
     Core class for the NG/AMS DB interface.
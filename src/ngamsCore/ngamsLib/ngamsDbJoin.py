@@ -39,7 +39,7 @@ It should be used as part of the ngamsDbBase parent classes.
 import logging
 
 from . import ngamsDbm, ngamsDbCore, ngamsLib, ngamsFileInfo
-from .ngamsCore import rmFile
+from .ngamsCore import rmFile, getDiskSpaceAvail
 from .ngamsCore import NGAMS_FILE_STATUS_OK, NGAMS_FILE_CHK_ACTIVE,NGAMS_DB_CH_FILE_UPDATE, NGAMS_DB_CH_FILE_INSERT
 
 logger = logging.getLogger(__name__)
@@ -101,6 +101,58 @@ class ngamsDbJoin(ngamsDbCore.ngamsDbCore):
                 yield x
 
 
+    def getFileSummary1ByDisk(self,
+                              diskId,
+                              after = None,
+                              upto = None,
+                              page_size = 1000):
+        """
+        Return summary information (see getFileSummary1()) about all the
+        files of a disk, ignored or not and regardless of their status,
+        ordered by File ID and File Version.
+
+        The files are queried in pages of at most ``page_size`` files, each
+        one starting where the previous one ended. Unlike getFileSummary1(),
+        no cursor is kept open between pages, so the caller can take its time
+        to process each file.
+
+        diskId:      ID of the disk hosting the files (string).
+
+        after:       If given, only files after this (File ID, File Version)
+                     are returned (tuple|None).
+
+        upto:        If given, only files up to (and including) this
+                     (File ID, File Version) are returned (tuple|None).
+
+        page_size:   Maximum number of files queried at once (integer).
+
+        Returns:     Generator yielding the summary of each file (list).
+        """
+        cols = ngamsDbCore.getNgasSummary1Cols(self._file_ignore_columnname)
+        while True:
+            sql, vals = self.buildFileSummary1Query(cols, diskIds=[diskId],
+                                                    fileStatus=[], order=0)
+            sql = [sql]
+            if after:
+                sql.append(" AND (nf.file_id > {} OR "
+                           "(nf.file_id = {} AND nf.file_version > {}))")
+                vals += [after[0], after[0], after[1]]
+            if upto:
+                sql.append(" AND (nf.file_id < {} OR "
+                           "(nf.file_id = {} AND nf.file_version <= {}))")
+                vals += [upto[0], upto[0], upto[1]]
+            sql.append(" ORDER BY nf.file_id, nf.file_version LIMIT {}")
+            vals.append(page_size)
+
+            res = self.query2(''.join(sql), args=vals)
+            for x in res:
+                yield x
+            if len(res) < page_size:
+                return
+            last = res[-1]
+            after = (last[ngamsDbCore.SUM1_FILE_ID], last[ngamsDbCore.SUM1_VERSION])
+
+
     def getFileSummary1SingleFile(self,
                                   diskId,
                                   fileId,
@@ -270,6 +322,44 @@ class ngamsDbJoin(ngamsDbCore.ngamsDbCore):
         return self.query2(''.join(sql), args = vals)
 
 
+    def getFileSummary3Multiple(self,
+                                fileIds,
+                                batchSize = 500):
+        """
+        Like getFileSummary3, but for several files at once. Instead of
+        issuing one query per file, files are looked up in batches of
+        `batchSize` files per query.
+
+        The resulting file information will be:
+
+          <File ID>, <Host ID>, <Ip Address>, <Port>, <Mountpoint>,
+          <Filename>, <File Version>, <format>, <File Size>, <Compression>
+
+        All versions of all files are returned, in no particular order.
+
+        fileIds:           IDs of the files to retrieve (list).
+
+        batchSize:         Maximum number of files looked up per query
+                           (integer).
+
+        Returns:           List with the file information (list).
+        """
+        fileIds = list(set(fileIds))
+        res = []
+        for i in range(0, len(fileIds), batchSize):
+            batch = fileIds[i:i + batchSize]
+            sql = ("SELECT nf.file_id, nh.host_id, nh.ip_address, nh.srv_port, "
+                   "nd.mount_point, nf.file_name, nf.file_version, "
+                   "nf.format, nf.file_size, nf.compression "
+                   "FROM ngas_files nf, ngas_disks nd, ngas_hosts nh "
+                   "WHERE nf.file_id IN (%s) AND nf.disk_id=nd.disk_id AND "
+                   "nd.host_id=nh.host_id AND nf.%s=0 AND "
+                   "nf.file_status='00000000'") % (', '.join(['{}'] * len(batch)),
+                                                   self._file_ignore_columnname)
+            res += self.query2(sql, args=batch)
+        return res
+
+
     def getFileSummarySpuriousFiles1(self,
                                      hostId = None,
                                      diskId = None,
@@ -860,6 +950,128 @@ class ngamsDbJoin(ngamsDbCore.ngamsDbCore):
         self.triggerEvents([diskId, None])
 
 
+    def writeFileEntries(self,
+                         hostId,
+                         fileInfoList,
+                         genSnapshot = 1,
+                         updateDiskInfo = 0):
+        """
+        Bulk version of writeFileEntry(). The information of the files given
+        as File Info Objects is written in the NGAS DB, updating the existing
+        entries and inserting the rest, all within a single transaction.
+        Updates and inserts are each carried out by a single statement
+        executed for all files. Files must have a version.
+
+        hostId:          ID of the host writing the entries (string).
+
+        fileInfoList:    File Info Objects of the files (list/ngamsFileInfo).
+
+        genSnapshot:     Generate snapshot files (integer/0|1).
+
+        updateDiskInfo:  Update also the counters of the disks hosting the
+                         files in the same transaction: the number of files
+                         (for new entries only), bytes stored, total write
+                         time and available space (integer/0|1).
+
+        Returns:         Void.
+        """
+        if not fileInfoList:
+            return
+
+        existing = self.filesInDb([fio.getFileId() for fio in fileInfoList])
+        inserts = []
+        updates = []
+        for fio in fileInfoList:
+            key = (fio.getDiskId(), fio.getFileId(), int(fio.getFileVersion()))
+            if key in existing:
+                updates.append(fio)
+            else:
+                inserts.append(fio)
+                existing.add(key)
+
+        def vals(fio):
+            ignore = fio.getIgnore()
+            if ignore == -1:
+                ignore = 0
+            checksum = fio.getChecksum()
+            checksum = str(checksum) if checksum else None
+            return (fio.getDiskId(), fio.getFilename(), fio.getFileId(),
+                    fio.getFileVersion(), fio.getFormat(), fio.getFileSize(),
+                    fio.getUncompressedFileSize(), fio.getCompression(),
+                    self.convertTimeStamp(fio.getIngestionDate()), ignore,
+                    checksum, fio.getChecksumPlugIn(), fio.getFileStatus(),
+                    self.convertTimeStamp(fio.getCreationDate()),
+                    int(fio.getIoTime()*1000), fio.getIngestionRate())
+
+        insert_sql = ("INSERT INTO ngas_files (disk_id, file_name, file_id,"
+                      "file_version, format, file_size, uncompressed_file_size,"
+                      " compression, ingestion_date, %s, checksum, "
+                      "checksum_plugin, file_status, creation_date, io_time, "
+                      "ingestion_rate) VALUES ({}, {}, {}, {}, {}, {}, {}, {},"
+                      " {}, {}, {},{}, {}, {}, {}, {})" % (self._file_ignore_columnname,))
+
+        # As in writeFileEntry, only a limited set of columns can be modified
+        update_sql = ("UPDATE ngas_files SET "
+                      "file_name={}, format={}, file_size={}, "
+                      "uncompressed_file_size={}, compression={}, "
+                      "%s={}, checksum={}, checksum_plugin={}, "
+                      "file_status={}, creation_date={}, io_time={}, "
+                      "ingestion_rate={} WHERE disk_id={} AND file_id={} "
+                      "AND file_version={}" % (self._file_ignore_columnname,))
+
+        def update_vals(fio):
+            v = vals(fio)
+            return (v[1], v[4], v[5], v[6], v[7], v[9], v[10], v[11], v[12],
+                    v[13], v[14], v[15], v[0], v[2], v[3])
+
+        with self.transaction() as t:
+            t.executemany(insert_sql, [vals(fio) for fio in inserts])
+            t.executemany(update_sql, [update_vals(fio) for fio in updates])
+            if updateDiskInfo:
+                self._updateDiskCounters(t, fileInfoList, inserts)
+
+        # Create the Temporary DB Change Snapshot Documents if requested.
+        if (self.getCreateDbSnapshot() and genSnapshot):
+            if inserts:
+                self.createDbFileChangeStatusDoc(hostId, NGAMS_DB_CH_FILE_INSERT,
+                                                 inserts)
+            if updates:
+                self.createDbFileChangeStatusDoc(hostId, NGAMS_DB_CH_FILE_UPDATE,
+                                                 updates)
+
+        for diskId in set(fio.getDiskId() for fio in fileInfoList):
+            self.triggerEvents([diskId, None])
+
+
+    def _updateDiskCounters(self, t, fileInfoList, inserts):
+        """
+        Updates the counters of the disks hosting the given files within
+        transaction `t`, with a single statement for all disks.
+        """
+        counters = {}
+        for fio in fileInfoList:
+            c = counters.setdefault(fio.getDiskId(), [0, 0, 0.])
+            c[1] += fio.getFileSize()
+            c[2] += max(fio.getIoTime(), 0)
+        for fio in inserts:
+            counters[fio.getDiskId()][0] += 1
+
+        diskIds = list(counters)
+        sql = ("SELECT disk_id, mount_point FROM ngas_disks "
+               "WHERE disk_id IN (%s)") % ', '.join(['{}'] * len(diskIds))
+        mtPts = dict(t.execute(sql, diskIds))
+
+        sql = ("UPDATE ngas_disks SET "
+               "number_of_files=(number_of_files + {}), "
+               "bytes_stored=(bytes_stored + {}), "
+               "total_disk_write_time=(total_disk_write_time + {}), "
+               "available_mb={} WHERE disk_id={}")
+        t.executemany(sql, [(n, size, ioTime,
+                             getDiskSpaceAvail(mtPts[diskId]), diskId)
+                            for diskId, (n, size, ioTime) in counters.items()
+                            if diskId in mtPts])
+
+
     def getClusterReadyArchivingUnits(self,
                                       clusterName):
         """
@@ -103,6 +103,30 @@ class ngamsDbNgasCache(ngamsDbCore.ngamsDbCore):
         return self
 
 
+    def updateCacheEntries(self,
+                           fileRefs,
+                           delete):
+        """
+        Like updateCacheEntry, but for several cached data objects at once,
+        within a single transaction.
+
+        fileRefs:      (Disk ID, File ID, File Version) tuples of the cached
+                       data objects (list).
+
+        delete:        Entries scheduled for deletion (integer/0|1).
+
+        Returns:       Reference to object itself.
+        """
+        sqlQuery = "UPDATE ngas_cache SET cache_delete = {0} WHERE " +\
+                   "disk_id = {1} AND file_id = {2} AND file_version = {3}"
+        delete = 1 if delete else 0
+        with self.transaction() as t:
+            t.executemany(sqlQuery, [(delete, diskId, fileId, int(fileVersion))
+                                     for diskId, fileId, fileVersion in fileRefs])
+
+        return self
+
+
     def deleteCacheEntry(self,
                          diskId,
                          fileId,
@@ -107,6 +107,31 @@ class ngamsDbNgasFiles(ngamsDbCore.ngamsDbCore):
             return 1
         return 0
 
+    def filesInDb(self,
+                  fileIds,
+                  batchSize = 500):
+        """
+        Like fileInDb, but for several files at once, returning where all
+        their copies are registered. Instead of issuing one query per file,
+        files are looked up in batches of `batchSize` files per query.
+
+        fileIds:       IDs of the files to look for (list).
+
+        batchSize:     Maximum number of files looked up per query (integer).
+
+        Returns:       Set of (Disk ID, File ID, File Version) tuples, one
+                       for each copy of the files found (set).
+        """
+        fileIds = list(set(fileIds))
+        res = set()
+        for i in range(0, len(fileIds), batchSize):
+            batch = fileIds[i:i + batchSize]
+            sql = ("SELECT disk_id, file_id, file_version FROM ngas_files "
+                   "WHERE file_id IN (%s)") % ', '.join(['{}'] * len(batch))
+            res.update((diskId, fileId, int(fileVersion))
+                       for diskId, fileId, fileVersion in self.query2(sql, args=batch))
+        return res
+
 
     def getFileInfoFromDiskIdFilename(self,
                                       diskId,
@@ -229,6 +254,36 @@ class ngamsDbNgasFiles(ngamsDbCore.ngamsDbCore):
             return res[0][0]
         raise Exception('File not found in ngas db - %s,%s,%d' % (fileId, diskId, fileVersion))
 
+    def getFileStatuses(self,
+                        fileRefs,
+                        batchSize = 500):
+        """
+        Like getFileStatus, but for several files at once. Instead of issuing
+        one query per file, files are looked up in batches of `batchSize`
+        files per query.
+
+        fileRefs:      (Disk ID, File ID, File Version) tuples of the files
+                       to look for (list).
+
+        batchSize:     Maximum number of files looked up per query (integer).
+
+        Returns:       Dictionary with the (Disk ID, File ID, File Version)
+                       of each file found as keys and its File Status
+                       (8 bits) as values (dictionary).
+        """
+        fileRefs = set((diskId, fileId, int(fileVersion)) for diskId, fileId, fileVersion in fileRefs)
+        fileIds = list(set(fileId for _, fileId, _ in fileRefs))
+        res = {}
+        for i in range(0, len(fileIds), batchSize):
+            batch = fileIds[i:i + batchSize]
+            sql = ("SELECT disk_id, file_id, file_version, file_status FROM ngas_files "
+                   "WHERE file_id IN (%s)") % ', '.join(['{}'] * len(batch))
+            for diskId, fileId, fileVersion, fileStatus in self.query2(sql, args=batch):
+                fileRef = (diskId, fileId, int(fileVersion))
+                if fileRef in fileRefs:
+                    res[fileRef] = fileStatus or '00000000'
+        return res
+
     def deleteFileInfo(self,
                        hostId,
                        diskId,
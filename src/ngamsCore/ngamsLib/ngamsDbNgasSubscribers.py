@@ -369,6 +369,46 @@ class ngamsDbNgasSubscribers(ngamsDbCore.ngamsDbCore):
                 ingestionDate, format, status, self.convertTimeStamp(status_date), comment)
         self.query2(sql, args = vals)
 
+    def addSubscrQueueEntries(self, entries):
+        """
+        Add several files to the persistent queue in a single transaction.
+        Each entry is a tuple with the arguments taken by addSubscrQueueEntry
+        (including the comment). If any entry cannot be added (e.g., because
+        it is already in the queue) none of them is.
+        """
+        sql = ("INSERT INTO ngas_subscr_queue "
+                "(subscr_id, file_id, file_version, "
+                "disk_id, file_name, ingestion_date, "
+                "format, status, status_date, %s) "
+                "VALUES ({}, {}, {}, {}, {}, {}, {}, {}, {}, {})") % (self.comment_colname(),)
+        vals = [entry[:8] + (self.convertTimeStamp(entry[8]), entry[9])
+                for entry in entries]
+        with self.transaction() as t:
+            t.executemany(sql, vals)
+
+    def updateSubscrQueueEntries(self, entries):
+        """
+        Update the status of several files in the persistent queue in a single
+        transaction. Each entry is a tuple with the arguments taken by
+        updateSubscrQueueEntry (including the comment); as with that method
+        the comment is left untouched when it is not given.
+        """
+        sql_no_comment = ("UPDATE ngas_subscr_queue SET status={}, status_date={} "
+                          "WHERE subscr_id={} AND file_id={} AND file_version={} AND disk_id={}")
+        sql_comment = ("UPDATE ngas_subscr_queue SET status={}, status_date={}, %s={} "
+                       "WHERE subscr_id={} AND file_id={} AND file_version={} AND disk_id={}") % (self.comment_colname(),)
+        no_comment, comment = [], []
+        for subscrId, fileId, fileVersion, diskId, status, status_date, cmt in entries:
+            status_date = self.convertTimeStamp(status_date)
+            key = (subscrId, fileId, fileVersion, diskId)
+            if cmt:
+                comment.append((status, status_date, cmt) + key)
+            else:
+                no_comment.append((status, status_date) + key)
+        with self.transaction() as t:
+            t.executemany(sql_no_comment, no_comment)
+            t.executemany(sql_comment, comment)
+
     def addSubscrBackLogEntry(self,
                               hostId,
                               portNo,
@@ -23,15 +23,18 @@
 Module containing HTTP utility code (mostly client-side)
 """
 
+import collections
 import contextlib
 import errno
 import io
 import logging
 import os
 import socket
+import threading
 import time
 import sys
 
+import six
 from six.moves import http_client as httplib  # @UnresolvedImport
 from six.moves.urllib import parse as urlparse  # @UnresolvedImport
 import requests
@@ -77,6 +80,149 @@ def _connect(conn):
             time.sleep(0.001 * ms)
 
 
+_pool_max_idle_per_host = 4
+_pool_max_idle_time = 4.
+if 'NGAS_HTTP_POOL_MAX_IDLE_PER_HOST' in os.environ:
+    _pool_max_idle_per_host = int(os.environ['NGAS_HTTP_POOL_MAX_IDLE_PER_HOST'])
+if 'NGAS_HTTP_POOL_MAX_IDLE_TIME' in os.environ:
+    _pool_max_idle_time = float(os.environ['NGAS_HTTP_POOL_MAX_IDLE_TIME'])
+
+class _pooled_response(httplib.HTTPResponse):
+    """An HTTP response that gives its connection back to its pool when closed"""
+
+    release = None
+
+    def close(self):
+        # The body has been fully read if the underlying file object has
+        # been closed already, in which case the connection can be reused
+        # (unless the server said it would close it)
+        reusable = self.isclosed() and not self.will_close
+        httplib.HTTPResponse.close(self)
+        if self.release:
+            release, self.release = self.release, None
+            release(reusable)
+
+class _pooled_connection(httplib.HTTPConnection):
+    response_class = _pooled_response
+
+def _is_open(conn):
+    # Responses that are not explicitly closed are closed (and their
+    # connections given back to the pool) when garbage collected, and the
+    # connection's socket might get finalized at the same time
+    return conn.sock is not None and conn.sock.fileno() >= 0
+
+class connection_pool(object):
+    """
+    A pool of idle, persistent HTTP connections indexed by host and port.
+
+    Connections are given back to the pool when the response obtained through
+    them is closed after being fully read. Connections that have been idle for
+    longer than ``max_idle_time`` seconds are discarded, as servers usually
+    close them on their side after a few seconds.
+    """
+
+    def __init__(self, max_idle_per_host, max_idle_time):
+        self.max_idle_per_host = max_idle_per_host
+        self.max_idle_time = max_idle_time
+        self._idle = collections.defaultdict(list)
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+        self.discarded = 0
+
+    def get(self, host, port, timeout=None):
+        """Returns an idle connection to host:port, or None if there is none"""
+        now = time.time()
+        with self._lock:
+            idle = self._idle[(host, port)]
+            while idle:
+                conn, last_used = idle.pop()
+                if now - last_used <= self.max_idle_time and _is_open(conn):
+                    self.reused += 1
+                    break
+                self.discarded += 1
+                conn.close()
+            else:
+                return None
+        conn.timeout = timeout
+        conn.sock.settimeout(timeout)
+        return conn
+
+    def new(self, host, port, timeout=None):
+        """Returns a new, unconnected connection to host:port"""
+        with self._lock:
+            self.created += 1
+        return _pooled_connection(host, port, timeout=timeout)
+
+    def put(self, host, port, conn, reusable):
+        """Gives ``conn`` back to the pool, closing it if not reusable"""
+        if reusable and self.max_idle_per_host > 0:
+            with self._lock:
+                idle = self._idle[(host, port)]
+                if len(idle) < self.max_idle_per_host:
+                    idle.append((conn, time.time()))
+                    return
+                self.discarded += 1
+        conn.close()
+
+    def clear(self):
+        """Closes all idle connections"""
+        with self._lock:
+            for idle in self._idle.values():
+                for conn, _ in idle:
+                    conn.close()
+            self._idle.clear()
+
+    @property
+    def idle_count(self):
+        with self._lock:
+            return sum(len(idle) for idle in self._idle.values())
+
+    def stats(self):
+        """Returns a dictionary with the statistics of this pool"""
+        return {'created': self.created, 'reused': self.reused,
+                'discarded': self.discarded, 'idle': self.idle_count}
+
+pool = connection_pool(_pool_max_idle_per_host, _pool_max_idle_time)
+"""The pool of persistent connections used by this module"""
+
+# https requests go through requests, which keeps its own pool of connections
+_https_session = requests.Session()
+
+def _send_request(conn, method, url, data, hdrs, is_file):
+
+    try:
+        if is_file:
+            conn.request(method, url, headers=hdrs)
+            pysendfile.sendfile(conn.sock, data)
+        else:
+            conn.request(method, url, body=data, headers=hdrs)
+        logger.debug("%s request sent to, waiting for a response", method)
+    except socket.error as e:
+
+        # If the server closes the connection while we write data
+        # we still try to read the response, if any
+        #
+        # In OSX >= 10.10 this error can come up as EPROTOTYPE instead of EPIPE
+        # (although the error code is not mentioned in send(2)). The actual
+        # error recognised by the kernel in this situation is slightly different,
+        # but still due to remote end closing the connection. For a full, nice
+        # explanation of this see:
+        #
+        # https://erickt.github.io/blog/2014/11/19/adventures-in-debugging-a-potential-osx-kernel-bug/
+        tolerate = e.errno in (errno.EPROTOTYPE, errno.EPIPE)
+        if not tolerate:
+            try:
+                conn.close()
+            except:
+                pass
+            raise
+
+    start = time.time()
+    response = conn.getresponse()
+    logger.debug("Response to %s request received within %.4f [s]", method, time.time() - start)
+    return response
+
 def _http_response(host, port, method, cmd,
                  data=None, timeout=None,
                  pars=[], hdrs={}):
@@ -123,40 +269,32 @@ def _http_response(host, port, method, cmd,
 
     # Go, go, go!
     logger.info("About to %s to %s:%d/%s", method, host, port, url)
-    conn = httplib.HTTPConnection(host, port, timeout = timeout)
-    _connect(conn)
-
-    try:
-        if is_file:
-            conn.request(method, url, headers=hdrs)
-            pysendfile.sendfile(conn.sock, data)
-        else:
-            conn.request(method, url, body=data, headers=hdrs)
-        logger.debug("%s request sent to, waiting for a response", method)
-    except socket.error as e:
 
-        # If the server closes the connection while we write data
-        # we still try to read the response, if any
-        #
-        # In OSX >= 10.10 this error can come up as EPROTOTYPE instead of EPIPE
-        # (although the error code is not mentioned in send(2)). The actual
-        # error recognised by the kernel in this situation is slightly different,
-        # but still due to remote end closing the connection. For a full, nice
-        # explanation of this see:
-        #
-        # https://erickt.github.io/blog/2014/11/19/adventures-in-debugging-a-potential-osx-kernel-bug/
-        tolerate = e.errno in (errno.EPROTOTYPE, errno.EPIPE)
-        if not tolerate:
-            try:
-                conn.close()
-            except:
-                pass
+    # Try first with an idle connection from the pool. The server might have
+    # closed it in the meanwhile, in which case we try again with a new
+    # connection, but only if we can send the request body again
+    conn = pool.get(host, port, timeout=timeout)
+    if conn is not None:
+        try:
+            response = _send_request(conn, method, url, data, hdrs, is_file)
+        except socket.timeout:
+            conn.close()
             raise
+        except (socket.error, httplib.HTTPException):
+            conn.close()
+            if not (data is None or is_file or isinstance(data, (bytes, six.text_type))):
+                raise
+            logger.debug("Persistent connection to %s:%d was closed, using a new one", host, port)
+            if is_file:
+                data.seek(0)
+        else:
+            response.release = lambda reusable: pool.put(host, port, conn, reusable)
+            return response
 
-    start = time.time()
-    response = conn.getresponse()
-    logger.debug("Response to %s request received within %.4f [s]", method, time.time() - start)
-
+    conn = pool.new(host, port, timeout=timeout)
+    _connect(conn)
+    response = _send_request(conn, method, url, data, hdrs, is_file)
+    response.release = lambda reusable: pool.put(host, port, conn, reusable)
     return response
 
 
@@ -175,17 +313,8 @@ def httpPost(host, port, cmd, data, mimeType, pars=[], hdrs={},
     Additional headers can be passed as a dictionary via `hdrs`.
     """
 
-    logger.debug("About to POST to %s:%d/%s", host, port, cmd)
-
-    # Prepare all headers that need to be sent
-    hdrs = dict(hdrs)
-    hdrs["Content-Type"] = mimeType
-    if contDisp:
-        hdrs["Content-Disposition"] = contDisp
-    if auth:
-        hdrs["Authorization"] = auth.strip()
-
-    resp = _http_response(host, port, 'POST', cmd, data, timeout, pars, hdrs)
+    resp = httpPostResponse(host, port, cmd, data, mimeType, pars=pars, hdrs=hdrs,
+                            timeout=timeout, contDisp=contDisp, auth=auth)
     with contextlib.closing(resp):
 
         # Receive + unpack reply.
@@ -198,8 +327,9 @@ def httpPost(host, port, cmd, data, mimeType, pars=[], hdrs={},
             for hdr in hdrs.keys():
                 logger.debug("HTTP Header: %s: %s", hdr, hdrs[hdr])
 
-        # How much do we need to read?
-        size = 0
+        # How much do we need to read? Without a Content-Length we read until
+        # the end of the response (e.g., when using chunked transfer encoding)
+        size = None
         if "content-length" in resp.msg:
             size = int(resp.msg["content-length"])
 
@@ -207,10 +337,12 @@ def httpPost(host, port, cmd, data, mimeType, pars=[], hdrs={},
         bs = 65536
         with contextlib.closing(io.BytesIO()) as out:
             readin = 0
-            while readin < size:
-                left = size - readin
+            while size is None or readin < size:
+                left = bs if size is None else size - readin
                 buff = resp.read(bs if left >= bs else left)
                 if not buff:
+                    if size is None:
+                        break
                     raise Exception('error reading data')
                 out.write(buff)
                 readin += len(buff)
@@ -219,6 +351,28 @@ def httpPost(host, port, cmd, data, mimeType, pars=[], hdrs={},
         return [reply, msg, hdrs, data]
 
 
+def httpPostResponse(host, port, cmd, data, mimeType, pars=[], hdrs={},
+                     timeout=None, contDisp=None, auth=None):
+    """
+    Like `httpPost`, but returns the HTTP response object from which the
+    response can be read instead of reading it fully.
+    It is the callers' responsibility to close the response object,
+    which in turn will close the HTTP connection.
+    """
+
+    logger.debug("About to POST to %s:%d/%s", host, port, cmd)
+
+    # Prepare all headers that need to be sent
+    hdrs = dict(hdrs)
+    hdrs["Content-Type"] = mimeType
+    if contDisp:
+        hdrs["Content-Disposition"] = contDisp
+    if auth:
+        hdrs["Authorization"] = auth.strip()
+
+    return _http_response(host, port, 'POST', cmd, data, timeout, pars, hdrs)
+
+
 def httpPostUrl(url, data, mimeType, hdrs={},
                 timeout=None, contDisp=None, auth=None, pars=[]):
     """
@@ -240,7 +394,7 @@ def httpPostUrl(url, data, mimeType, hdrs={},
             hdrs["Authorization"] = auth.strip()
             auth = None
 
-        resp = requests.post(
+        resp = _https_session.post(
             url, data=data, headers=hdrs, timeout=timeout, auth=auth,
             params=pars, verify=cert_path if cert_path is not None else True,
             cert=(client_cert, client_key),
@@ -289,10 +443,10 @@ def httpGetUrl(url, pars=[], hdrs={}, timeout=None, auth=None):
             # this passes on the internals of ngas' auth setup
             hdrs["Authorization"] = auth.strip()
             auth = None
-        resp = requests.get(
+        resp = _https_session.get(
             url, headers=hdrs, timeout=timeout, auth=auth, params=pars,
             verify=cert_path if cert_path is not None else True,
-            cert=(client_cert, client_key),
+            cert=(client_cert, client_key), stream=True,
         )
         resp.status = resp.status_code
         return resp
@@ -323,4 +477,127 @@ class sizeaware(object):
         return buf
 
     def __len__(self):
-        return self.size
\ No newline at end of file
+        return self.size
+
+def parse_range_header(value):
+    """
+    Parses the value of a ``Range`` header (RFC 7233) into a list of
+    ``(first, last)`` byte positions. ``last`` is ``None`` for ranges open
+    on their end, while ``first`` is ``None`` for suffix ranges, in which
+    case ``last`` is the suffix length. Raises ``ValueError`` if ``value``
+    is not a valid bytes range specification.
+    """
+    unit, sep, specs = value.partition('=')
+    if not sep or unit.strip().lower() != 'bytes':
+        raise ValueError("Unsupported range unit in %r" % value)
+
+    ranges = []
+    for spec in specs.split(','):
+        spec = spec.strip()
+        if not spec:
+            continue
+        first, sep, last = spec.partition('-')
+        first, last = first.strip(), last.strip()
+        if not sep or not (first or last):
+            raise ValueError("Invalid byte range: %r" % spec)
+        if (first and not first.isdigit()) or (last and not last.isdigit()):
+            raise ValueError("Invalid byte range: %r" % spec)
+        first = int(first) if first else None
+        last = int(last) if last else None
+        if first is not None and last is not None and last < first:
+            raise ValueError("Invalid byte range: %r" % spec)
+        ranges.append((first, last))
+
+    if not ranges:
+        raise ValueError("No byte ranges in %r" % value)
+    return ranges
+
+def format_range_header(ranges):
+    """The inverse of `parse_range_header`"""
+    def _fmt(x):
+        return '' if x is None else str(x)
+    return 'bytes=' + ','.join('%s-%s' % (_fmt(f), _fmt(l)) for f, l in ranges)
+
+def satisfiable_ranges(ranges, size):
+    """
+    Resolves the byte ``ranges`` returned by `parse_range_header` against a
+    representation of ``size`` bytes, returning the list of satisfiable
+    ``(start, end)`` ranges (both inclusive). Overlapping and adjacent ranges
+    are coalesced, so the result is sorted when it contains more than one
+    range. An empty list means that none of the ranges can be satisfied.
+    """
+    resolved = []
+    for first, last in ranges:
+        if first is None:
+            if last == 0:
+                continue
+            start = max(size - last, 0)
+            end = size - 1
+        else:
+            if first >= size:
+                continue
+            start = first
+            end = size - 1 if last is None else min(last, size - 1)
+        resolved.append((start, end))
+
+    if len(resolved) < 2:
+        return resolved
+
+    coalesced = []
+    for start, end in sorted(resolved):
+        if coalesced and start <= coalesced[-1][1] + 1:
+            coalesced[-1] = (coalesced[-1][0], max(end, coalesced[-1][1]))
+        else:
+            coalesced.append((start, end))
+    return coalesced
+
+def parse_content_range(value):
+    """
+    Parses the value of a ``Content-Range`` header into a
+    ``(start, end, size)`` tuple. ``size`` is ``None`` if unknown.
+    """
+    unit, _, spec = value.strip().partition(' ')
+    byte_range, _, size = spec.partition('/')
+    start, _, end = byte_range.partition('-')
+    if unit.lower() != 'bytes' or not (start.isdigit() and end.isdigit()):
+        raise ValueError("Invalid Content-Range: %r" % value)
+    size = None if size == '*' else int(size)
+    return int(start), int(end), size
+
+def byteranges_parts(f, boundary):
+    """
+    Iterates over the parts of a ``multipart/byteranges`` body read from
+    ``f`` using ``boundary``, yielding ``(start, end, size, reader)`` tuples,
+    where ``reader`` is a file-like object returning the data of the part.
+    Each reader must be consumed before moving on to the next part.
+    """
+
+    delimiter = b'--' + six.b(boundary)
+    while True:
+        line = f.readline()
+        if not line:
+            raise ValueError("Unexpected end of multipart/byteranges body")
+        line = line.rstrip(b'\r\n')
+        if line == delimiter + b'--':
+            return
+        if line != delimiter:
+            continue
+
+        content_range = None
+        while True:
+            line = f.readline().rstrip(b'\r\n')
+            if not line:
+                break
+            name, _, value = line.decode('latin1').partition(':')
+            if name.strip().lower() == 'content-range':
+                content_range = value
+        if content_range is None:
+            raise ValueError("Part without Content-Range in multipart/byteranges body")
+
+        start, end, size = parse_content_range(content_range)
+        reader = sizeaware(f, end - start + 1)
+        yield start, end, size, reader
+
+        # Skip any data not consumed by the caller
+        while reader.read(65536):
+            pass
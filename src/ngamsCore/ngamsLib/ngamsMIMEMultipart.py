@@ -36,7 +36,7 @@ import time
 
 import six
 
-from . import ngamsContainer, ngamsFileInfo
+from . import ngamsContainer, ngamsFileInfo, utils
 from .ngamsCore import checkCreatePath
 
 
@@ -79,7 +79,8 @@ class MIMEMultipartHandler(object):
         Method invoked by the parser to pass down the data contained in
         the part currently being parsed. This method might be called more than
         once, and indicates whether more data should be expected to be passed
-        down by the parser.
+        down by the parser. `data` might be a memoryview over the parser's
+        read buffer, and is therefore valid only during this call.
 
         In the particular case that this method cannot handle the full
         contents of the data passed down by the parser, it should return
@@ -173,21 +174,12 @@ class FilesystemWriterHandler(ContainerBuilderHandler):
         self._crc = 0
 
     def handleData(self, buf, moreExpected):
-        # Write always in _writeBlockSize blocks
-        while len(buf) > self._writeBlockSize:
-            block = buf[:self._writeBlockSize]
-            buf = buf[self._writeBlockSize:]
-            self.timedWrite(block)
-
-        # If the content of this file has finished
-        # arriving write the last piece to the file;
-        # otherwise return the remaining data so it's
-        # considered during the next call
-        if not moreExpected:
-            self.timedWrite(buf)
-        elif len(buf) > 0:
-            return buf
-
+        # Write always in blocks of at most _writeBlockSize;
+        # slicing memoryviews doesn't copy the data
+        if not isinstance(buf, memoryview):
+            buf = memoryview(buf)
+        for start in range(0, len(buf), self._writeBlockSize):
+            self.timedWrite(buf[start:start + self._writeBlockSize])
         return None
 
     def timedWrite(self, data):
@@ -220,6 +212,9 @@ class FilesystemWriterHandler(ContainerBuilderHandler):
     def getCrcTime(self):
         return self._crcTime
 
+def _tobytes(buf):
+    return buf.tobytes() if isinstance(buf, memoryview) else buf
+
 class MIMEMultipartParser(object):
     """
     A class that parses incoming ngams/container contents, which are
@@ -286,11 +281,16 @@ class MIMEMultipartParser(object):
         lead potentially to partial files being received, so users should be
         careful about it
         """
-        self._recurse()
+        rbuf = utils.buffers.get(self._readSize)
+        try:
+            self._recurse(rbuf)
+        finally:
+            utils.buffers.put(rbuf)
         logger.debug('Bytes expected/bytes received: %d/%d', self._totalSize, self._bytesRead)
 
-    def _recurse(self):
+    def _recurse(self, rbuf):
 
+        rview = memoryview(rbuf)
         rdSize = self._readSize
         readingFile = False
         state = self._ReadingState.headers
@@ -309,16 +309,32 @@ class MIMEMultipartParser(object):
 
             # Read, read, read...
             t = time.time()
-            buf = self._fd.read(rdSize)
+            bytesRead = utils.readinto(self._fd, rview[:rdSize])
             self._readingTime += (time.time() - t)
 
-            bytesRead = len(buf)
             self._bytesToRead -= bytesRead
             self._bytesRead   += bytesRead
+            buf = rview[:bytesRead]
+
+            # While reading the contents of a file, the data is passed down
+            # to the handler straight from the read buffer. What's left from
+            # the previous iteration is only the tail of the previous buffer,
+            # held back in case it was the beginning of a delimiter. If it
+            # wasn't we pass it down now and avoid joining it with this buffer
+            if state == self._ReadingState.data and prevBuf:
+                delimiter = CRLF + b'--' + boundary
+                if len(buf) >= len(delimiter) - 1:
+                    joint = prevBuf + buf[:len(delimiter) - 1].tobytes()
+                    if joint.find(delimiter) == -1:
+                        prevBuf = self._handler.handleData(prevBuf, True)
+                        if prevBuf:
+                            prevBuf = _tobytes(prevBuf)
 
             # Anything coming from a previous iteration gets prefixed
             if prevBuf:
-                buf = prevBuf + buf
+                buf = prevBuf + buf.tobytes()
+            elif state != self._ReadingState.data:
+                buf = buf.tobytes()
             prevBuf = None
 
             # On the first stage we read the MIME multipart headers and parse them
@@ -411,18 +427,27 @@ class MIMEMultipartParser(object):
             # When found, finish writing data, and pass the
             # delimiter to the ReadingState.delimiter state
             if state == self._ReadingState.data:
-                delIdx  = buf.find(CRLF + b'--' + boundary)
+                delimiter = CRLF + b'--' + boundary
+                if isinstance(buf, memoryview):
+                    delIdx = rbuf.find(delimiter, 0, len(buf))
+                else:
+                    delIdx = buf.find(delimiter)
                 if delIdx != -1:
                     logger.debug('Found end of file %s because we found boundary: %s', filename, boundary)
                     state = self._ReadingState.delimiter
-                    prevBuf = buf[delIdx:]
+                    prevBuf = _tobytes(buf[delIdx:])
                     buf = buf[:delIdx]
+                elif bytesRead:
+                    # Hold back the tail, it could be the start of a delimiter
+                    tail = max(len(buf) - len(delimiter) + 1, 0)
+                    prevBuf = _tobytes(buf[tail:])
+                    buf = buf[:tail]
 
                 buf = self._handler.handleData(buf, state == self._ReadingState.data)
                 if buf and len(buf):
-                    if prevBuf:
+                    if state != self._ReadingState.data:
                         raise Exception('No data should be returned when delimiter has been found')
-                    prevBuf = buf
+                    prevBuf = _tobytes(buf) + (prevBuf or b'')
 
             # If nothing was read, and nothing
             # was left for the next iteration, stop
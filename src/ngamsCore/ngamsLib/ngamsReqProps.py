@@ -87,6 +87,7 @@ class ngamsReqProps:
         self.__actualCount           = None
         self.__estTotalTime          = None
         self.__remainingTime         = None
+        self.__throughput            = None
         self.__lastRequestStatUpdate = None
         self.__completionTime        = None
 
@@ -861,6 +862,33 @@ class ngamsReqProps:
         return self.__remainingTime
 
 
+    def setThroughput(self,
+                      throughput,
+                      updateTime = 0):
+        """
+        Set the rate at which data is being processed by the request.
+
+        throughput:       Throughput in bytes per second (float).
+
+        updateTime:       Update time for this update of the status information
+                          in case this is set to 1 (integer/0|1).
+
+        Returns:          Reference to object itself.
+        """
+        self.__throughput = throughput
+        if (updateTime): self.setLastRequestStatUpdate()
+        return self
+
+
+    def getThroughput(self):
+        """
+        Get the rate at which data is being processed by the request.
+
+        Returns:     Throughput in bytes per second (float).
+        """
+        return self.__throughput
+
+
     def setLastRequestStatUpdate(self):
         """
         Set the time for performing the last update of the request
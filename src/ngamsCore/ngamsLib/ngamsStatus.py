@@ -85,6 +85,7 @@ class ngamsStatus:
         self.__actualCount           = None
         self.__estTotalTime          = None
         self.__remainingTime         = None
+        self.__throughput            = None
         self.__lastRequestStatUpdate = None
         self.__completionTime        = None
 
@@ -422,6 +423,28 @@ class ngamsStatus:
         return self.__remainingTime
 
 
+    def setThroughput(self,
+                      throughput):
+        """
+        Set the rate at which data is being processed by the request.
+
+        throughput:    Throughput in bytes per second (float).
+
+        Returns:       Reference to object itself.
+        """
+        self.__throughput = throughput
+        return self
+
+
+    def getThroughput(self):
+        """
+        Get the rate at which data is being processed by the request.
+
+        Returns:     Throughput in bytes per second (float).
+        """
+        return self.__throughput
+
+
     def setLastRequestStatUpdate(self,
                                  lastUpdateTime):
         """
@@ -510,6 +533,7 @@ class ngamsStatus:
                setActualCount(reqPropsObj.getActualCount()).\
                setEstTotalTime(reqPropsObj.getEstTotalTime()).\
                setRemainingTime(reqPropsObj.getRemainingTime()).\
+               setThroughput(reqPropsObj.getThroughput()).\
                setLastRequestStatUpdate(lastReqUpdate).\
                setCompletionTime(reqPropsObj.getCompletionTime())
         return self
@@ -672,6 +696,8 @@ class ngamsStatus:
         if (estTotalTime): self.setEstTotalTime(float(estTotalTime))
         remainingTime = getAttribValue(nodeList[0], "RemainingTime", 1)
         if (remainingTime): self.setRemainingTime(float(remainingTime))
+        throughput = getAttribValue(nodeList[0], "Throughput", 1)
+        if (throughput): self.setThroughput(float(throughput))
         lastRequestStatUpdate = getAttribValue(nodeList[0],
                                                "LastRequestStatUpdate", 1)
         if (lastRequestStatUpdate):
@@ -816,6 +842,8 @@ class ngamsStatus:
             statusEl.setAttribute("EstTotalTime", str(self.__estTotalTime))
         if self.__remainingTime is not None:
             statusEl.setAttribute("RemainingTime", str(self.__remainingTime))
+        if self.__throughput is not None:
+            statusEl.setAttribute("Throughput", "%.1f" % self.__throughput)
         if self.__lastRequestStatUpdate is not None:
             statusEl.setAttribute("LastRequestStatUpdate", toiso8601(self.__lastRequestStatUpdate))
         if self.__completionTime is not None:
@@ -0,0 +1,124 @@
+#
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2019
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+#
+"""
+Receiving data from a socket straight into a file using splice(2).
+
+This is the receiving counterpart of pysendfile: data is moved from the
+socket into a pipe, and from the pipe into the file, without ever being
+copied into user space.
+"""
+
+import errno
+import logging
+import os
+import select
+import socket
+
+
+logger = logging.getLogger(__name__)
+
+# splice is provided via os.splice in python3.10+, only in Linux
+os_splice = getattr(os, 'splice', None)
+
+_RETRY = frozenset((errno.EAGAIN, errno.EWOULDBLOCK))
+
+# Errors indicating that splice is not supported for the given descriptors
+_UNSUPPORTED = frozenset((errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP,
+                          errno.EBADF))
+
+# fcntl command to change the size of a pipe (Linux only)
+_F_SETPIPE_SZ = 1031
+
+def _set_pipe_size(fd, size):
+    try:
+        import fcntl
+        return fcntl.fcntl(fd, getattr(fcntl, 'F_SETPIPE_SZ', _F_SETPIPE_SZ), size)
+    except (ImportError, IOError, OSError):
+        return 65536
+
+def splice_to_file(sock, fout, count, blocksize=1024 * 1024):
+    """
+    Moves up to ``count`` bytes from ``sock`` into the current position of
+    file object ``fout``, which must be a regular file opened in binary mode,
+    without copying them into user space.
+
+    Returns the number of bytes moved, which is less than ``count`` if the
+    connection is closed by the other end, or if splice(2) is not available
+    or not supported for ``sock`` or ``fout``. In the latter case callers
+    should continue receiving the rest of the data by other means.
+    The socket's timeout is honoured.
+    """
+
+    if os_splice is None or count <= 0:
+        return 0
+
+    fout.flush()
+    sockno = sock.fileno()
+    fileno = fout.fileno()
+    timeout = sock.gettimeout()
+    if timeout is not None:
+        timeout *= 1000
+    pollster = select.poll()
+    pollster.register(sockno, select.POLLIN)
+
+    r, w = os.pipe()
+    try:
+        blocksize = min(blocksize, _set_pipe_size(w, blocksize))
+        total = 0
+        while total < count:
+            try:
+                n = os_splice(sockno, w, min(count - total, blocksize),
+                              flags=os.SPLICE_F_MOVE)
+            except OSError as err:
+                if err.errno in _RETRY:
+                    if not pollster.poll(timeout):
+                        raise socket.timeout('timed out')
+                    continue
+                elif err.errno in _UNSUPPORTED and total == 0:
+                    logger.debug("Cannot splice from socket: %s", err)
+                    return 0
+                raise
+            if n == 0:
+                break  # EOF
+
+            # Drain the pipe into the file. If the file doesn't support
+            # splice we copy this last piece and give up
+            left = n
+            while left:
+                try:
+                    left -= os_splice(r, fileno, left, flags=os.SPLICE_F_MOVE)
+                except OSError as err:
+                    if err.errno not in _UNSUPPORTED:
+                        raise
+                    logger.debug("Cannot splice into file: %s", err)
+                    while left:
+                        data = os.read(r, left)
+                        fout.write(data)
+                        left -= len(data)
+                    fout.flush()
+                    return total + n
+            total += n
+
+        return total
+    finally:
+        os.close(r)
+        os.close(w)
@@ -20,7 +20,9 @@
 #    MA 02111-1307  USA
 #
 
+import collections
 import contextlib
+import errno
 import itertools
 import logging
 import multiprocessing
@@ -38,11 +40,15 @@ logger = logging.getLogger(__name__)
 if sys.version_info[0] > 2:
     def b2s(b, enc='utf8'):
         return b.decode(enc)
+    def s2b(s, enc='utf8'):
+        return s.encode(enc)
     _long = int
     ifilter = filter
 else:
     def b2s(b, _='utf8'):
         return b
+    def s2b(s, enc='utf8'):
+        return s.encode(enc) if isinstance(s, unicode) else s
     _long = long
     ifilter = itertools.ifilter
 
@@ -141,4 +147,138 @@ def is_port_available(port):
 
 def find_available_port(base):
     """Find the first available port for binding starting from ``base``"""
-    return next(ifilter(is_port_available, itertools.count(base)))
\ No newline at end of file
+    return next(ifilter(is_port_available, itertools.count(base)))
+class buffer_pool(object):
+    """
+    A pool of reusable bytearrays, grouped by their size. Receive loops should
+    get their buffers from here and read into them with `readinto` instead
+    of allocating new objects for each block of data they read.
+    """
+
+    def __init__(self, max_idle_per_size=16):
+        self.max_idle_per_size = max_idle_per_size
+        self._free = collections.defaultdict(list)
+        self._lock = threading.Lock()
+
+    def get(self, size):
+        """Returns a bytearray of ``size`` bytes, reusing a free one if possible"""
+        with self._lock:
+            free = self._free[size]
+            if free:
+                return free.pop()
+        return bytearray(size)
+
+    def put(self, buff):
+        """Gives ``buff`` back to the pool"""
+        with self._lock:
+            free = self._free[len(buff)]
+            if len(free) < self.max_idle_per_size:
+                free.append(buff)
+
+    @contextlib.contextmanager
+    def buffer(self, size):
+        """Context manager yielding a memoryview over a pooled buffer"""
+        buff = self.get(size)
+        try:
+            yield memoryview(buff)
+        finally:
+            self.put(buff)
+
+    @property
+    def idle_count(self):
+        with self._lock:
+            return sum(len(free) for free in self._free.values())
+
+# The buffer pool shared by all receive loops
+buffers = buffer_pool()
+
+def readinto(f, buff):
+    """
+    Reads from ``f`` into the writable buffer ``buff``, using f.readinto()
+    when supported. Returns the number of bytes read.
+    """
+    if hasattr(f, 'readinto'):
+        return f.readinto(buff) or 0
+    data = f.read(len(buff))
+    n = len(data)
+    buff[:n] = data
+    return n
+
+def preallocate(f, size):
+    """
+    Reserves ``size`` bytes on disk for the file ``f``, reducing the
+    fragmentation of large files written in many small blocks.
+    This is a no-op if the platform or filesystem doesn't support it.
+    """
+    if size <= 0 or not hasattr(os, 'posix_fallocate'):
+        return
+    try:
+        os.posix_fallocate(f.fileno(), 0, size)
+    except OSError as e:
+        if e.errno not in (errno.EOPNOTSUPP, errno.EINVAL, errno.ENOSYS):
+            raise
+        logger.debug("Cannot preallocate %d bytes for %s: %s", size, getattr(f, 'name', f), e)
+
+class token_bucket(object):
+    """
+    A token bucket limiting the rate at which a resource is consumed
+    to ``rate`` units per second, allowing bursts of up to one second
+    once the bucket is full. The bucket starts empty.
+    """
+
+    def __init__(self, rate):
+        self.rate = float(rate)
+        self._tokens = 0.
+        self._last = time.time()
+
+    def consume(self, n):
+        """
+        Consumes ``n`` units, and returns the number of seconds the caller
+        should wait before consuming more to keep under the rate
+        """
+        now = time.time()
+        self._tokens = min(self.rate, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+        self._tokens -= n
+        if self._tokens >= 0:
+            return 0
+        return -self._tokens / self.rate
+
+def drop_cache(f, offset, length):
+    """
+    Advises the kernel that the given region of the file ``f`` will not be
+    accessed again, so it can be dropped from the page cache.
+    This is a no-op if the platform doesn't support it.
+    """
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    try:
+        os.posix_fadvise(f.fileno(), offset, length, os.POSIX_FADV_DONTNEED)
+    except OSError as e:
+        logger.debug("Cannot drop %s from the page cache: %s", getattr(f, 'name', f), e)
+
+# ioprio_set(2) syscall numbers, which Python doesn't expose
+_ioprio_set_syscalls = {'x86_64': 251, 'i386': 289, 'i686': 289,
+                        'aarch64': 30, 'ppc64le': 273}
+_IOPRIO_WHO_PROCESS = 1
+_IOPRIO_CLASS_IDLE = 3
+_IOPRIO_CLASS_SHIFT = 13
+
+def set_idle_io_priority():
+    """
+    Sets the I/O scheduling class of the calling thread to idle, so it only
+    gets disk time when no other process needs it (see ioprio_set(2)).
+    Returns whether the class could be set; this is only supported on Linux.
+    """
+    syscall_nr = _ioprio_set_syscalls.get(os.uname()[4])
+    if not sys.platform.startswith('linux') or syscall_nr is None:
+        logger.warning("Setting the I/O priority is not supported in this platform")
+        return False
+    import ctypes
+    libc = ctypes.CDLL(None, use_errno=True)
+    ioprio = _IOPRIO_CLASS_IDLE << _IOPRIO_CLASS_SHIFT
+    if libc.syscall(syscall_nr, _IOPRIO_WHO_PROCESS, 0, ioprio) != 0:
+        logger.warning("Cannot set idle I/O priority: %s",
+                       os.strerror(ctypes.get_errno()))
+        return False
+    return True
@@ -39,6 +39,7 @@ can be used to build up Python applications communicating with NG/AMS.
 import argparse
 import base64
 import contextlib
+import json
 import logging
 import os
 import random
@@ -50,9 +51,9 @@ import time
 from xml.dom import minidom
 
 from ngamsLib import ngamsLib, ngamsFileInfo, ngamsStatus, ngamsMIMEMultipart,\
-    ngamsHttpUtils, logutils
+    ngamsHttpUtils, logutils, utils
 from ngamsLib.ngamsCore import NGAMS_EXIT_CMD, NGAMS_INIT_CMD,\
-    NGAMS_HTTP_SUCCESS
+    NGAMS_HTTP_SUCCESS, NGAMS_HTTP_PARTIAL_CONTENT
 from ngamsLib.ngamsCore import NGAMS_ARCHIVE_CMD, NGAMS_REARCHIVE_CMD, NGAMS_HTTP_PAR_FILENAME, NGAMS_HTTP_HDR_FILE_INFO, NGAMS_HTTP_HDR_CONTENT_TYPE, \
     NGAMS_LABEL_CMD, NGAMS_ONLINE_CMD, NGAMS_OFFLINE_CMD, NGAMS_REMDISK_CMD, \
     NGAMS_REMFILE_CMD, NGAMS_REGISTER_CMD, NGAMS_RETRIEVE_CMD, NGAMS_STATUS_CMD, \
@@ -430,6 +431,56 @@ class ngamsPClient:
                 parser.parse()
             return ngamsStatus.dummy_success_stat(host_id)
 
+    def mretrieve(self, files, targetDir='.', as_tar=True):
+        """
+        Sends an MRETRIEVE command to NG/AMS to retrieve many files at once
+        and dumps them into the file system under `targetDir`. Each element of
+        `files` is either a file ID or a (file ID, file version) tuple.
+        Unless `as_tar` is set the files are received in a MIME multipart
+        message and stored under an ``mretrieve`` directory, like CRETRIEVE
+        does with containers.
+        """
+        lines = []
+        for f in files:
+            if isinstance(f, (tuple, list)):
+                lines.append('%s %d' % (f[0], int(f[1])))
+            else:
+                lines.append(f)
+        data = utils.s2b('\n'.join(lines))
+        pars = [('format', 'application/x-tar')] if as_tar else []
+        targetDir = targetDir or '.'
+
+        # Redirections keep the original request body
+        host, port = random.choice(self.servers)
+        for _ in range(5):
+            resp = ngamsHttpUtils.httpPostResponse(host, port, 'MRETRIEVE', data,
+                                                   'text/plain', pars=pars,
+                                                   timeout=self.timeout,
+                                                   auth=self.basic_auth)
+            if resp.status != 307:
+                break
+            location = resp.getheader('Location')
+            resp.close()
+            host, port = location.split("/")[2].split(":")
+            port = int(port)
+            logger.info("Redirecting to NG/AMS running on %s:%d", host, port)
+        else:
+            raise Exception("Too many redirections, aborting")
+
+        host_id = "%s:%d" % (host, port)
+        with contextlib.closing(resp):
+            if resp.status != NGAMS_HTTP_SUCCESS:
+                return ngamsStatus.to_status(resp, host_id, 'MRETRIEVE')
+
+            if as_tar:
+                tarfile.open(fileobj=resp, mode="r|").extractall(targetDir)
+            else:
+                size = int(resp.getheader('Content-Length'))
+                handler = ngamsMIMEMultipart.FilesystemWriterHandler(65536, basePath=targetDir)
+                parser = ngamsMIMEMultipart.MIMEMultipartParser(handler, resp, size, 65536)
+                parser.parse()
+            return ngamsStatus.dummy_success_stat(host_id)
+
     def exit(self):
         """
         Send an EXIT command to the NG/AMS Server associated to the object.
@@ -534,6 +585,48 @@ class ngamsPClient:
         return self.get_status(NGAMS_REMFILE_CMD, pars=pars)
 
 
+    def query(self, pars=[], output=None):
+        """
+        Sends a QUERY command to the NG/AMS Server. If `output` is given the
+        results are written into that file as they are received, otherwise they
+        are returned as the data of the returned status object.
+
+        Returns:     NG/AMS Status object (ngamsStatus).
+        """
+        if not output:
+            return self.get_status('QUERY', pars=pars)
+
+        resp, host, port = self._get('QUERY', pars=pars)
+        host_id = "%s:%d" % (host, port)
+        with contextlib.closing(resp):
+            if resp.status != NGAMS_HTTP_SUCCESS:
+                return ngamsStatus.to_status(resp, host_id, 'QUERY')
+            with open(output, 'wb') as fout:
+                _copy_response(resp, fout)
+        return ngamsStatus.dummy_success_stat(host_id)
+
+    def query_rows(self, query, pars=[]):
+        """
+        Sends a QUERY command to the NG/AMS Server for `query` and yields its
+        results as dictionaries as they are received, so big result sets can
+        be processed without having to hold them in memory.
+        """
+        pars = list(pars) + [('query', query), ('format', 'jsonl')]
+        resp, host, port = self._get('QUERY', pars=pars)
+        with contextlib.closing(resp):
+            if resp.status != NGAMS_HTTP_SUCCESS:
+                stat = ngamsStatus.to_status(resp, "%s:%d" % (host, port), 'QUERY')
+                raise Exception(stat.getMessage())
+            pending = b''
+            for chunk in _iter_content(resp):
+                lines = (pending + chunk).split(b'\n')
+                pending = lines.pop()
+                for line in lines:
+                    if line.strip():
+                        yield json.loads(utils.b2s(line))
+            if pending.strip():
+                yield json.loads(utils.b2s(pending))
+
     def register(self, path, asynchronous=False):
         """
         Send an REGISTER command to the NG/AMS Server associated to the object.
@@ -551,7 +644,8 @@ class ngamsPClient:
 
 
     def retrieve(self, fileId, fileVersion=-1, pars=[], hdrs={},
-                 targetFile=None, processing=None, processingPars=None):
+                 targetFile=None, processing=None, processingPars=None,
+                 byteRanges=None):
         """
         Request file `fileId` from the NG/AMS Server, store it locally
         in `targetFile`, and return the result of the operation as an
@@ -563,9 +657,18 @@ class ngamsPClient:
         If `processing` and `processingPars` are given, they are passed down
         as the processing plug-in name and parameters to be applied to the
         retrieved data *on the server side*, respectively.
+        If `byteRanges` is given, only those parts of the file are retrieved.
+        It is a list of (first, last) byte positions (both inclusive), where
+        `last` can be None to read until the end of the file, and `first` can
+        be None to read the last `last` bytes of the file. The data of all
+        ranges is stored one after the other in `targetFile`, sorted by offset
+        if more than one range is retrieved.
         """
 
         pars = list(pars)
+        if byteRanges:
+            hdrs = dict(hdrs)
+            hdrs['Range'] = ngamsHttpUtils.format_range_header(byteRanges)
         pars.append(("file_id", fileId))
         if fileVersion != -1:
             pars.append(("file_version", str(fileVersion)))
@@ -580,7 +683,7 @@ class ngamsPClient:
         host_id = "%s:%d" % (host, port)
         with contextlib.closing(resp):
 
-            if resp.status != NGAMS_HTTP_SUCCESS:
+            if resp.status not in (NGAMS_HTTP_SUCCESS, NGAMS_HTTP_PARTIAL_CONTENT):
                 return ngamsStatus.to_status(resp, host_id, 'RETRIEVE')
 
             # If the target path is a directory, take the filename
@@ -599,11 +702,17 @@ class ngamsPClient:
                 fname = os.path.join(fname, os.path.basename(parts['filename']))
 
             # Dump the data into the target file
+            try:
+                ctype = resp.headers.get('Content-Type', '')
+            except AttributeError:
+                ctype = resp.getheader('Content-Type', '')
+            ctype = ngamsLib.parseHttpHdr(ctype)
             with open(fname, 'wb') as f:
-                if hasattr(resp, 'content'):
-                    f.write(resp.content)
+                if 'multipart/byteranges' in ctype:
+                    for _, _, _, reader in ngamsHttpUtils.byteranges_parts(resp, ctype['boundary']):
+                        shutil.copyfileobj(reader, f)
                 else:
-                    shutil.copyfileobj(resp, f)
+                    _copy_response(resp, f)
 
             return ngamsStatus.dummy_success_stat(host_id)
 
@@ -622,7 +731,7 @@ class ngamsPClient:
 
             output = output or 'file_list.xml.gz'
             with open(output, 'wb') as fout, contextlib.closing(resp):
-                shutil.copyfileobj(resp, fout)
+                _copy_response(resp, fout)
             return ngamsStatus.dummy_success_stat("%s:%d" % (host, port))
 
         return self.get_status(NGAMS_STATUS_CMD, pars=pars)
@@ -792,6 +901,24 @@ class ngamsPClient:
                     raise
 
 
+def _iter_content(resp, bs=65536):
+    """Yields the body of the HTTP response `resp` in blocks as it arrives"""
+    if hasattr(resp, 'iter_content'):
+        for chunk in resp.iter_content(bs):
+            yield chunk
+        return
+    while True:
+        chunk = resp.read(bs)
+        if not chunk:
+            return
+        yield chunk
+
+def _copy_response(resp, f):
+    """Copies the body of the HTTP response `resp` into `f` as it arrives"""
+    for chunk in _iter_content(resp):
+        f.write(chunk)
+
+
 def setup_logging(opts):
 
     logging.root.addHandler(logging.NullHandler())
@@ -844,6 +971,7 @@ def main():
     parser.add_argument(      '--file-version',  help='A file version', type=int, default=-1)
     parser.add_argument(      '--file-id-list',  help='A list of File IDs')
     parser.add_argument(      '--file-uri',      help='A File URI')
+    parser.add_argument(      '--byte-ranges',   help='Byte ranges of the file to retrieve (e.g., 0-2879,-1000)')
     parser.add_argument(      '--file-info-xml', help='An XML File Info string')
     parser.add_argument('-n', '--no-versioning', help='Do not increase the file version', action='store_true')
     parser.add_argument('-d', '--disk-id',       help='Indicates a Disk ID')
@@ -912,6 +1040,10 @@ def main():
         stat = client.cremove(opts.file_id, opts.file_id_list, opts.container_id, opts.container_name)
     elif cmd == 'CRETRIEVE':
         stat = client.cretrieve(opts.container_name, opts.container_id, opts.output)
+    elif cmd == 'MRETRIEVE':
+        if not opts.file_id_list:
+            raise Exception('--file-id-list is required for MRETRIEVE')
+        stat = client.mretrieve(opts.file_id_list.split(':'), opts.output)
     elif (cmd == NGAMS_CACHEDEL_CMD):
         pars.append(("disk_id", opts.disk_id))
         pars.append(("file_id", opts.file_id))
@@ -929,6 +1061,8 @@ def main():
         stat = client.offline(opts.force)
     elif (cmd == NGAMS_ONLINE_CMD):
         stat = client.online()
+    elif cmd == 'QUERY':
+        stat = client.query(pars, opts.output)
     elif (cmd == NGAMS_REARCHIVE_CMD):
         if not opts.file_info_xml:
             msg = "Must specify parameter -fileInfoXml for a REARCHIVE Command"
@@ -942,9 +1076,13 @@ def main():
         stat = client.remFile(diskId=opts.disk_id, fileId=opts.file_id,
                               fileVersion=opts.file_version, execute=opts.execute)
     elif (cmd == NGAMS_RETRIEVE_CMD):
+        byte_ranges = None
+        if opts.byte_ranges:
+            byte_ranges = ngamsHttpUtils.parse_range_header('bytes=' + opts.byte_ranges)
         stat = client.retrieve(opts.file_id, opts.file_version, pars=pars,
                                targetFile=opts.output, processing=opts.p_plugin,
-                               processingPars=opts.p_plugin_pars)
+                               processingPars=opts.p_plugin_pars,
+                               byteRanges=byte_ranges)
     elif (cmd == NGAMS_STATUS_CMD):
         stat = client.status(pars, opts.output)
     elif (cmd == NGAMS_SUBSCRIBE_CMD):
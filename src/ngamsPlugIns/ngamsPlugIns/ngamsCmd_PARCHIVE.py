@@ -45,7 +45,7 @@ from six.moves.urllib import request as urlrequest  # @UnresolvedImport
 from ngamsLib.ngamsCore import NGAMS_SUCCESS, NGAMS_HTTP_SUCCESS, \
     NGAMS_FAILURE, NGAMS_HTTP_POST, getHostName, \
     NGAMS_HTTP_HDR_CHECKSUM, genLog, NGAMS_IDLE_SUBSTATE
-from ngamsLib import ngamsStatus, ngamsHighLevelLib,  ngamsLib
+from ngamsLib import ngamsStatus, ngamsHighLevelLib,  ngamsLib, utils
 
 
 logger = logging.getLogger(__name__)
@@ -170,6 +170,7 @@ def saveFromHttpToHttp(reqPropsObj,
     start = time.time()
 
     http = None
+    rbuf = utils.buffers.get(blockSize)
 
     try:
         # Distinguish between Archive Pull and Push Request. By Archive
@@ -200,7 +201,7 @@ def saveFromHttpToHttp(reqPropsObj,
         http = buildHttpClient(nexturl, mimeType, contDisp, remSize, checksum = reqPropsObj.getHttpHdr(NGAMS_HTTP_HDR_CHECKSUM))
 
         # Receive the data.
-        buf = "-"
+        rview = memoryview(rbuf)
         rdSize = blockSize
         slow = blockSize / (512 * 1024.)  # limit for 'slow' transfers
 #        sizeAccu = 0
@@ -216,13 +217,13 @@ def saveFromHttpToHttp(reqPropsObj,
         while ((remSize > 0) and ((time.time() - lastRecepTime) < 30.0)):
             if (remSize < rdSize): rdSize = remSize
             rdt = time.time()
-            buf = rfile.read(rdSize)
+            sizeRead = utils.readinto(rfile, rview[:rdSize])
             rdt = time.time() - rdt
             if (rdt > slow):
                 srb += 1
             rdtt += rdt
 
-            sizeRead = len(buf)
+            buf = rview[:sizeRead]
             remSize -= sizeRead
             tot_size += sizeRead
 
@@ -303,6 +304,7 @@ def saveFromHttpToHttp(reqPropsObj,
 
         raise err
     finally:
+        utils.buffers.put(rbuf)
         if (http != None):
             #http.close()
             del http
@@ -45,6 +45,8 @@ def changeNumThreads(srvObj, subscrId, oldNum, newNum):
     if (subscrId not in srvObj._subscrDeliveryThreadDic): # threads have not started yet
         return
     deliveryThreadList = srvObj._subscrDeliveryThreadDic[subscrId]
+    if (subscrId in srvObj._subscrStreamsDic):
+        srvObj._subscrStreamsDic[subscrId].set_max_streams(newNum)
 
     if (oldNum > newNum):
         for tid in range(oldNum - 1, -1, -1):
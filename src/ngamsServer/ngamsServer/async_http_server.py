@@ -0,0 +1,282 @@
+#
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2019
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+#
+"""
+An asyncio-based HTTP server front end for NGAS.
+
+The event loop accepts connections and reads the request line and headers
+of each incoming request without dedicating an OS thread to it. Once a
+request is fully received it is handed over to a bounded pool of worker
+threads (of size ``MaxSimReqs``) where the usual request handler class runs
+the command modules, which are blocking in nature. Requests arriving when
+all workers are busy are kept in the event loop until a worker becomes free
+instead of being rejected, up to ``MaxConnections`` of them. Persistent
+connections are also given back to the event loop while idle between requests.
+
+This module requires python 3.
+"""
+
+import asyncio
+import collections
+import concurrent.futures
+import io
+import logging
+import os
+import socket
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+# Maximum size of the request line plus headers we accept, same as apache
+_MAX_HEADER_SIZE = 8190
+
+class _prefixed_socket_reader(io.RawIOBase):
+    """
+    A raw, readable stream that first returns the contents of ``prefix``
+    and then reads from ``sock``.
+    """
+
+    def __init__(self, sock, prefix):
+        self._sock = sock
+        self._prefix = memoryview(prefix)
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self._prefix:
+            n = min(len(b), len(self._prefix))
+            b[:n] = self._prefix[:n]
+            self._prefix = self._prefix[n:]
+            return n
+        try:
+            return self._sock.recv_into(b)
+        except BlockingIOError:
+            return None
+
+class prefixed_request_handler_mixin(object):
+    """
+    Mixin for request handler classes that makes ``rfile`` return first the
+    data that has already been read by the event loop from the socket.
+    """
+
+    def __init__(self, request, client_address, server, prefix=b''):
+        self._prefix = prefix
+        self.leftover = None
+        super(prefixed_request_handler_mixin, self).__init__(request, client_address, server)
+
+    def setup(self):
+        super(prefixed_request_handler_mixin, self).setup()
+        self.rfile.close()
+        reader = _prefixed_socket_reader(self.connection, self._prefix)
+        self.rfile = io.BufferedReader(reader, self.rbufsize if self.rbufsize > 0 else io.DEFAULT_BUFFER_SIZE)
+
+    def handle(self):
+        """
+        Handles a single request. If the connection should be kept open,
+        ``leftover`` is set to any data already received for the next request
+        so the connection can be given back to the event loop.
+        """
+        self.close_connection = True
+        self.handle_one_request()
+        if self.close_connection:
+            return
+
+        leftover = []
+        self.connection.setblocking(False)
+        while True:
+            data = self.rfile.read1(io.DEFAULT_BUFFER_SIZE)
+            if not data:
+                break
+            leftover.append(data)
+        self.leftover = b''.join(leftover)
+
+class _http_protocol(asyncio.Protocol):
+    """Reads the headers of a request and hands it over to the server"""
+
+    def __init__(self, server, data=b'', keep_alive=False):
+        self.server = server
+        self.transport = None
+        self.data = bytearray(data)
+        self.dispatched = False
+        self.keep_alive = keep_alive
+        self._timer = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        timeout = self.server.header_timeout
+        if self.keep_alive:
+            timeout = self.server.keep_alive_timeout
+        self._timer = self.server.loop.call_later(timeout, self._timed_out)
+        if self.data:
+            self.data_received(b'')
+
+    def data_received(self, data):
+        self.data += data
+        if b'\r\n\r\n' in self.data:
+            self._timer.cancel()
+            self.transport.pause_reading()
+            self.server.request_received(self)
+        elif len(self.data) > _MAX_HEADER_SIZE:
+            self._timer.cancel()
+            self.reject(b'431 Request Header Fields Too Large')
+
+    def connection_lost(self, exc):
+        self._timer.cancel()
+        if not self.dispatched:
+            self.server.connection_lost(self)
+
+    def _timed_out(self):
+        # Idle persistent connections are expected to time out
+        if not self.keep_alive or self.data:
+            logger.warning("Timed out while waiting for request from %r",
+                           self.transport.get_extra_info('peername'))
+        self.transport.close()
+
+    def reject(self, status=b'503 Service Unavailable'):
+        self.transport.write(b'HTTP/1.0 ' + status + b'\r\n\r\n')
+        self.transport.close()
+
+class AsyncHttpServer(object):
+    """
+    Accepts HTTP connections on an asyncio event loop, and serves requests
+    with ``RequestHandlerClass`` on a bounded pool of worker threads.
+    """
+
+    def __init__(self, ngamsServer, server_address, RequestHandlerClass):
+
+        cfg = ngamsServer.getCfg()
+        self._ngamsServer = ngamsServer
+        self.max_workers = cfg.getMaxSimReqs()
+        self.max_connections = cfg.getMaxConnections()
+        self.header_timeout = cfg.getTimeOut() or 60
+        self.keep_alive_timeout = cfg.getKeepAliveTimeout()
+        self.RequestHandlerClass = type('async_' + RequestHandlerClass.__name__,
+                                        (prefixed_request_handler_mixin, RequestHandlerClass), {})
+
+        self.loop = asyncio.new_event_loop()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers)
+        self._busy = 0
+        self._queued = collections.deque()
+        self._stopped = threading.Event()
+
+        # Bind at construction time, like socketserver.TCPServer does
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(server_address)
+        self.socket.listen(min(self.max_connections, socket.SOMAXCONN))
+        self.server_address = self.socket.getsockname()
+
+    @property
+    def queued_count(self):
+        """Number of requests received and waiting for a free worker"""
+        return len(self._queued)
+
+    def serve_forever(self):
+        """Runs the event loop until shutdown() is called"""
+
+        asyncio.set_event_loop(self.loop)
+        server = self.loop.run_until_complete(
+            self.loop.create_server(lambda: _http_protocol(self), sock=self.socket))
+        try:
+            self.loop.run_forever()
+        finally:
+            server.close()
+            self.loop.run_until_complete(server.wait_closed())
+            while self._queued:
+                self._queued.popleft().reject()
+            self._executor.shutdown(wait=False)
+            self.loop.close()
+            self._stopped.set()
+
+    def shutdown(self):
+        """Stops the event loop and waits until serve_forever() returns"""
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._stopped.wait()
+
+    def request_received(self, protocol):
+        if self._busy < self.max_workers:
+            self._dispatch(protocol)
+        elif len(self._queued) < self.max_connections:
+            self._queued.append(protocol)
+        else:
+            logger.error("Maximum number of queued requests reached, rejecting request")
+            self._ngamsServer.requests_rejected.inc()
+            protocol.reject()
+
+    def connection_lost(self, protocol):
+        try:
+            self._queued.remove(protocol)
+        except ValueError:
+            pass
+
+    def _dispatch(self, protocol):
+
+        # Take over the connection's socket, leaving the transport behind.
+        # The transport closes its own copy of the descriptor, but the
+        # connection stays open through ours
+        transport = protocol.transport
+        client_address = transport.get_extra_info('peername')
+        fd = os.dup(transport.get_extra_info('socket').fileno())
+        protocol.dispatched = True
+        transport.abort()
+
+        sock = socket.socket(fileno=fd)
+        sock.setblocking(True)
+        self._busy += 1
+        f = self._executor.submit(self._process_request, sock, client_address, bytes(protocol.data))
+        f.add_done_callback(lambda _: self._call_in_loop(self._request_done))
+
+    def _call_in_loop(self, callback, *args):
+        """Schedules ``callback`` in the event loop, if it's still open"""
+        try:
+            self.loop.call_soon_threadsafe(callback, *args)
+            return True
+        except RuntimeError:
+            return False
+
+    def _request_done(self):
+        self._busy -= 1
+        while self._queued and self._busy < self.max_workers:
+            self._dispatch(self._queued.popleft())
+
+    def _keep_alive(self, sock, leftover):
+        protocol_factory = lambda: _http_protocol(self, leftover, keep_alive=True)
+        self.loop.create_task(self.loop.connect_accepted_socket(protocol_factory, sock))
+
+    def _process_request(self, sock, client_address, prefix):
+        handler = None
+        try:
+            handler = self.RequestHandlerClass(sock, client_address, self, prefix)
+        except Exception:
+            logger.exception("Unexpected error while serving request from %r", client_address)
+
+        # Give persistent connections back to the event loop
+        if (handler is not None and handler.leftover is not None and
+            self._call_in_loop(self._keep_alive, sock, handler.leftover)):
+            return
+
+        try:
+            sock.shutdown(socket.SHUT_WR)
+        except socket.error:
+            pass
+        sock.close()
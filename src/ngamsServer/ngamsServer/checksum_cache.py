@@ -0,0 +1,144 @@
+#
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2019
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+#
+"""
+A persistent, per-volume cache of file checksums.
+
+Checking the consistency of a file requires calculating its checksum, which
+for large files is expensive. The same files are usually checked several
+times in a short period of time (e.g., by the data check thread and the
+CHECKFILE command). This cache keeps the checksums calculated for the files
+of each volume in a DBM under the volume's ``.db`` directory, together with
+the inode, size and modification time of the file when the checksum was
+calculated. A cached checksum is used only while these are unchanged, and
+for a limited amount of time.
+"""
+
+import logging
+import os
+import threading
+import time
+
+import six
+
+from ngamsLib import ngamsDbm
+from ngamsLib.ngamsCore import NGAMS_DB_DIR
+
+
+logger = logging.getLogger(__name__)
+
+# Name of the DBM holding the checksums of the files of a volume
+CHECKSUM_CACHE_NAME = 'ChecksumCache'
+
+def _key(filename):
+    if isinstance(filename, six.text_type):
+        return filename.encode('utf-8')
+    return filename
+
+def _mtime_ns(st):
+    # st_mtime_ns is python 3 only
+    if hasattr(st, 'st_mtime_ns'):
+        return st.st_mtime_ns
+    return int(st.st_mtime * 1e9)
+
+class checksum_cache(object):
+    """
+    A cache of file checksums, stored in each volume.
+
+    Files are given by the mount point of their volume, and their name
+    relative to it. A cache with ``max_age`` 0 is disabled, and never stores
+    anything.
+    """
+
+    def __init__(self, max_age):
+        self.max_age = max_age
+        self._dbms = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return self.max_age > 0
+
+    def _dbm(self, mount_point):
+        """The DBM of the volume at `mount_point`, or None if not available"""
+        if mount_point not in self._dbms:
+            dbm = None
+            db_dir = os.path.join(mount_point, NGAMS_DB_DIR)
+            if os.path.isdir(db_dir):
+                try:
+                    dbm = ngamsDbm.ngamsDbm(os.path.join(db_dir, CHECKSUM_CACHE_NAME),
+                                            writePerm=1)
+                except Exception:
+                    logger.warning("Cannot open checksum cache under %s, "
+                                   "checksums of its files will not be cached",
+                                   db_dir, exc_info=True)
+            self._dbms[mount_point] = dbm
+        return self._dbms[mount_point]
+
+    def get(self, mount_point, filename, variant):
+        """
+        Returns the checksum calculated with `variant` for the given file,
+        or None if not cached, too old, or if the file changed since.
+        """
+        if not self.enabled:
+            return None
+        try:
+            st = os.stat(os.path.normpath(mount_point + "/" + filename))
+        except OSError:
+            return None
+        with self._lock:
+            dbm = self._dbm(mount_point)
+            entry = dbm.get(_key(filename)) if dbm is not None else None
+            if (entry is None or
+                entry[:4] != (st.st_ino, st.st_size, _mtime_ns(st), variant) or
+                time.time() - entry[5] > self.max_age):
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[4]
+
+    def put(self, mount_point, filename, variant, checksum):
+        """Stores the `checksum` calculated with `variant` for the given file"""
+        if not self.enabled or checksum is None:
+            return
+        try:
+            st = os.stat(os.path.normpath(mount_point + "/" + filename))
+        except OSError:
+            return
+        entry = (st.st_ino, st.st_size, _mtime_ns(st), variant, checksum, time.time())
+        with self._lock:
+            dbm = self._dbm(mount_point)
+            if dbm is not None:
+                dbm.add(_key(filename), entry)
+
+    def close(self):
+        """Writes all pending changes to disk"""
+        with self._lock:
+            for dbm in self._dbms.values():
+                if dbm is not None:
+                    dbm.sync()
+            self._dbms.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
@@ -239,6 +239,8 @@ def handleCmd(srvObj,
     logger.debug("Generate file information")
     dateDir = toiso8601(fmt=FMT_DATE_ONLY)
     resDapiList = []
+    fileInfos = []
+    pendingFileInfos = {}
 
     containerSizes = {}
 
@@ -251,6 +253,14 @@ def handleCmd(srvObj,
         basename = os.path.basename(filepath)
         fileId = basename
 
+        # File entries are written in the DB in bulk, but new versions of a
+        # file can only be calculated once its previous versions are there
+        if fileId in pendingFileInfos:
+            srvObj.getDb().writeFileEntries(srvObj.getHostId(),
+                                            list(pendingFileInfos.values()),
+                                            updateDiskInfo=1)
+            pendingFileInfos.clear()
+
         fileVersion, relPath, relFilename,\
                      complFilename, fileExists =\
                      ngamsPlugInApi.genFileInfo(srvObj.getDb(),
@@ -297,8 +307,7 @@ def handleCmd(srvObj,
         if reqPropsObj.getFileUri().count("file_version"):
             file_version = int((reqPropsObj.getFileUri().split("file_version=")[1]).split("&")[0])
 
-        # Check/generate remaining file info + update in DB.
-        logger.debug("Creating db entry")
+        # Check/generate remaining file info, written later in the DB.
         creDate = getFileCreationTime(resDapi.getCompleteFilename())
         fileInfo = ngamsFileInfo.ngamsFileInfo().\
                    setDiskId(resDapi.getDiskId()).\
@@ -314,30 +323,36 @@ def handleCmd(srvObj,
                    setFileStatus(NGAMS_FILE_STATUS_OK).\
                    setCreationDate(creDate).\
                    setIoTime(reqPropsObj.getIoTime())
-        fileInfo.write(srvObj.getHostId(), srvObj.getDb())
+
+        fileInfos.append((containerId, fileInfo))
+        pendingFileInfos[fileId] = fileInfo
+        resDapiList.append(resDapi)
+
+    # Write the information of all (remaining) files and their disk in the
+    # DB at once
+    logger.debug("Creating db entries")
+    srvObj.getDb().writeFileEntries(srvObj.getHostId(),
+                                    list(pendingFileInfos.values()),
+                                    updateDiskInfo=1)
+
+    for (containerId, fileInfo), resDapi in zip(fileInfos, resDapiList):
 
         # Add the file to the container
         srvObj.getDb().addFileToContainer(containerId, resDapi.getFileId(), True)
 
-        # Update the container sizes
-        for contSizeInfo in containerSizes.items():
-            srvObj.getDb().setContainerSize(contSizeInfo[0], contSizeInfo[1])
-
         # Inform the caching service about the new file.
         logger.debug("Inform the caching service about the new file.")
         if (srvObj.getCachingActive()):
             diskId      = resDapi.getDiskId()
             fileId      = resDapi.getFileId()
-            fileVersion = file_version
+            fileVersion = fileInfo.getFileVersion()
             filename    = resDapi.getRelFilename()
             ngamsCacheControlThread.addEntryNewFilesDbm(srvObj, diskId, fileId,
                                                        fileVersion, filename)
 
-        # Update disk info in NGAS Disks.
-        logger.debug("Update disk info in NGAS Disks.")
-        srvObj.getDb().updateDiskInfo(resDapi.getFileSize(), resDapi.getDiskId())
-
-        resDapiList.append(resDapi)
+    # Update the container sizes
+    for contSizeInfo in containerSizes.items():
+        srvObj.getDb().setContainerSize(contSizeInfo[0], contSizeInfo[1])
 
     # Check if the disk is completed.
     # We use an approximate extimate for the remaning disk space to avoid
@@ -69,6 +69,9 @@ def handleCmd(srvObj,
         diskId = reqPropsObj.getHttpPar("disk_id")
     if (reqPropsObj.hasHttpPar("host_id")):
         hostId = reqPropsObj.getHttpPar("host_id")
+    force = False
+    if (reqPropsObj.hasHttpPar("force")):
+        force = int(reqPropsObj.getHttpPar("force")) == 1
 
     # At least File ID must be specified (File Version is defaulted to 1).
     if (not fileId):
@@ -112,7 +115,7 @@ def handleCmd(srvObj,
                         tmpFileRes[ngamsDbCore.NGAS_FILES_FILE_SIZE],
                         tmpFileRes[ngamsDbCore.NGAS_FILES_FILE_STATUS],
                         tmpFileRes[ngamsDbCore.NGAS_FILES_DISK_ID]]
-        ngamsFileUtils.checkFile(srvObj, sum1FileInfo, checkReport)
+        ngamsFileUtils.checkFile(srvObj, sum1FileInfo, checkReport, force=force)
         if (not checkReport):
             msg = genLog("NGAMS_INFO_FILE_OK",
                          [fileId, int(fileVersion), diskId, fileSlotId,
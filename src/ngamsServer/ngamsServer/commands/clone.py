@@ -31,12 +31,16 @@
 Contains utilities used in connection with the cloning of files.
 """
 
+import collections
+import glob
+import hashlib
 import logging
 import os
 import threading
 import time
 
 import six
+from six.moves import queue  # @UnresolvedImport
 from six.moves.urllib import request as urlrequest  # @UnresolvedImport
 
 from .. import ngamsArchiveUtils, ngamsSrvUtils, ngamsFileUtils
@@ -48,11 +52,18 @@ from ngamsLib.ngamsCore import genLog, NGAMS_ONLINE_STATE, \
     rmFile, getFileSize, NGAMS_XML_MT, NGAMS_FAILURE, checkCreatePath, \
     mvFile, getFileCreationTime, NGAMS_SUCCESS, NGAMS_TEXT_MT, \
     NGAMS_NOTIF_INFO, NGAMS_CLONE_CMD, NGAMS_CLONE_THR, \
-    toiso8601
+    toiso8601, NGAMS_CACHE_DIR
 from ngamsLib import ngamsDbm, ngamsFileList, ngamsStatus, ngamsDiskUtils, ngamsLib
 
 logger = logging.getLogger(__name__)
 
+# Number of files of the clone list whose existing copies are looked up
+# with a single query
+_EXISTENCE_CHECK_BATCH = 500
+
+# Minimum number of seconds between updates of the Request Status
+_REQ_STATUS_UPDATE_PERIOD = 1.0
+
 def handleCmd(srvObj,
                    reqPropsObj,
                    httpRef):
@@ -284,7 +295,8 @@ def _checkFile(srvObj,
 
     checkChecksum:    Carry out checksum check (0|1/integer).
 
-    Returns:          Void.
+    Returns:          The checksum of the file, or None if it was not
+                      checked (string|None).
     """
     # First ensure to flush file caches.
     ngamsFileUtils.syncCachesCheckFiles(srvObj, [stagFile])
@@ -314,18 +326,396 @@ def _checkFile(srvObj,
     logger.debug("Size of cloned Staging File OK: %s", stagFile)
 
     # The file size was correct.
+    checksum = None
     if (checkChecksum):
-        if ngamsFileUtils.check_checksum(srvObj, fileInfoObj, stagFile):
+        checksum = ngamsFileUtils.check_checksum(srvObj, fileInfoObj, stagFile)
+        if checksum is not None:
             logger.debug("Checksum of cloned Staging File OK: %s", stagFile)
         else:
             logger.debug("No Checksum or Checksum Plug-In specified for file")
+    return checksum
+
+
+class _disk_slots(object):
+    """
+    Limits the number of files being cloned concurrently from (or into) any
+    given disk.
+    """
+
+    def __init__(self, max_per_disk):
+        self._max_per_disk = max(1, max_per_disk)
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, diskId):
+        with self._lock:
+            if diskId not in self._semaphores:
+                self._semaphores[diskId] = threading.BoundedSemaphore(self._max_per_disk)
+            return self._semaphores[diskId]
+
+
+class _clone_job(object):
+    """
+    The state shared by the workers cloning the files of a Clone Request:
+    the target disks reserved for each file, the persisted progress,
+    the Clone Status Report and the statistics published in the Request
+    Status.
+    """
+
+    def __init__(self, srvObj, reqPropsObj, trgDiskInfo, hostInfoDic,
+                 checkChecksum, cloneStatusDbm, progressDbm, totalBytes):
+        cfg = srvObj.getCfg()
+        self.srvObj = srvObj
+        self.reqPropsObj = reqPropsObj
+        self.trgDiskInfo = trgDiskInfo
+        self.hostInfoDic = hostInfoDic
+        self.checkChecksum = checkChecksum
+        self.cloneStatusDbm = cloneStatusDbm
+        self.progressDbm = progressDbm
+        self.totalBytes = totalBytes
+        self.sourceSlots = _disk_slots(cfg.getCloneMaxPerSourceDisk())
+        self.targetSlots = _disk_slots(cfg.getCloneMaxPerTargetDisk())
+        self.successCloneCount = 0
+        self.failedCloneCount = 0
+        self.bytesCloned = 0
+        self.bytesProcessed = 0
+        self.startTime = time.time()
+        self._lastStatusUpdate = 0
+        self._reserved = set()
+        self._lock = threading.Lock()
+        self._targetLock = threading.Lock()
+
+    def selectTargetDisk(self, fio, copies):
+        """
+        Selects the disk where ``fio`` will be cloned into, which must not
+        already host a copy of the file (as given by ``copies``, or by other
+        clones of this request), and reserves it for the file.
+        """
+        fileId, fileVersion = fio.getFileId(), fio.getFileVersion()
+        with self._targetLock:
+            if self.trgDiskInfo:
+                trgDiskInfo = self.trgDiskInfo
+            else:
+                # Try to find a disk not hosting already a file with that
+                # ID + version.
+                diskExemptList = [fio.getDiskId()]
+                while (1):
+                    trgDiskInfo = ngamsDiskUtils.\
+                                  findTargetDisk(self.srvObj.getHostId(),
+                                                 self.srvObj.getDb(),
+                                                 self.srvObj.getCfg(),
+                                                 fio.getFormat(),
+                                                 1, diskExemptList)
+                    diskId = trgDiskInfo.getDiskId()
+                    if (diskId in copies or
+                        (diskId, fileId, fileVersion) in self._reserved):
+                        # This file is already stored on the given disk.
+                        # Add to the exempt list.
+                        diskExemptList.append(diskId)
+                    else:
+                        # OK, this disk should be OK, stop looking for a
+                        # suitable Target Disk.
+                        break
+            self._reserved.add((trgDiskInfo.getDiskId(), fileId, fileVersion))
+        return trgDiskInfo
+
+    def releaseTargetDisk(self, trgDiskInfo, fio):
+        with self._targetLock:
+            self._reserved.discard((trgDiskInfo.getDiskId(), fio.getFileId(),
+                                    fio.getFileVersion()))
+
+    def fileCloned(self, fio, newFileInfo):
+        with self._lock:
+            self.successCloneCount += 1
+            self.bytesCloned += fio.getFileSize()
+            self.bytesProcessed += fio.getFileSize()
+            self.progressDbm.add(_sourceFileKey(fio), newFileInfo.getDiskId())
+            if (self.cloneStatusDbm is not None):
+                tmpFileList = _cloneStatusFileList(fio)
+                tmpFileList.setStatus(NGAMS_SUCCESS)
+                tmpFileList.addFileInfoObj(fio.setTag("SOURCE_FILE"))
+                tmpFileList.addFileInfoObj(newFileInfo.setTag("TARGET_FILE"))
+                self.cloneStatusDbm.addIncKey(tmpFileList)
+            self._updateRequestStatus()
+
+    def fileFailed(self, fio, errMsg):
+        with self._lock:
+            self.failedCloneCount += 1
+            self.bytesProcessed += fio.getFileSize()
+            if (self.cloneStatusDbm is not None):
+                tmpFileList = _cloneStatusFileList(fio)
+                tmpFileList.setStatus(NGAMS_FAILURE + ": Error: " + errMsg)
+                tmpFileList.addFileInfoObj(fio.setTag("SOURCE_FILE"))
+                self.cloneStatusDbm.addIncKey(tmpFileList)
+            self._updateRequestStatus()
+
+    def _updateRequestStatus(self):
+        """
+        Publishes the progress, throughput and estimated remaining time of
+        the request in its Request Status, at most once per second
+        """
+        if (not self.reqPropsObj):
+            return
+        self.reqPropsObj.incActualCount(1)
+        now = time.time()
+        if now - self._lastStatusUpdate < _REQ_STATUS_UPDATE_PERIOD:
+            return
+        self._lastStatusUpdate = now
+
+        elapsed = max(now - self.startTime, 1e-6)
+        throughput = self.bytesProcessed / elapsed
+        self.reqPropsObj.setThroughput(self.bytesCloned / elapsed)
+        if (throughput):
+            remainTime = (self.totalBytes - self.bytesProcessed) / throughput
+            self.reqPropsObj.setEstTotalTime(elapsed + remainTime).\
+                             setRemainingTime(remainTime)
+        complPercent = (100.0 * (float(self.reqPropsObj.getActualCount()) /
+                                 float(self.reqPropsObj.getExpectedCount())))
+        self.reqPropsObj.setCompletionPercent(complPercent, 1)
+        self.srvObj.updateRequestDb(self.reqPropsObj)
+
+
+def _cloneStatusFileList(fio):
+    return ngamsFileList.ngamsFileList("FILE_CLONE_STATUS",
+                                       "File: " + fio.getFileId() + "/" +\
+                                       fio.getDiskId() + "/" +\
+                                       str(fio.getFileVersion()))
+
+
+def _sourceFileKey(fio):
+    return ngamsLib.genFileKey(fio.getDiskId(), fio.getFileId(),
+                               fio.getFileVersion())
+
+
+def _cloneFile(job,
+               fio,
+               hostId,
+               mtPt,
+               copies):
+    """
+    Clone one file into a disk of this host.
+
+    job:         The Clone Request the file belongs to (_clone_job).
+
+    fio:         File info object of the file to clone (ngamsFileInfo).
+
+    hostId:      ID of the host where the file is stored (string).
+
+    mtPt:        Mount point of the disk hosting the file (string).
+
+    copies:      IDs of the disks already hosting a copy of the file
+                 (set).
+
+    Returns:     File info object of the new copy of the file (ngamsFileInfo).
+    """
+    # Check if file is marked as bad.
+    if (fio.getFileStatus()[0] == "1"):
+        errMsg = "File marked as bad - skipping!"
+        raise Exception(errMsg)
+
+    trgDiskInfo = job.selectTargetDisk(fio, copies)
+    try:
+        # We don't accept to clone onto the same disk (this would mean
+        # overwriting).
+        if (trgDiskInfo.getDiskId() == fio.getDiskId()):
+            raise Exception("Source and target files are identical")
+
+        with job.targetSlots(trgDiskInfo.getDiskId()):
+            return _cloneFileToDisk(job, fio, hostId, mtPt, copies, trgDiskInfo)
+    except Exception:
+        job.releaseTargetDisk(trgDiskInfo, fio)
+        raise
+
+
+def _cloneFileToDisk(job,
+                     fio,
+                     hostId,
+                     mtPt,
+                     copies,
+                     trgDiskInfo):
+    """
+    Receive the file into a Staging File on the given Target Disk, and move
+    it into its final location. See _cloneFile() for details.
+    """
+    srvObj = job.srvObj
+    tmpReqPropsObj = ngamsReqProps.ngamsReqProps()
+    tmpReqPropsObj.setMimeType(fio.getFormat())
+    stagingFilename = ngamsHighLevelLib.\
+                      genStagingFilename(srvObj.getCfg(),
+                                         tmpReqPropsObj,
+                                         trgDiskInfo, fio.getFileId())
+    # Receive the data into the Staging File using the urllib.
+    if (srvObj.getHostId() != hostId):
+        # Example: http://host:7777/RETRIEVE?file_id=id&file_version=1
+        ipAddress = job.hostInfoDic[hostId].getIpAddress()
+        portNo = job.hostInfoDic[hostId].getSrvPort()
+        fileUrl = "http://" + ipAddress + ":" + str(portNo) +\
+                  "/RETRIEVE?" + "file_id=" + fio.getFileId() +\
+                  "&file_version=" + str(fio.getFileVersion())
+        # If a specific Disk ID for the source file is given, append
+        # this.
+        if (fio.getDiskId()):
+            fileUrl += "&disk_id=%s" % fio.getDiskId()
+
+        # Check if host is suspended, if yes, wake it up.
+        if (srvObj.getDb().getSrvSuspended(hostId)):
+            logger.debug("Clone Request - Waking up suspended " +\
+                 "NGAS Host: %s", hostId)
+            ngamsSrvUtils.wakeUpHost(srvObj, hostId)
+    else:
+        fileUrl = "file:" + mtPt + "/" + fio.getFilename()
+    logger.debug("Receiving file via URI: %s into staging filename: %s",
+                 fileUrl, stagingFilename)
+    # We try up to 5 times to retrieve the file in case a problem is
+    # encountered during cloning.
+    for attempt in range(5):
+        try:
+            filename, headers = urlrequest.urlretrieve(fileUrl, stagingFilename)
+            checksum = _checkFile(srvObj, fio, stagingFilename, headers,
+                                  job.checkChecksum)
+            # If we get to this point the transfer was (probably) OK.
+            break
+        except Exception as e:
+            rmFile(stagingFilename)
+            errMsg = "Problem occurred while cloning file "+\
+                     "via URL: " + fileUrl + " - Error: " + str(e)
+            if (attempt < 4):
+                errMsg += " - Retrying in 5s ..."
+                logger.error(errMsg)
+                time.sleep(5)
+            else:
+                raise Exception(errMsg)
+
+    try:
+        # We simply copy the file into the same destination as the
+        # source file (but on another disk).
+        targPathName  = os.path.dirname(fio.getFilename())
+        targFilename  = os.path.basename(fio.getFilename())
+        complTargPath = os.path.normpath(trgDiskInfo.getMountPoint() +\
+                                         "/" + targPathName)
+        checkCreatePath(complTargPath)
+        complFilename = os.path.normpath(complTargPath + "/"+targFilename)
+        mvTime = mvFile(stagingFilename, complFilename)
+        ngamsLib.makeFileReadOnly(complFilename)
+    except Exception:
+        if (os.path.exists(stagingFilename)):
+            rmFile(stagingFilename)
+        raise
+
+    # The checksum of the new copy was just checked, no need to do it again
+    # until the cached value expires
+    srvObj.checksum_cache.put(trgDiskInfo.getMountPoint(), fio.getFilename(),
+                              ngamsFileUtils.get_checksum_name(fio.getChecksumPlugIn()),
+                              checksum)
+
+    # Update status for new file in the DB.
+    newFileInfo = fio.clone().setDiskId(trgDiskInfo.getDiskId()).\
+                  setCreationDate(getFileCreationTime(complFilename))
+    fileExists = trgDiskInfo.getDiskId() in copies
+    newFileInfo.write(srvObj.getHostId(), srvObj.getDb())
+
+    # Update status for the Target Disk in DB + check if the disk is
+    # completed.
+    if (fileExists): mvTime = 0
+    dummyDapiStatObj = ngamsDapiStatus.ngamsDapiStatus().\
+                       setDiskId(trgDiskInfo.getDiskId()).\
+                       setFileExists(fileExists).\
+                       setFileSize(fio.getFileSize()).setIoTime(mvTime)
+    ngamsDiskUtils.updateDiskStatusDb(srvObj.getDb(), dummyDapiStatObj)
+    ngamsArchiveUtils.checkDiskSpace(srvObj, trgDiskInfo.getDiskId())
+
+    # If running as a cache archive, update the Cache New Files DBM
+    # with the information about the new file.
+    if (srvObj.getCachingActive()):
+        ngamsCacheControlThread.addEntryNewFilesDbm(srvObj,
+                                                    trgDiskInfo.getDiskId(),
+                                                    fio.getFileId(),
+                                                    fio.getFileVersion(),
+                                                    fio.getFilename())
+
+    return newFileInfo
+
+
+def _cloneWorker(job,
+                 workQueue):
+    """
+    Clone the files put in ``workQueue`` until a None is found.
+    """
+    srvObj = job.srvObj
+    while (1):
+        entry = workQueue.get()
+        if entry is None:
+            return
+
+        # Check if we have permission to run. Otherwise, skip the rest
+        # of the files.
+        if (not srvObj.run_async_commands): continue
+
+        fio, hostId, mtPt, copies = entry
+        text = "Cloning file - File ID: %s/%d, on disk " +\
+               "with ID: %s on host: %s"
+        logger.debug(text, fio.getFileId(), fio.getFileVersion(),
+                       fio.getDiskId(), hostId)
+
+        clone_start = time.time()
+        try:
+            with job.sourceSlots(fio.getDiskId()):
+                newFileInfo = _cloneFile(job, fio, hostId, mtPt, copies)
+            job.fileCloned(fio, newFileInfo)
+
+            # Generate a confirmation log entry.
+            msg = genLog("NGAMS_INFO_FILE_CLONED",
+                         [fio.getFileId(), fio.getFileVersion(),
+                          fio.getDiskId(), hostId])
+            msg = msg + ". Time: %.3fs." % (time.time() - clone_start)
+            logger.info(msg, extra={'to_syslog': True})
+        except Exception as e:
+            errMsg = genLog("NGAMS_ER_FILE_CLONE_FAILED",
+                            [fio.getFileId(), fio.getFileVersion(),
+                             fio.getDiskId(), hostId, str(e)])
+            logger.warning(errMsg)
+            job.fileFailed(fio, errMsg)
+
+
+def _interleaveBySourceDisk(cloneEntries):
+    """
+    Reorder the given clone list entries so consecutive files come from
+    different source disks whenever possible, letting the workers read
+    from all source disks at the same time.
+    """
+    byDisk = collections.OrderedDict()
+    for entry in cloneEntries:
+        byDisk.setdefault(entry[0].getDiskId(), []).append(entry)
+    queues = [collections.deque(entries) for entries in byDisk.values()]
+    while queues:
+        for q in queues:
+            yield q.popleft()
+        queues = [q for q in queues if q]
+
+
+def _cloneListBatches(cloneListDbm, batchSize):
+    """
+    Yield the entries of the clone list in batches of ``batchSize``.
+    """
+    batch = []
+    key = 0
+    while (1):
+        if (not cloneListDbm.hasKey(str(key))): break
+        batch.append(cloneListDbm.get(str(key)))
+        key += 1
+        if len(batch) == batchSize:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
 
 
 def _cloneExec(srvObj,
                cloneListDbmName,
                tmpFilePat,
                targetDiskId,
-               reqPropsObj):
+               reqPropsObj,
+               progressDbmName):
     """
     See documentation of ngamsCloneCmd._cloneThread(). This function is
     merely implemented in order to encapsulate the whole process to be able
@@ -344,257 +734,107 @@ def _cloneExec(srvObj,
     cloneListDbm = ngamsDbm.ngamsDbm(cloneListDbmName)
 
     # We have to get the port numbers of the hosts where the files to be
-    # cloned are stored.
+    # cloned are stored, and the total amount of data to clone.
     hostInfoDic = {}
+    totalFiles = 0
+    totalBytes = 0
     cloneListDbm.initKeyPtr()
     while (1):
         key, fileInfo = cloneListDbm.getNext()
         if (not key): break
         hostInfoDic[fileInfo[1]] = -1
+        totalFiles += 1
+        totalBytes += fileInfo[0].getFileSize()
     hostInfoDic = ngamsHighLevelLib.resolveHostAddress(srvObj.getHostId(),
                                                        srvObj.getDb(),
                                                        srvObj.getCfg(),
                                                        hostInfoDic.keys())
 
-    # The cloning loop. Loop over the list of files to clone and generate
-    # a report with the result.
+    # If a Target Disk was specified, all files go there.
+    trgDiskInfo = None
+    if (targetDiskId):
+        try:
+            trgDiskInfo = ngamsDiskInfo.ngamsDiskInfo().\
+                          read(srvObj.getDb(), targetDiskId)
+            slotId = trgDiskInfo.getSlotId()
+            storageSetId = srvObj.getCfg().\
+                           getStorageSetFromSlotId(slotId).\
+                           getStorageSetId()
+            trgDiskInfo.setStorageSetId(storageSetId)
+        except Exception as e:
+            errMsg = "Cannot clone files onto disk with ID: %s - Error: %s"
+            logger.error(errMsg, targetDiskId, str(e), extra={'to_syslog': True})
+            return
+
+    # The Clone Status Report, and the list of files successfully cloned,
+    # which is kept across executions of the same Clone Request.
     if (emailNotif):
         cloneStatusDbmName = tmpFilePat + "_CLONE_STATUS_DB"
         cloneStatusDbm = ngamsDbm.ngamsDbm(cloneStatusDbmName,
                                            cleanUpOnDestr = 0, writePerm = 1)
-
-    successCloneCount = 0
-    failedCloneCount  = 0
-    abortCloneLoop    = 0
-    timeAccu          = 0.0
-    key = 0
-    while (1):
-
-        clone_start = time.time()
-
-        if (not cloneListDbm.hasKey(str(key))): break
-        fileInfo = cloneListDbm.get(str(key))
-        key += 1
-
-        # Check if we have permission to run. Otherwise, stop.
-        if (not srvObj.run_async_commands): break
-
-        fio = fileInfo[0]
-        mtPt = fileInfo[2]
-        if (emailNotif):
-            tmpFileList = ngamsFileList.\
-                          ngamsFileList("FILE_CLONE_STATUS",
-                                        "File: " + fio.getFileId() + "/" +\
-                                        fio.getDiskId() + "/" +\
-                                        str(fio.getFileVersion()))
-        hostId = fileInfo[1]
-        text = "Cloning file - File ID: %s/%d, on disk " +\
-               "with ID: %s on host: %s"
-        logger.debug(text, fio.getFileId(), fio.getFileVersion(),
-                       fio.getDiskId(), hostId)
-
-        # We generate a local Staging File and archive this.
-        stagingFilename = ""
-        try:
-            # Check if file is marked as bad.
-            if (fio.getFileStatus()[0] == "1"):
-                errMsg = "File marked as bad - skipping!"
-                raise Exception(errMsg)
-
-            if (targetDiskId == ""):
-                # Try to find a disk not hosting already a file with that
-                # ID + version.
-                diskExemptList = [fio.getDiskId()]
-                while (1):
-                    trgDiskInfo = ngamsDiskUtils.\
-                                  findTargetDisk(srvObj.getHostId(),
-                                                 srvObj.getDb(),
-                                                 srvObj.getCfg(),
-                                                 fio.getFormat(),
-                                                 1, diskExemptList)
-                    # Check if a file with that ID + version is already
-                    # stored on the selected Target Disk.
-                    if (srvObj.getDb().fileInDb(trgDiskInfo.getDiskId(),
-                                                fio.getFileId(),
-                                                fio.getFileVersion())):
-                        # This file is already stored on the given disk.
-                        # Add to the exempt list.
-                        diskExemptList.append(trgDiskInfo.getDiskId())
-                    else:
-                        # OK, this disk should be OK, stop looking for a
-                        # suitable Target Disk.
-                        break
-            else:
-                try:
-                    trgDiskInfo = ngamsDiskInfo.ngamsDiskInfo().\
-                                  read(srvObj.getDb(), targetDiskId)
-                    slotId = trgDiskInfo.getSlotId()
-                    storageSetId = srvObj.getCfg().\
-                                   getStorageSetFromSlotId(slotId).\
-                                   getStorageSetId()
-                    trgDiskInfo.setStorageSetId(storageSetId)
-                except Exception:
-                    abortCloneLoop = 1
-                    raise
-
-            # We don't accept to clone onto the same disk (this would mean
-            # overwriting).
-            if (trgDiskInfo.getDiskId() == fio.getDiskId()):
-                err = "Source and target files are identical"
-                msg = "Failed in cloning file with ID: " + fio.getFileId() +\
-                      "/Version: " + str(fio.getFileVersion()) +\
-                      " on disk with ID: " + fio.getDiskId() +\
-                      " on host: " + hostId + ". Reason: " + err
-                logger.warning(msg)
-                if (emailNotif):
-                    tmpFileList.setStatus(NGAMS_FAILURE + ": " + err)
-                    tmpFileList.addFileInfoObj(fio.setTag("SOURCE_FILE"))
-                    cloneStatusDbm.addIncKey(tmpFileList)
-                failedCloneCount += 1
-                continue
-
-            tmpReqPropsObj = ngamsReqProps.ngamsReqProps()
-            tmpReqPropsObj.setMimeType(fio.getFormat())
-            stagingFilename = ngamsHighLevelLib.\
-                              genStagingFilename(srvObj.getCfg(),
-                                                 tmpReqPropsObj,
-                                                 trgDiskInfo, fio.getFileId())
-            # Receive the data into the Staging File using the urllib.
-            if (srvObj.getHostId() != hostId):
-                # Example: http://host:7777/RETRIEVE?file_id=id&file_version=1
-                ipAddress = hostInfoDic[hostId].getIpAddress()
-                portNo = hostInfoDic[hostId].getSrvPort()
-                fileUrl = "http://" + ipAddress + ":" + str(portNo) +\
-                          "/RETRIEVE?" + "file_id=" + fio.getFileId() +\
-                          "&file_version=" + str(fio.getFileVersion())
-                # If a specific Disk ID for the source file is given, append
-                # this.
-                if (fio.getDiskId()):
-                    fileUrl += "&disk_id=%s" % fio.getDiskId()
-
-                # Check if host is suspended, if yes, wake it up.
-                if (srvObj.getDb().getSrvSuspended(hostId)):
-                    logger.debug("Clone Request - Waking up suspended " +\
-                         "NGAS Host: %s", hostId)
-                    ngamsSrvUtils.wakeUpHost(srvObj, hostId)
-            else:
-                fileUrl = "file:" + mtPt + "/" + fio.getFilename()
-            logger.debug("Receiving file via URI: %s into staging filename: %s",
-                         fileUrl, stagingFilename)
-            # We try up to 5 times to retrieve the file in case a problem is
-            # encountered during cloning.
-            for attempt in range(5):
-                try:
-                    filename, headers = urlrequest.urlretrieve(fileUrl, stagingFilename)
-                    _checkFile(srvObj, fio, stagingFilename, headers,
-                               checkChecksum)
-                    # If we get to this point the transfer was (probably) OK.
-                    break
-                except Exception as e:
-                    rmFile(stagingFilename)
-                    errMsg = "Problem occurred while cloning file "+\
-                             "via URL: " + fileUrl + " - Error: " + str(e)
-                    if (attempt < 4):
-                        errMsg += " - Retrying in 5s ..."
-                        logger.error(errMsg)
-                        time.sleep(5)
-                    else:
-                        raise Exception(errMsg)
-
-            # We simply copy the file into the same destination as the
-            # source file (but on another disk).
-            targPathName  = os.path.dirname(fio.getFilename())
-            targFilename  = os.path.basename(fio.getFilename())
-            complTargPath = os.path.normpath(trgDiskInfo.getMountPoint() +\
-                                             "/" + targPathName)
-            checkCreatePath(complTargPath)
-            complFilename = os.path.normpath(complTargPath + "/"+targFilename)
-            mvTime = mvFile(stagingFilename, complFilename)
-            ngamsLib.makeFileReadOnly(complFilename)
-
-            # Update status for new file in the DB.
-            newFileInfo = fio.clone().setDiskId(trgDiskInfo.getDiskId()).\
-                          setCreationDate(getFileCreationTime(complFilename))
-            fileExists = srvObj.getDb().fileInDb(trgDiskInfo.getDiskId(),
-                                                 fio.getFileId(),
-                                                 fio.getFileVersion())
-            newFileInfo.write(srvObj.getHostId(), srvObj.getDb())
-
-            # Update status for the Target Disk in DB + check if the disk is
-            # completed.
-            if (fileExists): mvTime = 0
-            dummyDapiStatObj = ngamsDapiStatus.ngamsDapiStatus().\
-                               setDiskId(trgDiskInfo.getDiskId()).\
-                               setFileExists(fileExists).\
-                               setFileSize(fio.getFileSize()).setIoTime(mvTime)
-            ngamsDiskUtils.updateDiskStatusDb(srvObj.getDb(), dummyDapiStatObj)
-            ngamsArchiveUtils.checkDiskSpace(srvObj, trgDiskInfo.getDiskId())
-
-            # Update the clone file status list.
-            if (emailNotif):
-                tmpFileList.setStatus(NGAMS_SUCCESS)
-                tmpFileList.addFileInfoObj(fio.setTag("SOURCE_FILE"))
-                tmpFileList.addFileInfoObj(newFileInfo.setTag("TARGET_FILE"))
-                cloneStatusDbm.addIncKey(tmpFileList)
-            successCloneCount += 1
-
-            # If running as a cache archive, update the Cache New Files DBM
-            # with the information about the new file.
-            if (srvObj.getCachingActive()):
-                diskId   = trgDiskInfo.getDiskId()
-                fileId   = fio.getFileId()
-                fileVer  = fio.getFileVersion()
-                filename = fio.getFilename()
-                ngamsCacheControlThread.addEntryNewFilesDbm(srvObj, diskId,
-                                                            fileId, fileVer,
-                                                            filename)
-
-            # Generate a confirmation log entry.
-            cloneTime = time.time() - clone_start
-            timeAccu += cloneTime
-            msg = genLog("NGAMS_INFO_FILE_CLONED",
-                         [fio.getFileId(), fio.getFileVersion(),
-                          fio.getDiskId(), hostId])
-            msg = msg + ". Time: %.3fs. Total time: %.3fs." %\
-                  (cloneTime, timeAccu)
-            logger.info(msg, extra={'to_syslog': True})
-        except Exception as e:
-            cloneTime = time.time() - clone_start
-            timeAccu += cloneTime
-            errMsg = genLog("NGAMS_ER_FILE_CLONE_FAILED",
-                            [fio.getFileId(), fio.getFileVersion(),
-                             fio.getDiskId(), hostId, str(e)])
-            if (abortCloneLoop):
-                logger.error(errMsg, extra={'to_syslog': True})
-                return
-            else:
-                logger.warning(errMsg)
-                if (emailNotif):
-                    tmpFileList.setStatus(NGAMS_FAILURE + ": Error: " + errMsg)
-                    tmpFileList.addFileInfoObj(fio.setTag("SOURCE_FILE"))
-                    cloneStatusDbm.addIncKey(tmpFileList)
-                failedCloneCount += 1
-
-            # Delete Staging File if already created.
-            if ((stagingFilename != "") and (os.path.exists(stagingFilename))):
-                rmFile(stagingFilename)
-
-        # Calculate time statistics.
-        if (reqPropsObj):
-            ngamsHighLevelLib.stdReqTimeStatUpdate(srvObj, reqPropsObj.\
-                                                   incActualCount(1), timeAccu)
+    progressDbm = ngamsDbm.ngamsDbm(progressDbmName, writePerm = 1,
+                                    autoSync = 1)
+
+    # The cloning loop. A pool of workers clones the files of the list, which
+    # is fed to them in batches whose existing copies are looked up with a
+    # single query.
+    job = _clone_job(srvObj, reqPropsObj, trgDiskInfo, hostInfoDic,
+                     checkChecksum, cloneStatusDbm, progressDbm, totalBytes)
+    nWorkers = max(1, srvObj.getCfg().getCloneWorkers())
+    workQueue = queue.Queue(maxsize = 2 * nWorkers)
+    workers = []
+    for i in range(nWorkers):
+        thrName = NGAMS_CLONE_THR + "WORKER-%d" % i
+        worker = threading.Thread(target=_cloneWorker, name=thrName,
+                                  args=(job, workQueue))
+        worker.daemon = True
+        worker.start()
+        workers.append(worker)
+    try:
+        for batch in _cloneListBatches(cloneListDbm, _EXISTENCE_CHECK_BATCH):
+            if (not srvObj.run_async_commands): break
+            copies = collections.defaultdict(set)
+            fileIds = [fileInfo[0].getFileId() for fileInfo in batch]
+            for diskId, fileId, fileVersion in srvObj.getDb().filesInDb(fileIds):
+                copies[(fileId, fileVersion)].add(diskId)
+            for fio, hostId, mtPt in _interleaveBySourceDisk(batch):
+                fileCopies = copies[(fio.getFileId(), fio.getFileVersion())]
+                workQueue.put((fio, hostId, mtPt, fileCopies))
+    finally:
+        for _ in workers:
+            workQueue.put(None)
+        for worker in workers:
+            worker.join()
+
+    successCloneCount = job.successCloneCount
+    failedCloneCount = job.failedCloneCount
+    timeAccu = time.time() - job.startTime
 
     # Final update of the Request Status.
     if (reqPropsObj):
         complPercent = (100.0 * (float(reqPropsObj.getActualCount()) /
                                  float(reqPropsObj.getExpectedCount())))
         reqPropsObj.setCompletionPercent(complPercent, 1)
+        reqPropsObj.setThroughput(job.bytesCloned / max(timeAccu, 1e-6))
+        reqPropsObj.setRemainingTime(0)
         reqPropsObj.setCompletionTime(1)
         srvObj.updateRequestDb(reqPropsObj)
 
+    # The list of cloned files is needed only if the Clone Request has to
+    # be resumed
+    totFiles = (successCloneCount + failedCloneCount)
+    timePerFile = (timeAccu / totFiles) if totFiles else 0.0
+    job.progressDbm = None
+    del progressDbm
+    if (totFiles == totalFiles and not failedCloneCount):
+        rmFile(progressDbmName + "*")
+    else:
+        logger.warning("Clone Request not completed (%d of %d file(s) cloned), "
+                       "issue it again to resume it",
+                       successCloneCount, totalFiles)
+
     # Send Clone Report with list of files cloned to a possible
     # requestor(select) of this.
-    totFiles = (successCloneCount + failedCloneCount)
     if (emailNotif):
         xmlStat = 0
         # TODO: Generation of XML status report is disabled since we cannot
@@ -655,7 +895,7 @@ def _cloneExec(srvObj,
             fo.write(tmpFormat % (toiso8601(), srvObj.getHostId(), diskId, fileId,
                                   str(fileVersion), totFiles,
                                   successCloneCount, failedCloneCount,
-                                  timeAccu, (timeAccu / totFiles)))
+                                  timeAccu, timePerFile))
             tmpFormat = "%-70s %-70s %-7s\n"
             fo.write(tmpFormat % ("Source File", "Target File", "Status"))
             fo.write(tmpFormat % (70 * "-", 70 * "-", 7 * "-"))
@@ -700,7 +940,7 @@ def _cloneExec(srvObj,
     if (cloneListDbm): del cloneListDbm
     rmFile(cloneListDbmName + "*")
     logger.info("_cloneExec(). Total time: %.3fs. Average time per file: %.3fs.",
-                timeAccu, (timeAccu / totFiles))
+                timeAccu, timePerFile)
 
 
 def _cloneThread(srvObj,
@@ -708,7 +948,8 @@ def _cloneThread(srvObj,
                  tmpFilePat,
                  targetDiskId = "",
                  reqPropsObj = None,
-                 dummyPar = None):
+                 dummyPar = None,
+                 progressDbmName = None):
     """
     Function that carried out the actual cloning process of the files
     referenced to in the 'cloneList'
@@ -734,12 +975,16 @@ def _cloneThread(srvObj,
                       Request Status will be updated as the request is carried
                       out (ngamsReqProps).
 
+    progressDbmName:  Name of the DBM where the files successfully cloned
+                      are recorded, so the Clone Request can be resumed if
+                      interrupted (string).
+
     Returns:          Void.
     """
     logger.info("Cloning Thread carrying out Clone Request ...")
     try:
         _cloneExec(srvObj, cloneListDbmName, tmpFilePat, targetDiskId,
-                   reqPropsObj)
+                   reqPropsObj, progressDbmName)
         rmFile(tmpFilePat + "*")
         logger.info("Processing of Clone Request completed")
         return
@@ -748,6 +993,28 @@ def _cloneThread(srvObj,
         raise
 
 
+def _genProgressDbmName(ngamsCfgObj,
+                        diskId,
+                        fileId,
+                        fileVersion,
+                        targetDiskId):
+    """
+    Generate the name of the DBM where the files successfully cloned by a
+    Clone Request with the given parameters are recorded. It is kept in the
+    NG/AMS cache directory, so it survives server restarts, until the Clone
+    Request is completed.
+
+    ngamsCfgObj:    NG/AMS Configuration Object (ngamsConfig).
+
+    Returns:        Name of the DBM (string).
+    """
+    cacheDir = os.path.join(ngamsCfgObj.getRootDirectory(), NGAMS_CACHE_DIR)
+    checkCreatePath(os.path.normpath(cacheDir))
+    pars = "|".join((diskId, fileId, str(fileVersion), targetDiskId))
+    digest = hashlib.md5(pars.encode('utf8')).hexdigest()
+    return os.path.join(cacheDir, NGAMS_CLONE_THR + "PROGRESS_" + digest)
+
+
 def _clone(srvObj,
            diskId,
            fileId,
@@ -788,6 +1055,24 @@ def _clone(srvObj,
     # Take only the first element in these cases
     if fileId != "" and (diskId != "" or fileVersion == -1):
         all_info = [all_info[0]]
+
+    # Skip the files already cloned by a previous, interrupted execution of
+    # this same Clone Request
+    progressDbmName = _genProgressDbmName(srvObj.getCfg(), diskId, fileId,
+                                          fileVersion, targetDiskId)
+    if glob.glob(progressDbmName + "*"):
+        progressDbm = ngamsDbm.ngamsDbm(progressDbmName)
+        remaining = [info for info in all_info
+                     if not progressDbm.hasKey(_sourceFileKey(info[0]))]
+        del progressDbm
+        logger.info("Resuming Clone Request, %d file(s) were already cloned",
+                    len(all_info) - len(remaining))
+        all_info = remaining
+        if not all_info:
+            rmFile(progressDbmName + "*")
+            msg = "All files of CLONE command were already cloned"
+            _sendReply(srvObj, httpRef, srvObj.genStatus(NGAMS_SUCCESS, msg))
+            return
     cloneDbCount = len(all_info)
 
     cloneListDbmName = tmpFilePat + "_CLONE_INFO_DB"
@@ -825,7 +1110,7 @@ def _clone(srvObj,
 
         # Do the actual cloning in a thread
         args = (srvObj, cloneListDbmName, tmpFilePat, targetDiskId,
-                reqPropsObj, None)
+                reqPropsObj, None, progressDbmName)
         thrName = NGAMS_CLONE_THR + threading.current_thread().getName()
         cloneThread = threading.Thread(None, _cloneThread, thrName, args)
         cloneThread.setDaemon(0)
@@ -834,14 +1119,20 @@ def _clone(srvObj,
         # Carry out the cloning (directly in this thread) and send reply
         # when this is done.
         _cloneExec(srvObj, cloneListDbmName, tmpFilePat, targetDiskId,
-                   reqPropsObj)
+                   reqPropsObj, progressDbmName)
         msg = "Successfully handled command CLONE"
         logger.debug(msg)
         status = srvObj.genStatus(NGAMS_SUCCESS, msg).\
                  setReqStatFromReqPropsObj(reqPropsObj).setActualCount(0)
         rmFile(cloneListDbmName + "*")
 
-    # Send reply if possible.
+    _sendReply(srvObj, httpRef, status)
+
+
+def _sendReply(srvObj, httpRef, status):
+    """
+    Send the given status as reply, if the HTTP Reference object is given.
+    """
     if (httpRef):
         xmlStat = status.genXmlDoc(0, 0, 0, 1, 0)
         xmlStat = ngamsHighLevelLib.addStatusDocTypeXmlDoc(srvObj, xmlStat)
@@ -0,0 +1,46 @@
+#
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2019
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+#
+"""
+Contains the functions to handle the METRICS command.
+"""
+
+import six
+
+from ngamsLib import metrics
+
+
+def handleCmd(srvObj, reqPropsObj, httpRef):
+    """
+    Handle METRICS command. The server metrics are sent back using the
+    Prometheus text exposition format.
+
+    srvObj:         Reference to NG/AMS server class object (ngamsServer).
+
+    reqPropsObj:    Request Property object to keep track of actions done
+                    during the request handling (ngamsReqProps).
+
+    httpRef:        Reference to the HTTP request handler
+                    object (ngamsHttpRequestHandler).
+
+    Returns:        Void.
+    """
+    httpRef.send_data(six.b(srvObj.metrics.render()), metrics.CONTENT_TYPE)
@@ -0,0 +1,241 @@
+#
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2019
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+#
+"""
+Function + code to handle the MRETRIEVE Command.
+
+MRETRIEVE retrieves many files in a single request. The files are given in
+the body of a POST request, one per line, each line containing a file ID
+optionally followed by a file version (separated by whitespace). The
+locations of all files are looked up in batches, and their contents are sent
+back either as a MIME multipart message or as a tarball, like CRETRIEVE does
+with the contents of a container.
+"""
+
+import collections
+import logging
+import os
+import tarfile
+
+from ngamsLib.ngamsCore import genLog, getFileSize, NGAMS_CONT_MT, \
+    NGAMS_ONLINE_STATE, NGAMS_IDLE_SUBSTATE, \
+    NGAMS_BUSY_SUBSTATE
+from ngamsLib import ngamsMIMEMultipart, utils
+from .. import InvalidParameter
+from . import cretrieve, retrieve
+
+
+logger = logging.getLogger(__name__)
+
+# Name of the container holding the files in MIME multipart responses
+CONTAINER_NAME = 'mretrieve'
+
+# HTTP code to redirect clients to other servers, keeping the request's body
+_HTTP_TEMPORARY_REDIRECT = 307
+
+requested_file = collections.namedtuple('requested_file', 'file_id version')
+file_location = collections.namedtuple('file_location',
+    'file_id host_id ip_address port mount_point filename version mime_type size compression')
+
+def parse_file_list(data):
+    """
+    Parses the body of an MRETRIEVE request, returning a list of
+    requested_file tuples. Versions default to -1 (i.e., the latest)
+    """
+    files = []
+    for line in utils.b2s(data).splitlines():
+        fields = line.split()
+        if not fields:
+            continue
+        if len(fields) > 2:
+            raise InvalidParameter("Invalid line in file list: %s" % line)
+        version = -1
+        if len(fields) == 2:
+            try:
+                version = int(fields[1])
+            except ValueError:
+                raise InvalidParameter("Invalid file version in file list: %s" % line)
+        files.append(requested_file(fields[0], version))
+    return files
+
+def locate_files(srvObj, files):
+    """
+    Locates all requested `files` with a batched database lookup, returning
+    a file_location for each of them in the same order. For each file the
+    latest version is chosen, unless a specific version was requested. Among
+    the copies of that version, copies in this server are preferred.
+    """
+
+    rows = collections.defaultdict(list)
+    for row in srvObj.getDb().getFileSummary3Multiple([f.file_id for f in files]):
+        loc = file_location(*row)
+        rows[loc.file_id].append(loc)
+
+    my_host_id = srvObj.getHostId()
+    locations = []
+    for f in files:
+        candidates = rows[f.file_id]
+        if f.version > 0:
+            candidates = [c for c in candidates if c.version == f.version]
+        if not candidates:
+            ref = f.file_id if f.version <= 0 else '%s/%d' % (f.file_id, f.version)
+            raise Exception(genLog("NGAMS_ER_UNAVAIL_FILE", [ref]))
+        version = max(c.version for c in candidates)
+        candidates = [c for c in candidates if c.version == version]
+        local = [c for c in candidates if c.host_id == my_host_id]
+        locations.append(local[0] if local else candidates[0])
+    return locations
+
+def _name_in_response(loc, names_count):
+    """Files requested more than once get their version appended"""
+    if names_count[loc.file_id] > 1:
+        return '%s.%d' % (loc.file_id, loc.version)
+    return loc.file_id
+
+def finfos_from_locations(srvObj, reqPropsObj, httpRef, locations):
+    """Creates a ngamsMIMEMultipart.file_info for each file location"""
+
+    names_count = collections.Counter(loc.file_id for loc in locations)
+    finfos = []
+    for loc in locations:
+        name = _name_in_response(loc, names_count)
+        if loc.host_id == srvObj.getHostId():
+            absname = os.path.normpath(os.path.join(loc.mount_point, loc.filename))
+            retrieve.performStaging(srvObj, reqPropsObj, httpRef, absname)
+            size = getFileSize(absname)
+            opener = cretrieve.fopener(absname)
+        else:
+            size = int(loc.size)
+            opener = cretrieve.http_opener(loc.ip_address, loc.port, loc.file_id,
+                                           loc.version, srvObj)
+        finfos.append(ngamsMIMEMultipart.file_info(loc.mime_type, name, size, opener))
+    return finfos
+
+def send_tarball(finfos, httpRef):
+    """Sends all files as a tarball, with the files at its top level"""
+
+    headers = []
+    for finfo in finfos:
+        tinfo = tarfile.TarInfo(name=finfo.name)
+        tinfo.type = tarfile.REGTYPE
+        tinfo.mode = 0o644
+        tinfo.size = finfo.size
+        headers.append(tinfo.tobuf())
+
+    # Headers might take more than one block for long names
+    size = 1024 + sum(len(hdr) + cretrieve.round_up(finfo.size, 512)
+                      for hdr, finfo in zip(headers, finfos))
+    httpRef.send_file_headers(CONTAINER_NAME + '.tar', 'application/x-tar', size)
+    for hdr, finfo in zip(headers, finfos):
+        httpRef.write_data(hdr)
+        cretrieve._send_finfo(finfo, httpRef)
+    httpRef.write_data(b'\x00' * 1024)
+
+def _handleCmdMRetrieve(srvObj, reqPropsObj, httpRef):
+    """
+    Carry out the action of a MRETRIEVE command.
+
+    srvObj:         Reference to NG/AMS server class object (ngamsServer).
+
+    reqPropsObj:    Request Property object to keep track of
+                    actions done during the request handling
+                    (ngamsReqProps).
+
+    httpRef:        Reference to the HTTP request handler
+                    object (ngamsHttpRequestHandler).
+
+    Returns:        Void.
+    """
+
+    # For data files, retrieval must be enabled otherwise the request is
+    # rejected.
+    if (not srvObj.getCfg().getAllowRetrieveReq()):
+        errMsg = genLog("NGAMS_ER_ILL_REQ", ["Retrieve"])
+        raise Exception(errMsg)
+
+    # We don't allow processing
+    if 'processing' in reqPropsObj:
+        raise Exception('MRETRIEVE command does not allow processing')
+
+    if not reqPropsObj.is_POST() or reqPropsObj.getSize() <= 0:
+        raise InvalidParameter("MRETRIEVE requires the list of files in the body of a POST request")
+    files = parse_file_list(httpRef.rfile.read(reqPropsObj.getSize()))
+    if not files:
+        raise InvalidParameter("No files requested")
+    logger.info("Handling request for %d files", len(files))
+
+    locations = locate_files(srvObj, files)
+
+    # Without proxy mode we can only redirect the whole request, and only if
+    # all files are in a single server
+    remote = set((loc.ip_address, loc.port) for loc in locations
+                 if loc.host_id != srvObj.getHostId())
+    if remote and not srvObj.getCfg().getProxyMode():
+        local = [loc for loc in locations if loc.host_id == srvObj.getHostId()]
+        if len(remote) > 1 or local:
+            raise Exception("Requested files are spread across different servers, "
+                            "cannot serve them without proxy mode")
+        host, port = remote.pop()
+        path = httpRef.path if httpRef.path.startswith('/') else '/' + httpRef.path
+        httpRef.redirect_to_url('http://%s:%d%s' % (host, port, path),
+                                http_status=_HTTP_TEMPORARY_REDIRECT)
+        return
+
+    finfos = finfos_from_locations(srvObj, reqPropsObj, httpRef, locations)
+    logger.info("Sending %d files (%d from other servers)", len(finfos),
+                len(locations) - sum(1 for loc in locations if loc.host_id == srvObj.getHostId()))
+
+    # Send all the data back, either as a multipart message or as a tarball
+    if 'format' in reqPropsObj and reqPropsObj['format'] == 'application/x-tar':
+        send_tarball(finfos, httpRef)
+    else:
+        cinfo = ngamsMIMEMultipart.container_info(CONTAINER_NAME, finfos)
+        reader = ngamsMIMEMultipart.ContainerReader(cinfo)
+        httpRef.send_data(reader, NGAMS_CONT_MT)
+
+
+def handleCmd(srvObj, reqPropsObj, httpRef):
+    """
+    Handle a MRETRIEVE command.
+
+    srvObj:         Reference to NG/AMS server class object (ngamsServer).
+
+    reqPropsObj:    Request Property object to keep track of
+                    actions done during the request handling
+                    (ngamsReqProps).
+
+    httpRef:        Reference to the HTTP request handler
+                    object (ngamsHttpRequestHandler).
+
+    Returns:        Void.
+    """
+
+    srvObj.checkSetState("Command MRETRIEVE", [NGAMS_ONLINE_STATE],
+                         [NGAMS_IDLE_SUBSTATE, NGAMS_BUSY_SUBSTATE],
+                         "", NGAMS_BUSY_SUBSTATE)
+
+    try:
+        _handleCmdMRetrieve(srvObj, reqPropsObj, httpRef)
+    finally:
+        srvObj.setSubState(NGAMS_IDLE_SUBSTATE)
+
+
+# EOF
@@ -31,8 +31,10 @@
 Dynamic loadable command to query the DB associated with the NG/AMS instance.
 """
 
+import csv
 import decimal
 import io
+import itertools
 import json
 import logging
 import os
@@ -41,7 +43,7 @@ import six
 from six.moves import cPickle  # @UnresolvedImport
 from six.moves import reduce  # @UnresolvedImport
 
-from ngamsLib import ngamsDbm, ngamsDbCore
+from ngamsLib import ngamsDbm, ngamsDbCore, utils
 from ngamsLib.ngamsCore import NGAMS_TMP_FILE_EXT, NGAMS_TEXT_MT, rmFile
 
 
@@ -51,6 +53,8 @@ CURSOR_IDX           = "__CURSOR_IDX__"
 NGAMS_PYTHON_LIST_MT = "application/python-list"
 NGAMS_PYTHON_PICKLE_MT = "application/python-pickle"
 NGAMS_JSON_MT = "application/json"
+NGAMS_JSON_LINES_MT = "application/x-ndjson"
+NGAMS_CSV_MT = "text/csv"
 
 # Dirty trick to get the simple columnnames from these tables
 class columns(object):
@@ -148,6 +152,64 @@ def formatAsList(resultSet, colnames):
     return buf.getvalue()
 
 
+def _as_python_list(rows, colnames):
+    """Yields ``rows`` formatted as the ``str`` representation of a list"""
+    yield b'['
+    for i, row in enumerate(rows):
+        if i:
+            yield b', '
+        yield six.b(repr(row))
+    yield b']'
+
+def _as_json(rows, colnames):
+    """Yields ``rows`` as a JSON list of objects"""
+    yield b'['
+    for i, row in enumerate(rows):
+        if i:
+            yield b', '
+        yield utils.s2b(json.dumps(dict(zip(colnames, row)), default=encode_decimal))
+    yield b']'
+
+def _as_json_lines(rows, colnames):
+    """Yields ``rows`` as JSON objects, one per line"""
+    for row in rows:
+        yield utils.s2b(json.dumps(dict(zip(colnames, row)), default=encode_decimal))
+        yield b'\n'
+
+def _as_csv(rows, colnames):
+    """Yields ``rows`` as CSV lines, preceded by a header line"""
+    buf = six.StringIO()
+    writer = csv.writer(buf)
+    for row in itertools.chain([colnames], rows):
+        writer.writerow(row)
+        yield utils.s2b(buf.getvalue())
+        buf.seek(0)
+        buf.truncate()
+
+# format: (formatting function, mime type)
+# These formats are produced row by row, and thus are streamed to the client
+_streamed_formats = {
+    "json": (_as_json, NGAMS_JSON_MT),
+    "jsonl": (_as_json_lines, NGAMS_JSON_LINES_MT),
+    "csv": (_as_csv, NGAMS_CSV_MT),
+    None: (_as_python_list, NGAMS_PYTHON_LIST_MT),
+}
+
+def _in_blocks(pieces, block_size):
+    """Joins the pieces of data yielded by ``pieces`` into bigger blocks"""
+    buf = []
+    buf_len = 0
+    for piece in pieces:
+        buf.append(piece)
+        buf_len += len(piece)
+        if buf_len >= block_size:
+            yield b''.join(buf)
+            buf = []
+            buf_len = 0
+    if buf:
+        yield b''.join(buf)
+
+
 def genCursorDbmName(rootDir,
                      cursorId):
     """
@@ -216,44 +278,39 @@ def handleCmd(srvObj,
         if param1 and param2:
             args = (param1, param2)
         elif param1:
-            sql = queries['files_greater']
+            colnames, sql = queries['files_greater']
             args = (param1,)
         else:
-            sql = queries['files_list']
+            colnames, sql = queries['files_list']
 
     # Execute the query.
     if not cursorId:
 
         # TODO: Make possible to return an XML document
-        # TODO: Potential problem with very large result sets.
-        #       Implement streaming result directly3
-        # rtobar, 2018 Feb: for the streaming result functionality to work
-        #                   correctly we need to support sending content with
-        #                   chunked transfer encoding first. This is not
-        #                   difficult to add on the server side, but needs
-        #                   to be also added on the client side (which I suppose
-        #                   means all languages, not only python, if we really
-        #                   need to maintain those).
-        #                   We already support proper cursors at the database
-        #                   access level, so it's not difficult to change
-        #                   the query below to use a cursor and work as a
-        #                   generator instead of returning the full list of
-        #                   results in one go.
-        res = list(srvObj.db.query2(sql, args=args))
+        # Results are read from a cursor and, for formats that allow it,
+        # streamed to the client as they are read (using chunked transfer
+        # encoding if the client supports it), so large result sets don't
+        # need to be held in memory
+        if out_format not in _streamed_formats and out_format not in ('list', 'text', 'pickle'):
+            out_format = None
+        block_size = srvObj.getCfg().getBlockSize()
+        with srvObj.db.dbCursor(sql, args=args) as cursor:
+            rows = cursor.fetch(1000)
+            if out_format in _streamed_formats:
+                formatter, mimeType = _streamed_formats[out_format]
+                data = _in_blocks(formatter(rows, colnames), block_size)
+                httpRef.send_chunked_data(data, mimeType)
+                return
+
+            res = list(rows)
+
         logger.info("Retrieved %d results for query: '%s' with args: %r", len(res), sql, args)
         if out_format in ("list", 'text'):
             finalRes = formatAsList(res, colnames)
             mimeType = NGAMS_TEXT_MT
-        elif out_format == "pickle":
+        else:
             finalRes = cPickle.dumps(res)
             mimeType = NGAMS_PYTHON_PICKLE_MT
-        elif out_format == "json":
-            results = [{colname: val for colname, val in zip(colnames, row)} for row in res]
-            finalRes = six.b(json.dumps(results, default=encode_decimal))
-            mimeType = NGAMS_JSON_MT
-        else:
-            finalRes = six.b(str(res))
-            mimeType = NGAMS_PYTHON_LIST_MT
 
         # Return the data and good bye.
         httpRef.send_data(finalRes, mimeType)
@@ -31,8 +31,11 @@
 Contains functions for handling the REGISTER command.
 """
 
+import collections
 import logging
+import multiprocessing
 import os
+import signal
 import threading
 import time
 
@@ -52,6 +55,271 @@ from .. import ngamsArchiveUtils, ngamsCacheControlThread, ngamsFileUtils
 
 logger = logging.getLogger(__name__)
 
+# Minimum period (in seconds) between updates of the Request Status
+_REQ_STATUS_UPDATE_PERIOD = 1.0
+
+_pending_file = collections.namedtuple('_pending_file',
+    'filename diskId piRes fileInfo startTime')
+
+def _initChecksumProc():
+    # Signals are meant for the server process, not for the pool's processes
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+def _checksum(args):
+    """
+    Computes the checksum of a file, returning it together with an error
+    message if the checksum could not be computed
+    """
+    filename, crc_variant = args
+    try:
+        return ngamsFileUtils.get_checksum(65536, filename, crc_variant) or '', None
+    except Exception as e:
+        return None, str(e)
+
+def _checksums(pool, batch, crc_variant):
+    """
+    Starts computing the checksums of the files of `batch`, in `pool` if
+    given, and returns a function that returns them in the same order.
+    """
+    args = [(fileInfo[0], crc_variant) for fileInfo in batch]
+    if pool:
+        return pool.map_async(_checksum, args).get
+    return lambda: [_checksum(a) for a in args]
+
+def _registerBatches(fileListDbm, sortFileList, batchSize):
+    """
+    Yields the entries of the File List DBM in batches of `batchSize`, in
+    the order given by the keys listed in the `sortFileList` file.
+    """
+    batch = []
+    with open(sortFileList) as fo:
+        for dbmKey in fo:
+            dbmKey = dbmKey.rstrip("\n")
+            if (dbmKey.strip() == ""):
+                break
+            batch.append(fileListDbm.get(dbmKey))
+            if len(batch) == batchSize:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+class _register_job(object):
+    """
+    Keeps track of the files handled by a Register Request, and of the
+    files moved to their final location whose information has not been
+    written yet into the DB.
+    """
+
+    def __init__(self, srvObj, reqPropsObj, diskInfoDic, crc_variant, regDbm):
+        self.srvObj = srvObj
+        self.reqPropsObj = reqPropsObj
+        self.diskInfoDic = diskInfoDic
+        self.crc_variant = crc_variant
+        self.regDbm = regDbm
+        self.pending = []
+        self.fileRegCount = 0
+        self.fileFailCount = 0
+        self.fileRejectCount = 0
+        self.bytesRegistered = 0
+        self.startTime = time.time()
+        self._lastStatusUpdate = 0
+
+    def _invokePlugIn(self, filename, diskId, mimeType):
+        srvObj = self.srvObj
+        regPi = srvObj.getCfg().register_plugins[mimeType]
+        logger.debug("Plugin found for %s: %s", mimeType, regPi)
+        params = ngamsPlugInApi.parseRawPlugInPars(regPi.pars)
+        tmpReqPropsObj = ngamsReqProps.ngamsReqProps().\
+                         setMimeType(mimeType).\
+                         setStagingFilename(filename).\
+                         setTargDiskInfo(self.diskInfoDic[diskId]).\
+                         setHttpMethod(NGAMS_HTTP_GET).\
+                         setCmd(NGAMS_REGISTER_CMD).\
+                         setSize(os.path.getsize(filename)).\
+                         setFileUri(filename).\
+                         setNoReplication(1)
+        plugInMethod = loadPlugInEntryPoint(regPi.name)
+        return plugInMethod(srvObj, tmpReqPropsObj, params)
+
+    def registerFile(self, filename, diskId, mimeType, checksum):
+        """
+        Registers a file, given its checksum as returned by _checksum().
+        The file is moved to its final location, but its information is
+        written into the DB only when the pending files are flushed.
+        """
+        srvObj = self.srvObj
+        reg_start = time.time()
+        try:
+            piRes = self._invokePlugIn(filename, diskId, mimeType)
+
+            # File versions are determined from the contents of the DB,
+            # which doesn't contain yet the files pending to be written
+            if any(p.piRes.getFileId() == piRes.getFileId() for p in self.pending):
+                self.flush()
+                piRes = self._invokePlugIn(filename, diskId, mimeType)
+
+            # Check if this file is already registered on this disk. In case
+            # yes, it is not registered again.
+            files = srvObj.db.getFileSummary1(srvObj.getHostId(), [piRes.getDiskId()],
+                                              [piRes.getFileId()])
+            for tmpFileInfo in files:
+                tmpMtPt = tmpFileInfo[ngamsDbCore.SUM1_MT_PT]
+                tmpFilename = tmpFileInfo[ngamsDbCore.SUM1_FILENAME]
+                tmpComplFilename = os.path.normpath(tmpMtPt + "/" +\
+                                                    tmpFilename)
+                if (tmpComplFilename == filename):
+                    self._fileRejected(filename, diskId, piRes)
+                    return
+
+            checksum, errMsg = checksum
+            if errMsg is not None:
+                raise Exception("Error while calculating checksum: %s" % errMsg)
+
+            # Move the file. Its information is written into the DB later
+            mvFile(filename, piRes.getCompleteFilename())
+            fileInfo = ngamsArchiveUtils.fileInfoFromPiStat(piRes, checksum,
+                                                            self.crc_variant)
+            self.pending.append(_pending_file(filename, diskId, piRes,
+                                              fileInfo, reg_start))
+        except Exception as e:
+            self._fileFailed(filename, diskId, str(e))
+
+    def flush(self):
+        """
+        Writes the information of the pending files and their disks into the
+        DB in a single transaction. If that fails, files are written one by
+        one.
+        """
+        pending, self.pending = self.pending, []
+        if not pending:
+            return
+        srvObj = self.srvObj
+
+        batched = True
+        try:
+            ngamsFileUtils.syncCachesCheckFiles(srvObj,
+                [p.piRes.getCompleteFilename() for p in pending])
+            srvObj.getDb().writeFileEntries(srvObj.getHostId(),
+                                            [p.fileInfo for p in pending],
+                                            updateDiskInfo=1)
+            written = pending
+        except Exception as e:
+            logger.warning("Failed to register %d files in a single transaction, "
+                           "registering them one by one. Error: %s", len(pending), str(e))
+            batched = False
+            written = []
+            for p in pending:
+                try:
+                    ngamsArchiveUtils.updateFileInfoDb(srvObj, p.piRes,
+                        p.fileInfo.getChecksum(), self.crc_variant)
+                    ngamsDiskUtils.updateDiskStatusDb(srvObj.getDb(), p.piRes)
+                    written.append(p)
+                except Exception as e:
+                    self._fileFailed(p.filename, p.diskId, str(e))
+
+        for p in written:
+            try:
+                if batched:
+                    ngamsArchiveUtils.addNewVersionToContainer(srvObj, p.fileInfo)
+                ngamsLib.makeFileReadOnly(p.piRes.getCompleteFilename())
+            except Exception as e:
+                logger.error(genLog("NGAMS_ER_FILE_REG_FAILED", [p.filename, str(e)]))
+            self._fileRegistered(p)
+
+    def _fileRegistered(self, p):
+        srvObj = self.srvObj
+        piRes = p.piRes
+        if (self.regDbm is not None):
+            uncomprSize = piRes.getUncomprSize()
+            ingestDate  = time.time()
+            creDateSecs = getFileCreationTime(piRes.getCompleteFilename())
+            tmpFileObj = ngamsFileInfo.ngamsFileInfo().\
+                         setDiskId(p.diskId).\
+                         setFilename(p.filename).\
+                         setFileId(piRes.getFileId()).\
+                         setFileVersion(piRes.getFileVersion()).\
+                         setFormat(piRes.getFormat()).\
+                         setFileSize(piRes.getFileSize()).\
+                         setUncompressedFileSize(uncomprSize).\
+                         setCompression(piRes.getCompression()).\
+                         setIngestionDate(ingestDate).\
+                         setIgnore(0).\
+                         setChecksum(p.fileInfo.getChecksum()).\
+                         setChecksumPlugIn(self.crc_variant).\
+                         setFileStatus(NGAMS_FILE_STATUS_OK).\
+                         setCreationDate(creDateSecs).\
+                         setTag("REGISTERED")
+            self.regDbm.addIncKey(tmpFileObj)
+        self.fileRegCount += 1
+        self.bytesRegistered += piRes.getFileSize()
+
+        # If running as a cache archive, update the Cache New Files DBM
+        # with the information about the new file.
+        if (srvObj.getCachingActive()):
+            ngamsCacheControlThread.addEntryNewFilesDbm(srvObj, p.diskId,
+                                                        piRes.getFileId(),
+                                                        piRes.getFileVersion(),
+                                                        p.filename)
+
+        # Generate a confirmation log entry.
+        msg = genLog("NGAMS_INFO_FILE_REGISTERED",
+                     [p.filename, piRes.getFileId(), piRes.getFileVersion(),
+                      piRes.getFormat()])
+        msg = msg + ". Time: %.3fs." % (time.time() - p.startTime)
+        logger.info(msg, extra={'to_syslog': 1})
+        self._fileHandled()
+
+    def _fileRejected(self, filename, diskId, piRes):
+        self.fileRejectCount += 1
+        tmpMsgForm = "REJECTED: File with File ID/Version: %s/%d " +\
+                     "and path: %s is already registered on disk " +\
+                     "with Disk ID: %s"
+        tmpMsg = tmpMsgForm % (piRes.getFileId(),
+                               piRes.getFileVersion(), filename,
+                               piRes.getDiskId())
+        logger.warning(tmpMsg + ". File is not registered again.")
+        if (self.regDbm is not None):
+            tmpFileObj = ngamsFileInfo.ngamsFileInfo().\
+                         setDiskId(diskId).setFilename(filename).\
+                         setTag(tmpMsg)
+            self.regDbm.addIncKey(tmpFileObj)
+        self._fileHandled()
+
+    def _fileFailed(self, filename, diskId, error):
+        errMsg = genLog("NGAMS_ER_FILE_REG_FAILED", [filename, error])
+        logger.error(errMsg)
+        if (self.regDbm is not None):
+            tmpFileObj = ngamsFileInfo.ngamsFileInfo().\
+                         setDiskId(diskId).setFilename(filename).\
+                         setTag(errMsg)
+            self.regDbm.addIncKey(tmpFileObj)
+        self.fileFailCount += 1
+        # TODO (rtobar, 2016-01): Why don't we raise an exception here?
+        #      Otherwise the command appears as successful on the
+        #      client-side
+        self._fileHandled()
+
+    def _fileHandled(self):
+        """
+        Publishes the progress, throughput and estimated remaining time of
+        the request in its Request Status, at most once per second
+        """
+        if (not self.reqPropsObj):
+            return
+        self.reqPropsObj.incActualCount(1)
+        now = time.time()
+        if now - self._lastStatusUpdate < _REQ_STATUS_UPDATE_PERIOD:
+            return
+        self._lastStatusUpdate = now
+        elapsed = now - self.startTime
+        self.reqPropsObj.setThroughput(self.bytesRegistered / max(elapsed, 1e-6))
+        ngamsHighLevelLib.stdReqTimeStatUpdate(self.srvObj, self.reqPropsObj,
+                                               elapsed)
+
+
 def _registerExec(srvObj,
                   fileListDbmName,
                   tmpFilePat,
@@ -156,163 +424,46 @@ def _registerExec(srvObj,
               (shellCmd, str(out), str(err)))
     rmFile(tmpFileList)
 
-    # Go through each file in the list, check if the mime-type is among the
-    # ones, which apply for registration. If yes try to register the file
-    # by invoking the corresponding DAPI on the file.
-    fileRegCount    = 0
-    fileFailCount   = 0
-    fileRejectCount = 0
-    regTimeAccu     = 0.0
-    fileCount       = 0
-    fo = open(sortFileList)
-    run = 1
-    while (run):
-        reg_start = time.time()
-        dbmKey = fo.readline()
-        if (dbmKey.strip() == ""):
-            run = 0
-            continue
-        fileInfo    = fileListDbm.get(dbmKey[0:-1])
-        filename    = fileInfo[0]
-        diskId      = fileInfo[1]
-        mimeType    = fileInfo[2]
-
-        # Register the file. Check first, that exactly this file is
-        # not already registered. In case it is, the file will be rejected.
-        regPi = srvObj.getCfg().register_plugins[mimeType]
-        logger.debug("Plugin found for %s: %s", mimeType, regPi)
-        params = ngamsPlugInApi.parseRawPlugInPars(regPi.pars)
-        tmpReqPropsObj = ngamsReqProps.ngamsReqProps().\
-                         setMimeType(mimeType).\
-                         setStagingFilename(filename).\
-                         setTargDiskInfo(diskInfoDic[diskId]).\
-                         setHttpMethod(NGAMS_HTTP_GET).\
-                         setCmd(NGAMS_REGISTER_CMD).\
-                         setSize(os.path.getsize(filename)).\
-                         setFileUri(filename).\
-                         setNoReplication(1)
-
-        tmpFileObj = ngamsFileInfo.ngamsFileInfo()
-        try:
-            # Invoke Registration Plug-In.
-            piName = regPi.name
-            plugInMethod = loadPlugInEntryPoint(piName)
-            piRes = plugInMethod(srvObj, tmpReqPropsObj, params)
-            del tmpReqPropsObj
-
-            # Check if this file is already registered on this disk. In case
-            # yes, it is not registered again.
-            files = srvObj.db.getFileSummary1(srvObj.getHostId(), [piRes.getDiskId()],
-                                              [piRes.getFileId()])
-            fileRegistered = 0
-            for tmpFileInfo in files:
-                tmpMtPt = tmpFileInfo[ngamsDbCore.SUM1_MT_PT]
-                tmpFilename = tmpFileInfo[ngamsDbCore.SUM1_FILENAME]
-                tmpComplFilename = os.path.normpath(tmpMtPt + "/" +\
-                                                    tmpFilename)
-                if (tmpComplFilename == filename):
-                    fileRegistered = 1
-                    break
-
-            if (fileRegistered):
-                fileRejectCount += 1
-                tmpMsgForm = "REJECTED: File with File ID/Version: %s/%d " +\
-                             "and path: %s is already registered on disk " +\
-                             "with Disk ID: %s"
-                tmpMsg = tmpMsgForm % (piRes.getFileId(),
-                                       piRes.getFileVersion(), filename,
-                                       piRes.getDiskId())
-                logger.warning(tmpMsg + ". File is not registered again.")
-                if (emailNotif):
-                    tmpFileObj.\
-                                 setDiskId(diskId).setFilename(filename).\
-                                 setTag(tmpMsg)
-                    regDbm.addIncKey(tmpFileObj)
-                if (reqPropsObj):
-                    reqPropsObj.incActualCount(1)
-                    ngamsHighLevelLib.stdReqTimeStatUpdate(srvObj, reqPropsObj,
-                                                           regTimeAccu)
-                regTimeAccu += time.time() - reg_start
-                fileCount += 1
-                continue
-
-            # Calculate checksum. We maintain the old name for backwards
-            # compatibility
-            crc_variant = srvObj.cfg.getCRCVariant()
-            if crc_variant == ngamsFileUtils.CHECKSUM_CRC32_INCONSISTENT:
-                crc_variant = 'ngamsGenCrc32'
-            checksum = ngamsFileUtils.get_checksum(65536, filename, crc_variant) or ''
-
-            # Move file and update information about file in the NGAS DB.
-            mvFile(filename, piRes.getCompleteFilename())
-            ngamsArchiveUtils.updateFileInfoDb(srvObj, piRes, checksum,
-                                               crc_variant)
-            ngamsDiskUtils.updateDiskStatusDb(srvObj.getDb(), piRes)
-            ngamsLib.makeFileReadOnly(piRes.getCompleteFilename())
-
-            if (emailNotif):
-                uncomprSize = piRes.getUncomprSize()
-                ingestDate  = time.time()
-                creDateSecs = getFileCreationTime(filename)
-                tmpFileObj.\
-                             setDiskId(diskId).\
-                             setFilename(filename).\
-                             setFileId(piRes.getFileId()).\
-                             setFileVersion(piRes.getFileVersion()).\
-                             setFormat(piRes.getFormat()).\
-                             setFileSize(piRes.getFileSize()).\
-                             setUncompressedFileSize(uncomprSize).\
-                             setCompression(piRes.getCompression()).\
-                             setIngestionDate(ingestDate).\
-                             setIgnore(0).\
-                             setChecksum(checksum).\
-                             setChecksumPlugIn(crc_variant).\
-                             setFileStatus(NGAMS_FILE_STATUS_OK).\
-                             setCreationDate(creDateSecs).\
-                             setTag("REGISTERED")
-            fileRegCount += 1
-
-            # If running as a cache archive, update the Cache New Files DBM
-            # with the information about the new file.
-            if (srvObj.getCachingActive()):
-                fileVer = fio.getFileVersion()
-                ngamsCacheControlThread.addEntryNewFilesDbm(srvObj, diskId,
-                                                            piRes.getFileId(),
-                                                            fileVer, filename)
-
-            # Generate a confirmation log entry.
-            msg = genLog("NGAMS_INFO_FILE_REGISTERED",
-                         [filename, piRes.getFileId(), piRes.getFileVersion(),
-                          piRes.getFormat()])
-            time.sleep(0.005)
-            regTime = time.time() - reg_start
-            msg = msg + ". Time: %.3fs." % (regTime)
-            logger.info(msg, extra={'to_syslog': 1})
-        except Exception as e:
-            errMsg = genLog("NGAMS_ER_FILE_REG_FAILED", [filename, str(e)])
-            logger.error(errMsg)
-            if (emailNotif):
-                tmpFileObj.\
-                             setDiskId(diskId).setFilename(filename).\
-                             setTag(errMsg)
-            fileFailCount += 1
-            regTime = time.time() - reg_start
-            # TODO (rtobar, 2016-01): Why don't we raise an exception here?
-            #      Otherwise the command appears as successful on the
-            #      client-side
-
-        # Add the file information in the registration report.
-        if (emailNotif): regDbm.addIncKey(tmpFileObj)
-
-        # Update request status time information.
-        regTimeAccu += regTime
-        if (reqPropsObj):
-            reqPropsObj.incActualCount(1)
-            ngamsHighLevelLib.stdReqTimeStatUpdate(srvObj, reqPropsObj,
-                                                   regTimeAccu)
-        fileCount += 1
-    fo.close()
+    # Go through each file in the list and try to register it by invoking the
+    # corresponding DAPI on the file. The checksums of the files of each
+    # batch are computed by a pool of processes while the previous batch is
+    # being registered. The information of the files of each batch is
+    # written into the DB in a single transaction.
+    crc_variant = srvObj.cfg.getCRCVariant()
+    if crc_variant == ngamsFileUtils.CHECKSUM_CRC32_INCONSISTENT:
+        crc_variant = 'ngamsGenCrc32'
+    job = _register_job(srvObj, reqPropsObj, diskInfoDic, crc_variant,
+                        regDbm if emailNotif else None)
+    nProcs = srvObj.getCfg().getRegisterWorkers()
+    batchSize = max(1, srvObj.getCfg().getRegisterBatchSize())
+    pool = None
+    if nProcs > 1:
+        pool = multiprocessing.Pool(nProcs, initializer=_initChecksumProc)
+    try:
+        batches = _registerBatches(fileListDbm, sortFileList, batchSize)
+        batch = next(batches, None)
+        checksums = _checksums(pool, batch, crc_variant) if batch else None
+        while batch:
+            nextBatch = next(batches, None)
+            nextChecksums = None
+            if nextBatch:
+                nextChecksums = _checksums(pool, nextBatch, crc_variant)
+            for fileInfo, checksum in zip(batch, checksums()):
+                job.registerFile(fileInfo[0], fileInfo[1], fileInfo[2], checksum)
+                if len(job.pending) >= batchSize:
+                    job.flush()
+            batch, checksums = nextBatch, nextChecksums
+        job.flush()
+    finally:
+        if pool:
+            pool.terminate()
+            pool.join()
     rmFile(sortFileList)
+    fileRegCount = job.fileRegCount
+    fileFailCount = job.fileFailCount
+    fileRejectCount = job.fileRejectCount
+    fileCount = fileRegCount + fileFailCount + fileRejectCount
+    regTimeAccu = time.time() - job.startTime
     if (emailNotif): regDbm.sync()
     del fileListDbm
     rmFile(fileListDbmName + "*")
@@ -325,6 +476,8 @@ def _registerExec(srvObj,
         else:
             complPercent =  100.0
         reqPropsObj.setCompletionPercent(complPercent, 1)
+        reqPropsObj.setThroughput(job.bytesRegistered / max(regTimeAccu, 1e-6))
+        reqPropsObj.setRemainingTime(0)
         reqPropsObj.setCompletionTime(1)
         srvObj.updateRequestDb(reqPropsObj)
 
@@ -564,6 +717,7 @@ def register(srvObj,
                                             mtPt2DiskInfo[mtPt].getDiskId(),
                                             mimeType]
                             fileListDbm.add(os.path.join(root,nextFile), tmpFileInfo)
+                            fileCount += 1
 
             elif os.path.isfile(searchPath):  # the path is actually pointing to a file
                 nextFile = os.path.basename(searchPath)
@@ -578,6 +732,7 @@ def register(srvObj,
                                     mtPt2DiskInfo[mtPt].getDiskId(),
                                     mimeType]
                     fileListDbm.add(os.path.join(root,nextFile), tmpFileInfo)
+                    fileCount += 1
         if foundVolume: break
 
 
@@ -37,13 +37,13 @@ import shutil
 import socket
 import time
 
-from ngamsLib import ngamsDppiStatus
+from ngamsLib import ngamsDppiStatus, ngamsHttpUtils
 from ngamsLib.ngamsCore import NGAMS_TEXT_MT, getFileSize, \
     genLog, NGAMS_PROC_FILE, NGAMS_HOST_LOCAL, \
     NGAMS_HOST_CLUSTER, NGAMS_HOST_REMOTE, \
     NGAMS_ONLINE_STATE, NGAMS_IDLE_SUBSTATE, \
     NGAMS_BUSY_SUBSTATE, loadPlugInEntryPoint
-from .. import ngamsFileUtils
+from .. import ngamsFileUtils, ngamsCacheControlThread
 
 
 logger = logging.getLogger(__name__)
@@ -206,15 +206,12 @@ def genReplyRetrieve(srvObj,
         resObj = statusObj.getResultObject(0)
 
         if resObj.getObjDataType() == NGAMS_PROC_FILE:
-            # See if client requested partial content
-            # This applies (currently) to files only
-            start_byte = 0
-            if reqPropsObj.retrieve_offset > 0:
-                start_byte = reqPropsObj.retrieve_offset
-
+            # Partial content requests apply (currently) to files only
             fname, hdrs = inform_compression(httpRef, resObj, compression)
             httpRef.send_file(resObj.getDataRef(), resObj.getMimeType(),
-                              start_byte=start_byte, fname=fname, hdrs=hdrs)
+                              fname=fname, hdrs=hdrs,
+                              ranges=reqPropsObj.retrieve_ranges,
+                              if_range=reqPropsObj.getHttpHdr('if-range'))
         else:
             httpRef.send_data(resObj.getDataRef(), resObj.getMimeType(), fname=resObj.getRefFilename())
 
@@ -332,6 +329,10 @@ def _handleCmdRetrieve(srvObj,
     # Send back reply with the result(s) queried and possibly processed.
     genReplyRetrieve(srvObj, reqPropsObj, httpRef, procResult, compression)
 
+    # Let the cache know the file was used
+    if srvObj.getCachingActive():
+        ngamsCacheControlThread.recordFileAccess(srvObj, fileId, fileVersion)
+
 
 def handleCmd(srvObj,
                       reqPropsObj,
@@ -361,17 +362,17 @@ def handleCmd(srvObj,
         srvObj.setSubState(NGAMS_IDLE_SUBSTATE)
         raise Exception(errMsg)
 
-    # See if client requested partial content and remember the starting offset
-    retrieve_offset = 0
+    # See if client requested partial content and remember the byte ranges.
+    # Whether they can be satisfied is checked when sending the file
+    retrieve_ranges = None
     range_hdr = reqPropsObj.getHttpHdr('range')
     if range_hdr:
         try:
-            retrieve_offset = int(range_hdr[6:-1])
-            if retrieve_offset < 0:
-                raise
-        except:
-            raise ValueError("Invalid Range header, must have the form 'bytes=start-' (start offset only)")
-    reqPropsObj.retrieve_offset = retrieve_offset
+            retrieve_ranges = ngamsHttpUtils.parse_range_header(range_hdr)
+        except ValueError as e:
+            srvObj.setSubState(NGAMS_IDLE_SUBSTATE)
+            raise ValueError("Invalid Range header: %s" % str(e))
+    reqPropsObj.retrieve_ranges = retrieve_ranges
 
     _handleCmdRetrieve(srvObj, reqPropsObj, httpRef)
     srvObj.setSubState(NGAMS_IDLE_SUBSTATE)
@@ -424,6 +424,8 @@ def handleCmd(srvObj,
     dbTimeReset       = ""
     fileList          = ""
     fileListId        = ""
+    httpPool          = ""
+    locationCache     = ""
     maxElements       = 100000
     if (reqPropsObj.hasHttpPar("disk_id")):
         diskId = reqPropsObj.getHttpPar("disk_id")
@@ -452,6 +454,10 @@ def handleCmd(srvObj,
         dbTime = True
     if (reqPropsObj.hasHttpPar("db_time_reset")):
         dbTimeReset = True
+    if (reqPropsObj.hasHttpPar("http_pool")):
+        httpPool = True
+    if (reqPropsObj.hasHttpPar("location_cache")):
+        locationCache = True
 
     if (reqPropsObj.hasHttpPar("flush_log")):
         # in the past this called flushLog()
@@ -556,6 +562,15 @@ def handleCmd(srvObj,
         msg = "Resetting DB timer"
         logger.debug(msg)
         srvObj.getDb().resetDbTime()
+    elif (httpPool):
+        logger.debug("Querying HTTP connection pool statistics")
+        msg = ("HTTP connection pool: created=%(created)d, reused=%(reused)d, "
+               "discarded=%(discarded)d, idle=%(idle)d" % ngamsHttpUtils.pool.stats())
+    elif (locationCache):
+        logger.debug("Querying file location cache statistics")
+        msg = ("File location cache: hits=%(hits)d, misses=%(misses)d, "
+               "invalidations=%(invalidations)d, size=%(size)d" %
+               srvObj.file_location_cache.stats())
     else:
         msg = "Successfully handled command STATUS"
 
@@ -89,6 +89,7 @@ def delSubscriber(srvObj,
     if (subscrId in srvObj._subscrSuspendDic):
         srvObj._subscrSuspendDic[subscrId].set() # resume all suspended deliveryThreads (if any) so they can know the subscriber is removed
         del srvObj._subscrDeliveryThreadDic[subscrId] # this does not kill those deliveryThreads, but only the list container
+        srvObj._subscrStreamsDic.pop(subscrId, None)
     else:
         estr = " Cannot find delivery threads for the subscriber '%s' kept internally. " % subscrId
         err += 1
@@ -120,7 +120,9 @@ def janitorThread(srvObj, srv_to_jan_queue, jan_to_srv_queue, stopEvt):
     try:
         while True:
 
+            cycleStart = time.time()
             JanitorCycle(plugins, srvObj, stopEvt)
+            srvObj.janitor_send('janitor-cycle-time', time.time() - cycleStart)
 
             # Suspend the thread for the time indicated.
             # Update the Janitor Thread run count.
@@ -19,45 +19,21 @@
 #    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
 #    MA 02111-1307  USA
 #
-"""Finds old requests and instructs the server to remove them"""
+"""Instructs the server to remove old requests from its Request DB"""
 
 import logging
 import time
 
-from .common import checkStopJanitorThread
-
 
 logger = logging.getLogger(__name__)
 
-def timed_out(t, timeout):
-    now = time.time()
-    return t is not None and (now - t) >= timeout
-
 def run(srvObj, stopEvt):
 
     logger.debug("Checking/cleaning up Request DB ...")
     reqTimeOut = 86400
 
-    req_ids = srvObj.janitor_communicate('get-request-ids', timeout=0.5)
-
-    to_delete = []
-    for reqId in req_ids:
-        reqPropsObj = srvObj.janitor_communicate('get-request', reqId, timeout=0.5)
-        checkStopJanitorThread(stopEvt)
-
-        # Remove a Request Properties Object from the DB if
-        #
-        # 1. The request handling is completed for more than
-        #    24 hours (86400s).
-        # 2. The request status has not been updated for more
-        #    than 24 hours (86400s).
-        comp_time = reqPropsObj.getCompletionTime()
-        last_update = reqPropsObj.getLastRequestStatUpdate()
-        if timed_out(comp_time, reqTimeOut) or timed_out(last_update, reqTimeOut):
-            logger.debug("Scheduling removal of request with ID from Request DBM: %s", reqId)
-            to_delete.append(reqId)
-
-    if to_delete:
-        srvObj.janitor_communicate('delete-requests', to_delete, timeout=5)
-
-    logger.debug("Request DB checked/cleaned up")
+    # Requests are removed if their handling was completed, or their status
+    # was last updated, more than 24 hours (86400s) ago. The Request DB does
+    # this in one go, so we don't need to inspect each request separately
+    n_expired = srvObj.janitor_communicate('expire-requests', time.time() - reqTimeOut, timeout=5)
+    logger.debug("Request DB checked/cleaned up, %d requests removed", n_expired)
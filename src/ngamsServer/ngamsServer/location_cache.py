@@ -0,0 +1,160 @@
+#
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2019
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+#
+"""
+An in-memory cache of file locations.
+
+Locating a file requires joining several tables of the database, which for
+frequently retrieved files means querying the same information over and
+over. This cache keeps the result of these lookups for a limited amount of
+time, and is invalidated when the files or disks involved change.
+"""
+
+import collections
+import logging
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+class location_cache(object):
+    """
+    A bounded LRU cache of file locations with a time-to-live for its entries.
+
+    Keys are tuples whose first element is a file ID, so all entries for a
+    given file can be invalidated at once. A cache with ``max_entries`` 0 is
+    disabled, and never stores anything.
+    """
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._keys_by_file = collections.defaultdict(set)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.db_change_listener = _db_change_listener(self)
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def get(self, key):
+        """Returns the location stored under ``key``, or None"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] < time.time():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._move_to_end(key)
+            return entry[0]
+
+    def put(self, key, location):
+        """Stores ``location`` under ``key``, evicting the oldest entries if necessary"""
+        if not self.enabled:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (location, time.time() + self.ttl)
+            self._keys_by_file[key[0]].add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, file_id):
+        """Removes all entries for ``file_id``"""
+        with self._lock:
+            keys = self._keys_by_file.pop(file_id, ())
+            for key in keys:
+                del self._entries[key]
+            if keys:
+                self.invalidations += 1
+
+    def clear(self):
+        """Removes all entries"""
+        with self._lock:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._keys_by_file.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'invalidations': self.invalidations,
+                    'size': len(self._entries)}
+
+    def handle_archive_event(self, evt):
+        """Archive event subscriber that invalidates the archived file"""
+        self.invalidate(evt.file_id)
+
+    def _move_to_end(self, key):
+        # OrderedDict.move_to_end is python 3 only
+        if hasattr(self._entries, 'move_to_end'):
+            self._entries.move_to_end(key)
+        else:
+            self._entries[key] = self._entries.pop(key)
+
+    def _remove(self, key):
+        del self._entries[key]
+        keys = self._keys_by_file[key[0]]
+        keys.discard(key)
+        if not keys:
+            del self._keys_by_file[key[0]]
+
+class _db_change_listener(object):
+    """
+    Receives the DB change events (see ngamsDbCore.addDbChangeEvt) on behalf
+    of a location_cache, and clears it whenever a disk changes.
+
+    Changes to single files are not attributed to any file in these events,
+    and are therefore handled explicitly by the code carrying them out. Changes
+    done by other servers of the cluster are not notified at all, hence the
+    time-to-live of the cache's entries.
+    """
+
+    def __init__(self, cache):
+        self._cache = cache
+        self._disk_changed = False
+
+    def addEventInfo(self, event_info):
+        # Disks (re)registered or removed come with their mount point,
+        # while file changes come only with the Disk ID
+        if len(event_info) > 1 and event_info[1] is not None:
+            self._disk_changed = True
+
+    def isSet(self):
+        return False
+
+    def set(self):
+        if self._disk_changed:
+            self._disk_changed = False
+            logger.debug("Disk changes detected, clearing file location cache")
+            self._cache.clear()
@@ -38,11 +38,13 @@ import logging
 import operator
 import os
 import random
+import threading
 import time
 
 from six.moves.urllib import parse as urlparse # @UnresolvedImport
 from six.moves.urllib import request as urlrequest # @UnresolvedImport
 from six.moves import cPickle # @UnresolvedImport
+from six.moves import queue # @UnresolvedImport
 
 from ngamsLib.ngamsCore import NGAMS_FAILURE, getFileCreationTime,\
     NGAMS_FILE_STATUS_OK, NGAMS_NOTIF_DISK_SPACE,\
@@ -112,13 +114,65 @@ archiving_results = collections.namedtuple('archiving_results',
 previous_file_info = collections.namedtuple('previous_file_info', 'disk_id size path')
 
 
-def archive_contents(out_fname, fin, fsize, block_size, crc_name, skip_crc=False):
+class _pipeline_stage(threading.Thread):
+    """
+    A thread consuming (buffer, nbytes) items from its queue, processing them
+    with `func` and handing them over to the `output` queue. A None item marks
+    the end of the data, and is also passed down. If `func` fails the error
+    is recorded and the remaining items are simply passed through, so buffers
+    keep flowing and the reader never blocks.
+    """
+
+    def __init__(self, name, func, output):
+        super(_pipeline_stage, self).__init__(name=name)
+        self.daemon = True
+        self.func = func
+        self.queue = queue.Queue()
+        self.output = output
+        self.elapsed = 0
+        self.error = None
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is not None and self.error is None:
+                buff, n = item
+                start = time.time()
+                try:
+                    self.func(buff[:n])
+                except Exception as e:
+                    self.error = e
+                self.elapsed += time.time() - start
+            self.output.put(item)
+            if item is None:
+                return
+
+# Number of buffers used by the archiving pipeline, and minimum number of
+# blocks a file needs to have for the pipeline to be worth setting up
+_ARCHIVE_PIPELINE_BUFFERS = 3
+_ARCHIVE_PIPELINE_MIN_BLOCKS = 4
+
+def archive_contents(out_fname, fin, fsize, block_size, crc_name, skip_crc=False,
+                     preallocate=False, splice=False):
     """
     Archives the contents read from `fin` (a file-like object with .read()
     support) and writes it to file `out_fname`, which is opened in write mode
     and truncated. While reading the data its checksum is calculated using the
     checksum method indicated by `crc_variant`.
 
+    If `preallocate` is set, the space for the whole file is reserved on disk
+    before writing into it. If `splice` is set, no checksum is calculated and
+    `fin` supports it (see ngamsServer._body_reader.splice_into) the data is
+    moved from the network into the file by the kernel, without going through
+    python at all.
+
+    Data is read into a small set of buffers taken from the shared pool in
+    utils.buffers. For files spanning a few blocks, reading, writing and
+    checksumming are done in a pipeline where each stage runs in its own
+    thread, so the three of them overlap.
+    The rtime, wtime and crctime fields of the result are the time spent on
+    each stage, and therefore their sum can be greater than totaltime.
+
     This method returns an archiving_results tuple populated with all the
     corresponding fields.
     """
@@ -133,39 +187,27 @@ def archive_contents(out_fname, fin, fsize, block_size, crc_name, skip_crc=False
             crc_m = crc_info.method
             crc = crc_info.init
 
-    crctime = 0
-    rtime = 0
-    wtime = 0
-    readin = 0
-
     logger.debug("Saving data in file: %s", out_fname)
 
     start = time.time()
     with open(out_fname, 'wb') as fout:
-        while readin < fsize:
-
-            left = fsize - readin
-
-            # Read
-            rstart = time.time()
-            buff = fin.read(block_size if left >= block_size else left)
-            rtime += time.time() - rstart
-            readin += len(buff)
-
-            if not buff:
-                raise eof_found("Only read %d out of %d bytes (%d bytes missing)"
-                                % (readin, fsize, fsize - readin))
-
-            # Write
-            wstart = time.time()
-            fout.write(buff)
-            wtime += time.time() - wstart
-
-            # CRC
-            if crc_m:
-                crcstart = time.time()
-                crc = crc_m(buff, crc)
-                crctime += time.time() - crcstart
+        if preallocate:
+            utils.preallocate(fout, fsize)
+
+        # Any data not spliced is read normally
+        readin = 0
+        splice_time = 0
+        if splice and not crc_m and hasattr(fin, 'splice_into'):
+            readin = fin.splice_into(fout, fsize)
+            splice_time = time.time() - start
+            logger.debug("Spliced %d bytes into %s", readin, out_fname)
+
+        if fsize - readin >= block_size * _ARCHIVE_PIPELINE_MIN_BLOCKS:
+            archive = _pipelined_archive
+        else:
+            archive = _serial_archive
+        readin, rtime, wtime, crctime, crc = archive(fin, fout, fsize, block_size, crc_m, crc, readin)
+        rtime += splice_time
 
     if crc_info:
         crc = crc_info.final(crc)
@@ -208,6 +250,99 @@ def archive_contents(out_fname, fin, fsize, block_size, crc_name, skip_crc=False
 
     return archiving_results(readin, rtime, wtime, crctime, total_time, crc_name, crc)
 
+def _serial_archive(fin, fout, fsize, block_size, crc_m, crc, readin):
+    """Reads, writes and checksums each block in turn"""
+
+    crctime = 0
+    rtime = 0
+    wtime = 0
+    with utils.buffers.buffer(block_size) as buff:
+        while readin < fsize:
+
+            left = fsize - readin
+
+            # Read
+            rstart = time.time()
+            n = utils.readinto(fin, buff[:block_size if left >= block_size else left])
+            rtime += time.time() - rstart
+            readin += n
+
+            if not n:
+                raise eof_found("Only read %d out of %d bytes (%d bytes missing)"
+                                % (readin, fsize, fsize - readin))
+
+            # Write
+            wstart = time.time()
+            fout.write(buff[:n])
+            wtime += time.time() - wstart
+
+            # CRC
+            if crc_m:
+                crcstart = time.time()
+                crc = crc_m(buff[:n], crc)
+                crctime += time.time() - crcstart
+
+    return readin, rtime, wtime, crctime, crc
+
+def _pipelined_archive(fin, fout, fsize, block_size, crc_m, crc, readin):
+    """
+    Reads blocks in the current thread, and writes and checksums them in two
+    other threads. Buffers go from the reader to the writer, then to the
+    checksum calculation (if any), and finally back to the reader.
+    """
+
+    buffers = [utils.buffers.get(block_size) for _ in range(_ARCHIVE_PIPELINE_BUFFERS)]
+    free = queue.Queue()
+    for buff in buffers:
+        free.put((memoryview(buff), 0))
+
+    crc_stage = None
+    if crc_m:
+        result = [crc]
+        def update_crc(data):
+            result[0] = crc_m(data, result[0])
+        crc_stage = _pipeline_stage('%s-crc' % threading.current_thread().name, update_crc, free)
+    writer = _pipeline_stage('%s-write' % threading.current_thread().name, fout.write,
+                             crc_stage.queue if crc_stage else free)
+    stages = [s for s in (writer, crc_stage) if s]
+    for stage in stages:
+        stage.start()
+
+    rtime = 0
+    try:
+        while readin < fsize:
+            buff, _ = free.get()
+            for stage in stages:
+                if stage.error is not None:
+                    raise stage.error
+
+            left = fsize - readin
+            rstart = time.time()
+            n = utils.readinto(fin, buff[:block_size if left >= block_size else left])
+            rtime += time.time() - rstart
+            readin += n
+
+            if not n:
+                raise eof_found("Only read %d out of %d bytes (%d bytes missing)"
+                                % (readin, fsize, fsize - readin))
+            writer.queue.put((buff, n))
+    finally:
+        writer.queue.put(None)
+        for stage in stages:
+            stage.join()
+        for buff in buffers:
+            utils.buffers.put(buff)
+
+    for stage in stages:
+        if stage.error is not None:
+            raise stage.error
+
+    crctime = 0
+    if crc_stage:
+        crc = result[0]
+        crctime = crc_stage.elapsed
+    return readin, rtime, writer.elapsed, crctime, crc
+
 
 def archive_contents_from_request(out_fname, cfg, req, rfile, skip_crc=False, transfer=None):
     """
@@ -228,7 +363,9 @@ def archive_contents_from_request(out_fname, cfg, req, rfile, skip_crc=False, tr
     def http_transfer(req, out_fname, crc_name, skip_crc):
         block_size = cfg.getBlockSize()
         size = req.getSize()
-        return archive_contents(out_fname, rfile, size, block_size, crc_name, skip_crc)
+        return archive_contents(out_fname, rfile, size, block_size, crc_name, skip_crc,
+                                preallocate=cfg.getPreallocateFiles(),
+                                splice=cfg.getSpliceIncomingData())
 
     transfer = transfer or http_transfer
     result = transfer(req, out_fname, crc_name, skip_crc=skip_crc)
@@ -293,17 +430,31 @@ def updateFileInfoDb(srvObj,
     if (piStat.getStatus() == NGAMS_FAILURE):
         return
 
-    # If there was a previous version of this file, and it had a container associated with it
-    # associate the new version with the container too
-    containerId = None
-    file_version = piStat.getFileVersion()
-    if file_version > 1:
-        fileInfo = ngamsFileInfo.ngamsFileInfo()
-        fileInfo.read(srvObj.getHostId(),srvObj.getDb(), piStat.getFileId(),
-                      fileVersion=(file_version - 1))
-        containerId = fileInfo.getContainerId()
-        prevSize = fileInfo.getUncompressedFileSize()
+    fileInfo = fileInfoFromPiStat(piStat, checksum, checksumPlugIn,
+                                  ingestion_rate=ingestion_rate)
+    fileInfo.write(srvObj.getHostId(), srvObj.getDb(), prev_disk_id=prev_disk_id)
+    logger.debug("Updated file info in NGAS DB for file with ID: %s", piStat.getFileId())
+
+    addNewVersionToContainer(srvObj, fileInfo)
+    return fileInfo
+
+def fileInfoFromPiStat(piStat,
+                       checksum,
+                       checksumPlugIn,
+                       ingestion_rate=None):
+    """
+    Creates the File Info Object for a file that has just been stored, as
+    described by the status returned by its Data Archiving Plug-In.
+
+    piStat:           Status object returned by Data Archiving Plug-In.
+                      (ngamsDapiStatus).
+
+    checksum:         Checksum value for file (string).
+
+    checksumPlugIn:   Checksum Plug-In (string).
 
+    Returns:          File Info Object (ngamsFileInfo).
+    """
     now = time.time()
     creDate = getFileCreationTime(piStat.getCompleteFilename())
     fileInfo = ngamsFileInfo.ngamsFileInfo().\
@@ -323,17 +474,30 @@ def updateFileInfoDb(srvObj,
                setIgnore(0)
     if ingestion_rate is not None:
         fileInfo.setIngestionRate(ingestion_rate)
+    return fileInfo
 
-    fileInfo.write(srvObj.getHostId(), srvObj.getDb(), prev_disk_id=prev_disk_id)
-    logger.debug("Updated file info in NGAS DB for file with ID: %s", piStat.getFileId())
+def addNewVersionToContainer(srvObj, fileInfo):
+    """
+    If the previous version of the file described by `fileInfo` was
+    associated with a container, associates the new version with it too,
+    updating the container size accordingly.
+    """
+    file_version = fileInfo.getFileVersion()
+    if file_version <= 1:
+        return
 
-    # Update the container size with the new size
-    if containerId:
-        newSize = fileInfo.getUncompressedFileSize()
-        srvObj.getDb().addFileToContainer(containerId, piStat.getFileId(), True)
-        srvObj.getDb().addToContainerSize(containerId, (newSize - prevSize))
+    prevFileInfo = ngamsFileInfo.ngamsFileInfo()
+    prevFileInfo.read(srvObj.getHostId(), srvObj.getDb(), fileInfo.getFileId(),
+                      fileVersion=(file_version - 1))
+    containerId = prevFileInfo.getContainerId()
+    if not containerId:
+        return
 
-    return fileInfo
+    # Update the container size with the new size
+    newSize = fileInfo.getUncompressedFileSize()
+    prevSize = prevFileInfo.getUncompressedFileSize()
+    srvObj.getDb().addFileToContainer(containerId, fileInfo.getFileId(), True)
+    srvObj.getDb().addToContainerSize(containerId, (newSize - prevSize))
 
 def replicateFile(dbConObj,
                   ngamsCfgObj,
@@ -603,7 +767,8 @@ def postFileRecepHandling(srvObj,
     # if checksum is already supplied then do not calculate it from the plugin
     if cksum is None:
         checksumPlugIn = ngamsFileUtils.get_checksum_name(srvObj.cfg.getCRCVariant())
-        checksum = ngamsFileUtils.get_checksum(65536, resultPlugIn.getCompleteFilename(), checksumPlugIn)
+        checksum = ngamsFileUtils.get_checksum(65536, resultPlugIn.getCompleteFilename(), checksumPlugIn,
+                                               srvObj.getCfg().getChecksumWorkers())
     else:
         checksum, checksumPlugIn = cksum
 
@@ -35,8 +35,10 @@ to manage the contents in the cache archive when running the NG/AMS Server
 as a cache archive.
 """
 import base64
+import heapq
 import logging
 import os
+import threading
 import time
 
 from six.moves import cPickle # @UnresolvedImport
@@ -90,9 +92,190 @@ CACHE_DEL_BIT_MASK = "00000100"
 CACHE_DEL_BIT_MASK_INT = int(CACHE_DEL_BIT_MASK, 2)
 
 
+# Policies used to choose which files are removed first from the cache when
+# it exceeds its maximum size or number of files.
+NGAMS_CACHE_EVICTION_POLICIES = ('FIFO', 'LRU', 'LFU', 'SIZE')
+
+
 class StopCacheControlThreadEx(Exception):
     pass
 
+
+class CacheIndex(object):
+    """
+    In-memory index of the files in the cache that are not scheduled for
+    deletion, updated as files are added, accessed and removed.
+
+    The index keeps the total size and number of the files, and orders them
+    by the time they entered the cache (to find expired files) and according
+    to an eviction ``policy`` (to find the files to remove when the cache is
+    full), so these don't need to be computed from the Cache Contents DBMS:
+
+     * FIFO: Files that entered the cache first are removed first.
+     * LRU: Files that were retrieved least recently are removed first.
+     * LFU: Files that were retrieved the least number of times are removed
+       first, and then those retrieved least recently.
+     * SIZE: Bigger files are removed first, and then those retrieved least
+       recently.
+
+    Files are identified by their (Disk ID, File ID, File Version) keys.
+    """
+
+    def __init__(self, policy='FIFO'):
+        if policy not in NGAMS_CACHE_EVICTION_POLICIES:
+            raise ValueError("Unknown cache eviction policy: %s" % (policy,))
+        self.policy = policy
+        self.total_size = 0
+        # key: file key, value: [size, cache time, last access, access count,
+        #                        stamp in _by_time, stamp in _by_policy]
+        self._entries = {}
+        # key: (File ID, File Version), value: set of file keys
+        self._copies = {}
+        # (priority, stamp, file key) tuples. Tuples whose stamp doesn't
+        # match that of their entry are outdated, and are discarded lazily
+        self._by_time = []
+        self._by_policy = []
+        self._accessed = set()
+        self._stamp = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def _priority(self, entry):
+        size, _, last_access, access_count, _, _ = entry
+        if self.policy == 'LRU':
+            return last_access
+        elif self.policy == 'LFU':
+            return (access_count, last_access)
+        elif self.policy == 'SIZE':
+            return (-size, last_access)
+        return entry[1]
+
+    def _push(self, key, entry, time_too=False):
+        self._stamp += 1
+        if time_too:
+            entry[4] = self._stamp
+            heapq.heappush(self._by_time, (entry[1], self._stamp, key))
+        entry[5] = self._stamp
+        heapq.heappush(self._by_policy, (self._priority(entry), self._stamp, key))
+        # Don't let outdated tuples accumulate indefinitely
+        if len(self._by_policy) > 2 * len(self._entries) + 1000:
+            self._by_policy = [t for t in self._by_policy if self._valid(t, 5)]
+            heapq.heapify(self._by_policy)
+
+    def _valid(self, item, stamp_idx):
+        entry = self._entries.get(item[2])
+        return entry is not None and entry[stamp_idx] == item[1]
+
+    def add(self, key, size, cache_time, last_access=None, access_count=0):
+        """Adds (or replaces) the file with the given key"""
+        with self._lock:
+            self._remove(key)
+            entry = [size, cache_time, last_access or cache_time, access_count, None, None]
+            self._entries[key] = entry
+            self._copies.setdefault(key[1:], set()).add(key)
+            self.total_size += size
+            self._push(key, entry, time_too=True)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self.total_size -= entry[0]
+        copies = self._copies[key[1:]]
+        copies.discard(key)
+        if not copies:
+            del self._copies[key[1:]]
+        self._accessed.discard(key)
+        # The time-ordered heap doesn't otherwise get rid of outdated tuples
+        if len(self._by_time) > 2 * len(self._entries) + 1000:
+            self._by_time = [t for t in self._by_time if self._valid(t, 4)]
+            heapq.heapify(self._by_time)
+
+    def remove(self, key):
+        """Removes the file with the given key, if present"""
+        with self._lock:
+            self._remove(key)
+
+    def size(self, key):
+        """Returns the size of the file with the given key"""
+        with self._lock:
+            return self._entries[key][0]
+
+    def set_size(self, key, size):
+        """Sets the size of the file with the given key, if present"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            self.total_size += size - entry[0]
+            entry[0] = size
+            if self.policy == 'SIZE':
+                self._push(key, entry)
+
+    def access(self, fileId, fileVersion, when=None):
+        """Records that all copies of the given file were accessed"""
+        when = when or time.time()
+        with self._lock:
+            for key in self._copies.get((fileId, fileVersion), ()):
+                entry = self._entries[key]
+                entry[2] = when
+                entry[3] += 1
+                self._accessed.add(key)
+                if self.policy != 'FIFO':
+                    self._push(key, entry)
+
+    def pop_accessed(self):
+        """
+        Returns the (last access, access count, key) of the files accessed
+        since the last call.
+        """
+        with self._lock:
+            accessed = [(self._entries[key][2], self._entries[key][3], key)
+                        for key in self._accessed]
+            self._accessed = set()
+            return accessed
+
+    def _first(self, heap, stamp_idx, n, condition=None, exclude=()):
+        # Heaps can't be iterated in order; pop the tuples we need,
+        # and push them back (if still valid) after the fact
+        popped = []
+        keys = []
+        try:
+            while heap and len(keys) < n:
+                item = heapq.heappop(heap)
+                if not self._valid(item, stamp_idx):
+                    continue
+                popped.append(item)
+                if condition is not None and not condition(item[0]):
+                    break
+                if item[2] not in exclude:
+                    keys.append(item[2])
+        finally:
+            for item in popped:
+                heapq.heappush(heap, item)
+        return keys
+
+    def expired(self, before, n):
+        """
+        Returns the keys of up to ``n`` files that entered the cache
+        before ``before``, oldest first.
+        """
+        with self._lock:
+            return self._first(self._by_time, 4, n, condition=lambda t: t < before)
+
+    def candidates(self, n, exclude=()):
+        """
+        Returns the keys of up to ``n`` files in the order they should be
+        removed from the cache, skipping those in ``exclude``.
+        """
+        with self._lock:
+            return self._first(self._by_policy, 5, n, exclude=exclude)
+
 def checkStopCacheControlThread(stopEvt):
     """
     Used to check if the Cache Control Thread should be stopped and in case
@@ -156,6 +339,26 @@ def createCacheDbms(srvObj, ready_evt):
         else:
             raise
 
+    # Columns added after the table was first introduced, which tables
+    # created by older versions don't have yet.
+    srvObj._cacheContDbmsCur.execute("PRAGMA table_info(ngas_cache)")
+    columns = set(col[1] for col in srvObj._cacheContDbmsCur.fetchall())
+    for column, typ in (('last_access', 'REAL'), ('access_count', 'INTEGER DEFAULT 0')):
+        if column not in columns:
+            srvObj._cacheContDbmsCur.execute("ALTER TABLE ngas_cache ADD COLUMN %s %s" % (column, typ))
+    srvObj._cacheContDbms.commit()
+
+    # Index the files in the cache that are not scheduled for deletion.
+    srvObj._cacheIndex = CacheIndex(srvObj.getCfg().getCachingEvictionPolicy())
+    srvObj._cacheContDbmsCur.execute("SELECT disk_id, file_id, file_version, " +\
+                                     "file_size, cache_time, last_access, " +\
+                                     "access_count FROM ngas_cache " +\
+                                     "WHERE cache_delete = 0")
+    for diskId, fileId, fileVersion, fileSize, cacheTime, lastAccess, accessCount in\
+            srvObj._cacheContDbmsCur.fetchall():
+        srvObj._cacheIndex.add((diskId, fileId, int(fileVersion)), fileSize,
+                               cacheTime, lastAccess, accessCount or 0)
+
     # Create the DBM to hold information about new files that are registered
     # on this node (to be inserted into the Local Cache Contents DBMS).
     newFilesDbmName = "%s/%s_%s" %\
@@ -407,6 +610,9 @@ def addEntryInCacheDbms(srvObj,
                    (diskId, fileId, int(fileVersion), filename, fileSize,
                     delete, timeNow, timeNow, cacheEntryObjPickleEnc)
         queryCacheDbms(srvObj, sqlQuery)
+        if (not delete):
+            srvObj._cacheIndex.add((diskId, fileId, int(fileVersion)),
+                                   fileSize, timeNow)
 
     if (addInRdbms):
         # Insert entry in the remote DBMS.
@@ -472,6 +678,7 @@ def setFileSizeCacheDbms(srvObj,
     sqlQuery = _SET_FILE_SIZE_CACHE_DBMS % (fileSize, diskId, fileId,
                                             fileVersion)
     queryCacheDbms(srvObj, sqlQuery)
+    srvObj._cacheIndex.set_size((diskId, fileId, int(fileVersion)), fileSize)
 
 
 _SET_CACHE_ENTRY_OBJECT_CACHE_DBMS_QUERY = "UPDATE ngas_cache SET " +\
@@ -524,6 +731,7 @@ def delEntryFromCacheDbms(srvObj,
     sqlQuery = _DEL_ENTRY_FROM_CACHE_DBMS_QUERY %\
                (diskId, fileId, int(fileVersion))
     queryCacheDbms(srvObj, sqlQuery)
+    srvObj._cacheIndex.remove((diskId, fileId, int(fileVersion)))
 
     # Remove from the Remote Cache Contents DBMS.
     srvObj.getDb().deleteCacheEntry(diskId, fileId, fileVersion)
@@ -689,6 +897,88 @@ def markFileChecked(srvObj,
     queryCacheDbms(srvObj, sqlQuery)
 
 
+def executeManyCacheDbms(srvObj,
+                         sqlQuery,
+                         argsList):
+    """
+    Execute an SQL statement in the local DBMS once for each set of
+    parameters given, within a single transaction.
+
+    srvObj:       Reference to server object (ngamsServer).
+
+    sqlQuery:     SQL statement to execute, with ? placeholders (string).
+
+    argsList:     Parameters for each execution (list).
+
+    Returns:      Void.
+    """
+    argsList = list(argsList)
+    if not argsList:
+        return
+    logger.debug("Performing SQL statement (Cache DBMS) %d times: %s",
+                 len(argsList), sqlQuery)
+    with srvObj._cacheContDbmsSem:
+        srvObj._cacheContDbmsCur.executemany(sqlQuery, argsList)
+        srvObj._cacheContDbms.commit()
+
+
+def markFilesChecked(srvObj,
+                     fileKeys):
+    """
+    Like markFileChecked, but for several files at once.
+
+    srvObj:       Reference to server object (ngamsServer).
+
+    fileKeys:     (Disk ID, File ID, File Version) of the files (list).
+
+    Returns:      Void.
+    """
+    timeNow = time.time()
+    sqlQuery = "UPDATE ngas_cache SET last_check = ? WHERE " +\
+               "disk_id = ? AND file_id = ? AND file_version = ?"
+    executeManyCacheDbms(srvObj, sqlQuery,
+                         [(timeNow, diskId, fileId, int(fileVersion))
+                          for diskId, fileId, fileVersion in fileKeys])
+
+
+def recordFileAccess(srvObj,
+                     fileId,
+                     fileVersion):
+    """
+    Record that a file was retrieved from this node, which is taken into
+    account by the LRU and LFU cache eviction policies. This is cheap, and
+    the access information is written to the Cache Contents DBMS by the
+    Cache Control Thread later on.
+
+    srvObj:       Reference to server object (ngamsServer).
+
+    fileId:       File ID of the file (string).
+
+    fileVersion:  Version of the file (integer).
+
+    Returns:      Void.
+    """
+    if srvObj._cacheIndex is not None:
+        srvObj._cacheIndex.access(fileId, int(fileVersion))
+
+
+def flushFileAccesses(srvObj):
+    """
+    Write the access information of the files retrieved since the last call
+    into the Cache Contents DBMS.
+
+    srvObj:       Reference to server object (ngamsServer).
+
+    Returns:      Void.
+    """
+    sqlQuery = "UPDATE ngas_cache SET last_access = ?, access_count = ? " +\
+               "WHERE disk_id = ? AND file_id = ? AND file_version = ?"
+    executeManyCacheDbms(srvObj, sqlQuery,
+                         [(lastAccess, accessCount) + fileKey
+                          for lastAccess, accessCount, fileKey in
+                          srvObj._cacheIndex.pop_accessed()])
+
+
 # Template to be used to build SQL queries when marking items for deletion
 # from the local cache.
 _SCHEDULE_DEL_TPL = "UPDATE ngas_cache SET cache_delete = 1 WHERE " +\
@@ -738,31 +1028,38 @@ def scheduleFileForDeletion(srvObj,
     logger.info(msg, diskId, fileId, str(fileVersion))
     sqlQuery = _SCHEDULE_DEL_TPL % (diskId, fileId, int(fileVersion))
     queryCacheDbms(srvObj, sqlQuery)
+    if srvObj._cacheIndex is not None:
+        srvObj._cacheIndex.remove((diskId, fileId, fileVersion))
     srvObj.getDb().updateCacheEntry(diskId, fileId, fileVersion, 1)
 
 
-def createTmpDbm(srvObj,
-                 id,
-                 delOnDestr = True):
+def scheduleFilesForDeletion(srvObj,
+                             fileKeys,
+                             reason):
     """
-    Create a temporary DBM. It will be created in the NGAS Temporary Directory.
+    Like scheduleFileForDeletion, but for several files at once. The files
+    are also marked as checked.
 
     srvObj:       Reference to server object (ngamsServer).
 
-    id:           ID used to build the name of the DBM (string).
+    fileKeys:     (Disk ID, File ID, File Version) of the files (list).
 
-    delOnDestr:   Delete (remove) the DBM upon destruction the DBM object
-                  (boolean).
+    reason:       Criteria that selected the files, for logging (string).
 
-    Returns:      DBM object (ngamsDbm2).
+    Returns:      Void.
     """
-    dbmName = os.path.normpath(ngamsHighLevelLib.\
-                               getNgasTmpDir(srvObj.getCfg()) +\
-                               "/CACHE_%s_DBM" % id)
-    rmFile(dbmName + "*")
-    dbm = ngamsDbm.ngamsDbm(dbmName, cleanUpOnDestr = delOnDestr,
-                             writePerm = 1)
-    return dbm
+    if not fileKeys:
+        return
+    for fileKey in fileKeys:
+        logger.info("CACHE-CRITERIA: %s: %s/%s/%s", reason, fileKey[0],
+                    fileKey[1], str(fileKey[2]))
+    sqlQuery = "UPDATE ngas_cache SET cache_delete = 1 WHERE " +\
+               "disk_id = ? AND file_id = ? AND file_version = ?"
+    executeManyCacheDbms(srvObj, sqlQuery, fileKeys)
+    for fileKey in fileKeys:
+        srvObj._cacheIndex.remove(fileKey)
+    srvObj.getDb().updateCacheEntries(fileKeys, 1)
+    markFilesChecked(srvObj, fileKeys)
 
 
 def _addEntryCacheCtrlPlugInDbm(srvObj,
@@ -883,16 +1180,40 @@ def _cacheCtrlPlugInThread(threadGrObj):
             break
        
 
+def _fileStatusAllowsDeletion(fileStatus):
+    re = bin(int(fileStatus, 2) & CACHE_DEL_BIT_MASK_INT)[2:] # logic AND, and remove the '0b', e.g '0b11001' --> '11001'
+    re = re.zfill(8) # fill zeroes at the beginning, e.g. '100' --> '00000100'
+    return (CACHE_DEL_BIT_MASK == re)
+
+
 def checkIfFileCanBeDeleted(srvObj, fileId, fileVersion, diskId):
     """
     Check if the file can be deleted from its file_status flag
     """
     fileStatus = srvObj.getDb().getFileStatus(fileId, fileVersion, diskId)
+    return _fileStatusAllowsDeletion(fileStatus)
 
-    re = bin(int(fileStatus, 2) & CACHE_DEL_BIT_MASK_INT)[2:] # logic AND, and remove the '0b', e.g '0b11001' --> '11001'
-    re = re.zfill(8) # fill zeroes at the beginning, e.g. '100' --> '00000100'
 
-    return (CACHE_DEL_BIT_MASK == re)
+def checkIfFilesCanBeDeleted(srvObj, fileKeys):
+    """
+    Like checkIfFileCanBeDeleted, but for several files at once, returning
+    the (Disk ID, File ID, File Version) of those that can be deleted. Files
+    not found in the NGAS DB anymore can be deleted as well.
+    """
+    fileStatuses = srvObj.getDb().getFileStatuses(fileKeys)
+    deletable = set()
+    for fileKey in fileKeys:
+        fileStatus = fileStatuses.get(fileKey)
+        if fileStatus is None:
+            logger.warning("file already gone, still mark for deletion: %s/%s/%s",
+                           str(fileKey[0]), str(fileKey[1]), str(fileKey[2]))
+            deletable.add(fileKey)
+        elif _fileStatusAllowsDeletion(fileStatus):
+            deletable.add(fileKey)
+        else:
+            logger.info("Cannot delete file from the cache: %s/%s/%s",
+                        str(fileKey[0]), str(fileKey[1]), str(fileKey[2]))
+    return deletable
 
 
 def checkCacheContents(srvObj, stopEvt, check_can_be_deleted):
@@ -930,46 +1251,24 @@ def checkCacheContents(srvObj, stopEvt, check_can_be_deleted):
 
     # 0. Go through the explicitDel queue to remove files
 
+    # The files are selected using the Cache Index, which keeps the files
+    # ordered and the size of the cache up to date, and are scheduled for
+    # deletion in batches of the following size.
+    batchSize = 1000
+    cacheIndex = srvObj._cacheIndex
+
     # 1. Evaluate if there are files residing in the cache for more than
     #    the specified amount of time.
     if (srvObj.getCfg().getVal("Caching[1].MaxTime")):
         logger.debug("Applying criteria: Expired files ...")
         maxCacheTime = int(srvObj.getCfg().getVal("Caching[1].MaxTime"))
-        sqlQuery = "SELECT * FROM ngas_cache WHERE cache_time < %.6f" %\
-                   (time.time() - maxCacheTime)
-        # Dump the results into a temporary DBM.
-        delFilesDbm = createTmpDbm(srvObj, "EXP_FILES_INFO")
-        # Encapsulate this in a try clause to be able to semaphore protect
-        # the interaction with SQLite in case other threads would try to
-        # access the DBMS.
-        try:
-            srvObj._cacheContDbmsSem.acquire()
-            srvObj._cacheContDbmsCur.execute(sqlQuery)
-            while (True):
-                fileInfoList = srvObj._cacheContDbmsCur.fetchmany(10000)
-                if (not fileInfoList): break
-                for sqlFileInfo in fileInfoList:
-                    logger.info("CACHE-CRITERIA: Maximum Time Expired: %s/%s/%s",
-                          sqlFileInfo[NGAMS_CACHE_DISK_ID],
-                          sqlFileInfo[NGAMS_CACHE_FILE_ID],
-                          str(sqlFileInfo[NGAMS_CACHE_FILE_VER]))
-                    delFilesDbm.addIncKey(sqlFileInfo)
-            srvObj._cacheContDbms.commit()
-            srvObj._cacheContDbmsSem.release()
-        except:
-            srvObj._cacheContDbmsSem.release()
-            raise
-
-        # Now, loop over the selected files and mark them for deletion.
-        delFilesDbm.initKeyPtr()
+        expiredTime = time.time() - maxCacheTime
         while (True):
-            key, sqlFileInfo = delFilesDbm.getNext()
-            if (not key): break
-            scheduleFileForDeletion(srvObj, sqlFileInfo)
-            markFileChecked(srvObj, sqlFileInfo)
-
-        del delFilesDbm
-        delFilesDbm = None
+            fileKeys = cacheIndex.expired(expiredTime, batchSize)
+            if (not fileKeys): break
+            scheduleFilesForDeletion(srvObj, fileKeys,
+                                     "Maximum Time Expired")
+            checkStopCacheControlThread(stopEvt)
 
     # 2. Remove files if there more files (in volume) in the cache than the
     #    specified threshold.
@@ -977,12 +1276,7 @@ def checkCacheContents(srvObj, stopEvt, check_can_be_deleted):
         logger.debug("Applying criteria: Maximum cache size ...")
         maxCacheSize = int(srvObj.getCfg().getVal("Caching[1].MaxCacheSize"))
         # Check if the size of the cache content exceeds the specified limit.
-        sqlQuery = "SELECT sum(file_size) FROM ngas_cache"
-        cacheSum = queryCacheDbms(srvObj, sqlQuery)[0][0]
-        if (not cacheSum):
-            cacheSum = 0
-        else:
-            cacheSum = int(cacheSum)
+        cacheSum = cacheIndex.total_size
 
         msg = "Current size of cache: %.3f GB, " +\
                   "Maximum cache size: %.3f GB"
@@ -998,118 +1292,43 @@ def checkCacheContents(srvObj, stopEvt, check_can_be_deleted):
             # to avoid having to clean-up constantly due to this rule.
             maxCacheSize *= 0.9
 
-            # Schedule files FIFO-wise for removal from the cache.
-            sqlQuery = "SELECT * FROM ngas_cache ORDER BY cache_time"
-            # Dump the results into a temporary DBM.
-            delFilesDbm = createTmpDbm(srvObj, "MAX_VOL_FILES_INFO")
-            # Encapsulate this in a try clause to be able to semaphore protect
-            # the interaction with SQLite in case other threads would try to
-            # access the DBMS.
-            try:
-                srvObj._cacheContDbmsSem.acquire()
-                srvObj._cacheContDbmsCur.execute(sqlQuery)
-                while (cacheSum > maxCacheSize):
-                    fileInfoList = srvObj._cacheContDbmsCur.fetchmany(10000)
-                    if (not fileInfoList): break
-                    for sqlFileInfo in fileInfoList:
-                        if (check_can_be_deleted):
-                            try:
-                                if (not checkIfFileCanBeDeleted(srvObj,
-                                                                sqlFileInfo[NGAMS_CACHE_FILE_ID],
-                                                                sqlFileInfo[NGAMS_CACHE_FILE_VER],
-                                                                sqlFileInfo[NGAMS_CACHE_DISK_ID])):
-                                    logger.info("Cannot delete file from the cache: %s/%s/%s",
-                                          str(sqlFileInfo[0]), str(sqlFileInfo[1]), str(sqlFileInfo[2]))
-                                    continue
-                            except Exception as cee:
-                                if (str(cee).lower().find('file not found in ngas db') > -1):
-                                    logger.warning("file already gone, still mark for deletion: %s/%s/%s",
-                                            str(sqlFileInfo[0]), str(sqlFileInfo[1]), str(sqlFileInfo[2]))
-                                else:
-                                    raise
-
-                        msg = "CACHE-CRITERIA: Maximum Cache Size " +\
-                              "Exceeded: %s/%s/%s"
-                        logger.info(msg,
-                              sqlFileInfo[NGAMS_CACHE_DISK_ID],
-                              sqlFileInfo[NGAMS_CACHE_FILE_ID],
-                              str(sqlFileInfo[NGAMS_CACHE_FILE_VER]))
-                        delFilesDbm.addIncKey(sqlFileInfo)
-                        fileSize = int(sqlFileInfo[NGAMS_CACHE_FILE_SIZE])
-                        cacheSum -= fileSize
-                        if (cacheSum < maxCacheSize): break
-                srvObj._cacheContDbms.commit()
-                srvObj._cacheContDbmsSem.release()
-            except:
-                srvObj._cacheContDbmsSem.release()
-                raise
-
-            # Now, loop over the selected files and mark them for deletion.
-            delFilesDbm.initKeyPtr()
-            while (True):
-                key, sqlFileInfo = delFilesDbm.getNext()
-                if (not key): break
-                scheduleFileForDeletion(srvObj, sqlFileInfo)
-                markFileChecked(srvObj, sqlFileInfo)
-
-            del delFilesDbm
-            delFilesDbm = None
+            # Schedule files for removal from the cache, in the order given
+            # by the eviction policy, skipping those that cannot be deleted.
+            undeletable = set()
+            while (cacheSum > maxCacheSize):
+                fileKeys = cacheIndex.candidates(batchSize, exclude=undeletable)
+                if (not fileKeys): break
+                if (check_can_be_deleted):
+                    deletable = checkIfFilesCanBeDeleted(srvObj, fileKeys)
+                    undeletable.update(k for k in fileKeys if k not in deletable)
+                    fileKeys = [k for k in fileKeys if k in deletable]
+                delFileKeys = []
+                for fileKey in fileKeys:
+                    delFileKeys.append(fileKey)
+                    cacheSum -= cacheIndex.size(fileKey)
+                    if (cacheSum < maxCacheSize): break
+                scheduleFilesForDeletion(srvObj, delFileKeys,
+                                         "Maximum Cache Size Exceeded")
+                checkStopCacheControlThread(stopEvt)
 
     # 3. Remove files if there are more files in the cache than the
     #    specified threshold.
     if (srvObj.getCfg().getVal("Caching[1].MaxFiles")):
         logger.debug("Applying criteria: Maximum number of files ...")
         maxFiles = int(srvObj.getCfg().getVal("Caching[1].MaxFiles"))
-        sqlQuery = "SELECT count(*) FROM ngas_cache"
-        numberOfFiles = queryCacheDbms(srvObj, sqlQuery)[0][0]
-        if (not numberOfFiles):
-            numberOfFiles = 0
-        else:
-            numberOfFiles = int(numberOfFiles)
+        numberOfFiles = len(cacheIndex)
         if (numberOfFiles > maxFiles):
-            # Remove files from the cache, FIFO-wise, until the number of
-            # files is 10% below the specified limit.
-            # It seems that ROWCOUNT is not implemented for SELECT
-            # for SQLite. We do it the brute way ...
-            sqlQuery = "SELECT * FROM ngas_cache ORDER BY cache_time"
+            # Remove files from the cache, in the order given by the eviction
+            # policy, until the number of files is 10% below the specified
+            # limit.
             noOfFilesToRemove = int(1.10 * float(numberOfFiles - maxFiles))
-            count = 0
-            # Dump the results into a temporary DBM.
-            delFilesDbm = createTmpDbm(srvObj, "MAX_NO_FILES_INFO")
-            # Encapsulate this in a try clause to be able to semaphore protect
-            # the interaction with SQLite in case other threads would try to
-            # access the DBMS.
-            try:
-                srvObj._cacheContDbmsSem.acquire()
-                srvObj._cacheContDbmsCur.execute(sqlQuery)
-                while (count < noOfFilesToRemove):
-                    fileInfoList = srvObj._cacheContDbmsCur.fetchmany(10000)
-                    if (not fileInfoList): break
-                    for sqlFileInfo in fileInfoList:
-                        msg = "CACHE-CRITERIA: Maximum Number of Files in " +\
-                              "Cache Exceeded: %s/%s/%s"
-                        logger.info(msg,
-                              sqlFileInfo[NGAMS_CACHE_DISK_ID],
-                              sqlFileInfo[NGAMS_CACHE_FILE_ID],
-                              str(sqlFileInfo[NGAMS_CACHE_FILE_VER]))
-                        delFilesDbm.addIncKey(sqlFileInfo)
-                        count += 1
-                        if (count >= noOfFilesToRemove): break
-                srvObj._cacheContDbms.commit()
-                srvObj._cacheContDbmsSem.release()
-            except:
-                srvObj._cacheContDbmsSem.release()
-                raise
-
-            # Now, marked the selected files for deletion.
-            delFilesDbm.initKeyPtr()
-            while (True):
-                key, sqlFileInfo = delFilesDbm.getNext()
-                if (not key): break
-                scheduleFileForDeletion(srvObj, sqlFileInfo)
-                markFileChecked(srvObj, sqlFileInfo)
-            del delFilesDbm
-            delFilesDbm = None
+            while (noOfFilesToRemove > 0):
+                fileKeys = cacheIndex.candidates(min(batchSize, noOfFilesToRemove))
+                if (not fileKeys): break
+                scheduleFilesForDeletion(srvObj, fileKeys,
+                                         "Maximum Number of Files in Cache Exceeded")
+                noOfFilesToRemove -= len(fileKeys)
+                checkStopCacheControlThread(stopEvt)
 
     # 4. Invoke the Cache Control Plug-In (if specified) on the files.
     if (srvObj.getCfg().getVal("Caching[1].CacheControlPlugIn")):
@@ -1195,6 +1414,7 @@ def removeFile(srvObj,
              diskInfoObj.getDiskId(), fileId, str(fileVersion))
         srvObj.getDb().deleteFileInfo(srvObj.getHostId(), diskInfoObj.getDiskId(), fileId,
                                       fileVersion)
+        srvObj.file_location_cache.invalidate(fileId)
     except Exception as e:
         msg = genLog("NGAMS_ER_DEL_FILE_DB", [diskInfoObj.getDiskId(),
                                               fileId, fileVersion, str(e)])
@@ -1223,34 +1443,15 @@ def cleanUpCache(srvObj):
 
     Returns:    Void.
     """
-    # We dump info for all files at once, into a temporary DBM, since during
-    # the cleaning up queries will be done in the associated SQLite DBMS.
+    # We get the info for all files at once, since during the cleaning up
+    # queries will be done in the associated SQLite DBMS.
     sqlQuery = "SELECT disk_id, file_id, file_version, filename " +\
                "FROM ngas_cache WHERE cache_delete = 1"
-    cleanUpDbm = createTmpDbm(srvObj, "CLEAN-UP_FILE_INFO")
-    try:
-        srvObj._cacheContDbmsSem.acquire()
-        srvObj._cacheContDbmsCur.execute(sqlQuery)
-        while (True):
-            fileInfoList = srvObj._cacheContDbmsCur.fetchmany(10000)
-            if (not fileInfoList): break
-            for sqlFileInfo in fileInfoList:
-                cleanUpDbm.addIncKey(sqlFileInfo)
-            #res = srvObj._cacheContDbmsCur.fetchone()
-            #if (not res): break
-            #cleanUpDbm.addIncKey(res)
-        srvObj._cacheContDbms.commit()
-        srvObj._cacheContDbmsSem.release()
-    except:
-        srvObj._cacheContDbmsSem.release()
-        raise
+    cleanUpList = queryCacheDbms(srvObj, sqlQuery)
 
     # Now, loop over the entries to delete.
     diskInfoDic = {}
-    cleanUpDbm.initKeyPtr()
-    while (True):
-        key, sqlFileInfo = cleanUpDbm.getNext()
-        if (not key): break
+    for sqlFileInfo in cleanUpList:
         diskId      = sqlFileInfo[0]
         fileId      = sqlFileInfo[1]
         fileVersion = sqlFileInfo[2]
@@ -1328,6 +1529,10 @@ def cacheControlThread(srvObj, ready_evt, check_can_be_deleted, stopEvt):
             # Contents DBMS.
             checkNewFilesDbm(srvObj)
 
+            # Persist the access information of the files retrieved since
+            # the last iteration.
+            flushFileAccesses(srvObj)
+
             # Go through local Cache Contents DBMS. Check for each item if it
             # can be deleted.
             checkCacheContents(srvObj, stopEvt, check_can_be_deleted)
@@ -43,7 +43,7 @@ logger = logging.getLogger(__name__)
 _builtin_cmds = {
     'ARCHIVE', 'BBCPARC', 'CACHEDEL', 'CAPPEND', 'CARCHIVE', 'CCREATE',
     'CDESTROY', 'CHECKFILE', 'CLIST', 'CLONE', 'CONFIG', 'CREMOVE', 'CRETRIEVE',
-    'DISCARD', 'EXIT', 'HELP', 'INIT', 'LABEL', 'LARCHIVE', 'OFFLINE', 'ONLINE', 'QARCHIVE',
+    'DISCARD', 'EXIT', 'HELP', 'INIT', 'LABEL', 'LARCHIVE', 'METRICS', 'MRETRIEVE', 'OFFLINE', 'ONLINE', 'QARCHIVE',
     'QUERY', 'REARCHIVE', 'REGISTER', 'REMDISK', 'REMFILE', 'RETRIEVE', 'STATUS',
     'SUBSCRIBE', 'UNSUBSCRIBE'
 }
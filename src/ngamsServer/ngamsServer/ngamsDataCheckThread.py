@@ -32,22 +32,26 @@ This module contains the code for the Data Check Thread, which is used
 to check the data holding in connection with one NGAS host.
 """
 
-import glob
+import collections
 import logging
 import os
-import random
 import time
 import threading
 
-from six.moves import cPickle # @UnresolvedImport
+from six.moves import queue # @UnresolvedImport
 
 from . import ngamsFileUtils
 from ngamsLib.ngamsCore import NGAMS_DATA_CHECK_THR, \
     NGAMS_CACHE_DIR, checkCreatePath, isoTime2Secs, \
-    rmFile, genLog, mvFile, NGAMS_DISK_INFO, NGAMS_VOLUME_ID_FILE, \
+    rmFile, genLog, NGAMS_DISK_INFO, NGAMS_VOLUME_ID_FILE, \
     NGAMS_VOLUME_INFO_FILE, NGAMS_STAGING_DIR, NGAMS_NOTIF_DATA_CHECK, toiso8601
 from ngamsLib import ngamsNotification, ngamsDiskInfo
-from ngamsLib import ngamsDbCore, ngamsDbm, ngamsHighLevelLib, ngamsLib
+from ngamsLib import ngamsDbCore, ngamsDbm
+
+try:
+    from os import scandir # @UnresolvedImport
+except ImportError: # python 2
+    scandir = None
 
 
 logger = logging.getLogger(__name__)
@@ -75,7 +79,7 @@ def suspend(stopEvt, t):
 
 # Parameters for statistics.
 class Stats(object):
-    def __init__(self, mbs, files):
+    def __init__(self, mbs, files, duration=0):
         self.lock = threading.Lock()
         self.last_db_update = 0
         self.time_start = time.time()
@@ -85,6 +89,7 @@ class Stats(object):
         self.mbs_checked = 0
         self.files = files
         self.files_checked = 0
+        self.duration = duration
 
 
 def _initFileCheckStatus(srvObj, amountMb, noOfFiles):
@@ -100,7 +105,9 @@ def _initFileCheckStatus(srvObj, amountMb, noOfFiles):
     Returns:        Void.
     """
 
-    stats = Stats(mbs=amountMb, files=noOfFiles)
+    duration = srvObj.getCfg().getDataCheckCycleDuration()
+    duration = isoTime2Secs(duration) if duration else 0
+    stats = Stats(mbs=amountMb, files=noOfFiles, duration=duration)
 
     srvObj.getDb().updateDataCheckStat(srvObj.getHostId(), stats.time_start,
                                        stats.time_remaining, 0,
@@ -113,12 +120,8 @@ def _initFileCheckStatus(srvObj, amountMb, noOfFiles):
 
 def _updateFileCheckStatus(srvObj,
                            fileSize,
-                           diskId,
                            fileId,
-                           fileVersion,
-                           report,
                            stats,
-                           dbmObjDic,
                            force = 0):
     """
     Update the status of the DCC.
@@ -127,16 +130,8 @@ def _updateFileCheckStatus(srvObj,
 
     fileSize:     Size of file (in bytes) that was checked (integer)
 
-    diskId:       ID of disk hosting file checked (string).
-
     fileId:       ID of file concerned (string).
 
-    fileVersion:  Version of file concered (integer).
-
-    report:       List containing the result of the file checking.
-                  Refer to documentation for ngamsFileUtils.checkFile()
-                  for futher information (list).
-
     force:        If set to 1 a DB update will be forced (integer/0|1).
 
     Returns:      Void.
@@ -153,10 +148,10 @@ def _updateFileCheckStatus(srvObj,
         checkTime = now - stats.time_start
         stats.check_rate = stats.mbs_checked / checkTime
         if stats.check_rate > 0:
-            stats.remainding_time = (stats.mbs - stats.mbs_checked) / stats.check_rate
+            stats.time_remaining = max(0, (stats.mbs - stats.mbs_checked) / stats.check_rate)
             statEstimTime = stats.mbs / stats.check_rate
         else:
-            stats.remainding_time = 0
+            stats.time_remaining = 0
             statEstimTime    = 0
 
         # Update DB only every 10s.
@@ -168,11 +163,6 @@ def _updateFileCheckStatus(srvObj,
                                                stats.files_checked)
             stats.last_db_update = now
 
-        # Update report if an error was found.
-        if (diskId and report):
-            fileKey = ngamsLib.genFileKey(None, fileId, fileVersion)
-            dbmObjDic[diskId][1].add(fileKey, report)
-
         statFormat = "DCC Status: Time Remaining (s): %d, " +\
                      "Rate (MB/s): %.3f, " +\
                      "Volume/Checked (MB): %.3f/%.3f, Files/Checked: %d/%d"
@@ -180,341 +170,290 @@ def _updateFileCheckStatus(srvObj,
              stats.mbs, stats.files, stats.files_checked)
 
 
-def collect_files_on_disk(stopEvt, disks):
-
-    all_files = {}
+def _pace(stopEvt, stats):
+    """
+    Suspends the calling sub-thread while the checking is ahead of the pace
+    needed to complete the check cycle in its target duration, if any.
+    """
+    if not stats.duration or not stats.mbs:
+        return
+    with stats.lock:
+        done = min(1, stats.mbs_checked / stats.mbs)
+        ahead = done * stats.duration - (time.time() - stats.time_start)
+    if ahead > 0:
+        logger.debug("Data checking ahead of schedule, suspending for %.3f [s]", ahead)
+        suspend(stopEvt, ahead)
 
-    # Loop over disks
-    for diskId, diskInfoObj in disks.items():
 
-        # Walk over the mount point and collect all files
-        mount_pt = diskInfoObj.getMountPoint()
-        for dirpath, dirs, files in os.walk(mount_pt):
-            _stopDataCheckThr(stopEvt)
+class _resume_cursors(object):
+    """
+    The position reached by the check of each disk, so an interrupted check
+    can be resumed later on where it was left. For each disk being checked
+    only the (File ID, File Version) of the last file checked and the
+    problems found so far are kept, in a DBM named:
 
-            # Ignore staging and hidden directories
-            dirs[:] = [d for d in dirs if d != NGAMS_STAGING_DIR and not d.startswith('.')]
+       <Mount Root Point>/cache/DATA-CHECK-THREAD_CURSORS.bsddb
+    """
 
-            # Ignore NGAS Disk Info files
-            files[:] = [f for f in files if f not in (NGAMS_DISK_INFO, NGAMS_VOLUME_ID_FILE, NGAMS_VOLUME_INFO_FILE)]
+    def __init__(self, cacheDir, disk_ids):
+        self._dbm = ngamsDbm.ngamsDbm(os.path.join(cacheDir, NGAMS_DATA_CHECK_THR + "_CURSORS"),
+                                      writePerm=1)
 
-            for filename in files:
-                filename = os.path.join(dirpath, filename)
-                all_files[filename] = diskId
+        # Forget about disks that are not scheduled for checking anymore
+        for key in self._dbm.keys():
+            if key.decode('latin1') not in disk_ids:
+                self._dbm.rem(key)
+        self._dbm.sync()
 
-    logger.info("Found %d files to check in %d disks", len(all_files), len(disks))
-    return all_files
+    def get(self, diskId):
+        """Returns the last file checked in the given disk and the problems found"""
+        cursor = self._dbm.get(diskId)
+        if cursor is None:
+            return None, []
+        return cursor
 
-def _dumpFileInfo(srvObj, disks_to_check, tmpFilePat, stopEvt):
-    """
-    Function that dumps the information about the files. One DBM is created
-    per disk. This is named:
+    def save(self, diskId, last, errors):
+        self._dbm.add(diskId, (last, errors), sync=1)
 
-       <Mount Root Point>/cache/DATA-CHECK-THREAD_QUEUE_<Disk ID>.bsddb
+    def finish(self, diskId):
+        if diskId in self._dbm:
+            self._dbm.rem(diskId)
+            self._dbm.sync()
 
-    If problems are found for a file, these are stored in DBM files named:
 
-       <Mount Root Point>/cache/DATA-CHECK-THREAD_ERRORS_<Disk ID>.bsddb
+def _list_dir(path):
+    """
+    Yields the name of each entry in ``path``, whether it is a directory, and
+    whether it is a symbolic link
+    """
+    if scandir is None:
+        for name in os.listdir(path):
+            fname = os.path.join(path, name)
+            yield name, os.path.isdir(fname), os.path.islink(fname)
+        return
+    for entry in scandir(path):
+        yield entry.name, entry.is_dir(), entry.is_symlink()
+
+def _scan_disk(stopEvt, mount_pt):
+    """
+    Returns the names, relative to ``mount_pt``, of all files found under it.
+    NGAS Disk Info files, and the staging and hidden directories are ignored.
+    """
+    ignored = (NGAMS_DISK_INFO, NGAMS_VOLUME_ID_FILE, NGAMS_VOLUME_INFO_FILE)
+    files = set()
+    dirs = ['']
+    while dirs:
+        _stopDataCheckThr(stopEvt)
+        dirname = dirs.pop()
+        try:
+            entries = list(_list_dir(os.path.join(mount_pt, dirname)))
+        except OSError:
+            logger.warning("Cannot list directory %s", os.path.join(mount_pt, dirname),
+                           exc_info=True)
+            continue
+        for name, is_dir, is_link in entries:
+            if not is_dir:
+                if name not in ignored:
+                    files.add(os.path.join(dirname, name))
+            elif not is_link and name != NGAMS_STAGING_DIR and not name.startswith('.'):
+                dirs.append(os.path.join(dirname, name))
+    return files
 
-    The function handles the DBM files in the following way:
 
-       1. Check for each DBM file found, if this disk is still in the system.
-          If not, the Queue and Error DBM files are removed.
+def _crossCheckNonRegFiles(srvObj, diskId, mtPt, unchecked_files):
+    """
+    This function checks if non-registered files were found during the checking
+    if these still are not available. This is necessary if requests are
+    handled during the check of a disk, in particular if files are
+    archived between the list of files actually found on the disk is
+    generated and the file information is read from the DB.
 
-       2. Go through the list of disks in the system. If they don't have
-          the two DBM files listed above, these are initialized. The file
-          information for all the files stored on the disk is dumped into
-          the Queue DBM file. Only files marked to be ignored are not dumped.
+    srvObj:            Reference to server object (ngamsServer).
 
-       3. Finally, build up a DBM with references to all files found
-          on this system
+    diskId:            ID of the disk where the files were found (string).
 
-    srvObj:       Reference to server object (ngamsServer).
+    mtPt:              Mount point of the disk (string).
 
-    tmpFilePat:   Pattern for temporary files (string).
+    unchecked_files:   Names of the files, relative to the mount point (set).
 
-    Returns:      Void.
+    Returns:           Dictionary with the full names of the files that are
+                       not registered, and the ID of their disk (dict).
     """
-    cacheDir = os.path.join(srvObj.getCfg().getRootDirectory(), NGAMS_CACHE_DIR)
-    checkCreatePath(os.path.normpath(cacheDir))
 
-    ###########################################################################
-    # Loop over the Queue/Error DBM files found, check if the disk is
-    # still in the system/scheduled for checking.
-    ###########################################################################
-    logger.debug("Loop over/check existing Queue/Error DBM Files ...")
-    dbmFileList = glob.glob(cacheDir + "/" + NGAMS_DATA_CHECK_THR +\
-                            "_QUEUE_*.bsddb")
-    dbmObjDic = {}
-    for dbmFile in dbmFileList:
-        _stopDataCheckThr(stopEvt)
-        diskId = dbmFile.split("_")[-1].split(".")[0]
-        if diskId not in disks_to_check:
-            filePat = "%s/%s*%s.bsddb" % (cacheDir,NGAMS_DATA_CHECK_THR,diskId)
-            rmFile(filePat)
+    unregistered = {}
+    for ngasFilename in unchecked_files:
+
+        filename = os.path.normpath(mtPt + "/" + ngasFilename)
+        fileInfo = srvObj.getDb().\
+                   getFileInfoFromDiskIdFilename(diskId, ngasFilename)
+        if fileInfo is not None:
+            msg = "File: %s detected as not registered was found in the "+\
+                  "NGAS DB while cross-checking discrepancy. Disk ID: " +\
+                  "%s/File Id: %s/File Version: %s"
+            logger.debug(msg, filename, diskId, fileInfo.getFileId(),
+                          fileInfo.getFileVersion())
         else:
-            # Add references to Queue/Error DBM.
-            queueDbmFile = "%s/%s_QUEUE_%s.bsddb" %\
-                           (cacheDir, NGAMS_DATA_CHECK_THR, diskId)
-            queueDbm = ngamsDbm.ngamsDbm(queueDbmFile, 0, 1)
-            errorDbmFile = "%s/%s_ERRORS_%s.bsddb" %\
-                           (cacheDir, NGAMS_DATA_CHECK_THR, diskId)
-            errorDbm = ngamsDbm.ngamsDbm(errorDbmFile, 0, 1)
-            dbmObjDic[diskId] = (queueDbm, errorDbm)
-    logger.debug("Looped over/checked existing Queue/Error DBM Files")
-    ###########################################################################
-
-    ###########################################################################
-    # Loop over the disks mounted in this system and check if they have a
-    # Queue/Error DBM file. In case the DBM files are not available, create
-    # these.
-    ###########################################################################
-    logger.debug("Create DBM files for disks to be checked ...")
-    startDbFileRd = time.time()
-    for diskId in disks_to_check.keys():
-        _stopDataCheckThr(stopEvt)
+            msg = "File: %s detected as not registered was not found " +\
+                  "in the NGAS DB while cross-checking discrepancy. " +\
+                  "Disk ID: %s"
+            logger.debug(msg, filename, diskId)
+            unregistered[filename] = diskId
 
-        if diskId in dbmObjDic:
-            continue
+    # Unregistered files returned
+    return unregistered
 
-        # The disk is ripe for checking but still has no Queue/Error DBM
-        # DBs allocated.
-        queueDbmFile = "%s/%s_QUEUE_%s.bsddb" %\
-                       (cacheDir, NGAMS_DATA_CHECK_THR, diskId)
-        tmpQueueDbmFile = tmpFilePat + "_" + os.path.basename(queueDbmFile)
-        queueDbm = ngamsDbm.ngamsDbm(tmpQueueDbmFile, 0, 1)
-
-        # Now, retrieve the files on the given disk, and store the info
-        # in the Queue DBM file.
-        files = srvObj.getDb().getFileSummary1(diskIds=[diskId],
-                                               ignore=0, fileStatus=[],
-                                               lowLimIngestDate=None,
-                                               order=0)
-        for fileInfo in files:
-            fileId  = fileInfo[ngamsDbCore.SUM1_FILE_ID]
-            fileVer = fileInfo[ngamsDbCore.SUM1_VERSION]
-            fileKey = ngamsLib.genFileKey(None, fileId, fileVer)
-            queueDbm.add(fileKey, fileInfo)
-        queueDbm.sync()
-
-        # Rename DCC Queue DBM from the temporary to the final name.
-        mvFile(tmpQueueDbmFile, queueDbmFile)
-        queueDbm = ngamsDbm.ngamsDbm(queueDbmFile, 0, 1)
-
-        # Create Error DBM + add these in the DBM Dictionary for the disk.
-        errorDbmFile = "%s/%s_ERRORS_%s.bsddb" %\
-                       (cacheDir, NGAMS_DATA_CHECK_THR, diskId)
-        errorDbm = ngamsDbm.ngamsDbm(errorDbmFile, 0, 1)
-        dbmObjDic[diskId] = (queueDbm, errorDbm)
 
-        _stopDataCheckThr(stopEvt)
-    logger.debug("Queried info for files to be checked from DB. Time: %.3fs",
-         time.time() - startDbFileRd)
-    logger.debug("Checked that disks scheduled for checking have DBM files")
-    ###########################################################################
+def _checkDisk(srvObj, stopEvt, diskInfo, cursors, stats, executor):
+    """
+    Checks the files of a disk, resuming the check from where it was left the
+    last time, if it was interrupted.
 
-    # These are all files recursively found on the disks
-    # Later on we check whether they are registered or not, and check them (or not)
-    start = time.time()
-    files_on_disk = collect_files_on_disk(stopEvt, disks_to_check)
-    end = time.time()
-    logger.debug("Collected references to %d files on disks in %.3f [s]",
-                 len(files_on_disk), end - start)
-
-    # Don't take these into account
-    logger.debug("Retrieving information about files to be ignored ...")
-    files = srvObj.getDb().getFileSummarySpuriousFiles1(srvObj.getHostId(), fetch_size=1000)
-    for fileInfo in files:
-        if (fileInfo[ngamsDbCore.SUM1_FILE_IGNORE]):
-            filename = os.path.\
-                       normpath(fileInfo[ngamsDbCore.SUM1_MT_PT] + "/" +\
-                                fileInfo[ngamsDbCore.SUM1_FILENAME])
-            if filename in files_on_disk:
-                del files_on_disk[filename]
-    logger.debug("Retrieved information about files to be ignored")
-    ###########################################################################
-
-    ###########################################################################
-    # Initialize the statistics parameters for the checking.
-    ###########################################################################
-    logger.debug("Initialize the statistics for the checking cycle ...")
-    amountMb = 0.0
-    noOfFiles = 0
-    for diskId in disks_to_check.keys():
-        queueDbm = dbmObjDic[diskId][0]
-        #################################################################################################
-        #jagonzal: Replace looping aproach to avoid exceptions coming from the next() method underneath
-        #          when iterating at the end of the table that are prone to corrupt the hash table object
-        #queueDbm.initKeyPtr()
-        #while (1):
-        #    fileKey, fileInfo = queueDbm.getNext()
-        #    if (not fileKey): break
-        for fileKey,dbVal in queueDbm.iteritems():
-            # jagonzal: We need to reformat the values and skip administrative elements #################
-            if b"__" in fileKey: continue
-            fileInfo = cPickle.loads(dbVal)
-            #############################################################################################
-            noOfFiles += 1
-            amountMb += float(fileInfo[ngamsDbCore.SUM1_FILE_SIZE]) / 1048576.0
-        #################################################################################################
+    The files registered in the disk are read from the DB in pages, and
+    checked in the order they are read. The position of the check is
+    persisted every now and then, and when the check is interrupted.
 
-    stats = _initFileCheckStatus(srvObj, amountMb, noOfFiles)
-    ###########################################################################
+    srvObj:       Reference to server object (ngamsServer).
+
+    diskInfo:     Disk to check (ngamsDiskInfo).
 
-    return files_on_disk, dbmObjDic, stats
+    cursors:      Resume cursors of the disks being checked (_resume_cursors).
 
-def _schedNextFile(srvObj,
-                   threadId, disk_ids, diskSchedDic, dbmObjDic, reqFileInfoSem):
+    Returns:      Tuple with the files found on the disk that are not
+                  registered (see _crossCheckNonRegFiles()), and the problems
+                  found for the registered ones (tuple).
     """
-    Function that returns the information about the next file to be checked
-    according to the checking scheme.
 
-    The function keeps track of which disk has been allocated to which
-    Checking Sub-Thread and allocates only files from the given disk to that
-    thread.
+    diskId = diskInfo.getDiskId()
+    mtPt = diskInfo.getMountPoint()
+    scan = srvObj.getCfg().getDataCheckScan()
+    db = srvObj.getDb()
 
-    srvObj:       Reference to server object (ngamsServer).
+    def key(fileInfo):
+        return (fileInfo[ngamsDbCore.SUM1_FILE_ID], fileInfo[ngamsDbCore.SUM1_VERSION])
 
-    threadId:     ID of the sub-thread (string).
+    def filename(fileInfo):
+        return os.path.normpath(fileInfo[ngamsDbCore.SUM1_FILENAME])
 
-    Returns:      List with information (format see
-                  ngamsDbCore.getFileSummary1()) for file to be checked. If
-                  there are no more files to check, None is returned
-                  (list/None).
-    """
+    # All files found on the disk; registered files are removed from here as
+    # they are read from the DB, leaving only the unregistered ones.
+    # Files up to the resume cursor, if any, were checked already.
+    start = time.time()
+    files_on_disk = _scan_disk(stopEvt, mtPt)
+    logger.debug("Found %d files in disk %s in %.3f [s]",
+                 len(files_on_disk), diskId, time.time() - start)
+    last, errors = cursors.get(diskId)
+    if last:
+        logger.info("Resuming check of disk %s after file %s/%s", diskId, last[0], last[1])
+        for fileInfo in db.getFileSummary1ByDisk(diskId, upto=last):
+            files_on_disk.discard(filename(fileInfo))
+            _stopDataCheckThr(stopEvt)
 
-    with reqFileInfoSem:
-        while True:
-            fileInfo = None
-            if threadId not in diskSchedDic:
-                if (disk_ids):
-                    idx = random.randint(0, (len(disk_ids) - 1))
-                    diskId = disk_ids[idx]
-                    # Check if that disk is already being checked by other
-                    # threads. If yes, we don't initialize the key pointer.
-                    beingChecked = 0
-                    for thrId in diskSchedDic.keys():
-                        if (diskSchedDic[thrId] == diskId):
-                            beingChecked = 1
-                            break
-                    if (not beingChecked):
-                        dbmObjDic[diskId][0].initKeyPtr()
-                    fileKey, fileInfo = dbmObjDic[diskId][0].getNext()
-                    diskSchedDic[threadId] = diskId
-                else:
-                    break
-            else:
-                diskId = diskSchedDic[threadId]
-                fileKey, fileInfo = dbmObjDic[diskId][0].getNext()
-
-            if (fileInfo):
-                # We got a file key + file info list, return the info.
-                break
-            else:
-                # There are no more file info lists for the given Disk ID,
-                # remove that Disk ID from the list and try to switch to
-                # another disk. Also set, the time for the last check of that
-                # disk.
-                dbmObjDic[diskId][0].cleanUp()
-                rmFile(dbmObjDic[diskId][0].getDbmName())
-                srvObj.getDb().setLastCheckDisk(diskId, time.time())
-                if diskId in disk_ids:
-                    idx = disk_ids.index(diskId)
-                    del disk_ids[idx]
-                for thrId in list(diskSchedDic):
-                    if (diskSchedDic[thrId] == diskId):
-                        del diskSchedDic[thrId]
-                if (disk_ids):
-                    idx = random.randint(0, (len(disk_ids) - 1))
-                    nextDiskId = disk_ids[idx]
-                    diskSchedDic[threadId] = nextDiskId
-                else:
-                    break
-
-        return fileInfo
+    last_save = time.time()
+    try:
+        for fileInfo in db.getFileSummary1ByDisk(diskId, after=last):
+            _stopDataCheckThr(stopEvt)
+            files_on_disk.discard(filename(fileInfo))
+
+            # Files marked to be ignored are not checked
+            if not fileInfo[ngamsDbCore.SUM1_FILE_IGNORE]:
+                tmpReport = []
+                try:
+                    ngamsFileUtils.checkFile(srvObj, fileInfo, tmpReport, scan,
+                                             executor=executor)
+                except Exception:
+                    logger.exception("Error while checking file %s/%s in disk %s",
+                                     fileInfo[ngamsDbCore.SUM1_FILE_ID],
+                                     fileInfo[ngamsDbCore.SUM1_VERSION], diskId)
+                _stopDataCheckThr(stopEvt)
+                if tmpReport:
+                    errors.append(tmpReport[0])
+                _updateFileCheckStatus(srvObj,
+                                       fileInfo[ngamsDbCore.SUM1_FILE_SIZE],
+                                       fileInfo[ngamsDbCore.SUM1_FILE_ID],
+                                       stats)
+
+            last = key(fileInfo)
+            if time.time() - last_save >= 10:
+                cursors.save(diskId, last, errors)
+                last_save = time.time()
+            _pace(stopEvt, stats)
+    except StopDataCheckThreadException:
+        if last:
+            cursors.save(diskId, last, errors)
+        raise
+
+    cursors.finish(diskId)
+    db.setLastCheckDisk(diskId, time.time())
+
+    unregistered = _crossCheckNonRegFiles(srvObj, diskId, mtPt, files_on_disk)
+    return unregistered, errors
 
 
 checksum_allow_evt = None
 checksum_stop_evt = None
-def do_checksum(blocksize, filename, checksum_variant):
+def do_checksum(blocksize, filename, checksum_variant, max_rate=0, drop_cache=False):
     return ngamsFileUtils.get_checksum_interruptible(blocksize, filename, checksum_variant,
-                                                     checksum_allow_evt, checksum_stop_evt)
+                                                     checksum_allow_evt, checksum_stop_evt,
+                                                     max_rate=max_rate, drop_cache=drop_cache)
 
 def _dataCheckSubThread(srvObj,
-                        threadId,
                         stopEvt,
-                        all_files,
-                        disk_ids,
-                        diskSchedDic,
-                        dbmObjDic,
-                        reqFileInfoSem,
-                        stats):
+                        devices,
+                        cursors,
+                        stats,
+                        results):
     """
     Sub-thread scheduled to carry out the actual checking. This makes
     it possible to do the checking in several threads simultaneously if
     the NGAS Host has multiple CPUs.
 
+    Each sub-thread takes one physical device at a time from the ``devices``
+    queue, and checks all its disks one after the other, so no two sub-threads
+    read from the same device at the same time.
+
     srvObj:       Reference to server object (ngamsServer).
 
-    threadId:     ID allocated to this thread (string).
+    devices:      Queue with the lists of disks hosted by each device
+                  (Queue).
+
+    results:      Dictionary where the results of checking each disk are
+                  stored (see _checkDisk()), indexed by Disk ID (dict).
 
     Returns:      Void.
     """
 
     # The globals are set at process creation time,
     # in ngamsServer#handleStartUp
-    def external_process_executor(*args, **kwargs):
-        return srvObj.workers_pool.apply(do_checksum, args, kwargs)
+    cfg = srvObj.getCfg()
+    checksum_kwargs = {'max_rate': cfg.getDataCheckMaxRate() * 1048576,
+                       'drop_cache': bool(cfg.getDataCheckDropCache())}
+    def external_process_executor(*args):
+        return srvObj.workers_pool.apply(do_checksum, args, checksum_kwargs)
 
-    while (1):
+    while True:
 
         try:
-            _stopDataCheckThr(stopEvt)
-
-            # Get the info for the next file to check + check it.
-            fileInfo = _schedNextFile(srvObj, threadId, disk_ids, diskSchedDic, dbmObjDic, reqFileInfoSem)
-            if (not fileInfo):
-                logger.debug("No more files in queue to check - exiting")
-                _updateFileCheckStatus(srvObj, None, None, None, None, [], stats, dbmObjDic, 1)
-                return
-
-            # Remove the entry for this file in the File Reference DBM to
-            # indicate that the file is registered in the DB.
-            filename = os.path.normpath(fileInfo[ngamsDbCore.SUM1_MT_PT]+"/" +\
-                                        fileInfo[ngamsDbCore.SUM1_FILENAME])
-            filename = str(filename)
-
-            if filename in all_files:
-                del all_files[filename]
-
-            # Update the overall status of the checking.
-            tmpReport = []
-            ngamsFileUtils.checkFile(srvObj, fileInfo, tmpReport,
-                                     srvObj.getCfg().getDataCheckScan(),
-                                     executor=external_process_executor)
-            _stopDataCheckThr(stopEvt)
-
-            if (not tmpReport): tmpReport = [[]]
-            _updateFileCheckStatus(srvObj,
-                                   fileInfo[ngamsDbCore.SUM1_FILE_SIZE],
-                                   fileInfo[ngamsDbCore.SUM1_DISK_ID],
-                                   fileInfo[ngamsDbCore.SUM1_FILE_ID],
-                                   fileInfo[ngamsDbCore.SUM1_VERSION],
-                                   tmpReport[0],
-                                   stats,
-                                   dbmObjDic)
-
-        except StopDataCheckThreadException:
+            disks = devices.get_nowait()
+        except queue.Empty:
+            logger.debug("No more disks to check - exiting")
             return
-        except Exception:
-            logger.exception("Exception encountered in Data Check Sub-Thread")
+
+        for diskInfo in disks:
+            diskId = diskInfo.getDiskId()
             try:
-                suspend(stopEvt, 2)
+                results[diskId] = _checkDisk(srvObj, stopEvt, diskInfo, cursors,
+                                             stats, external_process_executor)
             except StopDataCheckThreadException:
                 return
+            except Exception:
+                logger.exception("Exception encountered while checking disk %s", diskId)
+                try:
+                    suspend(stopEvt, 2)
+                except StopDataCheckThreadException:
+                    return
 
 
-def _genReport(srvObj, unregistered, diskDic, dbmObjDic, stats):
+def _genReport(srvObj, unregistered, errors, n_disks, stats):
     """
     Generate the DCC Check Report according to the problems found.
 
@@ -523,10 +462,7 @@ def _genReport(srvObj, unregistered, diskDic, dbmObjDic, stats):
     Returns:    Void.
     """
     # Find out how many inconsistencies were found.
-    noOfProbs = 0
-    # Errors found.
-    for diskId in diskDic.keys():
-        noOfProbs += dbmObjDic[diskId][1].getCount()
+    noOfProbs = len(errors)
     # Spurious files on disk.
     unRegFiles = len(unregistered)
 
@@ -562,22 +498,9 @@ def _genReport(srvObj, unregistered, diskDic, dbmObjDic, stats):
             report += format % ("Problem Description", "File ID",
                                 "Version", "Slot ID:Disk ID")
             report += separator
-            for diskId in diskDic.keys():
-                errDbm = dbmObjDic[diskId][1].initKeyPtr()
-                #################################################################################################
-                #jagonzal: Replace looping aproach to avoid exceptions coming from the next() method underneath
-                #          when iterating at the end of the table that are prone to corrupt the hash table object
-                #while (1):
-                #    fileKey, errInfo = errDbm.getNext()
-                #    if (not fileKey): break
-                for fileKey,dbVal in errDbm.iteritems():
-                    # jagonzal: We need to reformat the values and skip administrative elements #################
-                    if b"__" in fileKey: continue
-                    errInfo = cPickle.loads(dbVal)
-                    #############################################################################################
-                    slotDiskId = errInfo[3] + ":" + errInfo[4]
-                    report += format % (errInfo[0], errInfo[1], errInfo[2],slotDiskId)
-                #################################################################################################
+            for errInfo in errors:
+                slotDiskId = errInfo[3] + ":" + errInfo[4]
+                report += format % (errInfo[0], errInfo[1], errInfo[2],slotDiskId)
             report += separator
 
         # Not registered files found?
@@ -591,7 +514,7 @@ def _genReport(srvObj, unregistered, diskDic, dbmObjDic, stats):
             report += separator
 
         # Send Notification Message if needed (only if disks where checked).
-        if (len(diskDic.keys())):
+        if (n_disks):
             ngamsNotification.notify(srvObj.getHostId(), srvObj.getCfg(), NGAMS_NOTIF_DATA_CHECK,
                                      "DATA CHECK REPORT", report, force=1)
 
@@ -601,59 +524,25 @@ def _genReport(srvObj, unregistered, diskDic, dbmObjDic, stats):
                   stats.mbs_checked, stats.check_rate, checkTime])
     logger.info(msg)
 
-    # Remove the various DBMs allocated.
-    for diskId in diskDic.keys():
-        dbmObjDic[diskId][1].cleanUp()
-        del dbmObjDic[diskId]
 
-
-def _crossCheckNonRegFiles(srvObj, unchecked_files, diskDic):
+def _groupByDevice(disks):
     """
-    This function checks if non-registered files were found during the checking
-    if these still are not available. This is necessary if requests are
-    handled during the initialization of the DCC, in particular if files are
-    archived between the file information is dumped from the DB and the list
-    of files actually found on the data volumes is generated. I.e., the
-    sequence might be:
+    Groups the given disks by the device hosting them, as reported by the
+    operating system for their mount points.
 
-    - Dump DB File Info for this node.
-    - Some ARCHIVE Commands are handled.
-    - Generate list of files on the volumes in this node.
+    disks:      Dictionary with the disks, indexed by Disk ID (dict).
 
-    The files that were archived in between would be detected as not
-    registered.
-
-    srvObj:    Reference to server object (ngamsServer).
-
-    Returns:   None.
+    Returns:    List with the lists of disks hosted by each device (list).
     """
-
-    unregistered = {}
-    for filename, diskId in unchecked_files.items():
-
-        if diskId not in diskDic:
-            logger.warning("Unknown Disk ID: %s encountered", diskId)
-            break
-
-        mtPt = diskDic[diskId].getMountPoint()
-        ngasFilename = filename[(len(mtPt) + 1):]
-        fileInfo = srvObj.getDb().\
-                   getFileInfoFromDiskIdFilename(diskId, ngasFilename)
-        if fileInfo is not None:
-            msg = "File: %s detected as not registered was found in the "+\
-                  "NGAS DB while cross-checking discrepancy. Disk ID: " +\
-                  "%s/File Id: %s/File Version: %s"
-            logger.debug(msg, filename, diskId, fileInfo.getFileId(),
-                          fileInfo.getFileVersion())
-        else:
-            msg = "File: %s detected as not registered was not found " +\
-                  "in the NGAS DB while cross-checking discrepancy. " +\
-                  "Disk ID: %s"
-            logger.debug(msg, filename, diskId)
-            unregistered[filename] = diskId
-
-    # Unregistered files returned
-    return unregistered
+    devices = collections.OrderedDict()
+    for diskId in sorted(disks):
+        diskInfo = disks[diskId]
+        try:
+            dev = os.stat(diskInfo.getMountPoint()).st_dev
+        except OSError:
+            dev = diskId
+        devices.setdefault(dev, []).append(diskInfo)
+    return list(devices.values())
 
 
 def get_disks_to_check(srvObj):
@@ -683,27 +572,36 @@ def _data_check_cycle(srvObj, stopEvt, checksum_allow_evt, checksum_stop_evt):
     # Get list of disks that need checking
     disks_to_check = get_disks_to_check(srvObj)
 
-    # Get the information about the files in those disks that we should check.
-    tmpFilePat = ngamsHighLevelLib.\
-                 genTmpFilename(srvObj.getCfg(),
-                                NGAMS_DATA_CHECK_THR)
-    try:
-        all_files, dbmObjDic, stats = _dumpFileInfo(srvObj, disks_to_check, tmpFilePat, stopEvt)
-    finally:
-        rmFile(tmpFilePat + "*")
+    cacheDir = os.path.join(srvObj.getCfg().getRootDirectory(), NGAMS_CACHE_DIR)
+    checkCreatePath(os.path.normpath(cacheDir))
+
+    # Previous versions kept queues with the information about all files
+    # to check; these are not used anymore
+    rmFile(os.path.join(cacheDir, NGAMS_DATA_CHECK_THR + "_QUEUE_*"))
+    rmFile(os.path.join(cacheDir, NGAMS_DATA_CHECK_THR + "_ERRORS_*"))
+    cursors = _resume_cursors(cacheDir, disks_to_check)
 
-    # is allocated for each up to the limit defined in the
-    # configuration.
-    n_threads = min(len(disks_to_check), srvObj.getCfg().getDataCheckMaxProcs())
+    # The amount of data to check is taken from the disks' information,
+    # instead of adding up the sizes of all the files
+    amountMb = 0.0
+    noOfFiles = 0
+    for diskInfo in disks_to_check.values():
+        amountMb += max(0, diskInfo.getBytesStored()) / 1048576.0
+        noOfFiles += max(0, diskInfo.getNumberOfFiles())
+    stats = _initFileCheckStatus(srvObj, amountMb, noOfFiles)
+
+    # One sub-thread is allocated for each device, up to the limit defined in
+    # the configuration.
+    devices = queue.Queue()
+    for disks in _groupByDevice(disks_to_check):
+        devices.put(disks)
+    n_threads = min(devices.qsize(), srvObj.getCfg().getDataCheckMaxProcs())
 
-    diskSchedDic = {}
-    reqFileInfoSem = threading.Lock()
-    disk_ids = list(disks_to_check.keys())
+    results = {}
     threads = {}
     for n in range(n_threads):
         threadName = "%s-%d" % (NGAMS_DATA_CHECK_THR, n)
-        args = (srvObj, threadName, stopEvt, all_files, disk_ids, diskSchedDic,
-                dbmObjDic, reqFileInfoSem, stats)
+        args = (srvObj, stopEvt, devices, cursors, stats, results)
         logger.debug("Starting Data Check Sub-Thread: %s", threadName)
         t = threading.Thread(target=_dataCheckSubThread, name=threadName, args=args)
         t.setDaemon= True
@@ -722,7 +620,7 @@ def _data_check_cycle(srvObj, stopEvt, checksum_allow_evt, checksum_stop_evt):
             # Be nice and join sub-threads
             for t in threads.values():
                 t.join(10)
-                if t.isAlive():
+                if t.is_alive():
                     logger.warning("Thread %r didn't cleanly shut down within 10 seconds", t)
 
             # Let's stop ourselves now
@@ -731,26 +629,32 @@ def _data_check_cycle(srvObj, stopEvt, checksum_allow_evt, checksum_stop_evt):
         else:
             # Check if all the sub-threads are still running
             # or if the check cycle is completed.
-            threads = {n: t for n, t in threads.items() if t.isAlive()}
+            threads = {n: t for n, t in threads.items() if t.is_alive()}
             if not threads:
                 lastCheckTime = time.time()
                 break
 
-    # Check again for non-registered files.
-    # The sub-threads remove individual items from all_files after they
-    # check each file, so any files left there were not checked
-    unregistered = _crossCheckNonRegFiles(srvObj, all_files, disks_to_check)
+    _updateFileCheckStatus(srvObj, None, None, stats, 1)
+    srvObj.data_check_cycle_duration.observe(lastCheckTime - stats.time_start)
+
+    # Collect the files not registered and the problems found in all disks
+    unregistered = {}
+    errors = []
+    for disk_unregistered, disk_errors in results.values():
+        unregistered.update(disk_unregistered)
+        errors.extend(disk_errors)
 
     # Send out check report if any discrepancies found + send
     # out notification message according to configuration.
-    _genReport(srvObj, unregistered, disks_to_check, dbmObjDic, stats)
+    _genReport(srvObj, unregistered, errors, len(disks_to_check), stats)
 
-    # Set the last check for all disks to the same value
-    for diskId in disks_to_check.keys():
+    # Set the last check for all the checked disks to the same value
+    for diskId in results:
         srvObj.getDb().setLastCheckDisk(diskId, lastCheckTime)
 
     return stats
 
+
 def data_check_cycle(srvObj, stopEvt, checksum_allow_evt, checksum_stop_evt):
     # Simply set the server as data-checking or not
     srvObj.updateHostInfo(None, None, None, None, None, None, 1, None)
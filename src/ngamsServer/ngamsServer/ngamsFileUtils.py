@@ -37,6 +37,7 @@ import collections
 import contextlib
 import functools
 import logging
+import multiprocessing.pool
 import os
 import re
 import struct
@@ -46,7 +47,7 @@ import six
 
 from ngamsLib import ngamsDbCore, ngamsDiskInfo, ngamsStatus, \
     ngamsHttpUtils, ngamsFileInfo
-from ngamsLib import ngamsHighLevelLib
+from ngamsLib import ngamsHighLevelLib, utils
 from ngamsLib.ngamsCore import NGAMS_HOST_LOCAL, NGAMS_HOST_CLUSTER, \
     NGAMS_HOST_DOMAIN, rmFile, NGAMS_HOST_REMOTE, NGAMS_RETRIEVE_CMD, genLog, \
     NGAMS_STATUS_CMD, NGAMS_CACHE_DIR, \
@@ -389,6 +390,14 @@ def quickFileLocate(srvObj,
                           <Mountpoint>, <Filename>, <File Version>,
                           <format>) (tuple).
     """
+
+    # Hot files are located via the cache
+    cache = srvObj.file_location_cache
+    key = (fileId, fileVersion, hostId, domain, diskId, include_compression)
+    cached = cache.get(key)
+    if cached is not None:
+        return list(cached)
+
     res = srvObj.getDb().getFileSummary3(fileId, hostId, domain, diskId,
                                          fileVersion, cursor=False,
                                          include_compression=include_compression)
@@ -398,7 +407,9 @@ def quickFileLocate(srvObj,
             location = NGAMS_HOST_LOCAL
         else:
             location = NGAMS_HOST_REMOTE
-        return [location] + list(res[0])
+        result = [location] + list(res[0])
+        cache.put(key, tuple(result))
+        return result
 
     return (8 if not include_compression else 9) * (None,)
 
@@ -407,24 +418,28 @@ def checkFile(srvObj,
               sum1FileInfo,
               checkReport,
               skipCheckSum = 0,
-              executor=None):
+              executor=None,
+              force=False):
     """
     Function to carry out a consistency check on a file.
     If `stop_evt` and `allowed_evt` are given, then `get_checksum_interruptible`
     is used internally by this method; otherwise `get_checksum` is used.
     If `executor` is given, then it is used to carry out the execution of the
     checksum calculation; otherwise `get_checksum` is used.
+    Checksums found in the server's checksum cache are used instead of
+    calculating them again, unless `force` is set.
     """
 
-    executor = executor or get_checksum
+    executor = executor or functools.partial(get_checksum,
+        workers=srvObj.getCfg().getChecksumWorkers())
 
     foundProblem  = 0
     fileInfo      = sum1FileInfo
     diskId        = fileInfo[ngamsDbCore.SUM1_DISK_ID]
     slotId        = fileInfo[ngamsDbCore.SUM1_SLOT_ID]
-    filename      = os.path.\
-                    normpath(fileInfo[ngamsDbCore.SUM1_MT_PT] + "/" +\
-                             fileInfo[ngamsDbCore.SUM1_FILENAME])
+    mtPt          = fileInfo[ngamsDbCore.SUM1_MT_PT]
+    relFilename   = fileInfo[ngamsDbCore.SUM1_FILENAME]
+    filename      = os.path.normpath(mtPt + "/" + relFilename)
     if (fileInfo[ngamsDbCore.SUM1_CHECKSUM] == None):
         checksumDb = ""
     else:
@@ -492,15 +507,27 @@ def checkFile(srvObj,
                         blockSize = 4096
                     checksum_typ = get_checksum_name(crc_variant)
 
-                    # Calculate the checksum, possibly under the executor
-                    start = time.time()
-                    checksumFile = executor(blockSize, filename, crc_variant)
-                    duration = time.time() - start
-
-                    fsize_mb = getFileSize(filename) / 1024. / 1024.
-                    logger.info("Checked %s in %.4f [s] using %s. Check ran at %.3f [MB/s]. Checksum file/db:  %s / %s",
-                                filename, duration, str(crc_variant), fsize_mb / duration,
-                                str(checksumFile), checksumDb)
+                    # Use the checksum calculated previously if the file
+                    # didn't change since
+                    checksumFile = None
+                    if not force:
+                        checksumFile = srvObj.checksum_cache.get(mtPt, relFilename,
+                                                                 checksum_typ)
+                    if checksumFile is not None:
+                        logger.info("Checked %s using cached %s checksum. Checksum file/db:  %s / %s",
+                                    filename, checksum_typ, str(checksumFile), checksumDb)
+                    else:
+                        # Calculate the checksum, possibly under the executor
+                        start = time.time()
+                        checksumFile = executor(blockSize, filename, crc_variant)
+                        duration = time.time() - start
+                        srvObj.checksum_cache.put(mtPt, relFilename, checksum_typ,
+                                                  checksumFile)
+
+                        fsize_mb = getFileSize(filename) / 1024. / 1024.
+                        logger.info("Checked %s in %.4f [s] using %s. Check ran at %.3f [MB/s]. Checksum file/db:  %s / %s",
+                                    filename, duration, str(crc_variant), fsize_mb / duration,
+                                    str(checksumFile), checksumDb)
                 except Exception:
                     # We assume an IO error:
                     # "[Errno 2] No such file or directory"
@@ -581,31 +608,72 @@ CHECKSUM_NULL = -1
 CHECKSUM_CRC32_INCONSISTENT = 0
 CHECKSUM_CRC32C = 1
 CHECKSUM_CRC32Z = 2
+CHECKSUM_XXHASH64 = 3
+CHECKSUM_BLAKE3 = 4
+CHECKSUM_CRC64 = 5
+
+# Suffix of the names of the tree variants. The tree version of a variant
+# checksums each consecutive TREE_CHUNK_SIZE bytes of the data separately
+# using the original variant, and then the list of all these checksums. This
+# allows calculating the checksum of the different chunks of a file in
+# parallel, while still producing the same value when calculating it serially
+# as the data arrives.
+TREE_SUFFIX = '-tree'
+TREE_CHUNK_SIZE = 64 * 1024 * 1024
+
+# Registered checksum variants, by name, and the numbers and alternative
+# names that refer to them
+_checksum_variants = {}
+_checksum_aliases = {}
+
+def register_checksum_variant(name, info_factory, variant=None, aliases=()):
+    """
+    Registers a new checksum variant under `name`, which is the name stored in
+    the database for the files checksummed with it. `info_factory` is called
+    without arguments each time the variant is used, and should return its
+    checksum_info (or raise an exception if the variant is not available).
+    The variant can optionally be referred to by number (`variant`) and by
+    other names (`aliases`). Tree versions of the variant are automatically
+    available under `name` + TREE_SUFFIX.
+
+    Plug-ins can register their own variants, but should do so only if their
+    values can be stored in the ``checksum`` column of the ``ngas_files``
+    table (up to 64 characters). To be able to check files that were
+    checksummed with them the plug-ins must be loaded on server startup.
+    """
+    if name.endswith(TREE_SUFFIX):
+        raise ValueError("Checksum variant names cannot end with %s" % TREE_SUFFIX)
+    _checksum_variants[name] = info_factory
+    if variant is not None:
+        _checksum_aliases[variant] = name
+    for alias in aliases:
+        _checksum_aliases[alias] = name
 
 def _normalize_variant(variant_or_name):
+    """Returns the registered name of a variant, or None for CHECKSUM_NULL"""
 
     variant = variant_or_name
-
     if variant is None:
-        variant = CHECKSUM_NULL
+        return None
 
     # A plug-in name or variant name
-    elif isinstance(variant, six.string_types):
-        # In NGAS versions <= 8 the CRC was calculated as a separate step after
-        # archiving a file, and therefore was loaded as a plugin that received a
-        # filename when invoked.
-        # These two are the names stored at the database of those plugins, although
-        # the second one is simply a dummy name
-        if variant in ('ngamsGenCrc32', 'StreamCrc32', 'crc32'):
-            variant = CHECKSUM_CRC32_INCONSISTENT
-        elif variant == 'crc32c':
-            variant = CHECKSUM_CRC32C
-        elif variant == 'crc32z':
-            variant = CHECKSUM_CRC32Z
-        else:
-            variant = int(variant)
+    if isinstance(variant, six.string_types):
+        if variant in _checksum_variants:
+            return variant
+        elif variant in _checksum_aliases:
+            return _checksum_aliases[variant]
+        elif variant.endswith(TREE_SUFFIX):
+            leaf = _normalize_variant(variant[:-len(TREE_SUFFIX)])
+            if leaf is not None and not leaf.endswith(TREE_SUFFIX):
+                return leaf + TREE_SUFFIX
+            raise Exception('Unknown CRC variant: %r' % (variant_or_name,))
+        variant = int(variant)
 
-    return variant
+    if variant == CHECKSUM_NULL:
+        return None
+    if variant not in _checksum_aliases:
+        raise Exception('Unknown CRC variant: %r' % (variant_or_name,))
+    return _checksum_aliases[variant]
 
 def _filter_none(cond):
     def wrapped(x, y):
@@ -616,35 +684,140 @@ def _filter_none(cond):
         return cond(x, y)
     return wrapped
 
+def _hash_checksum_info(new, final, from_bytes, equals):
+    """
+    checksum_info for checksums calculated by hash objects. Their state is
+    the hash object itself, created when the first piece of data arrives.
+    """
+    def method(data, h):
+        if h is None:
+            h = new()
+        h.update(data)
+        return h
+    def _final(h):
+        return final(new() if h is None else h)
+    return checksum_info(None, method, _final, from_bytes, _filter_none(equals))
+
+def _crc32_info():
+    # This version of the crc is inconsistent because depending on the
+    # python version binascii.crc32 returns signed or unsigned values.
+    # python version <2.6 returned signed/unsigned depending on the platform,
+    # 2.6+ returns always signed, 3+ returns always unsigned).
+    fmt = '!i' if six.PY2 else '!I'
+    return checksum_info(0, binascii.crc32, lambda x: x, lambda x: struct.unpack(fmt, x)[0], _filter_none(lambda x, y: (int(x) & 0xffffffff) == (int(y) & 0xffffffff)))
+
+def _crc32c_info():
+    if not _crc32c_available:
+        raise Exception('Intel SSE 4.2 CRC32c instruction is not available')
+    return checksum_info(0, crc32c.crc32, lambda x: x & 0xffffffff, lambda x: struct.unpack('!I', x)[0], _filter_none(lambda x, y: int(x) == int(y)))
+
+def _crc32z_info():
+    # A consistent way of using binascii.crc32.
+    return checksum_info(0, binascii.crc32, lambda x: x & 0xffffffff, lambda x: struct.unpack('!I', x)[0], _filter_none(lambda x, y: int(x) == int(y)))
+
+def _xxhash64_info():
+    try:
+        import xxhash
+    except ImportError:
+        raise Exception('xxhash64 checksums require the xxhash package')
+    return _hash_checksum_info(xxhash.xxh64, lambda h: h.intdigest(),
+                               lambda x: struct.unpack('!Q', x)[0],
+                               lambda x, y: int(x) == int(y))
+
+def _blake3_info():
+    try:
+        import blake3
+    except ImportError:
+        raise Exception('blake3 checksums require the blake3 package')
+    # Stored as hexadecimal strings, a 256 bits integer doesn't fit in the DB
+    return _hash_checksum_info(blake3.blake3, lambda h: h.hexdigest(),
+                               lambda x: binascii.hexlify(x).decode('ascii'),
+                               lambda x, y: str(x).lower() == str(y).lower())
+
+def _crc64_info():
+    try:
+        import crcmod.predefined
+    except ImportError:
+        raise Exception('crc64 checksums require the crcmod package')
+    new = functools.partial(crcmod.predefined.PredefinedCrc, 'crc-64-we')
+    return _hash_checksum_info(new, lambda h: h.crcValue,
+                               lambda x: struct.unpack('!Q', x)[0],
+                               lambda x, y: int(x) == int(y))
+
+# In NGAS versions <= 8 the CRC was calculated as a separate step after
+# archiving a file, and therefore was loaded as a plugin that received a
+# filename when invoked.
+# These two aliases of crc32 are the names stored at the database of those
+# plugins, although the second one is simply a dummy name
+register_checksum_variant('crc32', _crc32_info, CHECKSUM_CRC32_INCONSISTENT,
+                          aliases=('ngamsGenCrc32', 'StreamCrc32'))
+register_checksum_variant('crc32c', _crc32c_info, CHECKSUM_CRC32C)
+register_checksum_variant('crc32z', _crc32z_info, CHECKSUM_CRC32Z)
+register_checksum_variant('xxhash64', _xxhash64_info, CHECKSUM_XXHASH64)
+register_checksum_variant('blake3', _blake3_info, CHECKSUM_BLAKE3)
+register_checksum_variant('crc64', _crc64_info, CHECKSUM_CRC64)
+
+class _tree_state(object):
+    """Running state of a tree checksum"""
+    __slots__ = ('leaf', 'filled', 'leaves')
+    def __init__(self, leaf):
+        self.leaf = leaf
+        self.filled = 0
+        self.leaves = []
+
+def _tree_root(leaf_info, leaves):
+    """Calculates the checksum of a tree given the checksums of its chunks"""
+    data = ''.join('%s\n' % (leaf,) for leaf in leaves).encode('ascii')
+    return leaf_info.final(leaf_info.method(data, leaf_info.init))
+
+def _tree_checksum_info(leaf_info):
+    """Returns the checksum_info of the tree version of `leaf_info`"""
+
+    def method(data, state):
+        if state is None:
+            state = _tree_state(leaf_info.init)
+        offset = 0
+        size = len(data)
+        while offset < size:
+            n = min(size - offset, TREE_CHUNK_SIZE - state.filled)
+            chunk = data if n == size else data[offset:offset + n]
+            state.leaf = leaf_info.method(chunk, state.leaf)
+            state.filled += n
+            offset += n
+            if state.filled == TREE_CHUNK_SIZE:
+                state.leaves.append(leaf_info.final(state.leaf))
+                state.leaf = leaf_info.init
+                state.filled = 0
+        return state
+
+    def final(state):
+        if state is None:
+            state = _tree_state(leaf_info.init)
+        leaves = state.leaves
+        if state.filled or not leaves:
+            leaves = leaves + [leaf_info.final(state.leaf)]
+        return _tree_root(leaf_info, leaves)
+
+    return checksum_info(None, method, final, None, leaf_info.equals)
+
 def get_checksum_info(variant_or_name):
     """
     Given a CRC variant, this method returns the method that should be
     continuously called to calculate the CRC of a given byte stream.
 
     The variant_or_name argument can be a number, where 0 is python's binascii
-    crc32 implementation and 1 is Intel's SSE 4.2 CRC32c implementation, or a
-    name indicating one of the old NGAMS plug-in names for performing CRC.
+    crc32 implementation and 1 is Intel's SSE 4.2 CRC32c implementation, or
+    the name of a registered variant (see register_checksum_variant), which
+    includes the old NGAMS plug-in names for performing CRC.
     The special value -1 means that no checksum is performed, and thus this
     method returns None
     """
-    variant = _normalize_variant(variant_or_name)
-    if variant == CHECKSUM_NULL:
+    name = _normalize_variant(variant_or_name)
+    if name is None:
         return None
-    if variant == CHECKSUM_CRC32_INCONSISTENT:
-        # This version of the crc is inconsistent because depending on the
-        # python version binascii.crc32 returns signed or unsigned values.
-        # python version <2.6 returned signed/unsigned depending on the platform,
-        # 2.6+ returns always signed, 3+ returns always unsigned).
-        fmt = '!i' if six.PY2 else '!I'
-        return checksum_info(0, binascii.crc32, lambda x: x, lambda x: struct.unpack(fmt, x)[0], _filter_none(lambda x, y: (int(x) & 0xffffffff) == (int(y) & 0xffffffff)))
-    elif variant == CHECKSUM_CRC32C:
-        if not _crc32c_available:
-            raise Exception('Intel SSE 4.2 CRC32c instruction is not available')
-        return checksum_info(0, crc32c.crc32, lambda x: x & 0xffffffff, lambda x: struct.unpack('!I', x)[0], _filter_none(lambda x, y: int(x) == int(y)))
-    elif variant == CHECKSUM_CRC32Z:
-        # A consistent way of using binascii.crc32.
-        return checksum_info(0, binascii.crc32, lambda x: x & 0xffffffff, lambda x: struct.unpack('!I', x)[0], _filter_none(lambda x, y: int(x) == int(y)))
-    raise Exception('Unknown CRC variant: %r' % (variant_or_name,))
+    if name.endswith(TREE_SUFFIX):
+        return _tree_checksum_info(get_checksum_info(name[:-len(TREE_SUFFIX)]))
+    return _checksum_variants[name]()
 
 def get_checksum_name(variant_or_name):
     """
@@ -652,30 +825,65 @@ def get_checksum_name(variant_or_name):
     variant.
 
     The variant_or_name argument can be a number, where 0 is python's binascii
-    crc32 implementation and 1 is Intel's SSE 4.2 CRC32c implementation, or a
-    name indicating one of the old NGAMS plug-in names for performing CRC.
+    crc32 implementation and 1 is Intel's SSE 4.2 CRC32c implementation, or
+    the name of a registered variant (see register_checksum_variant).
     The special value -1 means that no checksum is performed, and thus this
-    method returns 'nocrc'
+    method returns None
     """
-    variant = _normalize_variant(variant_or_name)
-    if variant == CHECKSUM_NULL:
-        return None
-    if variant == CHECKSUM_CRC32_INCONSISTENT:
-        return 'crc32'
-    elif variant == CHECKSUM_CRC32C:
-        return 'crc32c'
-    elif variant == CHECKSUM_CRC32Z:
-        return 'crc32z'
-    raise Exception('Unknown CRC variant: %d' % (variant_or_name,))
-
-def get_checksum(blocksize, fin, checksum_variant):
+    return _normalize_variant(variant_or_name)
+
+def _tree_leaf_checksum(args):
+    """Calculates the checksum of one of the chunks of a file"""
+    filename, offset, blocksize, leaf_name = args
+    crc_info = get_checksum_info(leaf_name)
+    crc_m = crc_info.method
+    crc = crc_info.init
+    remaining = TREE_CHUNK_SIZE
+    with open(filename, 'rb') as f:
+        f.seek(offset)
+        while remaining > 0:
+            block = f.read(min(blocksize, remaining))
+            if not block:
+                break
+            crc = crc_m(block, crc)
+            remaining -= len(block)
+    return crc_info.final(crc)
+
+def _get_tree_checksum_parallel(blocksize, filename, leaf_name, workers):
+    """
+    Calculates the tree checksum of a file using `workers` threads, each
+    calculating the checksum of a different chunk of the file
+    """
+    size = getFileSize(filename)
+    offsets = range(0, max(size, 1), TREE_CHUNK_SIZE)
+    pool = multiprocessing.pool.ThreadPool(min(workers, len(offsets)))
+    try:
+        leaves = pool.map(_tree_leaf_checksum,
+                          [(filename, offset, blocksize, leaf_name) for offset in offsets])
+    finally:
+        pool.close()
+        pool.join()
+    return _tree_root(get_checksum_info(leaf_name), leaves)
+
+def get_checksum(blocksize, fin, checksum_variant, workers=1):
     """
     Returns the checksum of a file (or file object) using the given checksum type.
+
+    For the tree checksum variants, if `fin` is a filename and `workers` is
+    greater than 1, the checksums of the different chunks of the file are
+    calculated in parallel by that many threads.
     """
     crc_info = get_checksum_info(checksum_variant)
     if crc_info is None:
         return None
 
+    name = get_checksum_name(checksum_variant)
+    if (name.endswith(TREE_SUFFIX) and workers > 1 and
+        isinstance(fin, six.string_types) and
+        getFileSize(fin) > TREE_CHUNK_SIZE):
+        return _get_tree_checksum_parallel(blocksize, fin,
+                                           name[:-len(TREE_SUFFIX)], workers)
+
     crc_m = crc_info.method
 
     # fin can be a filename, in which case we open (and then close) it
@@ -705,7 +913,8 @@ def get_checksum(blocksize, fin, checksum_variant):
     return crc
 
 def get_checksum_interruptible(blocksize, filename, checksum_variant,
-                               checksum_allow_evt, checksum_stop_evt):
+                               checksum_allow_evt, checksum_stop_evt,
+                               max_rate=0, drop_cache=False):
     """
     Like get_checksum, but the inner loop's execution is conditioned by two
     events to signal a full stop, and whether the execution of the inner loop
@@ -713,18 +922,31 @@ def get_checksum_interruptible(blocksize, filename, checksum_variant,
 
     When the caller sets the `stop_evt`, the `allowed_evt` should also be set;
     otherwise the execution will hang indefinitely.
+
+    If `max_rate` is given, the file is read at most at that many bytes per
+    second. If `drop_cache` is set, the data read is dropped from the page
+    cache as the file is read.
     """
     crc_info = get_checksum_info(checksum_variant)
     if crc_info is None:
         return None
     crc_m = crc_info.method
     crc = crc_info.init
+    bucket = utils.token_bucket(max_rate) if max_rate > 0 else None
+    offset = 0
     with open(filename, 'rb') as f:
         for block in iter(functools.partial(f.read, blocksize), b''):
             checksum_allow_evt.wait()
             if checksum_stop_evt.is_set():
                 return
             crc = crc_m(block, crc)
+            if drop_cache:
+                utils.drop_cache(f, offset, len(block))
+            offset += len(block)
+            if bucket:
+                delay = bucket.consume(len(block))
+                if delay and checksum_stop_evt.wait(delay):
+                    return
     crc = crc_info.final(crc)
     return crc
 
@@ -740,7 +962,8 @@ def check_checksum(srvObj, fio, filename):
 
     filename:     Name of file to check (string).
 
-    Returns:      Void.
+    Returns:      The checksum of the file, or None if it was not checked
+                  (string|None).
 
     Exceptions:   An exception is raised if the checksum is illegal.
     """
@@ -754,11 +977,13 @@ def check_checksum(srvObj, fio, filename):
         blockSize = srvObj.getCfg().getBlockSize()
         if blockSize == -1:
             blockSize = 4096
-        current_checksum = str(get_checksum(blockSize, filename, crc_variant))
+        current_checksum = str(get_checksum(blockSize, filename, crc_variant,
+                                            srvObj.getCfg().getChecksumWorkers()))
         if not checksum_info.equals(current_checksum, stored_checksum):
             msg = "Illegal checksum (found: %s, expected %s) on file %s/%s/%s" % \
                   (current_checksum, stored_checksum, fio.getDiskId(), fio.getFileId(), fio.getFileVersion())
             raise Exception(msg)
+        return current_checksum
     else:
         msg = "No checksum or checksum variant specified for file " +\
               "%s/%s/%s - skipping checksum check"
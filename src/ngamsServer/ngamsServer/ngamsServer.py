@@ -35,14 +35,17 @@ services for the NG/AMS Server.
 import argparse
 import collections
 import contextlib
+import email.utils
+import io
 import logging
 import multiprocessing
 import math
 import os
 import re
-import shutil
+import select
 import signal
 import socket
+import ssl
 import sys
 import threading
 import time
@@ -60,14 +63,15 @@ import netifaces
 from ngamsLib.ngamsCore import genLog, getNgamsVersion, \
     getFileSize, getDiskSpaceAvail, checkCreatePath,\
     getHostName, ngamsCopyrightString, getNgamsLicense,\
-    NGAMS_HTTP_REDIRECT, NGAMS_HTTP_INT_AUTH_USER, \
+    NGAMS_HTTP_REDIRECT, NGAMS_HTTP_INT_AUTH_USER, NGAMS_HTTP_SUCCESS, \
+    NGAMS_HTTP_PARTIAL_CONTENT, NGAMS_HTTP_RANGE_NOT_SATISFIABLE, \
     NGAMS_SUCCESS, NGAMS_FAILURE, NGAMS_OFFLINE_STATE,\
     NGAMS_IDLE_SUBSTATE, NGAMS_BUSY_SUBSTATE, NGAMS_NOTIF_ERROR,\
     NGAMS_NOT_SET, NGAMS_XML_MT, loadPlugInEntryPoint, isoTime2Secs,\
     toiso8601
 from ngamsLib import ngamsHighLevelLib, ngamsLib, ngamsEvent, ngamsHttpUtils,\
-    utils, logutils
-from ngamsLib import ngamsDb, ngamsConfig, ngamsReqProps, pysendfile
+    utils, logutils, metrics
+from ngamsLib import ngamsDb, ngamsConfig, ngamsReqProps, pysendfile, pysplice
 from ngamsLib import ngamsStatus, ngamsHostInfo, ngamsNotification
 from . import janitor
 from . import InvalidParameter, NoSuchCommand
@@ -76,10 +80,13 @@ from . import ngamsDataCheckThread
 from . import ngamsUserServiceThread
 from . import ngamsMirroringControlThread
 from . import ngamsCacheControlThread
+from . import checksum_cache
+from . import location_cache
 from . import request_db
 
 
 logger = logging.getLogger(__name__)
+access_logger = logging.getLogger('ngamsServer.access')
 
 def get_all_ipaddrs():
     """
@@ -104,17 +111,58 @@ class thread_pool_mixin(socketserver.ThreadingMixIn):
         # but haven't been picked up yet, declared in TCPServer
         self.request_queue_size = max_reqs
 
+        # Connections being handled by a thread of the pool, and those among
+        # them that are idle, waiting for a new request to arrive
+        self._connections_lock = threading.Lock()
+        self._connections = 0
+        self._idle_connections = set()
+
     def process_request(self, request, client_address):
         """process the request in a thread of the pool"""
 
         if self._ngamsServer.serving_count >= self.request_queue_size:
             logger.error("Maximum number of serving threads reached, rejecting request")
+            self._ngamsServer.requests_rejected.inc()
             wfile = request.makefile('wb')
             wfile.write(b'HTTP/1.0 503 Service Unavailable\r\n\r\n')
             return
 
+        # Idle persistent connections should not prevent new connections
+        # from being served, so we close one to free its thread
+        with self._connections_lock:
+            self._connections += 1
+            if self._connections > self.request_queue_size and self._idle_connections:
+                self._close_idle_connection(self._idle_connections.pop())
+
         self._pool.apply_async(self.process_request_thread, args=(request, client_address))
 
+    def process_request_thread(self, request, client_address):
+        try:
+            socketserver.ThreadingMixIn.process_request_thread(self, request, client_address)
+        finally:
+            with self._connections_lock:
+                self._connections -= 1
+
+    def connection_idle(self, connection):
+        """Called by request handlers while waiting for a new request"""
+        with self._connections_lock:
+            if self._connections > self.request_queue_size:
+                return False
+            self._idle_connections.add(connection)
+            return True
+
+    def connection_busy(self, connection):
+        """Called by request handlers after waiting for a new request"""
+        with self._connections_lock:
+            self._idle_connections.discard(connection)
+
+    def _close_idle_connection(self, connection):
+        # Shutting down the reading side wakes up the thread waiting on it
+        try:
+            connection.shutdown(socket.SHUT_RD)
+        except socket.error:
+            pass
+
 class ngamsHttpServer(thread_pool_mixin, BaseHTTPServer.HTTPServer):
     """Class providing pooled multithreaded HTTP server functionality"""
 
@@ -125,7 +173,6 @@ class ngamsHttpServer(thread_pool_mixin, BaseHTTPServer.HTTPServer):
         BaseHTTPServer.HTTPServer.__init__(self, server_address, ngamsHttpRequestHandler)
 
         if ngamsServer._cert is not None:
-            import ssl
             logger.info("Using TLS for testing")
             context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
             context.load_cert_chain(certfile=ngamsServer._cert)
@@ -144,7 +191,67 @@ class _atomic_counter(object):
             val = self.val
             self.val += 1
             return val
-            
+
+class _body_reader(object):
+    """
+    Wraps the ``rfile`` of a request handler, keeping track of how many
+    bytes of the request body have been read
+    """
+
+    def __init__(self, f, sock=None):
+        self.f = f
+        self.sock = sock
+        self.readin = 0
+
+    def read(self, *args):
+        data = self.f.read(*args)
+        self.readin += len(data)
+        return data
+
+    def readline(self, *args):
+        data = self.f.readline(*args)
+        self.readin += len(data)
+        return data
+
+    def readinto(self, b):
+        n = self.f.readinto(b)
+        self.readin += n or 0
+        return n
+
+    def splice_into(self, fout, count):
+        """
+        Writes up to ``count`` bytes of the body into ``fout``, moving them
+        from the socket directly into the file when possible. Data already
+        buffered in user space is written first.
+
+        Returns the number of bytes written, which can be less than ``count``
+        if splicing is not possible, in which case the rest of the data should
+        be read normally.
+        """
+        if (self.sock is None or pysplice.os_splice is None or
+            not hasattr(self.f, 'read1') or isinstance(self.sock, ssl.SSLSocket)):
+            return 0
+
+        written = 0
+        timeout = self.sock.gettimeout()
+        self.sock.setblocking(False)
+        try:
+            while written < count:
+                data = self.f.read1(min(count - written, io.DEFAULT_BUFFER_SIZE))
+                if not data:
+                    break
+                fout.write(data)
+                written += len(data)
+        finally:
+            self.sock.settimeout(timeout)
+
+        written += pysplice.splice_to_file(self.sock, fout, count - written)
+        self.readin += written
+        return written
+
+    def __getattr__(self, name):
+        return getattr(self.f, name)
+
 class ngamsHttpRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
     """
     Class used to handle an HTTP request. The various ``send_*`` methods
@@ -154,6 +261,7 @@ class ngamsHttpRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
 
     server_version = "NGAMS/" + getNgamsVersion()
     req_count = _atomic_counter(0)
+    delimited_response = False
 
     def setup(self):
 
@@ -165,28 +273,61 @@ class ngamsHttpRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         cfg = self.ngasServer.getCfg()
         self.timeout = cfg.getTimeOut() or 60
 
-        # Make the name of the current thread more unique
-        # This is important because we currently use the thread name to uniquely
-        # map log statements to individual requests. Log statements use
-        req_num = self.req_count.inc()
-        threading.current_thread().setName('R-%d' % req_num)
+        # Persistent connections require HTTP/1.1
+        self.keep_alive_timeout = cfg.getKeepAliveTimeout()
+        if self.keep_alive_timeout > 0:
+            self.protocol_version = 'HTTP/1.1'
+
+        self.access_log = cfg.getAccessLog()
 
         BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
 
+    def handle(self):
+        """Handles one or more requests, waiting a limited time between them"""
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection and self.wait_for_request():
+            self.handle_one_request()
+
+    def wait_for_request(self):
+        """
+        Waits at most ``keep_alive_timeout`` seconds for a new request to
+        arrive through a persistent connection. Returns whether there is
+        data to read.
+        """
+        if not self.server.connection_idle(self.connection):
+            return False
+        self.connection.settimeout(self.keep_alive_timeout)
+        try:
+            if hasattr(self.rfile, 'peek'):
+                return bool(self.rfile.peek(1))
+            return bool(select.select([self.connection], [], [], self.keep_alive_timeout)[0])
+        except socket.error:
+            return False
+        finally:
+            self.server.connection_busy(self.connection)
+            self.connection.settimeout(self.timeout)
+
     def version_string(self):
         return self.server_version
 
     def log_message(self, fmt, *args):
         """
-        The default log_request is not safe (it blocks) under heavy load.
-        I suggest using a Queue and another thread to read from the queue
-        and write it to disk as a possible solution here. A pass works for
-        now, but you get no logging.
-
-        Comment this method out to enable (unsafe) logging.
+        Logs messages from the base class (e.g., errors while parsing requests)
+        into the access log, if enabled. Logging blocks under heavy load unless
+        asynchronous logging is enabled too, which is thus recommended.
 
         Returns:    Void.
         """
+        if self.access_log:
+            access_logger.info("%s %s", self.client_address[0], fmt % args)
+
+    def log_request(self, code='-', size='-'):
+        """
+        Called by the base class when sending a response. Requests are logged
+        instead after being handled (see reqHandle), when their total size
+        and duration are known.
+        """
         pass
 
     def reqHandle(self):
@@ -196,10 +337,31 @@ class ngamsHttpRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         Returns:    Void.
         """
 
+        # Make the name of the current thread more unique
+        # This is important because we currently use the thread name to uniquely
+        # map log statements to individual requests. Log statements use
+        req_num = self.req_count.inc()
+        threading.current_thread().setName('R-%d' % req_num)
+        start = time.time()
+
         # This is set by send_response below to prevent multiple replies being
         # send during the same HTTP request
         self.reply_sent = False
         self.headers_sent = False
+        self.delimited_response = False
+        self.status_code = None
+        self.bytes_sent = 0
+
+        # A persistent connection can only be kept if the request body
+        # is fully consumed while handling the request
+        body_size = 0
+        if 'content-length' in self.headers:
+            body_size = int(self.headers['content-length'])
+        if 'transfer-encoding' in self.headers:
+            self.close_connection = True
+        rfile = self.rfile
+        if body_size:
+            self.rfile = _body_reader(rfile, self.connection)
 
         path = self.path.strip("?/ ")
         try:
@@ -219,14 +381,37 @@ class ngamsHttpRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         except Exception:
             logger.exception("Error while handling request", extra={'to_syslog': True})
             raise
+        finally:
+            if body_size:
+                if self.rfile.readin < body_size:
+                    self.close_connection = True
+                self.rfile = rfile
+            if self.access_log:
+                access_logger.info('%s "%s %s" %s %d %.3f', self.client_address[0],
+                                   self.command, ngamsLib.hidePassword(self.path),
+                                   self.status_code or '-', self.bytes_sent, time.time() - start)
 
     # The three methods we support
     do_GET  = reqHandle
     do_POST = reqHandle
     do_PUT  = reqHandle
 
+    def send_header(self, keyword, value):
+        if keyword.lower() in ('content-length', 'transfer-encoding'):
+            self.delimited_response = True
+        BaseHTTPServer.BaseHTTPRequestHandler.send_header(self, keyword, value)
+
     # Richer end_headers method to keep track of call
     def end_headers(self):
+
+        # Clients can only tell where the body of a response without a
+        # Content-Length ends if we close the connection
+        if not self.close_connection:
+            if self.delimited_response or self.command == 'HEAD':
+                self.send_header('Keep-Alive', 'timeout=%d' % self.keep_alive_timeout)
+            else:
+                self.send_header('Connection', 'close')
+
         BaseHTTPServer.BaseHTTPRequestHandler.end_headers(self)
         self.headers_sent = True
 
@@ -238,6 +423,7 @@ class ngamsHttpRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         if self.reply_sent:
             raise Exception("Tried to send two responses :(")
         self.reply_sent = True
+        self.status_code = code
 
         BaseHTTPServer.BaseHTTPRequestHandler.send_response(self, code, message=message)
         for k, v in hdrs.items():
@@ -262,51 +448,126 @@ class ngamsHttpRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         self.send_response(http_status, hdrs={'Location': url})
         self.end_headers()
 
-    def send_file(self, f, mime_type, start_byte=0, fname=None, hdrs={}):
+    def send_file(self, f, mime_type, start_byte=0, fname=None, hdrs={},
+                  ranges=None, if_range=None):
         """
         Sends file ``f`` of type ``mime_type`` to the client. Optionally a different
         starting byte to start the transmission from, and a different name for
         the file to present the data to the user can be given.
+
+        Alternatively ``ranges`` can be a list of byte ranges as returned by
+        `ngamsHttpUtils.parse_range_header`, in which case only those parts
+        of the file are sent, as a single part or as a multipart/byteranges
+        message. If ``if_range`` is given it must match the file's ETag or
+        Last-Modified value for the ranges to be honoured, otherwise the whole
+        file is sent.
         """
 
         fname = fname or os.path.basename(f)
         size = getFileSize(f)
+        hdrs = dict(hdrs)
+        hdrs.update(self._file_validators(f, size))
+        hdrs['Accept-Ranges'] = 'bytes'
+
+        if start_byte and not ranges:
+            ranges = [(start_byte, None)]
+        if ranges and if_range and if_range not in (hdrs['ETag'], hdrs['Last-Modified']):
+            logger.info("If-Range validator doesn't match, sending full file")
+            ranges = None
+        if not ranges:
+            self.send_file_headers(fname, mime_type, size, hdrs=hdrs)
+            self.write_file_data(f, size)
+            return
+
+        byte_ranges = ngamsHttpUtils.satisfiable_ranges(ranges, size)
+        if not byte_ranges:
+            hdrs['Content-Range'] = 'bytes */%d' % size
+            self.send_status("Requested range not satisfiable", status=NGAMS_FAILURE,
+                             code=NGAMS_HTTP_RANGE_NOT_SATISFIABLE, hdrs=hdrs)
+            return
+
+        if len(byte_ranges) == 1:
+            start, end = byte_ranges[0]
+            self.send_file_headers(fname, mime_type, size, start, hdrs=hdrs, end_byte=end)
+            self.write_file_data(f, size, start, end - start + 1)
+            return
 
-        self.send_file_headers(fname, mime_type, size, start_byte, hdrs=hdrs)
-        self.write_file_data(f, size, start_byte)
+        self._send_byteranges(f, mime_type, size, byte_ranges, fname, hdrs)
+
+    def _file_validators(self, f, size):
+        """Returns the ETag and Last-Modified headers for file ``f``"""
+        mtime = os.path.getmtime(f)
+        return {'ETag': '"%x-%x"' % (int(mtime * 1e6), size),
+                'Last-Modified': email.utils.formatdate(mtime, usegmt=True)}
+
+    def _send_byteranges(self, f, mime_type, size, byte_ranges, fname, hdrs):
+        """Sends ``byte_ranges`` of file ``f`` as a multipart/byteranges message"""
+
+        boundary = uuid.uuid4().hex
+        part_headers = []
+        for start, end in byte_ranges:
+            part_headers.append(six.b(
+                '--%s\r\nContent-Type: %s\r\nContent-Range: bytes %d-%d/%d\r\n\r\n' %
+                (boundary, mime_type, start, end, size)))
+        trailer = six.b('--%s--\r\n' % boundary)
+        length = len(trailer) + sum(len(ph) + end - start + 1 + 2
+                                    for ph, (start, end) in zip(part_headers, byte_ranges))
+
+        hdrs['Content-Type'] = 'multipart/byteranges; boundary=%s' % boundary
+        hdrs['Content-Disposition'] = 'attachment; filename="%s"' % fname
+        hdrs['Content-Length'] = str(length)
+        logger.info("Sending %d byte ranges of %s", len(byte_ranges), f)
+        self.send_response(NGAMS_HTTP_PARTIAL_CONTENT, hdrs=hdrs)
+        self.end_headers()
+        for ph, (start, end) in zip(part_headers, byte_ranges):
+            self._write_body(ph)
+            self.write_file_data(f, size, start, end - start + 1)
+            self._write_body(b'\r\n')
+        self._write_body(trailer)
 
-    def send_file_headers(self, fname, mime_type, size, start_byte=0, hdrs={}):
+    def send_file_headers(self, fname, mime_type, size, start_byte=0, hdrs={}, end_byte=None):
         """Sends the headers advertising file ``fname``, but without its data.
+        If ``start_byte`` or ``end_byte`` are given a 206 response is sent
+        advertising only that (inclusive) byte range of the file.
         Headers set by this method take precedence over values given by the
         caller via the ``hdrs`` optional argument"""
 
+        partial = bool(start_byte) or end_byte is not None
+        if end_byte is None:
+            end_byte = size - 1
         _hdrs = {'Content-Type': mime_type,
                 'Content-Disposition': 'attachment; filename="%s"' % fname,
-                'Content-Length': str(size - start_byte)}
-        if start_byte:
+                'Content-Length': str(end_byte - start_byte + 1)}
+        if partial:
             _hdrs['Accept-Ranges'] = 'bytes'
-            _hdrs["Content-Range"] = "bytes %d-%d/%d" % (start_byte, size - 1, size)
+            _hdrs["Content-Range"] = "bytes %d-%d/%d" % (start_byte, end_byte, size)
 
+        hdrs = dict(hdrs)
         hdrs.update(_hdrs)
-        self.send_response(200, hdrs=hdrs)
+        self.send_response(NGAMS_HTTP_PARTIAL_CONTENT if partial else NGAMS_HTTP_SUCCESS, hdrs=hdrs)
         self.end_headers()
 
-    def write_file_data(self, f, size, start_byte=0):
-        """sends file ``f``, hopefully using ``sendfile(2)``"""
+    def write_file_data(self, f, size, start_byte=0, count=None):
+        """sends file ``f`` (or ``count`` bytes of it), hopefully using ``sendfile(2)``"""
 
         if not self.headers_sent:
             raise RuntimeError('Trying to send file data but HTTP headers not sent')
 
         self.wfile.flush()
-        logger.info("Sending %s (%d bytes) to client, starting at byte %d", f, size, start_byte)
+        if count is None:
+            count = size - start_byte
+        if count <= 0:
+            return
+        logger.info("Sending %s (%d bytes) to client, starting at byte %d", f, count, start_byte)
         with open(f, 'rb') as fin:
             st = time.time()
             if self.ngasServer.get_server_access_proto() == "https":
-                pysendfile.sendfile_send(self.connection, fin, start_byte)
+                pysendfile.sendfile_send(self.connection, fin, start_byte, count)
             else:
-                pysendfile.sendfile(self.connection, fin, start_byte)
-            howlong = time.time() - st
-            size_mb = size / 1024. / 1024.
+                pysendfile.sendfile(self.connection, fin, start_byte, count)
+            self.bytes_sent += count
+            howlong = max(time.time() - st, 1e-6)
+            size_mb = count / 1024. / 1024.
         logger.info("Sent %s at %.3f [MB/s]", f, size_mb / howlong)
 
     def send_data(self, data, mime_type, code=200, message=None, fname=None, hdrs={}):
@@ -336,10 +597,60 @@ class ngamsHttpRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
 
         # Support for file-like objects (but files should be sent via write_file_data)
         if hasattr(data, 'read'):
-            shutil.copyfileobj(data, self.wfile)
-            return
+            while True:
+                buf = data.read(io.DEFAULT_BUFFER_SIZE)
+                if not buf:
+                    return
+                self._write_body(buf)
 
+        self._write_body(data)
+
+    def _write_body(self, data):
         self.wfile.write(data)
+        self.bytes_sent += len(data)
+
+    def send_chunked_data(self, chunks, mime_type, code=200, message=None, fname=None, hdrs={}):
+        """
+        Sends back the data yielded by ``chunks``, which is of type
+        ``mime_type``, without knowing its total size in advance. If ``fname``
+        is given then the data is sent as an attachment.
+
+        Data is sent using chunked transfer encoding if possible. Clients
+        that don't support it (i.e., HTTP/1.0 clients) get all data in one go.
+        """
+
+        if self.request_version < 'HTTP/1.1':
+            self.send_data(b''.join(chunks), mime_type, code=code,
+                           message=message, fname=fname, hdrs=hdrs)
+            return
+
+        hdrs = dict(hdrs)
+        logger.info("Sending data of type %s and headers %r in chunks", mime_type, hdrs)
+
+        hdrs['Content-Type'] = mime_type
+        if fname:
+            hdrs['Content-Disposition'] = 'attachment; filename="%s"' % fname
+
+        # Chunked transfer encoding requires HTTP/1.1 on our side too,
+        # otherwise the end of the data is signaled by closing the connection
+        chunked = self.protocol_version >= 'HTTP/1.1'
+        if chunked:
+            hdrs['Transfer-Encoding'] = 'chunked'
+        else:
+            self.close_connection = True
+
+        self.send_response(code, message=message, hdrs=hdrs)
+        self.end_headers()
+        for chunk in chunks:
+            if not chunk:
+                continue
+            if chunked:
+                self._write_body(six.b('%x\r\n' % len(chunk)))
+            self._write_body(chunk)
+            if chunked:
+                self._write_body(b'\r\n')
+        if chunked:
+            self._write_body(b'0\r\n\r\n')
 
     def send_status(self, message, status=NGAMS_SUCCESS, code=None, http_message=None, hdrs={}):
         """Creates and sends an NGAS status XML document back to the client"""
@@ -365,11 +676,10 @@ class ngamsHttpRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
     def proxy_request(self, host_id, host, port, timeout=300):
         """Proxy the current request to ``host``:``port``"""
 
-        # Calculate target URL
+        # Calculate target path
         path = self.path
         if not path.startswith('/'):
             path = '/' + path
-        url = 'http://%s:%d%s' % (host, port, path)
         logger.info("Proxying request for %s to %s:%d (corresponding to server %s)",
                     path, host, port, host_id)
 
@@ -388,19 +698,16 @@ class ngamsHttpRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         timeout = min(max(timeout, 0), 1200)
 
         # Cleanup any headers that we know we'll set again
-        # (including "Host", we are not a *realy* proxy)
+        # (including "Host", we are not a *realy* proxy), and hop-by-hop ones
         _STD_HDRS = ('host', 'content-type', 'content-length', 'content-disposition',
-                     'accept-encoding', 'transfer-encoding', 'authorization')
+                     'accept-encoding', 'transfer-encoding', 'authorization',
+                     'connection', 'keep-alive')
         hdrs = {k: v for k, v in self.headers.items() if k.lower() not in _STD_HDRS}
 
-        # Forward GET or POST request, get back code/msg/hdrs/data
+        # Forward GET or POST request, get back the response
         if self.command == 'GET':
-            resp = ngamsHttpUtils.httpGetUrl(url, hdrs=hdrs, timeout=timeout,
-                                             auth=authHttpHdrVal)
-            with contextlib.closing(resp):
-                code, data = resp.status, resp.read()
-            hdrs = {h[0]: h[1] for h in resp.getheaders()}
-
+            resp = ngamsHttpUtils.httpGet(host, port, path, hdrs=hdrs,
+                                          timeout=timeout, auth=authHttpHdrVal)
         else:
             # During HTTP post we need to pass down a EOF-aware,
             # read()-able object
@@ -410,37 +717,34 @@ class ngamsHttpRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
             if 'content-type' in self.headers:
                 mime_type = self.headers['content-type']
 
-            code, _, hdrs, data = ngamsHttpUtils.httpPostUrl(url, data, mime_type,
-                                                             hdrs=hdrs,
-                                                             timeout=timeout,
-                                                             auth=authHttpHdrVal)
-
-        # Our code calculates the content length already, let's not send it twice
-        # Similarly, let's avoid Content-Type rewriting
-        # Here "hdrs" is not a one of the nice email.message.Message objects
-        # which allows for case-insensitive lookup, but simply a dictionary,
-        # so we are forced to perform a case-sensitive lookup
-        logger.info("Received response from %s:%d, sending to client", host, port)
-        logger.info("Headers from response: %r", hdrs)
-        if 'content-length' in hdrs:
-            del hdrs['content-length']
-        if 'Content-Length' in hdrs:
-            del hdrs['Content-Length']
-        mime_type = ''
-        if 'content-type' in hdrs:
-            mime_type = hdrs['content-type']
-            del hdrs['content-type']
-        if 'Content-Type' in hdrs:
-            mime_type = hdrs['Content-Type']
-            del hdrs['Content-Type']
-
-        self.send_data(data, mime_type, code=code, hdrs=hdrs)
-
+            resp = ngamsHttpUtils.httpPostResponse(host, port, path, data, mime_type,
+                                                   hdrs=hdrs, timeout=timeout,
+                                                   auth=authHttpHdrVal)
+
+        # Stream the response back to the client in blocks, so memory usage
+        # doesn't depend on the size of the response. Headers like
+        # Content-Length and Content-Range are passed through as they are,
+        # except for those describing the upstream connection, or those
+        # we set ourselves
+        _RESP_HDRS = ('connection', 'keep-alive', 'transfer-encoding', 'server', 'date')
+        with contextlib.closing(resp):
+            hdrs = {k: v for k, v in resp.getheaders() if k.lower() not in _RESP_HDRS}
+            logger.info("Received response from %s:%d, sending to client", host, port)
+            logger.info("Headers from response: %r", hdrs)
+            self.send_response(resp.status, message=resp.reason, hdrs=hdrs)
+            self.end_headers()
+
+            block_size = srv.cfg.getBlockSize()
+            while True:
+                buf = resp.read(block_size)
+                if not buf:
+                    break
+                self._write_body(buf)
 
 
 class logging_config(object):
     def __init__(self, stdout_level, file_level, logfile, logfile_rot_interval,
-                 syslog, syslog_prefix, syslog_address):
+                 syslog, syslog_prefix, syslog_address, async_queue_size=None):
         self.stdout_level = stdout_level
         self.file_level = file_level
         self.logfile = logfile
@@ -448,6 +752,8 @@ class logging_config(object):
         self.syslog = syslog
         self.syslog_prefix = syslog_prefix
         self.syslog_address = syslog_address
+        # 0 means records are written synchronously
+        self.async_queue_size = async_queue_size
 
 
 def show_threads():
@@ -569,6 +875,8 @@ class ngamsServer(object):
         self._subscrScheduledStatus   = {}
         self._subscrCheckedStatus     = {}
         self._subscrQueueDic          = {}
+        self._subscrStreamsDic        = {}
+        self._subscrPersistentQueue   = None
         self._subscrDeliveryThreadDic = {}
         self._subscrDeliveryThreadDicRef = {}
         self._subscrDeliveryFileDic   = {}
@@ -622,6 +930,12 @@ class ngamsServer(object):
         # configuration
         self.request_db = None
 
+        # Cache of file locations, disabled until the configuration is loaded
+        self.file_location_cache = location_cache.location_cache(0, 0)
+
+        # Cache of file checksums, disabled until the configuration is loaded
+        self.checksum_cache = checksum_cache.checksum_cache(0)
+
         # Handling of a Cache Archive.
         self._cache_control_thread = utils.Task(ngamsCacheControlThread.NGAMS_CACHE_CONTROL_THR,
                                                 ngamsCacheControlThread.cacheControlThread)
@@ -630,6 +944,7 @@ class ngamsServer(object):
         self._cacheContDbms             = None
         self._cacheContDbmsCur          = None
         self._cacheContDbmsSem          = threading.Semaphore(1)
+        self._cacheIndex                = None
         self._cacheNewFilesDbm          = None
         self._cacheNewFilesDbmSem       = threading.Semaphore(1)
         self._cacheCtrlPiDbm            = None
@@ -660,6 +975,53 @@ class ngamsServer(object):
         # Created by ngamsSrvUtils.handleOnline
         self.remote_subscription_creation_task = None
 
+        # Metrics exposed via the METRICS command
+        self.metrics = metrics.default_registry
+        self._init_metrics()
+
+    def _init_metrics(self):
+        m = self.metrics
+        self.requests_total = m.counter('ngas_requests_total',
+            'Requests handled, by command and HTTP status code', ('command', 'code'))
+        self.request_duration = m.histogram('ngas_request_duration_seconds',
+            'Time spent handling requests, by command', ('command',))
+        self.request_bytes_received = m.counter('ngas_request_bytes_received_total',
+            'Bytes received in request bodies, by command', ('command',))
+        self.request_bytes_sent = m.counter('ngas_request_bytes_sent_total',
+            'Bytes sent in response bodies, by command', ('command',))
+        self.requests_rejected = m.counter('ngas_requests_rejected_total',
+            'Requests rejected because too many requests were being served')
+        m.gauge('ngas_requests_active', 'Requests being served',
+                function=lambda: self.serving_count)
+        m.gauge('ngas_requests_queued', 'Requests waiting for a free worker (asyncio backend only)',
+                function=lambda: getattr(self.__httpDaemon, 'queued_count', 0))
+        m.gauge('ngas_subscription_backlog_files', 'Files in the subscription back-log',
+                function=self.getSubcrBackLogCount)
+        m.gauge('ngas_subscription_queue_files', 'Files queued for delivery, by subscriber',
+                ('subscriber',), function=lambda: {(subscr_id,): q.qsize()
+                                                   for subscr_id, q in list(self._subscrQueueDic.items())})
+        self.subscr_delivered_files = m.counter('ngas_subscription_delivered_files_total',
+            'Files delivered, by subscriber', ('subscriber',))
+        self.subscr_delivered_bytes = m.counter('ngas_subscription_delivered_bytes_total',
+            'Bytes delivered, by subscriber', ('subscriber',))
+        self.subscr_delivery_errors = m.counter('ngas_subscription_delivery_errors_total',
+            'Files that failed to be delivered, by subscriber', ('subscriber',))
+        self.subscr_lag = m.gauge('ngas_subscription_lag_seconds',
+            'Time between the ingestion and the delivery of the last file delivered, by subscriber',
+            ('subscriber',))
+        m.gauge('ngas_subscription_streams', 'Files allowed to be delivered in parallel, by subscriber',
+                ('subscriber',), function=lambda: {(subscr_id,): s.limit
+                                                   for subscr_id, s in list(self._subscrStreamsDic.items())})
+        m.gauge('ngas_subscription_throughput_bytes_per_second', 'Recent delivery throughput, by subscriber',
+                ('subscriber',), function=lambda: {(subscr_id,): s.throughput
+                                                   for subscr_id, s in list(self._subscrStreamsDic.items())})
+        self.janitor_cycle_duration = m.histogram('ngas_janitor_cycle_duration_seconds',
+            'Time spent running all janitor plug-ins')
+        self.data_check_cycle_duration = m.histogram('ngas_data_check_cycle_duration_seconds',
+            'Time spent checking all disks by the data check thread',
+            buckets=(60, 300, 900, 1800, 3600, 3 * 3600, 6 * 3600, 12 * 3600,
+                     86400, 2 * 86400, 7 * 86400))
+
     def get_server_access_proto(self):
         if self._cert is not None:
             return 'https'
@@ -673,7 +1035,8 @@ class ngamsServer(object):
             self.addSubscriptionInfo([(evt.file_id, evt.file_version)], [])
             self.triggerSubscriptionThread()
 
-        self.archive_event_subscribers = [trigger_subscription]
+        self.archive_event_subscribers = [trigger_subscription,
+                                          self.file_location_cache.handle_archive_event]
         for (module, clazz), pars in self.cfg.archive_evt_plugins.items():
             pars = ngamsLib.parseRawPlugInPars(pars) if pars else {}
             plugin = loadPlugInEntryPoint(module, clazz)(**pars)
@@ -735,6 +1098,7 @@ class ngamsServer(object):
 
         # If we cannot setup a syslog handler we log this
         # (after setting up all the logging)
+        handlers = []
         syslog_setup_failed = False
         if logcfg.syslog:
             from logging.handlers import SysLogHandler
@@ -757,7 +1121,7 @@ class ngamsServer(object):
                     def filter(self, record):
                         return hasattr(record, 'to_syslog') and record.to_syslog
                 hnd.addFilter(to_syslog_filter())
-                logging.root.addHandler(hnd)
+                handlers.append(hnd)
             except socket.error:
                 syslog_setup_failed = True
 
@@ -769,12 +1133,26 @@ class ngamsServer(object):
             hnd = logutils.RenamedRotatingFileHandler(logcfg.logfile, logcfg.logfile_rot_interval, "LOG-ROTATE-%s.nglog.unsaved")
             hnd.setLevel(file_level)
             hnd.setFormatter(formatter)
-            logging.root.addHandler(hnd)
+            handlers.append(hnd)
 
         if log_to_stdout:
             hnd = logging.StreamHandler(sys.stdout)
             hnd.setFormatter(formatter)
             hnd.setLevel(stdout_level)
+            handlers.append(hnd)
+
+        # Records are either written by the thread logging them, or handed
+        # over to a dedicated writer thread. The latter covers also the
+        # records forwarded by the janitor process
+        if logcfg.async_queue_size > 0:
+            async_hnd = logutils.AsyncHandler(handlers, logcfg.async_queue_size)
+            handlers = [async_hnd]
+            self.metrics.counter('ngas_log_records_dropped_total',
+                'Log records dropped because the logging queue was full',
+                function=lambda: async_hnd.dropped)
+            self.metrics.gauge('ngas_log_queue_records', 'Log records waiting to be written',
+                function=async_hnd.queue.qsize)
+        for hnd in handlers:
             logging.root.addHandler(hnd)
 
         logging.root.setLevel(root_level)
@@ -1046,6 +1424,9 @@ class ngamsServer(object):
             elif name == 'janitor-run-count':
                 self._janitorThreadRunCount = item
 
+            elif name == 'janitor-cycle-time':
+                self.janitor_cycle_duration.observe(item)
+
             elif name == 'event-info-list':
                 info = None
                 if self._janitordbChangeSync.isSet():
@@ -1063,6 +1444,9 @@ class ngamsServer(object):
                 self.request_db.delete(item)
                 reply = None
 
+            elif name == 'expire-requests':
+                reply = self.request_db.expire(item)
+
             else:
                 raise ValueError("Unknown item in queue: name=%s, item=%r" % (name,item))
 
@@ -1621,6 +2005,8 @@ class ngamsServer(object):
         with self.serving_count_lock:
             self.serving_count += 1
             self.serving = True
+        req_start = time.time()
+        known_cmd = True
 
         # Create new request handle + add this entry in the Request DB.
         reqPropsObj = ngamsReqProps.ngamsReqProps()
@@ -1636,6 +2022,7 @@ class ngamsServer(object):
             if not httpRef.reply_sent:
                 httpRef.send_status("Successfully handled request")
         except NoSuchCommand as e:
+            known_cmd = False
             httpRef.send_status("Command not found", status=NGAMS_FAILURE, code=404)
         except InvalidParameter as e:
             httpRef.send_status("Invalid parameter: %s" % e.args[0], status=NGAMS_FAILURE, code=400)
@@ -1659,8 +2046,11 @@ class ngamsServer(object):
                 raise
 
             # Send a response if one hasn't been send yet. Use a shorter timeout
-            # if possible to avoid hanging out in here
-            if not httpRef.reply_sent:
+            # if possible to avoid hanging out in here. If a response has
+            # been (partially) sent already the connection cannot be reused
+            if httpRef.reply_sent:
+                httpRef.close_connection = True
+            else:
                 timeout = min((httpRef.connection.gettimeout(), 20))
                 httpRef.connection.settimeout(timeout)
                 httpRef.send_status(errMsg, status=NGAMS_FAILURE, code=400)
@@ -1670,6 +2060,15 @@ class ngamsServer(object):
             self.request_db.update(reqPropsObj)
             self.setLastReqEndTime()
 
+            # Unknown commands are grouped together to keep the number
+            # of different label values bounded
+            cmd = reqPropsObj.getCmd() if known_cmd else None
+            cmd = cmd or 'UNKNOWN'
+            self.requests_total.inc(command=cmd, code=httpRef.status_code or '')
+            self.request_duration.observe(time.time() - req_start, command=cmd)
+            self.request_bytes_received.inc(getattr(httpRef.rfile, 'readin', 0), command=cmd)
+            self.request_bytes_sent.inc(httpRef.bytes_sent, command=cmd)
+
             with self.serving_count_lock:
                 self.serving_count -= 1
                 if not self.serving_count:
@@ -1869,6 +2268,7 @@ class ngamsServer(object):
         self.db = ngamsDb.from_config(self.cfg)
         ngasTmpDir = ngamsHighLevelLib.getNgasTmpDir(self.cfg)
         self.db.setDbTmpDir(ngasTmpDir)
+        self.db.addDbChangeEvt(self.file_location_cache.db_change_listener)
 
     def close_db(self):
         """Close the connections to the database"""
@@ -1911,6 +2311,10 @@ class ngamsServer(object):
                 logger.info("Added %s to the system path", p)
 
         # Exactly what the name implies
+        self.file_location_cache = location_cache.location_cache(
+            self.cfg.getFileLocationCacheSize(), self.cfg.getFileLocationCacheTTL())
+        self.checksum_cache = checksum_cache.checksum_cache(
+            self.cfg.getChecksumCacheMaxAge())
         self.connect_to_db()
 
         # Do we need data check workers?
@@ -1935,6 +2339,11 @@ class ngamsServer(object):
                 ngamsDataCheckThread.checksum_allow_evt = srvObj.checksum_allow_evt
                 ngamsDataCheckThread.checksum_stop_evt = srvObj.checksum_stop_evt
 
+                # Workers only read data to check it, so they can yield
+                # their disk time to everyone else
+                if srvObj.getCfg().getDataCheckIdleIoPrio():
+                    utils.set_idle_io_priority()
+
                 def noop(*args):
                     pass
 
@@ -1978,6 +2387,10 @@ class ngamsServer(object):
             logcfg.logfile_rot_interval = isoTime2Secs(self.getCfg().getLogRotateInt())
             if not logcfg.logfile_rot_interval:
                 logcfg.logfile_rot_interval = 600
+        if logcfg.async_queue_size is None:
+            logcfg.async_queue_size = 0
+            if self.getCfg().getAsyncLogging():
+                logcfg.async_queue_size = self.getCfg().getAsyncLoggingQueueSize()
 
         try:
             self.setup_logging()
@@ -2091,6 +2504,11 @@ class ngamsServer(object):
             cache_dir = ngamsHighLevelLib.getNgasChacheDir(self.getCfg())
             dbm_fname = os.path.join(cache_dir, '%s_REQUEST_INFO_DB' % self.host_id)
             self.request_db = request_db.DBMRequestDB(dbm_fname)
+        elif request_db_backend == 'sqlite':
+            cache_dir = ngamsHighLevelLib.getNgasChacheDir(self.getCfg())
+            sqlite_fname = os.path.join(cache_dir, '%s_REQUEST_INFO.sqlite' % self.host_id)
+            self.request_db = request_db.SQLiteRequestDB(sqlite_fname,
+                                                         self.getCfg().getRequestDbSyncInterval())
         else:
             raise Exception("Unsupported backend: %s" % request_db_backend)
 
@@ -2173,8 +2591,17 @@ class ngamsServer(object):
         hostName = getHostName()
         logger.info("Setting up NG/AMS HTTP Server (Host: %s - IP: %s - Port: %d)",
                     hostName, self.ipAddress, self.portNo)
-        self.__httpDaemon = ngamsHttpServer(self, (self.ipAddress, self.portNo))
-        logger.info("NG/AMS HTTP Server ready")
+        server_address = (self.ipAddress, self.portNo)
+        backend = self.cfg.getHttpServerBackend()
+        if backend == 'asyncio' and self._cert is not None:
+            logger.warning("TLS is not supported by the asyncio HTTP server backend, using threads instead")
+            backend = 'threads'
+        if backend == 'asyncio':
+            from .async_http_server import AsyncHttpServer
+            self.__httpDaemon = AsyncHttpServer(self, server_address, ngamsHttpRequestHandler)
+        else:
+            self.__httpDaemon = ngamsHttpServer(self, server_address)
+        logger.info("NG/AMS HTTP Server ready (backend: %s)", backend)
 
         self.__httpDaemon.serve_forever()
 
@@ -2221,6 +2648,9 @@ class ngamsServer(object):
         if self.workers_pool:
             self.workers_pool.close()
             self.workers_pool.join()
+        self.checksum_cache.close()
+        if self.request_db:
+            self.request_db.close()
         show_threads()
 
         # Close all connections to the database, please
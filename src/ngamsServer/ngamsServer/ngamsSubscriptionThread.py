@@ -34,7 +34,9 @@ This module contains the code for the (Data) Subscription Thread, which is
 used to handle the delivery of data to Subscribers.
 """
 
+import collections
 import logging
+import multiprocessing.pool
 import threading
 import time
 import os
@@ -47,9 +49,9 @@ from . import ngamsCacheControlThread
 from ngamsLib.ngamsCore import NGAMS_SUBSCRIPTION_THR, isoTime2Secs,\
     NGAMS_SUBSCR_BACK_LOG, NGAMS_DELIVERY_THR,\
     NGAMS_HTTP_INT_AUTH_USER, NGAMS_REARCHIVE_CMD, NGAMS_FAILURE,\
-    NGAMS_HTTP_SUCCESS, NGAMS_SUCCESS, getFileSize, rmFile, loadPlugInEntryPoint,\
+    NGAMS_HTTP_SUCCESS, NGAMS_SUCCESS, getFileSize, loadPlugInEntryPoint,\
     toiso8601, NGAMS_HTTP_HDR_CHECKSUM, NGAMS_HTTP_HDR_FILE_INFO, fromiso8601
-from ngamsLib import ngamsDbm, ngamsStatus, ngamsHighLevelLib, ngamsFileInfo, ngamsDbCore,\
+from ngamsLib import ngamsStatus, ngamsFileInfo, ngamsDbCore,\
     ngamsHttpUtils
 
 
@@ -85,6 +87,10 @@ def startSubscriptionThread(srvObj):
     Returns:    Void.
     """
     logger.debug("Starting Subscription Thread ...")
+    cfg = srvObj.getCfg()
+    srvObj._subscrPersistentQueue = PersistentSubscrQueue(srvObj.getDb(),
+                                                          cfg.getSubscrQueueBatchSize(),
+                                                          cfg.getSubscrQueueFlushInterval())
     srvObj._subscriptionRunSync.set()
     args = (srvObj, None)
     srvObj._subscriptionThread = threading.Thread(None, subscriptionThread,
@@ -114,6 +120,8 @@ def stopSubscriptionThread(srvObj):
     srvObj._subscriptionStopSyncConf.wait(10)
     srvObj._subscriptionStopSync.clear()
     srvObj._subscriptionThread = None
+    if srvObj._subscrPersistentQueue:
+        srvObj._subscrPersistentQueue.close()
     #_backupQueueToBacklog(srvObj) # this is too time-consuming. No need any more, since the thread will trigger all subscribers when it is just started
     logger.info("Subscription Thread stopped")
 
@@ -288,35 +296,25 @@ def _addFileDeliveryDic(subscrId,
         finally:
             fileDeliveryCountDic_Sem.release()
 
-def _checkIfDeliverFile(srvObj,
-                        subscrObj,
-                        fileInfo,
-                        deliverReqDic,
-                        deliveredStatus,
-                        scheduledStatus,
-                        fileDeliveryCountDic,
-                        fileDeliveryCountDic_Sem,
-                        explicitFileDelivery = False):
+def _isDeliveryCandidate(subscrObj,
+                         fileInfo,
+                         deliveredStatus,
+                         scheduledStatus,
+                         explicitFileDelivery = False):
     """
-    Analyze if a file should be delivered to a Subscriber.
-
-    srvObj:           Reference to server object (ngamsServer).
+    Analyze if, according to its ingestion date, a file should be delivered
+    to a Subscriber.
 
     subscrObj:        Subscriber object (ngamsSubscriber).
 
-    fileInfo:         List with file infomation as returned by
-                      ngams.getFileSummary2() (sub-list) (list).
-
-    deliverReqDic:    Dictionary with Subscriber IDs as keys referring
-                      to lists with the information about the files to
-                      deliver to each of the Subscribers (dictionary/list).
+    fileInfo:         List with file infomation on the internal format (list).
 
     deliveredStatus:  Dictionary that contains the Subscriber IDs as keys
                       and where the corresponding value is the time
                       for the last file delivery
                       (dictionary/string (ISO 8601)).
 
-    Returns:          Void.
+    Returns:          True if the file should be delivered (boolean).
     """
     lastDelivery        = deliveredStatus[subscrObj.getId()]
     if (subscrObj.getId() in scheduledStatus):
@@ -326,12 +324,8 @@ def _checkIfDeliverFile(srvObj,
     if lastSchedule is not None:
         lastSchedule = fromiso8601(lastSchedule, local=True)
 
-    fileInfo            = _convertFileInfo(fileInfo)
     fileId              = fileInfo[FILE_ID]
-    filename            = fileInfo[FILE_NM]
-    fileVersion         = fileInfo[FILE_VER]
     fileIngDate         = fromiso8601(fileInfo[FILE_DATE], local=True)
-    fileBackLogBuffered = fileInfo[FILE_BL]
     subs_start = subscrObj.getStartDate()
 
     if lastDelivery is not None and lastSchedule is not None and lastSchedule > lastDelivery:
@@ -346,16 +340,83 @@ def _checkIfDeliverFile(srvObj,
     elif fileIngDate >= subs_start:
         deliverFile = explicitFileDelivery or lastDelivery is None or fileIngDate >= lastDelivery
 
-    # Register the file if we should deliver this file to the Subscriber.
-    if deliverFile:
-        filterMatched = _checkIfFilterPluginSayYes(srvObj, subscrObj, filename, fileId, fileVersion, fpiMode = FPI_MODE_METADATA_ONLY)
-        if (filterMatched):
-            _addFileDeliveryDic(subscrObj.getId(), fileInfo,
-                                                deliverReqDic, fileDeliveryCountDic, fileDeliveryCountDic_Sem, srvObj)
-        #debug_chen
-        logger.debug('File %s is accepted to delivery list', fileId)
-    else:
+    if not deliverFile:
         logger.debug('File %s is out, ingDate = %s, lastDelivery = %s', fileId, toiso8601(fileIngDate), toiso8601(lastDelivery))
+    return deliverFile
+
+
+def _selectFilesToDeliver(srvObj,
+                          checks,
+                          deliverReqDic,
+                          deliveredStatus,
+                          scheduledStatus,
+                          fileDeliveryCountDic,
+                          fileDeliveryCountDic_Sem,
+                          filterWorkers = 1):
+    """
+    Analyze which files should be delivered to which Subscribers, and
+    register them in the delivery dictionary.
+
+    Files are first selected according to their ingestion date, and then
+    according to the Filter Plug-In of each Subscriber (if any). Each Filter
+    Plug-In is invoked only once for each combination of parameters and file,
+    using ``filterWorkers`` threads.
+
+    srvObj:           Reference to server object (ngamsServer).
+
+    checks:           List of (subscriber object, file info,
+                      explicit file delivery) tuples to analyze (list).
+
+    deliverReqDic:    Dictionary with Subscriber IDs as keys referring
+                      to lists with the information about the files to
+                      deliver to each of the Subscribers (dictionary/list).
+
+    deliveredStatus:  See _isDeliveryCandidate().
+
+    Returns:          Void.
+    """
+    candidates = []
+    for subscrObj, fileInfo, explicitFileDelivery in checks:
+        fileInfo = _convertFileInfo(fileInfo)
+        if _isDeliveryCandidate(subscrObj, fileInfo, deliveredStatus, scheduledStatus, explicitFileDelivery):
+            candidates.append((subscrObj, fileInfo))
+
+    # key: (plug-in, parameters, file ID, file version), value: (subscriber, file info)
+    filterChecks = collections.OrderedDict()
+    for subscrObj, fileInfo in candidates:
+        filterChecks.setdefault(_filterKey(subscrObj, fileInfo), (subscrObj, fileInfo))
+
+    def filterSaysYes(check):
+        subscrObj, fileInfo = check
+        return _checkIfFilterPluginSayYes(srvObj, subscrObj, fileInfo[FILE_NM], fileInfo[FILE_ID],
+                                          fileInfo[FILE_VER], fpiMode = FPI_MODE_METADATA_ONLY)
+
+    if filterWorkers > 1 and len(filterChecks) > 1:
+        pool = multiprocessing.pool.ThreadPool(min(filterWorkers, len(filterChecks)))
+        try:
+            results = pool.map(filterSaysYes, list(filterChecks.values()))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [filterSaysYes(check) for check in filterChecks.values()]
+    results = dict(zip(filterChecks.keys(), results))
+
+    # Register the files we should deliver to each Subscriber.
+    for subscrObj, fileInfo in candidates:
+        if results[_filterKey(subscrObj, fileInfo)]:
+            _addFileDeliveryDic(subscrObj.getId(), fileInfo,
+                                deliverReqDic, fileDeliveryCountDic, fileDeliveryCountDic_Sem, srvObj)
+            logger.debug('File %s is accepted to delivery list', fileInfo[FILE_ID])
+
+
+def _filterKey(subscrObj, fileInfo):
+    """
+    Generate the key identifying the evaluation of the Filter Plug-In of a
+    Subscriber on a file (tuple).
+    """
+    return (subscrObj.getFilterPi(), subscrObj.getFilterPiPars(),
+            fileInfo[FILE_ID], fileInfo[FILE_VER])
 
 
 def _convertFileInfo(fileInfo):
@@ -574,6 +635,95 @@ def _checkIfFilterPluginSayYes(srvObj, subscrObj, filename, fileId, fileVersion,
     return deliverFile
 
 
+class DeliveryStreams(object):
+    """
+    Limits how many Data Delivery Threads of a subscriber send files at the
+    same time (i.e., how many parallel streams are used), up to
+    ``max_streams``, which is the number of delivery threads.
+
+    When ``adaptive`` the limit starts at 1, and is adjusted at the end of
+    each period of ``interval`` seconds in which all allowed streams were
+    used: it grows by one while the aggregated throughput rises, and shrinks
+    by one when it drops (e.g., because latency went up). Errors halve the
+    limit straight away. Otherwise the limit is always ``max_streams``.
+    """
+
+    def __init__(self, max_streams, adaptive=False, interval=5.):
+        self.max_streams = max(1, max_streams)
+        self.adaptive = adaptive
+        self.interval = interval
+        self.limit = 1 if adaptive else self.max_streams
+        self.active = 0
+        self.throughput = 0.
+        self._last_throughput = None
+        self._cond = threading.Condition()
+        self._reset_window()
+
+    def _reset_window(self):
+        self._window_start = time.time()
+        self._window_bytes = 0
+        self._saturated = False
+
+    def set_max_streams(self, max_streams):
+        with self._cond:
+            self.max_streams = max(1, max_streams)
+            self.limit = min(self.limit, self.max_streams) if self.adaptive else self.max_streams
+            self._cond.notify_all()
+
+    def acquire(self, timeout=None):
+        """Waits for a free stream for up to ``timeout`` seconds, returns whether one was obtained"""
+        end = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while self.active >= self.limit:
+                remaining = None if end is None else end - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            self.active += 1
+            if self.active == self.limit:
+                self._saturated = True
+            return True
+
+    def release(self, nbytes, success):
+        """Gives a stream back after sending ``nbytes`` successfully or not"""
+        with self._cond:
+            self.active -= 1
+            if not success:
+                if self.adaptive and self.limit > 1:
+                    self.limit = max(1, self.limit // 2)
+                    logger.info('Delivery error, reducing parallel streams to %d', self.limit)
+                self._last_throughput = None
+                self._reset_window()
+            else:
+                self._window_bytes += nbytes
+                elapsed = time.time() - self._window_start
+                if elapsed >= self.interval:
+                    self._end_window(elapsed)
+            self._cond.notify_all()
+
+    def _end_window(self, elapsed):
+        self.throughput = self._window_bytes / elapsed
+        if self.adaptive and self._saturated:
+            last = self._last_throughput
+            if (last is None or self.throughput > last * 1.05) and self.limit < self.max_streams:
+                self.limit += 1
+            elif last is not None and self.throughput < last * 0.9 and self.limit > 1:
+                self.limit -= 1
+            self._last_throughput = self.throughput
+            logger.debug('Delivery throughput: %.0f Bytes/s, using up to %d parallel streams',
+                         self.throughput, self.limit)
+        self._reset_window()
+
+def _getDeliveryStreams(srvObj, subscrObj):
+    """Returns the DeliveryStreams of a Subscriber, creating it if necessary"""
+    subscrId = subscrObj.getId()
+    streams = srvObj._subscrStreamsDic.get(subscrId)
+    if streams is None:
+        streams = DeliveryStreams(int(subscrObj.getConcurrentThreads()),
+                                  srvObj.getCfg().getSubscrAdaptiveStreams())
+        streams = srvObj._subscrStreamsDic.setdefault(subscrId, streams)
+    return streams
+
 def _deliveryThread(srvObj,
                     subscrObj,
                     quChunks,
@@ -606,6 +756,7 @@ def _deliveryThread(srvObj,
     """
 
     subscrbId = subscrObj.getId();
+    streams = _getDeliveryStreams(srvObj, subscrObj)
     tname = threading.current_thread().name
     tident = threading.current_thread().ident
     remindMainThread = True # whether to notify the subscriptionThread when the queue is empty in order to bypass static suspension time
@@ -754,13 +905,20 @@ def _deliveryThread(srvObj,
                         )
                         if sub_auth is not None:
                             authHdr = sub_auth
-                        with open(filename, "rb") as f:
-                            reply, msg, hdrs, data = \
-                                   ngamsHttpUtils.httpPostUrl(sendUrl, f, fileMimeType,
-                                                        contDisp=contDisp,
-                                                        auth=authHdr,
-                                                        hdrs=hdrs,
-                                                        timeout=120)
+                        while not streams.acquire(timeout=1):
+                            _checkStopDataDeliveryThread(srvObj, subscrbId)
+                        sent = None
+                        try:
+                            with open(filename, "rb") as f:
+                                reply, msg, hdrs, data = \
+                                       ngamsHttpUtils.httpPostUrl(sendUrl, f, fileMimeType,
+                                                            contDisp=contDisp,
+                                                            auth=authHdr,
+                                                            hdrs=hdrs,
+                                                            timeout=120)
+                                sent = os.fstat(f.fileno()).st_size
+                        finally:
+                            streams.release(sent or 0, sent is not None and reply == NGAMS_HTTP_SUCCESS)
                         stat.clear()
                         if data:
                             stat.unpackXmlDoc(data)
@@ -777,6 +935,7 @@ def _deliveryThread(srvObj,
 
                     if udx < urlListLen - 1: #try the next url
                         continue
+                    srvObj.subscr_delivery_errors.inc(subscriber=subscrbId)
                     # If an error occurred during data delivery, we should not update
                     # the Subscription Status table for this Subscriber, but should
                     # instead make an entry in the Subscription Back-Log Table
@@ -853,6 +1012,9 @@ def _deliveryThread(srvObj,
                         fileSize = getFileSize(filename)
                         transfer_rate = '%.0f Bytes/s' % (fileSize / howlong)
                         updateSubscrQueueStatus(srvObj, subscrbId, fileId, fileVersion, diskId, 0, transfer_rate)
+                        srvObj.subscr_delivered_files.inc(subscriber=subscrbId)
+                        srvObj.subscr_delivered_bytes.inc(fileSize, subscriber=subscrbId)
+                        srvObj.subscr_lag.set(time.time() - fileIngDate, subscriber=subscrbId)
                         logger.info("File: %s/%s delivered to Subscriber: %s by Delivery Thread [%s]",
                                      baseName, str(fileVersion), subscrObj.getId(), str(tident))
 
@@ -930,6 +1092,178 @@ def _fileKey(fileId,
     """
     return "%s___%s" % (str(fileId), str(fileVersion))
 
+class PersistentSubscrQueue(object):
+    """
+    Front-end to the persistent subscription queue (the ngas_subscr_queue
+    table) used by the Subscription and Data Delivery Threads.
+
+    New files are inserted in batches of ``batch_size`` entries, each batch in
+    a single transaction. Status updates are kept in memory and written
+    together in a single transaction when ``batch_size`` of them are pending,
+    or at the latest every ``flush_interval`` seconds. The status of each
+    entry is also mirrored in memory (up to ``mirror_size`` entries), so
+    checking whether a file has been or is being delivered usually doesn't
+    need to query the database.
+
+    Updates that are not yet written are lost if the server crashes, in which
+    case the affected files are (re)delivered after the restart, as with
+    any other file that was being delivered at the time.
+    """
+
+    def __init__(self, db, batch_size=100, flush_interval=0.5, mirror_size=100000):
+        self.db = db
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.mirror_size = mirror_size
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        # key: (subscrId, fileId, fileVersion, diskId), value: (status, comment)
+        self._status = collections.OrderedDict()
+        # key: as above, value: (status, status_date, comment)
+        self._pending = collections.OrderedDict()
+        self._flushing = {}
+        self._closed = False
+        self._stop_evt = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_periodically, name='SubscrQueueFlusher')
+        self._flusher.daemon = True
+        self._flusher.start()
+
+    def _flush_periodically(self):
+        while not self._stop_evt.wait(self.flush_interval):
+            self.flush()
+
+    def _remember(self, key, status, comment):
+        # Must be called with self._lock held
+        self._status.pop(key, None)
+        self._status[key] = (status, comment)
+        while len(self._status) > self.mirror_size:
+            oldest = next(iter(self._status))
+            if oldest in self._pending or oldest in self._flushing:
+                break
+            del self._status[oldest]
+
+    def add(self, subscrId, fileInfos):
+        """
+        Adds the given files (see _convertFileInfo) to the queue of
+        ``subscrId`` with status -2 (scheduled). Returns a list with whether
+        each file was added or not (e.g., because it was already queued).
+        """
+        added = []
+        for i in range(0, len(fileInfos), self.batch_size):
+            chunk = fileInfos[i:i + self.batch_size]
+            keys = [(subscrId, fi[FILE_ID], fi[FILE_VER], fi[FILE_DISK_ID]) for fi in chunk]
+            with self._lock:
+                known = [key in self._status for key in keys]
+            ts = time.time()
+            entries = [(subscrId, fi[FILE_ID], fi[FILE_VER], fi[FILE_DISK_ID], fi[FILE_NM],
+                        fi[FILE_DATE], fi[FILE_MIME], -2, ts, None)
+                       for fi, k in zip(chunk, known) if not k]
+            try:
+                self.db.addSubscrQueueEntries(entries)
+                inserted = [True] * len(entries)
+            except Exception:
+                # Some files were probably queued already, try one by one
+                inserted = []
+                for entry in entries:
+                    try:
+                        self.db.addSubscrQueueEntry(*entry)
+                        inserted.append(True)
+                    except Exception as e:
+                        logger.debug('Failed to add file %s to the persistent subscription queue: %s', entry[1], str(e))
+                        inserted.append(False)
+            inserted = iter(inserted)
+            chunk_added = [False if k else next(inserted) for k in known]
+            with self._lock:
+                for key, was_added in zip(keys, chunk_added):
+                    if was_added:
+                        self._remember(key, -2, None)
+            added += chunk_added
+        return added
+
+    def get(self, subscrId, fileId, fileVersion, diskId):
+        """Returns the (status, comment) of a file, or None if not queued"""
+        key = (subscrId, fileId, fileVersion, diskId)
+        with self._lock:
+            if key in self._status:
+                return self._status[key]
+        res = self.db.getSubscrQueueStatus(subscrId, fileId, fileVersion, diskId)
+        if res is not None:
+            with self._lock:
+                if key not in self._status:
+                    self._remember(key, res[0], res[1])
+        return res
+
+    def update(self, subscrId, fileId, fileVersion, diskId, status, comment=None):
+        """
+        Updates the status of a file. As with
+        ngamsDbNgasSubscribers.updateSubscrQueueEntry the comment is only
+        updated if given; failures (``status`` > 0) reported with the same
+        comment than the previous one increase the failure count instead.
+        """
+        ts = time.time()
+        if (comment and len(comment) > 255):
+            comment = comment[0:255]
+        key = (subscrId, fileId, fileVersion, diskId)
+        if (status > 0 and comment):
+            current = self.get(*key)
+            if not current:
+                return
+            if (current[1] == comment and current[0] > 0): # the same error / failure msg
+                status, comment = current[0] + 1, None
+        with self._lock:
+            previous = self._pending.pop(key, None)
+            if not comment:
+                prev_comment = previous[2] if previous else None
+                mirrored = self._status.get(key)
+                self._pending[key] = (status, ts, prev_comment)
+                self._remember(key, status, mirrored[1] if mirrored else None)
+            else:
+                self._pending[key] = (status, ts, comment)
+                self._remember(key, status, comment)
+            flush = self._closed or len(self._pending) >= self.batch_size
+        if flush:
+            self.flush()
+
+    def flush(self):
+        """Writes all pending status updates in a single transaction"""
+        with self._flush_lock:
+            with self._lock:
+                self._flushing, self._pending = self._pending, collections.OrderedDict()
+            if not self._flushing:
+                return
+            try:
+                self.db.updateSubscrQueueEntries([key + value for key, value in self._flushing.items()])
+            except Exception:
+                logger.exception("Fail to update persistent queue, will retry")
+                with self._lock:
+                    for key, value in self._flushing.items():
+                        if key not in self._pending:
+                            self._pending[key] = value
+            finally:
+                with self._lock:
+                    self._flushing = {}
+
+    def forget(self, subscrId):
+        """
+        Writes all pending updates, and drops the in-memory status of the
+        files of ``subscrId``, which is then read again from the database
+        """
+        self.flush()
+        with self._lock:
+            for key in [k for k in self._status if k[0] == subscrId]:
+                del self._status[key]
+
+    def close(self):
+        """
+        Stops writing updates periodically and writes all pending ones. Any
+        further update is written immediately.
+        """
+        with self._lock:
+            self._closed = True
+        self._stop_evt.set()
+        self._flusher.join()
+        self.flush()
+
 def buildSubscrQueue(srvObj, subscrId, dataMoverOnly = False):
     """
     initialise the subscription queue and
@@ -946,6 +1280,8 @@ def buildSubscrQueue(srvObj, subscrId, dataMoverOnly = False):
         quChunks = Queue()
 
     try:
+        # pending updates need to be written before we go to the database
+        srvObj._subscrPersistentQueue.forget(subscrId)
         # change status to "scheduled" for files "being transferred" before system restart
         srvObj.getDb().updateSubscrQueueEntryStatus(subscrId, -1, -2)
         #grab those files that have been scheduled from the persistent queue
@@ -963,21 +1299,8 @@ def buildSubscrQueue(srvObj, subscrId, dataMoverOnly = False):
 
 
 def updateSubscrQueueStatus(srvObj, subscrId, fileId, fileVersion, diskId, status, comment = None):
-    ts = time.time()
-    if (comment and len(comment) > 255):
-        comment = comment[0:255]
     try:
-        if (status > 0 and comment):
-            ffif = getSubscrQueueStatus(srvObj, subscrId, fileId, fileVersion, diskId)
-            if (ffif):
-                sta = ffif[0]
-                cmt = ffif[1]
-                if (cmt == comment and sta > 0): # the same error / failure msg
-                    srvObj.getDb().updateSubscrQueueEntry(subscrId, fileId, fileVersion, diskId, sta + 1, ts) #increase # of failures by one
-                else:
-                    srvObj.getDb().updateSubscrQueueEntry(subscrId, fileId, fileVersion, diskId, status, ts, comment)
-        else:
-            srvObj.getDb().updateSubscrQueueEntry(subscrId, fileId, fileVersion, diskId, status, ts, comment)
+        srvObj._subscrPersistentQueue.update(subscrId, fileId, fileVersion, diskId, status, comment)
     except Exception as eee:
         logger.error("Fail to update persistent queue: %s", str(eee))
 
@@ -986,7 +1309,7 @@ def getSubscrQueueStatus(srvObj, subscrId, fileId, fileVersion, diskId):
     Return both status and comment
     """
     try:
-        return srvObj.getDb().getSubscrQueueStatus(subscrId, fileId, fileVersion, diskId)
+        return srvObj._subscrPersistentQueue.get(subscrId, fileId, fileVersion, diskId)
     except Exception as ex:
         logger.error("Fail to query persistent queue: %s", str(ex))
         return None
@@ -998,20 +1321,28 @@ def addToSubscrQueue(srvObj, subscrId, fileInfo, quChunks):
 
     fileInfo    file information (List) that has already been converted (see _convertFileInfo(fileInfo))
     """
-    fileInfo = _convertFileInfo(fileInfo)
-    fileId         = fileInfo[FILE_ID]
-    filename       = fileInfo[FILE_NM]
-    fileVersion    = fileInfo[FILE_VER]
-    fileIngDate    = fileInfo[FILE_DATE]
-    fileMimeType   = fileInfo[FILE_MIME]
-    diskId = fileInfo[FILE_DISK_ID]
+    addFilesToSubscrQueue(srvObj, subscrId, [fileInfo], quChunks)
+
+def addFilesToSubscrQueue(srvObj, subscrId, fileInfos, quChunks):
+    """
+    Insert a list of files into the persistent subscription queue in batches,
+    and add those that were successfully inserted to the cache subscription
+    queue
+
+    fileInfos   list of file information (see addToSubscrQueue)
+    """
+    fileInfos = [_convertFileInfo(fileInfo) for fileInfo in fileInfos]
     try:
-        ts = time.time()
-        srvObj.getDb().addSubscrQueueEntry(subscrId, fileId, fileVersion, diskId, filename, fileIngDate, fileMimeType, -2, ts)
-        quChunks.put(fileInfo)
+        added = srvObj._subscrPersistentQueue.add(subscrId, fileInfos)
     except Exception as ee:
+        logger.error('Subscriber %s failed to add files to the persistent subscription queue due to %s', subscrId, str(ee))
+        added = [False] * len(fileInfos)
+    for fileInfo, was_added in zip(fileInfos, added):
+        if (was_added):
+            quChunks.put(fileInfo)
+            continue
         # most likely error - key duplication, that will prevent cache queue from adding this entry, which is correct
-        logger.error('Subscriber %s failed to add to the persistent subscription queue file %s due to %s', subscrId, filename, str(ee))
+        logger.error('Subscriber %s failed to add to the persistent subscription queue file %s', subscrId, fileInfo[FILE_NM])
         if (fileInfo[FILE_BL] == NGAMS_SUBSCR_BACK_LOG):
             quChunks.put(fileInfo)
 
@@ -1054,10 +1385,8 @@ def subscriptionThread(srvObj,
             if (len(dm_hosts) < 1):
                 raise Exception("Invalid data mover hosts configuration!")
 
-    fileDicDbm = None
-    fileDicDbmName = ngamsHighLevelLib.genTmpFilename(srvObj.getCfg(),
-                                                      NGAMS_SUBSCRIPTION_THR +\
-                                                      "_FILE_DIC")
+    filterWorkers = srvObj.getCfg().getSubscrFilterWorkers()
+
     # Similar to Deliver Status Dictionary, the Schedule Status Dictionary
     # indicates for each Subscriber when the last file was scheduled (but
     # possibly not delivered yet)
@@ -1112,20 +1441,49 @@ def subscriptionThread(srvObj,
             # Subscriber.
             deliverReqDic = {}
 
-            # Generate dictionary to keep information about each file, which
-            # might be a candidate for being delivered to Subscribers.
-            # The format is:
+            # The Deliver Status Dictionary indicates for each Subscriber
+            # when the last file was delivered. We first initialize the
+            # Deliver Status Dictionary with None to indicate later if that
+            # this Subscriber (apparently) didn't have any files delivered.
+            deliveredStatus = {}
+            for subscrId in srvObj.getSubscriberDic().keys():
+                deliveredStatus[subscrId] = None
+                if (subscrId not in scheduledStatus):
+                    scheduledStatus[subscrId] = None
+            subscrIds = srvObj.getSubscriberDic().keys()
+            subscrStatus = srvObj.getDb().\
+                           getSubscriberStatus(subscrIds, srvObj.getHostId(),
+                                               srvObj.getCfg().getPortNo())
+            for subscrStat in subscrStatus:
+                subscrId      = subscrStat[0]
+                subscrLastDel = subscrStat[1]
+                deliveredStatus[subscrId] = subscrLastDel
+
+            # Deliver file to a Subscriber if:
             #
-            # {<File Key>: [[<File Info>, ...], ...], ...}
+            # 1. (File-Ingestion-Date >= Subscription-Date) and
+            #    (Last-File-Ingestion-Date = None)
+            # 2. (File-Ingestion-Date >= Subscription-Date) and
+            #    (File-Ingestion-Date >= Last-File-Ingestion-Date)
+            # 3. If the Filter Plug-In indicates a match (if a Filter Plug-In
+            #    is specified).
+            def selectFilesToDeliver(checks):
+                _selectFilesToDeliver(srvObj, checks, deliverReqDic, deliveredStatus, scheduledStatus,
+                                      fileDeliveryCountDic, fileDeliveryCountDic_Sem, filterWorkers)
+
+            # Files which might be candidates for being delivered to
+            # Subscribers, in the order they were retrieved from the DB.
+            # The format is:
             #
-            # The key in this Dictionary is the File ID (pointing to lists
-            # with the file information, one for each version.
+            # {<File Key>: <File Info>, ...}
             #
             # If no specific Subscribers are specified, we only query
             # information about the files specified, otherwise, we have to
             # query information about all files available on this host.
-            rmFile(fileDicDbmName + "*")
-            fileDicDbm = ngamsDbm.ngamsDbm(fileDicDbmName, writePerm=1)
+            # In the latter case files are checked as they are retrieved,
+            # instead of keeping them all in memory.
+            candidates = collections.OrderedDict()
+            candidatesChecked = False
 
             if (dataMoverOnly and srvObj.getSubcrBackLogCount() <= 1000): # do not bring in too many new files if back-logged files are piling up
                 for subscrId in srvObj.getSubscriberDic().keys():
@@ -1149,7 +1507,7 @@ def subscriptionThread(srvObj,
                     lastIngDate = None
                     for fileInfo in files:
                         fileInfo = _convertFileInfo(fileInfo)
-                        fileDicDbm.add(_fileKey(fileInfo[FILE_ID], fileInfo[FILE_VER]), fileInfo)
+                        candidates[_fileKey(fileInfo[FILE_ID], fileInfo[FILE_VER])] = fileInfo
                         if (fileInfo[FILE_DATE] > lastIngDate): #just in case the cursor result is not sorted!
                             lastIngDate = fileInfo[FILE_DATE]
                         count += 1
@@ -1176,17 +1534,33 @@ def subscriptionThread(srvObj,
                     if min_date is None or min_date > myMinDate:
                         min_date = myMinDate
 
+                # Check the files for each of the Subscribers referenced
+                # explicitly (new Subscribers) as they are retrieved, keeping
+                # only those referenced explicitly for the check below.
+                if (not dataMoverOnly):
+                    checkSubscrObjs = subscrObjs
+                else:
+                    checkSubscrObjs = list(srvObj.getSubscriberDic().values())
+                fileRefKeys = set(_fileKey(fileRef[0], fileRef[1]) for fileRef in fileRefs)
+
                 files = srvObj.getDb().getFileSummary2(srvObj.getHostId(), ing_date = min_date, fetch_size=100)
                 if min_date is not None:
                     logger.debug('Fetching files ingested after %s', toiso8601(min_date))
                 else:
                     logger.debug('Fetching all ingested files')
+                checks = []
                 for fileInfo in files:
                     fileInfo = _convertFileInfo(fileInfo)
-                    fileDicDbm.add(_fileKey(fileInfo[FILE_ID],
-                                            fileInfo[FILE_VER]),
-                                   fileInfo)
+                    fileKey = _fileKey(fileInfo[FILE_ID], fileInfo[FILE_VER])
+                    if fileKey in fileRefKeys:
+                        candidates[fileKey] = fileInfo
+                    checks += [(subscrObj, fileInfo, False) for subscrObj in checkSubscrObjs]
+                    if len(checks) >= 1000:
+                        selectFilesToDeliver(checks)
+                        checks = []
                     _checkStopSubscriptionThread(srvObj)
+                selectFilesToDeliver(checks)
+                candidatesChecked = True
             elif (fileRefs != []): # this is still possible even for data mover (due to recovered subscriptionList during server start)
                 # fileRefDic: Dictionary indicating which versions for each
                 # file that are of interest.
@@ -1211,41 +1585,14 @@ def subscriptionThread(srvObj,
                     # explicitly specified.
                     fileInfo = _convertFileInfo(fileInfo)
                     if fileInfo[FILE_VER] in fileRefDic[fileInfo[FILE_ID]]:
-                        fileDicDbm.add(_fileKey(fileInfo[FILE_ID],
-                                                fileInfo[FILE_VER]),
-                                       fileInfo)
+                        candidates[_fileKey(fileInfo[FILE_ID],
+                                            fileInfo[FILE_VER])] = fileInfo
                     _checkStopSubscriptionThread(srvObj)
 
-            # The Deliver Status Dictionary indicates for each Subscriber
-            # when the last file was delivered. We first initialize the
-            # Deliver Status Dictionary with None to indicate later if that
-            # this Subscriber (apparently) didn't have any files delivered.
-            deliveredStatus = {}
-            for subscrId in srvObj.getSubscriberDic().keys():
-                deliveredStatus[subscrId] = None
-                if (subscrId not in scheduledStatus):
-                    scheduledStatus[subscrId] = None
-            subscrIds = srvObj.getSubscriberDic().keys()
-            subscrStatus = srvObj.getDb().\
-                           getSubscriberStatus(subscrIds, srvObj.getHostId(),
-                                               srvObj.getCfg().getPortNo())
-            for subscrStat in subscrStatus:
-                subscrId      = subscrStat[0]
-                subscrLastDel = subscrStat[1]
-                deliveredStatus[subscrId] = subscrLastDel
-
-            # Deliver file to a Subscriber if:
-            #
-            # 1. (File-Ingestion-Date >= Subscription-Date) and
-            #    (Last-File-Ingestion-Date = None)
-            # 2. (File-Ingestion-Date >= Subscription-Date) and
-            #    (File-Ingestion-Date >= Last-File-Ingestion-Date)
-            # 3. If the Filter Plug-In indicates a match (if a Filter Plug-In
-            #    is specified).
-
-            # First check for each file referenced explicitly (new files
-            # archived since last run of Subscription Thread) if they should
-            # be delivered to one or more of the Subscribers.
+            # Check for each file referenced explicitly (new files archived
+            # since last run of Subscription Thread) if they should be
+            # delivered to one or more of the Subscribers.
+            checks = []
             for fileRef in fileRefs:
                 fileId      = fileRef[0]
                 fileVersion = fileRef[1]
@@ -1253,40 +1600,25 @@ def subscriptionThread(srvObj,
                 # Check that this file is contained in the File Dictionary
                 # of possible candiate files, and resolve the reference to the
                 # information for that file at the same time.
-                if (fileDicDbm.hasKey(_fileKey(fileId, fileVersion))):
-                    tmpFileInfo = fileDicDbm.get(_fileKey(fileId, fileVersion))
-                else:
+                tmpFileInfo = candidates.get(_fileKey(fileId, fileVersion))
+                if tmpFileInfo is None:
                     errMsg = "File Scheduled for delivery to Subscribers " +\
                              "(File ID: " + fileId + "/File Version: " +\
                              str(fileVersion) + ") not registered in the NGAS DB"
                     logger.warning(errMsg)
                     continue
 
-                # Loop to determine for each Subscriber whether to deliver
-                # the file or not to this or not.
-                for subscrId in srvObj.getSubscriberDic().keys():
-                    subscrObj = srvObj.getSubscriberDic()[subscrId]
-                    _checkIfDeliverFile(srvObj, subscrObj, tmpFileInfo,
-                                        deliverReqDic, deliveredStatus, scheduledStatus, fileDeliveryCountDic, fileDeliveryCountDic_Sem, explicitFileDelivery = True)
-
-            # Then check if for each of the Subscribers referenced explicitly
-            # (new Subscribers) for each file Online on this system, if we
-            # should deliver data to these.
-            if (not dataMoverOnly):
-                for subscrObj in subscrObjs:
-                    # Loop over each file and check if it should be delivered.
-                    for fileKey in fileDicDbm.keys():
-                        fileInfo = fileDicDbm.get(fileKey)
-                        _checkIfDeliverFile(srvObj, subscrObj, fileInfo,
-                                            deliverReqDic, deliveredStatus, scheduledStatus, fileDeliveryCountDic, fileDeliveryCountDic_Sem)
-            else:  # Third, if datamover, add those files
-                for subscrId in srvObj.getSubscriberDic().keys():
-                    subscrObj = srvObj.getSubscriberDic()[subscrId]
-                    logger.debug('Checking files for data mover %s', subscrId)
-                    for fileKey in fileDicDbm.keys():
-                        fileInfo = fileDicDbm.get(fileKey)
-                        _checkIfDeliverFile(srvObj, subscrObj, fileInfo,
-                                            deliverReqDic, deliveredStatus, scheduledStatus, fileDeliveryCountDic, fileDeliveryCountDic_Sem)
+                # Determine for each Subscriber whether to deliver the file
+                # or not to this or not.
+                for subscrObj in srvObj.getSubscriberDic().values():
+                    checks.append((subscrObj, tmpFileInfo, True))
+
+            # Finally, if datamover, add those files
+            if (dataMoverOnly and not candidatesChecked):
+                for subscrObj in srvObj.getSubscriberDic().values():
+                    logger.debug('Checking files for data mover %s', subscrObj.getId())
+                    checks += [(subscrObj, fileInfo, False) for fileInfo in candidates.values()]
+            selectFilesToDeliver(checks)
 
             # Then finally check if there are back-logged files to deliver.
             # selectDiskId = srvObj.getCachingActive()
@@ -1378,13 +1710,11 @@ def subscriptionThread(srvObj,
                     allFiles = []
                 #if (srvObj.getSubcrBackLogCount() > 0):
                 logger.debug('Put %d new files in the queue for subscriber %s', len(allFiles), subscrId)
-                for jdx in range(len(allFiles)):
-                    ffinfo = allFiles[jdx]
-                    addToSubscrQueue(srvObj, subscrId, ffinfo, quChunks)
-                    #quChunks.put(allFiles[jdx])
+                addFilesToSubscrQueue(srvObj, subscrId, allFiles, quChunks)
                     # Deliver the data - spawn off a Delivery Thread to do this job
                 logger.debug('Number of elements in Queue %s: %d', subscrId, quChunks.qsize())
                 if subscrId not in deliveryThreadDic:
+                    _getDeliveryStreams(srvObj, srvObj.getSubscriberDic()[subscrId]).set_max_streams(int(num_threads))
                     deliveryThreads = []
                     for tid in range(int(num_threads)):
                         args = (srvObj, srvObj.getSubscriberDic()[subscrId], quChunks, fileDeliveryCountDic, fileDeliveryCountDic_Sem, None)
@@ -1398,11 +1728,6 @@ def subscriptionThread(srvObj,
 
                     deliveryThreadDic[subscrId] = deliveryThreads
         except Exception as e:
-            try:
-                del fileDicDbm
-            except:
-                pass
-            rmFile(fileDicDbmName + "*")
             if (str(e).find("_STOP_SUBSCRIPTION_THREAD_") != -1): break
             errMsg = "Error occurred during execution of the Data " +\
                      "Subscription Thread."
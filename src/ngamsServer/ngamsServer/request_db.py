@@ -21,13 +21,24 @@
 #
 """Classes implementing the request DB"""
 
+import collections
 import errno
+import logging
 import os
+import sqlite3
 import threading
 
 from ngamsLib import ngamsDbm, utils
 
 
+logger = logging.getLogger(__name__)
+
+def _expired(req, cutoff):
+    """Whether ``req`` completed, or was last updated, before ``cutoff``"""
+    return any(t is not None and t <= cutoff
+               for t in (req.getCompletionTime(), req.getLastRequestStatUpdate()))
+
+
 class NullRequestDB(object):
     """A RequestDB class that implements null behaviour"""
 
@@ -37,10 +48,14 @@ class NullRequestDB(object):
     update = noop
     delete = noop
     get = noop
+    close = noop
 
     def keys(self):
         return []
 
+    def expire(self, cutoff):
+        return 0
+
 class InMemoryRequestDB(object):
     """A RequestDB class that keeps requests in memory"""
 
@@ -69,6 +84,16 @@ class InMemoryRequestDB(object):
     def keys(self):
         return list(self.requests)
 
+    def expire(self, cutoff):
+        """Removes the requests completed, or last updated, before ``cutoff``"""
+        expired = [req_id for req_id, req in list(self.requests.items())
+                   if _expired(req, cutoff)]
+        self.delete(expired)
+        return len(expired)
+
+    def close(self):
+        pass
+
 class DBMRequestDB(object):
     """A RequestDB backed up by a DBM file"""
 
@@ -125,4 +150,171 @@ class DBMRequestDB(object):
 
     def keys(self):
         with self.lock:
-            return list(map(utils.b2s, self.dbm.keys()))
\ No newline at end of file
+            return list(map(utils.b2s, self.dbm.keys()))
+
+    def expire(self, cutoff):
+        """Removes the requests completed, or last updated, before ``cutoff``"""
+        expired = []
+        for req_id in self.keys():
+            req = self.get(req_id)
+            if req is not None and _expired(req, cutoff):
+                expired.append(req_id)
+        self.delete(expired)
+        return len(expired)
+
+    def close(self):
+        pass
+
+
+_summary_fields = ('request_id', 'command', 'http_method', 'request_time',
+                   'completion_percent', 'expected_count', 'actual_count',
+                   'est_total_time', 'remaining_time', 'throughput',
+                   'last_update', 'completion_time')
+
+class request_summary(collections.namedtuple('request_summary', _summary_fields)):
+    """
+    The properties of a request kept by SQLiteRequestDB, which are those
+    reported by the STATUS command. They are accessed with the same methods
+    offered by ngamsReqProps.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_request(cls, req):
+        return cls(req.getRequestId(), req.getCmd(), req.getHttpMethod(),
+                   req.getRequestTime(), req.getCompletionPercent(),
+                   req.getExpectedCount(), req.getActualCount(),
+                   req.getEstTotalTime(), req.getRemainingTime(),
+                   req.getThroughput(), req.getLastRequestStatUpdate(),
+                   req.getCompletionTime())
+
+    def getRequestId(self):
+        return self.request_id
+
+    def getCmd(self):
+        return self.command
+
+    def getHttpMethod(self):
+        return self.http_method
+
+    def getRequestTime(self):
+        return self.request_time
+
+    def getCompletionPercent(self):
+        return self.completion_percent
+
+    def getExpectedCount(self):
+        return self.expected_count
+
+    def getActualCount(self):
+        return self.actual_count
+
+    def getEstTotalTime(self):
+        return self.est_total_time
+
+    def getRemainingTime(self):
+        return self.remaining_time
+
+    def getThroughput(self):
+        return self.throughput
+
+    def getLastRequestStatUpdate(self):
+        return self.last_update
+
+    def getCompletionTime(self):
+        return self.completion_time
+
+class SQLiteRequestDB(object):
+    """
+    A RequestDB backed up by an SQLite database, storing only a summary of
+    each request (see request_summary).
+
+    Requests being added or updated are kept in memory, and are written in
+    batches to the database every ``sync_interval`` seconds by a background
+    thread, so request threads don't wait for disk I/O. The database is
+    opened in WAL mode, and is kept across server restarts.
+    """
+
+    def __init__(self, fname, sync_interval=1.0):
+        self.fname = fname
+        self.sync_interval = sync_interval
+        self.lock = threading.Lock()
+        self._pending = {}
+        self._conn = sqlite3.connect(fname, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS requests (request_id TEXT PRIMARY KEY, %s)' %
+                           ', '.join(_summary_fields[1:]))
+        self._conn.execute('CREATE INDEX IF NOT EXISTS requests_last_update ON requests (last_update)')
+        self._conn.commit()
+        self._insert_sql = 'INSERT OR REPLACE INTO requests VALUES (%s)' % ', '.join('?' * len(_summary_fields))
+        self._select_sql = 'SELECT %s FROM requests' % ', '.join(_summary_fields)
+        self._stop_evt = threading.Event()
+        self._syncer = threading.Thread(target=self._sync_periodically, name='RequestDbSync')
+        self._syncer.daemon = True
+        self._syncer.start()
+
+    def add(self, req):
+        summary = request_summary.from_request(req)
+        with self.lock:
+            self._pending[summary.request_id] = summary
+
+    update = add
+
+    def _sync_periodically(self):
+        while not self._stop_evt.wait(self.sync_interval):
+            try:
+                self.sync()
+            except Exception:
+                logger.exception("Error while syncing the request DB")
+
+    def sync(self):
+        """Writes all pending requests into the database"""
+        with self.lock:
+            if not self._pending:
+                return
+            with self._conn:
+                self._conn.executemany(self._insert_sql, self._pending.values())
+            self._pending.clear()
+
+    def delete(self, req_ids):
+        req_ids = [(str(req_id),) for req_id in req_ids]
+        with self.lock:
+            for (req_id,) in req_ids:
+                self._pending.pop(req_id, None)
+            with self._conn:
+                self._conn.executemany('DELETE FROM requests WHERE request_id = ?', req_ids)
+
+    def get(self, req_id):
+        with self.lock:
+            summary = self._pending.get(req_id)
+            if summary is not None:
+                return summary
+            row = self._conn.execute(self._select_sql + ' WHERE request_id = ?', (req_id,)).fetchone()
+        return request_summary(*row) if row else None
+
+    def keys(self):
+        with self.lock:
+            keys = set(self._pending)
+            keys.update(row[0] for row in self._conn.execute('SELECT request_id FROM requests'))
+        return list(keys)
+
+    def expire(self, cutoff):
+        """
+        Removes the requests completed, or last updated, before ``cutoff``,
+        all in one go
+        """
+        self.sync()
+        with self.lock:
+            with self._conn:
+                cursor = self._conn.execute('DELETE FROM requests WHERE completion_time <= ? OR last_update <= ?',
+                                            (cutoff, cutoff))
+            return cursor.rowcount
+
+    def close(self):
+        """Stops the background sync thread, and writes all pending requests"""
+        self._stop_evt.set()
+        self._syncer.join()
+        self.sync()
+        self._conn.close()
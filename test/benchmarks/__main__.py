@@ -0,0 +1,81 @@
+#
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2019
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+#
+"""Command-line entry point for the NGAS benchmarks"""
+
+import argparse
+import json
+import logging
+import sys
+
+from . import benchmarks
+
+
+def main():
+
+    all_benchmarks = [name[len('bench_'):] for name in benchmarks.all_benchmarks()]
+
+    parser = argparse.ArgumentParser(prog='python -m test.benchmarks',
+                                     description='Runs the NGAS benchmarks')
+    parser.add_argument('benchmarks', nargs='*', metavar='benchmark', default=all_benchmarks,
+                        help='The benchmarks to run, defaults to all of them: %s' % ', '.join(all_benchmarks))
+    parser.add_argument('-o', '--output', help='File where results are written in JSON format, defaults to stdout')
+    parser.add_argument('-s', '--scale', type=float, default=1,
+                        help='Factor applied to the amount of work done by each benchmark, defaults to 1')
+    parser.add_argument('-b', '--baseline',
+                        help='Results of a previous run to compare against. Regressions make the program exit with status 1')
+    parser.add_argument('-t', '--tolerance', type=float, default=0.1,
+                        help='Fraction by which metrics can be worse than their baseline, defaults to 0.1')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Show the progress of the benchmarks')
+    opts = parser.parse_args()
+
+    unknown = set(opts.benchmarks) - set(all_benchmarks)
+    if unknown:
+        parser.error('Unknown benchmarks: %s' % ', '.join(sorted(unknown)))
+
+    logging.basicConfig(level=logging.INFO if opts.verbose else logging.WARNING,
+                        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    results = benchmarks.run(['bench_' + name for name in opts.benchmarks], opts.scale)
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if opts.output:
+        with open(opts.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+    errors = [name for name, metrics in results['results'].items() if 'error' in metrics]
+    if errors:
+        sys.stderr.write('Benchmarks failed: %s\n' % ', '.join(sorted(errors)))
+
+    regressions = []
+    if opts.baseline:
+        with open(opts.baseline) as f:
+            baseline = json.load(f)
+        regressions = benchmarks.compare(results, baseline, opts.tolerance)
+        for name, metric, base, value in regressions:
+            sys.stderr.write('Regression in %s: %s went from %.3f to %.3f\n' % (name, metric, base, value))
+
+    if errors or regressions:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+#
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2019
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+#
+"""
+The individual benchmarks, and the functions used to run them and to compare
+their results.
+"""
+
+import functools
+import logging
+import math
+import os
+import platform
+import re
+import time
+
+from ngamsLib.ngamsCore import getNgamsVersion, toiso8601
+from ..ngamsTestLib import ngamsTestSuite, tmp_path, tmp_root
+
+
+logger = logging.getLogger(__name__)
+
+MB = 1024. * 1024.
+
+def percentile(values, p):
+    """The ``p``-th percentile of ``values``, using the nearest-rank method"""
+    values = sorted(values)
+    rank = max(1, int(math.ceil(p / 100. * len(values))))
+    return values[min(rank, len(values)) - 1]
+
+def lower_is_better(metric):
+    """Whether lower values of ``metric`` are better (e.g., latencies)"""
+    return metric.endswith('_ms')
+
+class ngamsBenchmarks(ngamsTestSuite):
+    """
+    The NGAS benchmarks. Each ``bench_*`` method measures one aspect of the
+    system and records its results with ``record``. The amount of work done
+    by each benchmark is multiplied by ``scale``.
+    """
+
+    scale = 1
+
+    def __init__(self, methodName):
+        ngamsTestSuite.__init__(self, methodName)
+        self.results = {}
+
+    def n(self, count):
+        return max(1, int(count * self.scale))
+
+    def record(self, **metrics):
+        for name, value in metrics.items():
+            logger.info("%s: %s = %.3f", self._testMethodName, name, value)
+        self.results.update(metrics)
+
+    def _archive_files(self, cmd, count, size, port=None, prefix='bench'):
+        """Archives ``count`` files of ``size`` bytes, returns the time it took"""
+        data = os.urandom(size)
+        args = (port,) if port else ()
+        start = time.time()
+        for i in range(count):
+            args_i = args + (data, '%s-%s-%d.data' % (prefix, cmd, i), 'application/octet-stream')
+            self.archive_data(*args_i, cmd=cmd)
+        return time.time() - start
+
+    def _archive_throughput(self, count, size):
+        self.prepExtSrv()
+        for cmd in ('ARCHIVE', 'QARCHIVE'):
+            elapsed = self._archive_files(cmd, count, size)
+            self.record(**{'%s_files_per_s' % cmd: count / elapsed,
+                           '%s_mb_per_s' % cmd: count * size / MB / elapsed})
+
+    def bench_archive_small(self):
+        """ARCHIVE and QARCHIVE throughput for small (1 KB) files"""
+        self._archive_throughput(self.n(200), 1024)
+
+    def bench_archive_large(self):
+        """ARCHIVE and QARCHIVE throughput for large (64 MB) files"""
+        self._archive_throughput(self.n(4), 64 * 1024 * 1024)
+
+    def bench_retrieve(self):
+        """RETRIEVE latency for small (1 KB) files"""
+        self.prepExtSrv()
+        count = self.n(20)
+        self._archive_files('QARCHIVE', count, 1024)
+        target = tmp_path('retrieved')
+        latencies = []
+        for _ in range(10):
+            for i in range(count):
+                start = time.time()
+                self.retrieve('bench-QARCHIVE-%d.data' % i, targetFile=target)
+                latencies.append((time.time() - start) * 1000)
+        self.record(RETRIEVE_p50_ms=percentile(latencies, 50),
+                    RETRIEVE_p90_ms=percentile(latencies, 90),
+                    RETRIEVE_p99_ms=percentile(latencies, 99))
+
+    def bench_query(self):
+        """QUERY throughput, in rows per second"""
+        self.prepExtSrv()
+        self._archive_files('QARCHIVE', self.n(500), 16)
+        rows = 0
+        start = time.time()
+        for _ in range(10):
+            rows += sum(1 for _ in self.client.query_rows('files_list'))
+        self.record(QUERY_rows_per_s=rows / (time.time() - start))
+
+    def bench_subscription(self):
+        """Rate at which a subscriber receives files"""
+        cluster = self.prepCluster(((8888, ()), (8889, ())))
+        subscriber, (_, db) = [(srv_id, cfg_db) for srv_id, cfg_db in cluster.items()
+                               if srv_id.endswith(':8889')][0]
+        count, size = self.n(100), 64 * 1024
+        self._archive_files('QARCHIVE', count, size, port=8888)
+
+        sql = ("SELECT count(*) FROM ngas_files nf, ngas_disks nd "
+               "WHERE nf.disk_id = nd.disk_id AND nd.host_id = {0}")
+        start = time.time()
+        self.subscribe(8888, 'http://localhost:8889/QARCHIVE',
+                       startDate='%sT00:00:00.000' % time.strftime("%Y-%m-%d"))
+        while db.query2(sql, args=(subscriber,))[0][0] < count:
+            if time.time() - start > 60 * max(1, self.scale):
+                self.fail("Files were not delivered in time")
+            time.sleep(0.05)
+        elapsed = time.time() - start
+        self.record(SUBSCRIPTION_files_per_s=count / elapsed,
+                    SUBSCRIPTION_mb_per_s=count * size / MB / elapsed)
+
+    def bench_datacheck(self):
+        """Rate at which the data check thread checks files"""
+        self.prepExtSrv()
+        self._archive_files('QARCHIVE', self.n(20), 32 * 1024 * 1024)
+
+        cfg = (("NgamsCfg.DataCheckThread[1].Active", "1"),
+               ("NgamsCfg.DataCheckThread[1].Scan", "0"),
+               ("NgamsCfg.DataCheckThread[1].MinCycle", "0T00:00:00"),
+               ("NgamsCfg.Log[1].LocalLogLevel", "4"))
+        cfg, _ = self.restart_last_server(start=functools.partial(self.prepExtSrv, cfgProps=cfg))
+
+        start = time.time()
+        while time.time() - start < 60 * max(1, self.scale):
+            with open(cfg.getLocalLogFile()) as log:
+                for line in log:
+                    if "NGAMS_INFO_DATA_CHK_STAT" in line:
+                        rate = float(re.search(r"Checking rate: ([0-9.]+) MB/s", line).group(1))
+                        self.record(DATACHECK_mb_per_s=rate)
+                        return
+            time.sleep(0.5)
+        self.fail("Data Check Thread didn't complete a check cycle in time")
+
+def all_benchmarks():
+    """The names of all benchmarks, in the order they are run"""
+    return [name for name in dir(ngamsBenchmarks) if name.startswith('bench_')]
+
+def run(names, scale=1):
+    """
+    Runs the benchmarks with the given ``names`` and returns a dictionary
+    with their results and the details of the environment they ran on.
+    A benchmark that fails has its error recorded instead of its results.
+    """
+    ngamsBenchmarks.scale = scale
+    results = {}
+    for name in names:
+        bench = ngamsBenchmarks(name)
+        bench.setUp()
+        try:
+            getattr(bench, name)()
+            results[name] = bench.results
+        except Exception as e:
+            logger.exception("Benchmark %s failed", name)
+            results[name] = {'error': str(e)}
+        finally:
+            bench.tearDown()
+
+    return {'ngas_version': getNgamsVersion(),
+            'python_version': platform.python_version(),
+            'platform': platform.platform(),
+            'date': toiso8601(),
+            'tmp_root': tmp_root,
+            'scale': scale,
+            'results': results}
+
+def compare(results, baseline, tolerance):
+    """
+    Compares ``results`` against those in ``baseline``, and returns a list
+    with the (benchmark, metric, baseline value, value) of all metrics that
+    are worse than their baseline by more than ``tolerance`` (a fraction).
+    """
+    regressions = []
+    for name, metrics in sorted(results['results'].items()):
+        base_metrics = baseline['results'].get(name, {})
+        for metric, value in sorted(metrics.items()):
+            base = base_metrics.get(metric)
+            if not isinstance(value, (int, float)) or not isinstance(base, (int, float)):
+                continue
+            if lower_is_better(metric):
+                worse = value > base * (1 + tolerance)
+            else:
+                worse = value < base * (1 - tolerance)
+            if worse:
+                regressions.append((name, metric, base, value))
+    return regressions
@@ -35,10 +35,12 @@ Contains the Test Suite for the ARCHIVE Command.
 import contextlib
 import functools
 import glob
+import io
 import os
 import subprocess
 import time
 import unittest
+import zlib
 from multiprocessing.pool import ThreadPool
 
 from six.moves import cPickle # @UnresolvedImport
@@ -49,7 +51,7 @@ from ngamsLib import ngamsStatus, ngamsFileInfo, ngamsHttpUtils
 from ..ngamsTestLib import ngamsTestSuite, \
     pollForFile, remFitsKey, writeFitsKey, prepCfg, getTestUserEmail, \
     genTmpFilename, execCmd, save_to_tmp, tmp_path
-from ngamsServer import ngamsFileUtils
+from ngamsServer import ngamsArchiveUtils, ngamsFileUtils
 
 
 # TODO: See how we can actually set this dynamically in the future
@@ -1505,6 +1507,20 @@ class ngamsArchiveCmdTest(ngamsTestSuite):
         archive_rate = db.query2('SELECT ingestion_rate FROM ngas_files')[0][0]
         self.assertLessEqual(overall_rate, archive_rate)
 
+    def test_spliced_archiving(self):
+        """Data is correctly stored with and without splicing it into the file"""
+
+        data = os.urandom(1024 * 1024 + 17)
+        for splice in (0, 1):
+            self.prepExtSrv(cfgProps=(('NgamsCfg.Server[1].SpliceIncomingData', splice),))
+            for crc_variant in (-1, 0):
+                self.archive_data(data, 'file1.txt', 'application/octet-stream',
+                                  cmd='QARCHIVE', pars=[('crc_variant', crc_variant)])
+                self.retrieve('file1.txt', targetFile=tmp_path())
+                with open(tmp_path('file1.txt'), 'rb') as f:
+                    self.assertEqual(data, f.read())
+            self.terminateAllServer()
+
     def test_archive_no_versioning(self):
         self._test_archive_no_versioning('ARCHIVE')
 
@@ -1580,3 +1596,113 @@ class ngamsArchiveCmdTest(ngamsTestSuite):
             archive(data, versioning_param=versioning_param, version=3, expected_status='FAILURE')
             archive(data, versioning_param=versioning_param, version=4, expected_status='FAILURE')
             archive(data, versioning_param=versioning_param, version=50, expected_status='FAILURE')
+
+
+class ArchiveContentsTest(unittest.TestCase):
+    """Tests for the archive_contents function used to receive data"""
+
+    def setUp(self):
+        checkCreatePath(tmp_path())
+        self.out_fname = genTmpFilename()
+        self.addCleanup(rmFile, self.out_fname)
+
+    def _test_archive_contents(self, data, crc_name, block_size=4096):
+        out_fname = self.out_fname
+        res = ngamsArchiveUtils.archive_contents(out_fname, io.BytesIO(data),
+                                                 len(data), block_size, crc_name,
+                                                 skip_crc=crc_name is None)
+        self.assertEqual(len(data), res.size)
+        with open(out_fname, 'rb') as f:
+            self.assertEqual(data, f.read())
+        if crc_name is not None:
+            expected_crc = ngamsFileUtils.get_checksum(block_size, out_fname, crc_name)
+            self.assertEqual(expected_crc, res.crc)
+
+    def test_all_variants(self):
+        """Data and checksums are correct when reading in one or many blocks"""
+        variants = ['crc32', 'crc32z', 'crc32z-tree', None]
+        if _crc32c_available:
+            variants.append('crc32c')
+        for crc_name in variants:
+            for size in (0, 1, 4096, 4097, 4096 * 20 + 1):
+                self._test_archive_contents(os.urandom(size), crc_name)
+
+    def test_eof(self):
+        """Less data than advertised is reported as such"""
+        for size in (100, 4096 * 20):
+            with self.assertRaises(ngamsArchiveUtils.eof_found):
+                fin = io.BytesIO(os.urandom(size - 1))
+                ngamsArchiveUtils.archive_contents(self.out_fname, fin, size,
+                                                   4096, 'crc32')
+
+    def test_read_only_file(self):
+        """File-like objects without readinto() are also supported"""
+        out_fname = self.out_fname
+        res = ngamsArchiveUtils.archive_contents(out_fname, generated_file(4096 * 20),
+                                                 4096 * 20, 4096, 'crc32')
+        self.assertEqual(4096 * 20, res.size)
+        self.assertEqual(ngamsFileUtils.get_checksum(4096, out_fname, 'crc32'), res.crc)
+
+
+class ChecksumVariantsTest(unittest.TestCase):
+    """Tests for the registry of checksum variants and the tree variants"""
+
+    def setUp(self):
+        checkCreatePath(tmp_path())
+        self.fname = genTmpFilename()
+        self.addCleanup(rmFile, self.fname)
+
+    def test_names(self):
+        """Variants can be referred to by number, name and alias"""
+        for variant, name in ((0, 'crc32'), ('0', 'crc32'), ('ngamsGenCrc32', 'crc32'),
+                              ('StreamCrc32', 'crc32'), (2, 'crc32z'),
+                              (3, 'xxhash64'), ('blake3', 'blake3'),
+                              ('crc32z-tree', 'crc32z-tree'),
+                              ('ngamsGenCrc32-tree', 'crc32-tree')):
+            self.assertEqual(name, ngamsFileUtils.get_checksum_name(variant))
+        for variant in (-1, '-1', None):
+            self.assertIsNone(ngamsFileUtils.get_checksum_name(variant))
+            self.assertIsNone(ngamsFileUtils.get_checksum_info(variant))
+        for variant in (100, 'unknown', 'unknown-tree', 'crc32z-tree-tree'):
+            self.assertRaises(Exception, ngamsFileUtils.get_checksum_name, variant)
+
+    def test_register_variant(self):
+        """Variants registered by plug-ins can be used like the built-in ones"""
+        info = functools.partial(ngamsFileUtils.checksum_info, 1, zlib.adler32,
+                                 lambda x: x & 0xffffffff, None, lambda x, y: int(x) == int(y))
+        ngamsFileUtils.register_checksum_variant('adler32', info, 100, aliases=('adler',))
+        def unregister():
+            del ngamsFileUtils._checksum_variants['adler32']
+            del ngamsFileUtils._checksum_aliases[100]
+            del ngamsFileUtils._checksum_aliases['adler']
+        self.addCleanup(unregister)
+
+        data = os.urandom(10000)
+        with open(self.fname, 'wb') as f:
+            f.write(data)
+        for variant in (100, 'adler', 'adler32'):
+            self.assertEqual('adler32', ngamsFileUtils.get_checksum_name(variant))
+            self.assertEqual(zlib.adler32(data) & 0xffffffff,
+                             ngamsFileUtils.get_checksum(4096, self.fname, variant))
+        self.assertEqual('adler32-tree', ngamsFileUtils.get_checksum_name('adler-tree'))
+        ngamsFileUtils.get_checksum(4096, self.fname, 'adler-tree')
+
+    def test_tree_variants(self):
+        """Tree checksums are the same when calculated serially or in parallel"""
+        chunk_size = ngamsFileUtils.TREE_CHUNK_SIZE
+        ngamsFileUtils.TREE_CHUNK_SIZE = 1000
+        self.addCleanup(setattr, ngamsFileUtils, 'TREE_CHUNK_SIZE', chunk_size)
+
+        crcs = set()
+        for size in (0, 1, 999, 1000, 1001, 5500, 6000):
+            data = os.urandom(size)
+            with open(self.fname, 'wb') as f:
+                f.write(data)
+            serial = ngamsFileUtils.get_checksum(333, self.fname, 'crc32z-tree')
+            parallel = ngamsFileUtils.get_checksum(333, self.fname, 'crc32z-tree', workers=4)
+            self.assertEqual(serial, parallel)
+            crc_info = ngamsFileUtils.get_checksum_info('crc32z-tree')
+            self.assertEqual(serial, crc_info.final(crc_info.method(data, crc_info.init)))
+            self.assertNotEqual(serial, ngamsFileUtils.get_checksum(333, self.fname, 'crc32z'))
+            crcs.add(serial)
+        self.assertEqual(7, len(crcs))
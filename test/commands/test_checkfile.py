@@ -31,6 +31,9 @@
 This module contains the Test Suite for the CHECKFILE Command.
 """
 
+import glob
+import os
+
 from ngamsLib.ngamsCore import NGAMS_CHECKFILE_CMD
 from ..ngamsTestLib import ngamsTestSuite
 
@@ -83,6 +86,45 @@ class ngamsCheckFileCmdTest(ngamsTestSuite):
         self.assert_ref_file(refStatFile, statObj.getMessage(), msg=msg)
 
 
+    def test_checksum_cache(self):
+        """Checksums are cached until the file changes, unless forced"""
+
+        self.prepExtSrv(cfgProps=[('NgamsCfg.Server[1].ChecksumCacheMaxAge', '3600')])
+        self.archive("src/SmallFile.fits")
+        fname = self.ngas_path('FitsStorage1-Main-1/saf/2001-05-08/1/'
+                               'TEST.2001-05-08T15:25:00.123.fits.gz')
+        pars = [["disk_id", self.ngas_disk_id("FitsStorage1/Main/1")],
+                ["file_id", "TEST.2001-05-08T15:25:00.123"],
+                ["file_version", "1"]]
+        def check_file(expected_log_id, force=False):
+            statObj = self.get_status(NGAMS_CHECKFILE_CMD,
+                                      pars=pars + [["force", int(force)]])
+            self.assertTrue(statObj.getMessage().startswith(expected_log_id),
+                            statObj.getMessage())
+
+        # Whole seconds, so the modification time can be restored exactly
+        mtime = 1500000000
+        os.utime(fname, (mtime, mtime))
+
+        # The checksum is calculated and cached
+        check_file('NGAMS_INFO_FILE_OK')
+        self.assertTrue(glob.glob(self.ngas_path('FitsStorage1-Main-1/.db/ChecksumCache*')))
+
+        # Corrupt the file, but keep its inode, size and modification time,
+        # so the cached checksum is still used unless we force the check
+        os.chmod(fname, 0o666)
+        with open(fname, 'r+b') as f:
+            f.seek(-16, 2)
+            f.write(os.urandom(16))
+        os.utime(fname, (mtime, mtime))
+        check_file('NGAMS_INFO_FILE_OK')
+        check_file('NGAMS_ER_FILE_NOK', force=True)
+
+        # Changing the modification time invalidates the cached checksum
+        os.utime(fname, (mtime, mtime + 10))
+        check_file('NGAMS_ER_FILE_NOK')
+
+
     def test_ErrHandling_1(self):
         """
         Synopsis:
@@ -31,10 +31,13 @@
 This module contains the Test Suite for the CLONE Command.
 """
 
+import collections
 import functools
+import glob
 
 from ngamsLib.ngamsCore import getHostName, NGAMS_CLONE_CMD
-from ngamsLib import ngamsFileInfo
+from ngamsLib import ngamsDbm, ngamsFileInfo, ngamsLib
+from ngamsServer.commands import clone
 from ..ngamsTestLib import ngamsTestSuite, waitReqCompl, genErrMsgVals, \
     unzip, genTmpFilename, tmp_path, as_ngas_disk_id
 
@@ -593,4 +596,35 @@ class ngamsCloneCmdTest(ngamsTestSuite):
 
         ref_file = "ref/ngamsCloneCmdTest_test_CloneCmd_2_ref"
         msg = "Incorrect/missing CLONE Status Notification Email Msg"
-        self.assert_clone_mail(ref_file, msg)
\ No newline at end of file
+        self.assert_clone_mail(ref_file, msg)
+
+
+    def test_resume(self):
+        """
+        Files recorded as cloned by a previous, interrupted execution of a
+        Clone Request are not cloned again when the request is re-issued
+        """
+        cfg, db = self.prepExtSrv(cfgProps=(('NgamsCfg.Server[1].RequestDbBackend', 'memory'),))
+        for _ in range(5):
+            self.archive("src/SmallFile.fits")
+        diskId = self.ngas_disk_id("FitsStorage1/Main/1")
+        orig_copies = collections.Counter(version for _, _, version in db.filesInDb([nmuFileId]))
+
+        # Versions 1 and 2 were cloned already
+        progressDbmName = clone._genProgressDbmName(cfg, diskId, "", -1, "")
+        progressDbm = ngamsDbm.ngamsDbm(progressDbmName, writePerm=1)
+        for version in (1, 2):
+            progressDbm.add(ngamsLib.genFileKey(diskId, nmuFileId, version), "")
+        del progressDbm
+
+        statObj = self.get_status(NGAMS_CLONE_CMD,
+                                  pars = [["disk_id", diskId], ["async", "1"]])
+        self.assertEqual(3, int(statObj.getExpectedCount()))
+        finalStatObj = waitReqCompl(self, statObj.getRequestId(), 20)
+        self.assertEqual(3, int(finalStatObj.getActualCount()))
+        self.assertGreater(finalStatObj.getThroughput(), 0)
+
+        # Once completed there is nothing left to resume
+        self.assertFalse(glob.glob(progressDbmName + "*"))
+        copies = collections.Counter(version for _, _, version in db.filesInDb([nmuFileId]))
+        self.assertEqual([0, 0, 1, 1, 1], [copies[v] - orig_copies[v] for v in range(1, 6)])
@@ -0,0 +1,74 @@
+#
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2019
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+#
+import contextlib
+import time
+
+from ngamsLib import ngamsHttpUtils
+from ..ngamsTestLib import ngamsTestSuite, tmp_path
+
+
+class MetricsCmdTest(ngamsTestSuite):
+    """Tests for the METRICS command"""
+
+    def _get_metrics(self):
+        resp = ngamsHttpUtils.httpGet('localhost', 8888, 'METRICS')
+        with contextlib.closing(resp):
+            self.assertEqual(200, resp.status)
+            self.assertTrue(resp.getheader('content-type').startswith('text/plain; version=0.0.4'))
+            text = resp.read().decode('utf8')
+        samples = {}
+        for line in text.splitlines():
+            if not line.startswith('#'):
+                name, value = line.rsplit(' ', 1)
+                samples[name] = float(value)
+        return samples
+
+    def test_metrics(self):
+
+        self.prepExtSrv()
+        self.archive_data(b'a' * 1000, 'file.data', 'application/octet-stream', cmd='QARCHIVE')
+        self.retrieve('file.data', targetFile=tmp_path())
+        ngamsHttpUtils.httpGet('localhost', 8888, 'NOTACOMMAND').close()
+
+        # Requests are accounted for after their response is sent
+        for _ in range(50):
+            samples = self._get_metrics()
+            if 'ngas_requests_total{command="UNKNOWN",code="404"}' in samples:
+                break
+            time.sleep(0.1)
+        self.assertEqual(1, samples['ngas_requests_total{command="QARCHIVE",code="200"}'])
+        self.assertEqual(1, samples['ngas_requests_total{command="RETRIEVE",code="200"}'])
+        self.assertEqual(1, samples['ngas_requests_total{command="UNKNOWN",code="404"}'])
+        self.assertEqual(1, samples['ngas_request_duration_seconds_count{command="QARCHIVE"}'])
+        self.assertEqual(1000, samples['ngas_request_bytes_received_total{command="QARCHIVE"}'])
+        self.assertEqual(1000, samples['ngas_request_bytes_sent_total{command="RETRIEVE"}'])
+        self.assertEqual(0, samples['ngas_requests_rejected_total'])
+
+        # The METRICS request itself is being served
+        self.assertGreaterEqual(samples['ngas_requests_active'], 1)
+        self.assertEqual(0, samples['ngas_subscription_backlog_files'])
+        self.assertGreater(samples['ngas_db_query_duration_seconds_count{operation="SELECT"}'], 0)
+        self.assertGreater(samples['ngas_db_pool_wait_seconds_count'], 0)
+
+        # Previous METRICS requests are counted too
+        samples = self._get_metrics()
+        self.assertGreaterEqual(samples['ngas_requests_total{command="METRICS",code="200"}'], 1)
@@ -78,4 +78,32 @@ class ngamsQueryCmdTest(ngamsTestSuite):
         stat = self.assert_query(pars=[['query', 'disks_list'], ['format', 'json']])
         results = json.loads(utils.b2s(stat.getData()))
         self.assertEqual(0, int(results[0]['number_of_files']))
-        self.assertEqual(cfg.getArchiveName(), results[0]['archive'])
\ No newline at end of file
+        self.assertEqual(cfg.getArchiveName(), results[0]['archive'])
+    def test_streamed_formats(self):
+        """Results in json lines and csv formats are streamed as they are read"""
+
+        self.prepExtSrv()
+        self.archive("src/SmallFile.fits")
+
+        # The file is stored in the Main and Replication disks
+        stat = self.assert_query(pars=[['query', 'files_list'], ['format', 'jsonl']])
+        lines = utils.b2s(stat.getData()).splitlines()
+        self.assertEqual(2, len(lines))
+        for line in lines:
+            self.assertEqual("TEST.2001-05-08T15:25:00.123", json.loads(line)['file_id'])
+
+        stat = self.assert_query(pars=[['query', 'files_list'], ['format', 'csv']])
+        lines = utils.b2s(stat.getData()).splitlines()
+        self.assertEqual(3, len(lines))
+        self.assertTrue(lines[0].startswith('disk_id,'))
+        for line in lines[1:]:
+            self.assertIn("TEST.2001-05-08T15:25:00.123", line)
+
+    def test_client_query_rows(self):
+
+        self.prepExtSrv()
+        self.archive("src/SmallFile.fits")
+        rows = list(self.client.query_rows('files_list'))
+        self.assertEqual(2, len(rows))
+        for row in rows:
+            self.assertEqual("TEST.2001-05-08T15:25:00.123", row['file_id'])
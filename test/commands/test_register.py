@@ -36,7 +36,7 @@ import time
 
 from ngamsLib import ngamsFileInfo
 from ngamsLib.ngamsCore import checkCreatePath, getHostName, NGAMS_REGISTER_CMD
-from ..ngamsTestLib import ngamsTestSuite, tmp_path
+from ..ngamsTestLib import ngamsTestSuite, tmp_path, waitReqCompl
 
 
 class ngamsRegisterCmdTest(ngamsTestSuite):
@@ -108,6 +108,28 @@ class ngamsRegisterCmdTest(ngamsTestSuite):
         msg = "Incorrect info in DB for registered file"
         self.assert_status_ref_file(fileInfoRef, tmpFileObj, msg=msg)
 
+    def test_register_batches(self):
+        """Files are registered in batches, getting consecutive versions"""
+        cfg = (('NgamsCfg.Server[1].RegisterBatchSize', '2'),
+               ('NgamsCfg.Server[1].RequestDbBackend', 'memory'))
+        _, db = self.prepExtSrv(cfgProps=cfg)
+        regDir = self.ngas_path("FitsStorage2-Main-3/saf/batches")
+        checkCreatePath(regDir)
+        for i in range(5):
+            self.cp("src/SmallFile.fits", os.path.join(regDir, "SmallFile%d.fits" % i))
+        status = self.get_status(NGAMS_REGISTER_CMD, (("path", regDir), ("async", "1")))
+        self.assertEqual(5, int(status.getExpectedCount()))
+        status = waitReqCompl(self, status.getRequestId(), 20)
+        self.assertEqual(5, int(status.getActualCount()))
+        self.assertGreater(status.getThroughput(), 0)
+
+        # All files have the same File ID
+        sql = "SELECT file_version, checksum FROM ngas_files WHERE file_id = {}"
+        res = db.query2(sql, args=("TEST.2001-05-08T15:25:00.123",))
+        self.assertEqual([1, 2, 3, 4, 5], sorted(int(r[0]) for r in res))
+        self.assertEqual(1, len(set(r[1] for r in res)))
+        self.assertTrue(res[0][1])
+
     def test_register_no_params(self):
         '''Tests that a register plugin without parameters can work'''
         cfg = (('NgamsCfg.Register[1].PlugIn[2].Name', 'test.support.generic_register_plugin'),
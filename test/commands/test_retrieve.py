@@ -35,7 +35,7 @@ import contextlib
 import io
 import os
 
-from ngamsLib import ngamsHttpUtils
+from ngamsLib import ngamsHttpUtils, ngamsLib
 from ngamsLib.ngamsCore import getHostName
 from ..ngamsTestLib import ngamsTestSuite, genTmpFilename, unzip, tmp_path
 
@@ -457,12 +457,8 @@ class ngamsRetrieveCmdTest(ngamsTestSuite):
         self.prepExtSrv()
         self.archive("src/SmallFile.fits")
 
-        # Partial retrieval only supports a start offset, so using only
-        # a suffix length or a begin/end range should fail
-        ranges = ['0-1', '-1']
-
-        # Not a number, missing -, negative number
-        ranges += ['a-', 'a', '0', '-100-']
+        # Not a number, missing -, negative number, reversed range
+        ranges = ['a-', 'a', '0', '-100-', '5-2']
 
         for r in ranges:
             hdrs = {'Range': 'bytes=' + r}
@@ -501,6 +497,10 @@ class ngamsRetrieveCmdTest(ngamsTestSuite):
                                               pars=(('file_id', 'source'),),
                                               hdrs={'Range': 'bytes=%d-' % (offset,)})
             with contextlib.closing(response):
+                if offset >= file_size:
+                    self.assertEqual(416, response.status)
+                    continue
+                self.assertEqual(206, response.status)
                 total_read = 0
                 while total_read < part_size:
                     to_read = part_size - total_read
@@ -511,4 +511,194 @@ class ngamsRetrieveCmdTest(ngamsTestSuite):
                     piece_by_piece.write(data)
 
         self.assertEqual(file_size, piece_by_piece.tell())
-        self.assertEqual(full.getvalue(), piece_by_piece.getvalue())
\ No newline at end of file
+        self.assertEqual(full.getvalue(), piece_by_piece.getvalue())
+
+    def test_proxied_retrieval(self):
+        """Proxied retrievals keep the original headers and honour Range"""
+
+        self.prepCluster((8000, 8011))
+        contents = os.urandom(1024 * 1024)
+        with open(tmp_path("source"), 'wb') as f:
+            f.write(contents)
+        self.archive(8011, tmp_path("source"), mimeType='application/octet-stream')
+
+        for offset in (0, 1000):
+            response = ngamsHttpUtils.httpGet('127.0.0.1', 8000, 'RETRIEVE',
+                                              pars=(('file_id', 'source'),),
+                                              hdrs={'Range': 'bytes=%d-' % (offset,)})
+            with contextlib.closing(response):
+                self.assertEqual(206, response.status)
+                self.assertEqual(str(len(contents) - offset), response.getheader('content-length'))
+                self.assertEqual(contents[offset:], response.read())
+
+        # Multiple ranges go through too
+        self._test_multi_range_retrieval(8000, contents)
+
+    def _archive_random_file(self, size):
+        contents = os.urandom(size)
+        with open(tmp_path("source"), 'wb') as f:
+            f.write(contents)
+        self.archive(tmp_path("source"), mimeType='application/octet-stream')
+        return contents
+
+    def _get_ranges(self, port, ranges, **hdrs):
+        hdrs['Range'] = ranges
+        return ngamsHttpUtils.httpGet('127.0.0.1', port, 'RETRIEVE',
+                                      pars=(('file_id', 'source'),), hdrs=hdrs)
+
+    def test_range_retrieval(self):
+        """Single ranges, including suffix and closed ones, get a 206"""
+
+        self.prepExtSrv()
+        contents = self._archive_random_file(1024)
+        for r, expected in (('0-0', contents[:1]), ('10-19', contents[10:20]),
+                            ('-100', contents[-100:]), ('1000-5000', contents[1000:]),
+                            ('-5000', contents)):
+            with contextlib.closing(self._get_ranges(8888, 'bytes=' + r)) as response:
+                self.assertEqual(206, response.status)
+                self.assertEqual(expected, response.read())
+                start = len(contents) - len(expected) if r.startswith('-') else int(r.split('-')[0])
+                self.assertEqual('bytes %d-%d/1024' % (start, start + len(expected) - 1),
+                                 response.getheader('Content-Range'))
+
+        # Through the client, both single and multiple ranges
+        self.retrieve('source', targetFile=tmp_path('part'), byteRanges=[(0, 9)])
+        with open(tmp_path('part'), 'rb') as f:
+            self.assertEqual(contents[:10], f.read())
+        self.retrieve('source', targetFile=tmp_path('part'), byteRanges=[(None, 10), (0, 9)])
+        with open(tmp_path('part'), 'rb') as f:
+            self.assertEqual(contents[:10] + contents[-10:], f.read())
+
+    def _test_multi_range_retrieval(self, port, contents):
+        response = self._get_ranges(port, 'bytes=0-9,100-199,-10')
+        with contextlib.closing(response):
+            self.assertEqual(206, response.status)
+            ctype = ngamsLib.parseHttpHdr(response.getheader('Content-Type'))
+            self.assertIn('multipart/byteranges', ctype)
+            parts = [(start, end, size, reader.read(end - start + 1))
+                     for start, end, size, reader in
+                     ngamsHttpUtils.byteranges_parts(response, ctype['boundary'])]
+            self.assertFalse(response.read())
+        size = len(contents)
+        self.assertEqual([(0, 9, size, contents[:10]),
+                          (100, 199, size, contents[100:200]),
+                          (size - 10, size - 1, size, contents[-10:])], parts)
+
+    def test_multi_range_retrieval(self):
+        self.prepExtSrv()
+        self._test_multi_range_retrieval(8888, self._archive_random_file(1024))
+
+    def test_unsatisfiable_range(self):
+        self.prepExtSrv()
+        self._archive_random_file(1024)
+        for r in ('1024-', '2000-3000,4000-', '-0'):
+            with contextlib.closing(self._get_ranges(8888, 'bytes=' + r)) as response:
+                self.assertEqual(416, response.status)
+                self.assertEqual('bytes */1024', response.getheader('Content-Range'))
+                response.read()
+        status = self.retrieve_fail('source', targetFile=tmp_path('part'), byteRanges=[(2000, None)])
+        self.assertIn('not satisfiable', status.getMessage())
+
+    def test_if_range(self):
+        """Ranges are honoured only if If-Range matches the file's validators"""
+
+        self.prepExtSrv()
+        contents = self._archive_random_file(1024)
+        with contextlib.closing(self._get_ranges(8888, 'bytes=0-9')) as response:
+            response.read()
+            etag = response.getheader('ETag')
+            last_modified = response.getheader('Last-Modified')
+        self.assertTrue(etag)
+        self.assertTrue(last_modified)
+
+        for if_range, status, expected in ((etag, 206, contents[:10]),
+                                           (last_modified, 206, contents[:10]),
+                                           ('"other"', 200, contents),
+                                           ('Thu, 01 Jan 1970 00:00:00 GMT', 200, contents)):
+            response = self._get_ranges(8888, 'bytes=0-9', **{'If-Range': if_range})
+            with contextlib.closing(response):
+                self.assertEqual(status, response.status)
+                self.assertEqual(expected, response.read())
+
+    def _archive_for_mretrieve(self, n_files, prefix='mretrieve', *port):
+        contents = {}
+        for i in range(n_files):
+            name = '%s_%d' % (prefix, i)
+            contents[name] = os.urandom(1000 + i)
+            with open(tmp_path(name), 'wb') as f:
+                f.write(contents[name])
+            self.archive(*(port + (tmp_path(name),)), mimeType='application/octet-stream')
+        return contents
+
+    def _check_mretrieved(self, tgt_dir, contents):
+        self.assertEqual(sorted(contents), sorted(os.listdir(tgt_dir)))
+        for name, data in contents.items():
+            with open(os.path.join(tgt_dir, name), 'rb') as f:
+                self.assertEqual(data, f.read())
+
+    def _test_mretrieve(self, as_tar):
+
+        self.prepExtSrv()
+        contents = self._archive_for_mretrieve(5)
+        tgt_dir = tmp_path("mretrieved")
+        os.mkdir(tgt_dir)
+        self.mretrieve(list(contents), targetDir=tgt_dir, as_tar=as_tar)
+        if not as_tar:
+            tgt_dir = os.path.join(tgt_dir, 'mretrieve')
+        self._check_mretrieved(tgt_dir, contents)
+
+    def test_mretrieve_mime(self):
+        self._test_mretrieve(False)
+
+    def test_mretrieve_tar(self):
+        self._test_mretrieve(True)
+
+    def test_mretrieve_versions(self):
+        """Files requested in more than one version get it in their names"""
+
+        self.prepExtSrv()
+        v1 = self._archive_for_mretrieve(1)['mretrieve_0']
+        v2 = self._archive_for_mretrieve(1)['mretrieve_0']
+        tgt_dir = tmp_path("mretrieved")
+        os.mkdir(tgt_dir)
+        self.mretrieve([('mretrieve_0', 1), 'mretrieve_0'], targetDir=tgt_dir)
+        self._check_mretrieved(tgt_dir, {'mretrieve_0.1': v1, 'mretrieve_0.2': v2})
+
+    def test_mretrieve_unknown_file(self):
+        self.prepExtSrv()
+        self._archive_for_mretrieve(2)
+        for files in (['mretrieve_0', 'unknown'], [('mretrieve_1', 2)]):
+            status = self.mretrieve_fail(files, targetDir=tmp_path())
+            self.assertIn('NGAMS_ER_UNAVAIL_FILE', status.getMessage())
+
+    def test_mretrieve_in_cluster(self):
+        """Files from different servers are relayed by the contacted server"""
+
+        self.prepCluster((8000, 8011))
+        contents = self._archive_for_mretrieve(2, 'local', 8000)
+        contents.update(self._archive_for_mretrieve(4, 'remote', 8011))
+        tgt_dir = tmp_path("mretrieved")
+        os.mkdir(tgt_dir)
+        self.mretrieve(8000, list(contents), targetDir=tgt_dir, as_tar=True)
+        self._check_mretrieved(tgt_dir, contents)
+
+    def test_location_cache(self):
+        """Repeated retrievals hit the cache, but see newly archived versions"""
+
+        self.prepExtSrv()
+        v1 = self._archive_random_file(100)
+        for _ in range(3):
+            self.retrieve('source', targetFile=tmp_path('retrieved'))
+            with open(tmp_path('retrieved'), 'rb') as f:
+                self.assertEqual(v1, f.read())
+        status = self.get_status('STATUS', pars=[['location_cache', 1]])
+        self.assertIn('hits=2', status.getMessage())
+
+        # The new version invalidates the cached location of the previous one
+        v2 = self._archive_random_file(200)
+        self.retrieve('source', targetFile=tmp_path('retrieved'))
+        with open(tmp_path('retrieved'), 'rb') as f:
+            self.assertEqual(v2, f.read())
+        self.retrieve('source', targetFile=tmp_path('retrieved'), fileVersion=1)
+        with open(tmp_path('retrieved'), 'rb') as f:
+            self.assertEqual(v1, f.read())
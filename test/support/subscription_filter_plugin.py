@@ -0,0 +1,11 @@
+from logging import getLogger
+
+log = getLogger(__name__)
+
+# The (parameters, file ID, file version) of each invocation
+invocations = []
+
+def subscription_filter_plugin(srvObj, plugInPars, filename, fileId, fileVersion):
+    log.info("Using subscription filter plugin")
+    invocations.append((plugInPars, fileId, fileVersion))
+    return fileVersion % 2 == int(plugInPars)
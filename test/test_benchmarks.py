@@ -0,0 +1,57 @@
+#
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2019
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+#
+"""Tests for the benchmarks' machinery"""
+
+import unittest
+
+from .benchmarks import benchmarks
+
+
+class BenchmarksTests(unittest.TestCase):
+
+    def test_percentile(self):
+        values = list(range(100, 0, -1))
+        self.assertEqual(50, benchmarks.percentile(values, 50))
+        self.assertEqual(99, benchmarks.percentile(values, 99))
+        self.assertEqual(100, benchmarks.percentile(values, 100))
+        self.assertEqual(1, benchmarks.percentile(values, 0))
+        self.assertEqual(7, benchmarks.percentile([7], 90))
+
+    def test_compare(self):
+        """Only metrics worse than their baseline beyond the tolerance are reported"""
+
+        baseline = {'results': {'bench_a': {'X_mb_per_s': 100, 'X_p50_ms': 10},
+                                'bench_b': {'error': 'failed'}}}
+        results = {'results': {'bench_a': {'X_mb_per_s': 95, 'X_p50_ms': 10.5},
+                               'bench_b': {'Y_files_per_s': 1},
+                               'bench_c': {'Z_files_per_s': 1}}}
+        self.assertEqual([], benchmarks.compare(results, baseline, 0.1))
+
+        results['results']['bench_a'] = {'X_mb_per_s': 80, 'X_p50_ms': 12}
+        self.assertEqual([('bench_a', 'X_mb_per_s', 100, 80),
+                          ('bench_a', 'X_p50_ms', 10, 12)],
+                         benchmarks.compare(results, baseline, 0.1))
+        self.assertEqual([], benchmarks.compare(results, baseline, 0.25))
+
+    def test_all_benchmarks(self):
+        self.assertIn('bench_archive_small', benchmarks.all_benchmarks())
+        self.assertIn('bench_datacheck', benchmarks.all_benchmarks())
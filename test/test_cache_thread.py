@@ -22,22 +22,24 @@
 
 import time
 
-from .ngamsTestLib import ngamsTestSuite
+from ngamsServer import ngamsCacheControlThread
+from .ngamsTestLib import ngamsTestSuite, tmp_path
 
 
 class ngamsCacheThreadTest(ngamsTestSuite):
     """Unit tests for the cache thread logic"""
 
-    def get_cache_cfg(self, period, max_cache_size, check):
+    def get_cache_cfg(self, period, max_cache_size, check, **kwargs):
         cfg = [('Enable', '1'), ('Period', period), ('CheckCanBeDeleted', int(check))]
         if max_cache_size is not None:
             cfg.append(('MaxCacheSize', str(max_cache_size)))
+        cfg += [(k, str(v)) for k, v in kwargs.items()]
 
         # Enable the cache thread, but only trigger it when we hit 1 GB (which we won't)
         return [('NgamsCfg.Caching[1].%s' % k, v) for k, v in cfg]
 
-    def start_cache_server(self, period, max_cache_size=None, check=False):
-        cfg = self.get_cache_cfg(period, max_cache_size, check)
+    def start_cache_server(self, period, max_cache_size=None, check=False, **kwargs):
+        cfg = self.get_cache_cfg(period, max_cache_size, check, **kwargs)
         return self.prepExtSrv(cfgProps=cfg)
 
     def test_registered_in_cache(self):
@@ -77,4 +79,81 @@ class ngamsCacheThreadTest(ngamsTestSuite):
         self._test_delete_from_cache(False)
 
     def test_dont_delete_from_cache(self):
-        self._test_delete_from_cache(True)
\ No newline at end of file
+        self._test_delete_from_cache(True)
+    def _test_eviction_policy(self, policy, expected):
+        """Retrieved files stay longer in the cache with the LRU policy"""
+
+        _, db = self.start_cache_server('0T00:00:01', MaxFiles=2, EvictionPolicy=policy)
+        # Files archived in different iterations of the cache thread
+        # enter the cache at different times
+        for name in ('file-1', 'file-2'):
+            self.archive_data(b'data', name, 'application/octet-stream', cmd='QARCHIVE')
+            time.sleep(2)
+        self.retrieve('file-1', targetFile=tmp_path())
+        self.archive_data(b'data', 'file-3', 'application/octet-stream', cmd='QARCHIVE')
+        time.sleep(3)
+
+        res = db.query2('SELECT file_id FROM ngas_cache')
+        self.assertEqual(expected, set(x[0] for x in res))
+
+    def test_fifo_eviction(self):
+        self._test_eviction_policy('FIFO', {'file-2', 'file-3'})
+
+    def test_lru_eviction(self):
+        self._test_eviction_policy('LRU', {'file-1', 'file-3'})
+
+
+class CacheIndexTest(ngamsTestSuite):
+    """Unit tests for the index of the cache contents"""
+
+    def _index(self, policy):
+        index = ngamsCacheControlThread.CacheIndex(policy)
+        for i, size in enumerate((30, 10, 20)):
+            index.add(('disk-id', 'file-%d' % i, 1), size, 100. + i)
+        return index
+
+    def _file_ids(self, keys):
+        return [key[1] for key in keys]
+
+    def test_totals(self):
+        index = self._index('FIFO')
+        self.assertEqual(3, len(index))
+        self.assertEqual(60, index.total_size)
+        index.set_size(('disk-id', 'file-0', 1), 5)
+        index.remove(('disk-id', 'file-1', 1))
+        index.remove(('disk-id', 'file-1', 1))
+        self.assertEqual(2, len(index))
+        self.assertEqual(25, index.total_size)
+        self.assertNotIn(('disk-id', 'file-1', 1), index)
+
+    def test_expired(self):
+        index = self._index('LRU')
+        index.access('file-0', 1, when=200.)
+        self.assertEqual(['file-0', 'file-1'], self._file_ids(index.expired(102, 10)))
+        self.assertEqual(['file-0'], self._file_ids(index.expired(102, 1)))
+        index.remove(('disk-id', 'file-0', 1))
+        self.assertEqual(['file-1', 'file-2'], self._file_ids(index.expired(103, 10)))
+
+    def test_policies(self):
+        for policy, expected in (('FIFO', ['file-0', 'file-1', 'file-2']),
+                                 ('LRU', ['file-2', 'file-1', 'file-0']),
+                                 ('LFU', ['file-2', 'file-0', 'file-1']),
+                                 ('SIZE', ['file-0', 'file-2', 'file-1'])):
+            index = self._index(policy)
+            index.access('file-1', 1, when=200.)
+            index.access('file-1', 1, when=201.)
+            index.access('file-0', 1, when=300.)
+            self.assertEqual(expected, self._file_ids(index.candidates(10)), policy)
+            # Candidates stay in the index until removed
+            self.assertEqual(expected, self._file_ids(index.candidates(10)), policy)
+            exclude = {('disk-id', expected[0], 1)}
+            self.assertEqual(expected[1:2], self._file_ids(index.candidates(1, exclude)), policy)
+
+    def test_accessed(self):
+        index = self._index('LFU')
+        index.add(('other-disk', 'file-0', 1), 1, 100.)
+        index.access('file-0', 1, when=200.)
+        index.access('file-0', 1, when=300.)
+        self.assertEqual({(300., 2, ('disk-id', 'file-0', 1)), (300., 2, ('other-disk', 'file-0', 1))},
+                         set(index.pop_accessed()))
+        self.assertEqual([], index.pop_accessed())
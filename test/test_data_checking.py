@@ -31,9 +31,13 @@
 This module contains the Test Suite for the Data Consistency Checking Thread.
 """
 
+import functools
 import os
+import re
 import time
 
+from ngamsLib import ngamsDbm
+from ngamsLib.ngamsCore import NGAMS_CACHE_DIR, NGAMS_DATA_CHECK_THR
 from .ngamsTestLib import ngamsTestSuite, tmp_path
 
 
@@ -61,6 +65,7 @@ class ngamsDataCheckingThreadTest(ngamsTestSuite):
                ("NgamsCfg.DataCheckThread[1].MinCycle", "0T00:00:00"),
                ("NgamsCfg.Log[1].LocalLogLevel", "4"),
                ("NgamsCfg.Db[1].Snapshot", "0"))
+        cfg += tuple(kwargs.pop('cfgProps', ()))
         return self.prepExtSrv(cfgProps=cfg, *args, **kwargs)
 
     def wait_and_count_checked_files(self, cfg, db, checked, unregistered, bad):
@@ -85,6 +90,7 @@ class ngamsDataCheckingThreadTest(ngamsTestSuite):
                     self.assertEqual(checked, nfiles_checked)
                     self.assertEqual(unregistered, nfiles_unregistered)
                     self.assertEqual(bad, nfiles_bad)
+                    check_time = float(re.search(r"checking: ([0-9.]+)s", line).group(1))
                     found = True
             time.sleep(0.5)
         if not found:
@@ -93,8 +99,10 @@ class ngamsDataCheckingThreadTest(ngamsTestSuite):
 
         db_bad = db.query2("SELECT count(*) FROM ngas_files WHERE file_status LIKE '1%'")[0][0]
         self.assertEqual(bad, db_bad)
+        return check_time
 
-    def _test_data_check_thread(self, registered, unregistered, bad, corrupt=None):
+    def _test_data_check_thread(self, registered, unregistered, bad, corrupt=None,
+                                cfgProps=()):
 
         # Start the server normally without the datacheck thread
         # and perform some archives. Turn off snapshoting also,
@@ -109,12 +117,21 @@ class ngamsDataCheckingThreadTest(ngamsTestSuite):
                 corrupt(cfg, db)
 
         # Restart and see what does the data checker thread find
-        cfg, db = self.restart_last_server(before_restart=before_restart, start=self.start_srv)
-        self.wait_and_count_checked_files(cfg, db, registered, unregistered, bad)
+        start = functools.partial(self.start_srv, cfgProps=cfgProps)
+        cfg, db = self.restart_last_server(before_restart=before_restart, start=start)
+        return self.wait_and_count_checked_files(cfg, db, registered, unregistered, bad)
 
     def test_normal_case(self):
         self._test_data_check_thread(6, 0, 0)
 
+    def test_throttled(self):
+        cfg = (("NgamsCfg.DataCheckThread[1].MaxRate", "1"),
+               ("NgamsCfg.DataCheckThread[1].IdleIoPrio", "1"),
+               ("NgamsCfg.DataCheckThread[1].DropCache", "1"),
+               ("NgamsCfg.DataCheckThread[1].CycleDuration", "00:00:05"))
+        check_time = self._test_data_check_thread(6, 0, 0, cfgProps=cfg)
+        self.assertGreaterEqual(check_time, 4.5)
+
     def test_unregistered(self):
 
         # Manually copy a file into the disk. We need to manually prepare the
@@ -164,4 +181,19 @@ class ngamsDataCheckingThreadTest(ngamsTestSuite):
                    'AND file_version = 1')
             db.query2(sql, args=('123', 'TEST.2001-05-08T15:25:00.123'))
 
-        self._test_data_check_thread(6, 0, 2, corrupt=change_checksum)
\ No newline at end of file
+        self._test_data_check_thread(6, 0, 2, corrupt=change_checksum)
+
+    def test_resume(self):
+
+        # Pretend a previous check of one of the disks was interrupted
+        # after checking the first version of the file
+        def interrupt_check(cfg, db):
+            sql = "SELECT disk_id, file_id FROM ngas_files WHERE file_version = 1"
+            disk_id, file_id = db.query2(sql)[0]
+            cursors = os.path.join(cfg.getRootDirectory(), NGAMS_CACHE_DIR,
+                                   NGAMS_DATA_CHECK_THR + "_CURSORS")
+            dbm = ngamsDbm.ngamsDbm(cursors, writePerm=1)
+            dbm.add(disk_id, ((file_id, 1), []), sync=1)
+            del dbm
+
+        self._test_data_check_thread(5, 0, 0, corrupt=interrupt_check)
@@ -20,8 +20,9 @@
 #    MA 02111-1307  USA
 #
 
-from ngamsLib import ngamsDb, ngamsDiskInfo, ngamsFileInfo
+from ngamsLib import ngamsDb, ngamsDbCore, ngamsDiskInfo, ngamsFileInfo
 from test import ngamsTestLib
+from test.ngamsTestLib import tmp_root
 
 class DbTests(ngamsTestLib.ngamsTestSuite):
 
@@ -48,3 +49,85 @@ class DbTests(ngamsTestLib.ngamsTestSuite):
         file_info.write('host-id', self.db, genSnapshot=0)
         res = list(self.db.getFileInfoList('disk-id', fileId="*"))
         self.assertEqual(1, len(res))
+
+    def test_write_file_entries(self):
+        """Files and the counters of their disk are written in bulk"""
+
+        disk_info = ngamsDiskInfo.ngamsDiskInfo()
+        disk_info.setDiskId('disk-id')
+        disk_info.setMountPoint(tmp_root)
+        disk_info.setNumberOfFiles(0).setBytesStored(0)
+        disk_info.write(self.db)
+
+        def file_info(file_id, version, checksum):
+            return ngamsFileInfo.ngamsFileInfo().\
+                   setDiskId('disk-id').setFileId(file_id).\
+                   setFileVersion(version).setChecksum(checksum).\
+                   setFileSize(10)
+
+        self.db.writeFileEntries('host-id', [file_info('file-1', 1, '1'),
+                                             file_info('file-2', 1, '2'),
+                                             file_info('file-2', 2, '3')],
+                                 genSnapshot=0, updateDiskInfo=1)
+        self.db.writeFileEntries('host-id', [file_info('file-2', 2, '4'),
+                                             file_info('file-3', 1, '5')],
+                                 genSnapshot=0, updateDiskInfo=1)
+
+        res = self.db.getFileInfoList('disk-id', fileId="*")
+        res = sorted((ngamsFileInfo.ngamsFileInfo().unpackSqlResult(r) for r in res),
+                     key=lambda fio: (fio.getFileId(), fio.getFileVersion()))
+        self.assertEqual([('file-1', 1, '1'), ('file-2', 1, '2'),
+                          ('file-2', 2, '4'), ('file-3', 1, '5')],
+                         [(fio.getFileId(), fio.getFileVersion(), fio.getChecksum())
+                          for fio in res])
+
+        disk_info = ngamsDiskInfo.ngamsDiskInfo().read(self.db, 'disk-id')
+        self.assertEqual(4, disk_info.getNumberOfFiles())
+        self.assertEqual(50, disk_info.getBytesStored())
+
+    def test_file_summary_by_disk(self):
+        """Files of a disk are read in pages, optionally from a given file"""
+
+        disk_info = ngamsDiskInfo.ngamsDiskInfo()
+        disk_info.setDiskId('disk-id')
+        disk_info.setMountPoint(tmp_root)
+        disk_info.write(self.db)
+
+        files = [('file-%d' % i, v) for i in range(1, 4) for v in (1, 2)]
+        self.db.writeFileEntries('host-id',
+                                 [ngamsFileInfo.ngamsFileInfo().\
+                                  setDiskId('disk-id').setFileId(file_id).\
+                                  setFileVersion(version).setIgnore(version == 2)
+                                  for file_id, version in files],
+                                 genSnapshot=0)
+
+        def summary(**kwargs):
+            return [(r[ngamsDbCore.SUM1_FILE_ID], r[ngamsDbCore.SUM1_VERSION])
+                    for r in self.db.getFileSummary1ByDisk('disk-id', **kwargs)]
+
+        for page_size in (1, 2, 4, 6, 10):
+            self.assertEqual(files, summary(page_size=page_size))
+        self.assertEqual(files[3:], summary(after=files[2], page_size=2))
+        self.assertEqual(files[:3], summary(upto=files[2], page_size=2))
+        self.assertEqual([], summary(after=files[-1]))
+
+    def test_file_statuses(self):
+        """The status of several files is read at once"""
+
+        disk_info = ngamsDiskInfo.ngamsDiskInfo()
+        disk_info.setDiskId('disk-id')
+        disk_info.setMountPoint(tmp_root)
+        disk_info.write(self.db)
+
+        self.db.writeFileEntries('host-id',
+                                 [ngamsFileInfo.ngamsFileInfo().\
+                                  setDiskId('disk-id').setFileId('file-%d' % i).\
+                                  setFileVersion(1).setFileStatus('0000000%d' % (i % 2))
+                                  for i in range(5)],
+                                 genSnapshot=0)
+
+        refs = [('disk-id', 'file-%d' % i, 1) for i in (1, 2, 7)]
+        refs.append(('other-disk', 'file-3', 1))
+        self.assertEqual({('disk-id', 'file-1', 1): '00000001',
+                          ('disk-id', 'file-2', 1): '00000000'},
+                         self.db.getFileStatuses(refs, batchSize=2))
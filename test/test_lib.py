@@ -20,9 +20,12 @@
 #    MA 02111-1307  USA
 #
 
+import logging
+import threading
+import time
 import unittest
 
-from ngamsLib import ngamsCore, ngamsLib
+from ngamsLib import logutils, metrics, ngamsCore, ngamsHttpUtils, ngamsLib, utils
 
 class NgamsLibTests(unittest.TestCase):
 
@@ -44,4 +47,131 @@ class NgamsLibTests(unittest.TestCase):
         """Double-checks that filenames are properly escaped"""
 
         self.assertEqual('_', ngamsCore.to_valid_filename('?'))
-        self.assertEqual('__', ngamsCore.to_valid_filename('??'))
\ No newline at end of file
+        self.assertEqual('__', ngamsCore.to_valid_filename('??'))
+
+    def test_buffer_pool(self):
+        """Buffers are reused, and only up to max_idle_per_size are kept"""
+
+        pool = utils.buffer_pool(max_idle_per_size=2)
+        buffs = [pool.get(10) for _ in range(3)]
+        self.assertEqual(3, len(set(id(b) for b in buffs)))
+        for b in buffs:
+            self.assertEqual(10, len(b))
+            pool.put(b)
+        self.assertEqual(2, pool.idle_count)
+
+        with pool.buffer(10) as b:
+            self.assertEqual(10, len(b))
+            self.assertEqual(1, pool.idle_count)
+        self.assertEqual(2, pool.idle_count)
+
+        # Different sizes are kept separately
+        self.assertEqual(20, len(pool.get(20)))
+        self.assertEqual(2, pool.idle_count)
+
+    def test_token_bucket(self):
+        """Consumers are asked to wait as long as needed to keep under the rate"""
+
+        bucket = utils.token_bucket(100)
+        self.assertAlmostEqual(0.5, bucket.consume(50), places=2)
+        self.assertAlmostEqual(1.5, bucket.consume(100), places=2)
+
+        # Bursts are limited to one second's worth of tokens
+        bucket._last -= 10
+        self.assertEqual(0, bucket.consume(50))
+        self.assertAlmostEqual(0.5, bucket.consume(100), places=2)
+
+    def test_metrics(self):
+        """Metrics are rendered using the Prometheus text exposition format"""
+
+        registry = metrics.registry()
+        requests = registry.counter('requests_total', 'Requests', ('command',))
+        requests.inc(command='STATUS')
+        requests.inc(2, command='QUERY')
+        self.assertIs(requests, registry.counter('requests_total', 'Requests', ('command',)))
+        self.assertRaises(ValueError, requests.inc, cmd='STATUS')
+        self.assertRaises(ValueError, registry.gauge, 'requests_total', 'Requests')
+        registry.gauge('active', 'Active "requests"', function=lambda: 3)
+        duration = registry.histogram('duration_seconds', 'Duration', buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 5):
+            duration.observe(value)
+        self.assertEqual((4, 5.65), duration.get())
+
+        self.assertEqual('''# HELP requests_total Requests
+# TYPE requests_total counter
+requests_total{command="STATUS"} 1.0
+requests_total{command="QUERY"} 2.0
+# HELP active Active "requests"
+# TYPE active gauge
+active 3.0
+# HELP duration_seconds Duration
+# TYPE duration_seconds histogram
+duration_seconds_bucket{le="0.1"} 2.0
+duration_seconds_bucket{le="1.0"} 3.0
+duration_seconds_bucket{le="+Inf"} 4.0
+duration_seconds_sum 5.65
+duration_seconds_count 4.0
+''', registry.render())
+
+    def test_async_log_handler(self):
+        """Records are written by a separate thread, and dropped if too many are queued"""
+
+        class blocking_handler(logging.Handler):
+            def __init__(self):
+                logging.Handler.__init__(self, logging.INFO)
+                self.records = []
+                self.unblocked = threading.Event()
+            def emit(self, record):
+                self.unblocked.wait()
+                self.records.append(record.getMessage())
+
+        inner = blocking_handler()
+        handler = logutils.AsyncHandler([inner], maxsize=2)
+        logger = logging.getLogger('test_async_log_handler')
+        logger.propagate = False
+        logger.setLevel(logging.DEBUG)
+        logger.addHandler(handler)
+        try:
+            # The writer thread blocks on the first record, two more
+            # fill up the queue, and the rest are dropped
+            logger.warning('record 0')
+            while not handler.queue.empty():
+                time.sleep(0.01)
+            logger.debug('below the level of the inner handler')
+            for i in range(1, 10):
+                logger.warning('record %d', i)
+            self.assertEqual(8, handler.dropped)
+            inner.unblocked.set()
+        finally:
+            logger.removeHandler(handler)
+            handler.close()
+        self.assertEqual(['record 0', 'record 1',
+                          'Dropped 8 log records because the logging queue was full'],
+                         inner.records)
+
+    def test_range_header_parsing(self):
+        """Range headers are parsed following RFC 7233"""
+
+        parse = ngamsHttpUtils.parse_range_header
+        self.assertEqual([(0, None)], parse('bytes=0-'))
+        self.assertEqual([(0, 1), (None, 5), (10, None)], parse('bytes=0-1, -5 ,10-'))
+        self.assertEqual([(3, 3)], parse('bytes=3-3,'))
+        for invalid in ('0-1', 'lines=0-1', 'bytes=', 'bytes=-', 'bytes=a-',
+                        'bytes=0', 'bytes=-100-', 'bytes=5-2', 'bytes=+1-2'):
+            self.assertRaises(ValueError, parse, invalid)
+
+        for ranges in ([(0, None)], [(0, 1), (None, 5), (10, None)]):
+            self.assertEqual(ranges, parse(ngamsHttpUtils.format_range_header(ranges)))
+
+    def test_satisfiable_ranges(self):
+        """Ranges are resolved against the size of the data, and coalesced"""
+
+        resolve = ngamsHttpUtils.satisfiable_ranges
+        self.assertEqual([(0, 99)], resolve([(0, None)], 100))
+        self.assertEqual([(90, 99)], resolve([(None, 10)], 100))
+        self.assertEqual([(0, 99)], resolve([(None, 1000)], 100))
+        self.assertEqual([(50, 99)], resolve([(50, 1000)], 100))
+        self.assertEqual([], resolve([(100, None), (None, 0)], 100))
+        self.assertEqual([], resolve([(0, None)], 0))
+        self.assertEqual([(0, 9), (90, 99)], resolve([(None, 10), (0, 9), (200, 300)], 100))
+        self.assertEqual([(0, 20)], resolve([(10, 20), (0, 9), (5, 15)], 100))
@@ -0,0 +1,86 @@
+#
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2019
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+#
+import time
+import unittest
+
+from ngamsServer import location_cache
+
+
+class LocationCacheTest(unittest.TestCase):
+
+    def test_lru(self):
+        cache = location_cache.location_cache(2, 60)
+        cache.put(('a', -1), 'loc_a')
+        cache.put(('b', -1), 'loc_b')
+        self.assertEqual('loc_a', cache.get(('a', -1)))
+
+        # b is the least recently used entry now
+        cache.put(('c', -1), 'loc_c')
+        self.assertIsNone(cache.get(('b', -1)))
+        self.assertEqual('loc_a', cache.get(('a', -1)))
+        self.assertEqual('loc_c', cache.get(('c', -1)))
+        self.assertEqual({'hits': 3, 'misses': 1, 'invalidations': 0, 'size': 2},
+                         cache.stats())
+
+    def test_ttl(self):
+        cache = location_cache.location_cache(10, 0.1)
+        cache.put(('a', -1), 'loc_a')
+        self.assertEqual('loc_a', cache.get(('a', -1)))
+        time.sleep(0.2)
+        self.assertIsNone(cache.get(('a', -1)))
+        self.assertEqual(0, cache.stats()['size'])
+
+    def test_invalidation(self):
+        cache = location_cache.location_cache(10, 60)
+        for key in (('a', -1), ('a', 2), ('b', -1)):
+            cache.put(key, 'loc')
+        cache.invalidate('a')
+        self.assertIsNone(cache.get(('a', -1)))
+        self.assertIsNone(cache.get(('a', 2)))
+        self.assertEqual('loc', cache.get(('b', -1)))
+        cache.clear()
+        self.assertIsNone(cache.get(('b', -1)))
+        self.assertEqual(2, cache.stats()['invalidations'])
+
+    def test_disabled(self):
+        cache = location_cache.location_cache(0, 60)
+        cache.put(('a', -1), 'loc_a')
+        self.assertIsNone(cache.get(('a', -1)))
+        self.assertEqual(0, cache.stats()['size'])
+
+    def test_db_change_events(self):
+        """Only disk changes clear the cache"""
+
+        def trigger_events(evt, event_info=None):
+            # Like ngamsDbCore.triggerEvents does
+            if event_info:
+                evt.addEventInfo(event_info)
+            if not evt.isSet():
+                evt.set()
+
+        cache = location_cache.location_cache(10, 60)
+        cache.put(('a', -1), 'loc')
+        trigger_events(cache.db_change_listener)
+        trigger_events(cache.db_change_listener, ['disk-id', None])
+        self.assertEqual('loc', cache.get(('a', -1)))
+        trigger_events(cache.db_change_listener, ['disk-id', '/mount/point'])
+        self.assertIsNone(cache.get(('a', -1)))
@@ -188,4 +188,24 @@ class ngamsMIMEMultipartTest(ngamsTestLib.ngamsTestSuite):
         message = message.getvalue()
         mlen = len(message)
 
-        self.assertEqual(mlen, rlen)
\ No newline at end of file
+        self.assertEqual(mlen, rlen)
+    def test_FilesystemWriterHandler(self):
+        """Files are written back exactly as they were, regardless of the reading size"""
+
+        message = self._createMIMEMessage(False)
+        contents = {}
+        for myfile in self.myfiles:
+            with open(myfile, 'rb') as f:
+                contents[myfile] = f.read()
+
+        for size in (1, 7, 64, 100, 1024, 65536):
+            basePath = tempfile.mkdtemp(dir=ngamsTestLib.tmp_root)
+            handler = ngamsMIMEMultipart.FilesystemWriterHandler(16, True, basePath=basePath)
+            parser = ngamsMIMEMultipart.MIMEMultipartParser(handler, io.BytesIO(message), len(message), size)
+            parser.parse()
+
+            self.assertEqual(len(self.myfiles), len(handler.getFileDataList()))
+            for myfile in self.myfiles:
+                with open(os.path.join(basePath, myfile), 'rb') as f:
+                    self.assertEqual(contents[myfile], f.read())
+            rmFile(basePath)
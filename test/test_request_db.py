@@ -19,22 +19,32 @@
 #    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
 #    MA 02111-1307  USA
 #
+import time
+
 from test import ngamsTestLib
+from ngamsLib import ngamsReqProps
 from ngamsServer import request_db
 
 
 class DummyRequest(object):
     '''Dummy request type stored during these tests'''
 
-    def __init__(self, request_id, data=None):
+    def __init__(self, request_id, data=None, last_update=None):
         self.request_id = request_id
         self.data = data or request_id
+        self.last_update = last_update
 
     def getRequestId(self):
         return self.request_id
 
+    def getCompletionTime(self):
+        return None
+
+    def getLastRequestStatUpdate(self):
+        return self.last_update
+
     def clone(self):
-        return DummyRequest(self.request_id, self.data)
+        return DummyRequest(self.request_id, self.data, self.last_update)
 
     def __eq__(self, other):
         return (other.request_id == self.request_id and
@@ -78,6 +88,16 @@ class RequestDbTestBase(object):
             self.assertIsNotNone(db.get(k))
         self.assertEqual(['0', '1', '2'], sorted(list(db.keys())))
 
+    def test_expire(self):
+        db = self.create_request_db()
+        now = time.time()
+        db.add(DummyRequest('0', last_update=now - 100))
+        db.add(DummyRequest('1', last_update=now))
+        db.add(DummyRequest('2'))
+        self.assertEqual(1, db.expire(now - 50))
+        self.assertEqual(['1', '2'], sorted(db.keys()))
+        self.assertEqual(0, db.expire(now - 50))
+
 class TestDBMRequestsDB(RequestDbTestBase, ngamsTestLib.ngamsTestSuite):
     def create_request_db(self):
         return request_db.DBMRequestDB(ngamsTestLib.genTmpFilename())
@@ -94,4 +114,93 @@ class TestNullRequestDB(ngamsTestLib.ngamsTestSuite):
         db.update()
         db.delete()
         db.get()
-        db.keys()
\ No newline at end of file
+        db.keys()
+        db.expire(time.time())
+        db.close()
+
+def _request(request_id):
+    req = ngamsReqProps.ngamsReqProps()
+    req.setRequestId(request_id)
+    req.setCmd('ARCHIVE')
+    return req
+
+class TestSQLiteRequestDB(ngamsTestLib.ngamsTestSuite):
+
+    def create_request_db(self, fname=None, sync_interval=1.0):
+        db = request_db.SQLiteRequestDB(fname or ngamsTestLib.genTmpFilename(), sync_interval)
+        self.addCleanup(db.close)
+        return db
+
+    def assert_summary(self, req, summary):
+        self.assertIsNotNone(summary)
+        self.assertEqual(req.getRequestId(), summary.getRequestId())
+        self.assertEqual(req.getCmd(), summary.getCmd())
+        self.assertEqual(req.getCompletionPercent(), summary.getCompletionPercent())
+        self.assertEqual(req.getLastRequestStatUpdate(), summary.getLastRequestStatUpdate())
+        self.assertEqual(req.getCompletionTime(), summary.getCompletionTime())
+
+    def test_full_cycle(self):
+        db = self.create_request_db()
+        self.assertEqual([], db.keys())
+        self.assertIsNone(db.get('0'))
+        db.delete(['0'])
+
+        req0, req1, req2 = (_request(str(i)) for i in range(3))
+        db.add(req0)
+        self.assert_summary(req0, db.get('0'))
+        self.assertEqual(['0'], db.keys())
+
+        # Values are the same before and after being written to the database
+        req0.setCompletionPercent(50, updateTime=1)
+        db.update(req0)
+        self.assert_summary(req0, db.get('0'))
+        db.sync()
+        self.assert_summary(req0, db.get('0'))
+        self.assertEqual(['0'], db.keys())
+
+        db.delete(['0'])
+        self.assertEqual([], db.keys())
+        self.assertIsNone(db.get('0'))
+
+        db.add(req0)
+        db.add(req1)
+        db.sync()
+        db.add(req2)
+        self.assertEqual(['0', '1', '2'], sorted(db.keys()))
+        db.delete(['0', '1', '2'])
+        self.assertEqual([], db.keys())
+
+    def test_expire(self):
+        db = self.create_request_db()
+        old, completed, recent = (_request(str(i)) for i in range(3))
+        old.setLastRequestStatUpdate()
+        completed.setCompletionTime()
+        time.sleep(0.01)
+        cutoff = time.time()
+        recent.setLastRequestStatUpdate()
+        for req in (old, completed, recent):
+            db.add(req)
+        self.assertEqual(2, db.expire(cutoff))
+        self.assertEqual(['2'], db.keys())
+        self.assertEqual(0, db.expire(cutoff))
+
+    def test_background_sync_and_persistence(self):
+        fname = ngamsTestLib.genTmpFilename()
+        db = request_db.SQLiteRequestDB(fname, sync_interval=0.1)
+        req = _request('0')
+        req.setCompletionTime()
+        db.add(req)
+
+        # The background thread writes pending requests into the database
+        deadline = time.time() + 5
+        while db._pending and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertFalse(db._pending)
+
+        db.add(_request('1'))
+        db.close()
+
+        # All requests survive a close/reopen
+        db = self.create_request_db(fname)
+        self.assert_summary(req, db.get('0'))
+        self.assertEqual(['0', '1'], sorted(db.keys()))
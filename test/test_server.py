@@ -33,6 +33,7 @@ This module contains the Test Suite for the NG/AMS Server.
 
 import contextlib
 import os
+import re
 import socket
 import subprocess
 import sys
@@ -41,6 +42,8 @@ import time
 import unittest
 import uuid
 
+from six.moves import http_client as httplib  # @UnresolvedImport
+
 from ngamsLib import ngamsHttpUtils
 from ngamsLib.ngamsCore import NGAMS_HTTP_SERVICE_NA
 from .ngamsTestLib import ngamsTestSuite, save_to_tmp, tmp_path
@@ -137,12 +140,80 @@ class ngamsServerTest(ngamsTestSuite):
         resp, _, _ = self.client._get('UNKNOWN_CMD')
         self.assertEqual(404, resp.status)
 
+    def test_async_logging_and_access_log(self):
+        cfg, _ = self.prepExtSrv(cfgProps=(('NgamsCfg.Log[1].AsyncLogging', '1'),
+                                           ('NgamsCfg.Log[1].AccessLog', '1'),
+                                           ('NgamsCfg.Log[1].LocalLogLevel', '4')))
+        self.status()
+        self.get_status('UNKNOWN_CMD', expectedStatus='FAILURE')
+
+        # Records are written by a separate thread, give it some time
+        access_lines = []
+        for _ in range(50):
+            with open(cfg.getLocalLogFile()) as f:
+                access_lines = [l for l in f if 'ngamsServer.access' in l]
+            if any('/UNKNOWN_CMD' in l for l in access_lines):
+                break
+            time.sleep(0.1)
+        self.assertTrue(any(re.search(r'"GET /STATUS\S*" 200 \d+ ', l) for l in access_lines))
+        self.assertTrue(any(re.search(r'"GET /UNKNOWN_CMD\S*" 404 \d+ ', l) for l in access_lines))
+
     @unittest.skipUnless('NGAS_MANY_STARTS_TEST' in os.environ, 'skipped by default')
     def test_many_starts(self):
         for _ in range(int(os.environ['NGAS_MANY_STARTS_TEST'])):
             self.prepExtSrv()
             self.terminateAllServer()
 
+@unittest.skipIf(sys.version_info[0] < 3, 'asyncio backend requires python 3')
+class AsyncHttpServerTest(ngamsTestSuite):
+
+    def _prep_async_srv(self, *cfgProps, **kwargs):
+        cfgProps = (('NgamsCfg.Server[1].HttpServerBackend', 'asyncio'),) + cfgProps
+        return self.prepExtSrv(cfgProps=cfgProps, **kwargs)
+
+    def test_archive_retrieve(self):
+        amount_of_data = 10*1024*1024 # 10 MBs
+        spaces = " " * amount_of_data
+        self._prep_async_srv()
+        self.archive_data(spaces, 'some-file.data', 'application/octet-stream')
+        self.retrieve(fileId='some-file.data', targetFile=tmp_path())
+        self.assertEqual(amount_of_data, os.path.getsize(tmp_path('some-file.data')))
+
+    def test_requests_are_queued(self):
+
+        save_to_tmp("handleHttpRequest_Block5secs", fname="handleHttpRequest_tmp")
+        self._prep_async_srv(('NgamsCfg.Server[1].MaxSimReqs', '2'),
+                             srvModule="test.support.ngamsSrvTestDynReqCallBack")
+
+        # Fire off two clients, each takes 5 seconds to finish
+        cl1, cl2 =  self.get_client(), self.get_client()
+        threading.Thread(target=cl1.online).start()
+        threading.Thread(target=cl2.online).start()
+
+        # The third one waits for a free worker instead of being rejected
+        time.sleep(2)
+        resp = ngamsHttpUtils.httpGet('127.0.0.1', 8888, 'STATUS', timeout=30)
+        with contextlib.closing(resp):
+            self.assertEqual(200, resp.status)
+
+    def test_too_many_connections(self):
+
+        save_to_tmp("handleHttpRequest_Block5secs", fname="handleHttpRequest_tmp")
+        self._prep_async_srv(('NgamsCfg.Server[1].MaxSimReqs', '1'),
+                             ('NgamsCfg.Server[1].MaxConnections', '1'),
+                             srvModule="test.support.ngamsSrvTestDynReqCallBack")
+
+        # One client is served, the other one waits
+        cl1, cl2 =  self.get_client(), self.get_client()
+        threading.Thread(target=cl1.online).start()
+        threading.Thread(target=cl2.online).start()
+
+        # The third one should not pass through
+        time.sleep(2)
+        resp = ngamsHttpUtils.httpGet('127.0.0.1', 8888, 'ONLINE')
+        with contextlib.closing(resp):
+            self.assertEqual(NGAMS_HTTP_SERVICE_NA, resp.status)
+
 class ngamsDaemonTest(ngamsTestSuite):
 
     def _run_daemon_cmd(self, cfg_file, cmd):
@@ -186,6 +257,57 @@ class _ReqDbTests(object):
         self.archive_data(spaces, 'some-file.data', 'application/octet-stream')
         self.retrieve(fileId='some-file.data', targetFile=tmp_path())
 
-for db in ('null', 'memory', 'bsddb'):
+for db in ('null', 'memory', 'bsddb', 'sqlite'):
     name = 'ReqDbTests_%s' % db
     locals()[name] = type(name, (ngamsTestSuite, _ReqDbTests,), {'db': db})
+
+class _KeepAliveTests(object):
+
+    def _prep_srv(self, keep_alive_timeout='5'):
+        self.prepExtSrv(cfgProps=(('NgamsCfg.Server[1].HttpServerBackend', self.backend),
+                                  ('NgamsCfg.Server[1].KeepAliveTimeout', keep_alive_timeout)))
+
+    def _get_status_twice(self):
+        conn = httplib.HTTPConnection('127.0.0.1', 8888, timeout=10)
+        with contextlib.closing(conn):
+            conn.request('GET', '/STATUS')
+            resp = conn.getresponse()
+            self.assertEqual(200, resp.status)
+            resp.read()
+            sock = conn.sock
+            conn.request('GET', '/STATUS')
+            resp = conn.getresponse()
+            self.assertEqual(200, resp.status)
+            resp.read()
+            return sock is not None and sock is conn.sock
+
+    def test_keep_alive(self):
+        self._prep_srv()
+        self.assertTrue(self._get_status_twice())
+
+        # Data sent after a request should not break the next one
+        self.archive_data(b'some data', 'some-file.data', 'application/octet-stream')
+        self.retrieve(fileId='some-file.data', targetFile=tmp_path())
+        self.assertTrue(self._get_status_twice())
+
+    def test_keep_alive_disabled(self):
+        self._prep_srv(keep_alive_timeout='0')
+        self.assertFalse(self._get_status_twice())
+
+    def test_connection_pool_status(self):
+        self._prep_srv()
+        reused = ngamsHttpUtils.pool.reused
+        for _ in range(3):
+            resp = ngamsHttpUtils.httpGet('127.0.0.1', 8888, 'STATUS')
+            with contextlib.closing(resp):
+                resp.read()
+        self.assertGreaterEqual(ngamsHttpUtils.pool.reused - reused, 2)
+        status = self.status(pars=[('http_pool', '1')])
+        self.assertIn('HTTP connection pool', status.getMessage())
+
+for backend in ('threads', 'asyncio'):
+    name = 'KeepAliveTests_%s' % backend
+    cls = type(name, (ngamsTestSuite, _KeepAliveTests,), {'backend': backend})
+    if backend == 'asyncio':
+        cls = unittest.skipIf(sys.version_info[0] < 3, 'asyncio backend requires python 3')(cls)
+    locals()[name] = cls
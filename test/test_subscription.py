@@ -42,9 +42,11 @@ import six
 import requests
 import trustme
 
-from ngamsLib import ngamsHttpUtils
+from ngamsLib import ngamsHttpUtils, ngamsDb, ngamsDbCore, ngamsSubscriber
 from ngamsLib.ngamsCore import getHostName
-from .ngamsTestLib import ngamsTestSuite, tmp_path, genTmpFilename
+from ngamsServer import ngamsSubscriptionThread
+from .ngamsTestLib import ngamsTestSuite, tmp_path, genTmpFilename, delNgasTbls
+from .support import subscription_filter_plugin
 
 try:
     import ssl
@@ -317,6 +319,42 @@ class ngamsSubscriptionTest(ngamsTestSuite):
         finally:
             subscription_listener.close()
 
+    def test_adaptive_streams(self):
+        """Files are delivered with adaptive streams, and delivery metrics are kept"""
+
+        self._prep_subscription_cluster((8888, [('NgamsCfg.SubscriptionDef[1].AdaptiveStreams', '1')], False),
+                                        (8889, [], True))
+        subscribe = functools.partial(ngamsHttpUtils.httpGet, 'localhost', 8888, 'SUBSCRIBE', timeout=5)
+        subscription_listener = self.notification_listener()
+        params = {'url': 'http://localhost:8889/QARCHIVE',
+                  'subscr_id': 'HERE-TO-THERE',
+                  'priority': 1,
+                  'start_date': '%sT00:00:00.000' % time.strftime("%Y-%m-%d"),
+                  'concurrent_threads': 4}
+        with contextlib.closing(subscribe(pars=params)) as resp:
+            self.assertEqual(resp.status, 200)
+
+        try:
+            for fname in ('SmallFile.fits', 'TinyTestFile.fits'):
+                self.qarchive(8888, 'src/' + fname, mimeType='application/octet-stream')
+                self.assertIsNotNone(subscription_listener.wait_for_file(10))
+        finally:
+            subscription_listener.close()
+
+        # Metrics are updated after the files are received on the other side
+        expected = 'ngas_subscription_delivered_files_total{subscriber="HERE-TO-THERE"} 2.0'
+        deadline = time.time() + 10
+        while True:
+            with contextlib.closing(ngamsHttpUtils.httpGet('localhost', 8888, 'METRICS', timeout=5)) as resp:
+                self.assertEqual(resp.status, 200)
+                metrics = resp.read().decode('utf-8')
+            if expected in metrics or time.time() > deadline:
+                break
+            time.sleep(0.1)
+        self.assertIn(expected, metrics)
+        self.assertIn('ngas_subscription_streams{subscriber="HERE-TO-THERE"}', metrics)
+        self.assertIn('ngas_subscription_lag_seconds{subscriber="HERE-TO-THERE"}', metrics)
+
     @unittest.skipIf(ssl is None, "Need ssl module for this test to run")
     def test_https_subscription(self):
         ca = trustme.CA()
@@ -422,3 +460,155 @@ class ngamsSubscriptionTest(ngamsTestSuite):
         self.assertEqual('SmallFile.fits', archive_evt.file_id)
 
         self.retrieve(sub_port, 'SmallFile.fits', fileVersion=2, targetFile=tmp_path())
+
+class SelectFilesToDeliverTest(ngamsTestSuite):
+
+    class _server(object):
+        def getCachingActive(self):
+            return False
+
+    def _select(self, subscribers, fileInfos, filterWorkers):
+        deliverReqDic = {}
+        status = {s.getId(): None for s in subscribers}
+        checks = [(s, f, False) for s in subscribers for f in fileInfos]
+        del subscription_filter_plugin.invocations[:]
+        ngamsSubscriptionThread._selectFilesToDeliver(self._server(), checks,
+            deliverReqDic, status, dict(status), {}, None, filterWorkers)
+        return {subscrId: [f[0] for f in files] for subscrId, files in deliverReqDic.items()}
+
+    def _test_select(self, filterWorkers):
+        plugin = 'test.support.subscription_filter_plugin'
+        subscribers = [ngamsSubscriber.ngamsSubscriber(url='http://host%d/QARCHIVE' % i,
+                                                       filterPi=plugin, filterPiPars=pars)
+                       for i, pars in enumerate(('0', '1', '1'))]
+        subscribers.append(ngamsSubscriber.ngamsSubscriber(url='http://host3/QARCHIVE'))
+        fileInfos = []
+        for i in range(10):
+            fileInfo = (len(ngamsDbCore.getNgasSummary2Def()) + 1) * [None]
+            fileInfo[:4] = ['file-%d' % i, '/tmp/file-%d' % i, i, '2020-01-01T00:00:00.000']
+            fileInfos.append(fileInfo)
+
+        delivered = self._select(subscribers, fileInfos, filterWorkers)
+        self.assertEqual(['file-%d' % i for i in range(0, 10, 2)], delivered['http://host0/QARCHIVE'])
+        self.assertEqual(['file-%d' % i for i in range(1, 10, 2)], delivered['http://host1/QARCHIVE'])
+        self.assertEqual(['file-%d' % i for i in range(1, 10, 2)], delivered['http://host2/QARCHIVE'])
+        self.assertEqual(['file-%d' % i for i in range(10)], delivered['http://host3/QARCHIVE'])
+
+        # Subscribers with the same plug-in parameters share the evaluations
+        invocations = subscription_filter_plugin.invocations
+        self.assertEqual(20, len(invocations))
+        self.assertEqual(20, len(set(invocations)))
+
+    def test_select(self):
+        self._test_select(1)
+
+    def test_select_parallel(self):
+        self._test_select(4)
+
+class PersistentSubscrQueueTest(ngamsTestSuite):
+
+    def setUp(self):
+        super(PersistentSubscrQueueTest, self).setUp()
+        cfg = self.env_aware_cfg()
+        self.point_to_sqlite_database(cfg, True)
+        self.db = ngamsDb.from_config(cfg, maxpool=1)
+        delNgasTbls(self.db)
+
+    def tearDown(self):
+        self.db.close()
+        super(PersistentSubscrQueueTest, self).tearDown()
+
+    def _file_info(self, i):
+        return ['file-%d' % i, '/tmp/file-%d' % i, 1, '2020-01-01T00:00:00.000',
+                'application/octet-stream', 'disk-id', None]
+
+    def _db_status(self, i):
+        return self.db.getSubscrQueueStatus('sub', 'file-%d' % i, 1, 'disk-id')
+
+    def test_batched_writes(self):
+        queue = ngamsSubscriptionThread.PersistentSubscrQueue(self.db, batch_size=3, flush_interval=60)
+        self.addCleanup(queue.close)
+
+        # Files are added in batches; those already queued are not added again
+        infos = [self._file_info(i) for i in range(5)]
+        self.assertEqual([True] * 5, queue.add('sub', infos))
+        self.assertEqual([False, True], queue.add('sub', [infos[0], self._file_info(5)]))
+        self.assertEqual(6, len(self.db.getSubscrQueue('sub', status=-2)))
+        queue.forget('sub')
+        self.assertEqual([False], queue.add('sub', [infos[0]]))
+
+        # Status updates are seen immediately, but written in batches
+        queue.update('sub', 'file-0', 1, 'disk-id', -1)
+        queue.update('sub', 'file-1', 1, 'disk-id', 1, 'error')
+        self.assertEqual((-1, None), queue.get('sub', 'file-0', 1, 'disk-id'))
+        self.assertEqual((1, 'error'), queue.get('sub', 'file-1', 1, 'disk-id'))
+        self.assertEqual(-2, self._db_status(0)[0])
+        queue.update('sub', 'file-1', 1, 'disk-id', 1, 'error')
+        queue.update('sub', 'file-2', 1, 'disk-id', -1)
+        self.assertEqual((-1, None), tuple(self._db_status(0)))
+        self.assertEqual((2, 'error'), tuple(self._db_status(1)))
+
+        # Comments are kept when not given, and the rest is written on close
+        queue.update('sub', 'file-1', 1, 'disk-id', 0)
+        queue.close()
+        self.assertEqual((0, 'error'), tuple(self._db_status(1)))
+
+        # Updates after closing are written immediately
+        queue.update('sub', 'file-2', 1, 'disk-id', 0, 'done')
+        self.assertEqual((0, 'done'), tuple(self._db_status(2)))
+
+    def test_periodic_flush(self):
+        queue = ngamsSubscriptionThread.PersistentSubscrQueue(self.db, batch_size=100, flush_interval=0.1)
+        self.addCleanup(queue.close)
+        queue.add('sub', [self._file_info(0)])
+        queue.update('sub', 'file-0', 1, 'disk-id', 0)
+        deadline = time.time() + 5
+        while self._db_status(0)[0] != 0 and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(0, self._db_status(0)[0])
+
+class DeliveryStreamsTest(ngamsTestSuite):
+
+    def _deliver(self, streams, nbytes, success=True, parallel=True):
+        # Uses all allowed streams (or only one if not parallel), making the
+        # last delivery end a 1-second throughput window
+        n = streams.limit if parallel else 1
+        for _ in range(n):
+            self.assertTrue(streams.acquire(timeout=0))
+        for _ in range(n - 1):
+            streams.release(0, True)
+        streams._window_start = time.time() - 1
+        streams.release(nbytes, success)
+
+    def test_fixed_streams(self):
+        streams = ngamsSubscriptionThread.DeliveryStreams(2)
+        self.assertTrue(streams.acquire(timeout=0))
+        self.assertTrue(streams.acquire(timeout=0))
+        self.assertFalse(streams.acquire(timeout=0.01))
+        streams.release(10, False)
+        self.assertEqual(2, streams.limit)
+        self.assertTrue(streams.acquire(timeout=0))
+
+    def test_adaptive_streams(self):
+        streams = ngamsSubscriptionThread.DeliveryStreams(4, adaptive=True, interval=0.5)
+        self.assertEqual(1, streams.limit)
+
+        # Grows while throughput rises, up to the maximum
+        for nbytes in (1000, 2000, 3000, 4000, 5000):
+            self._deliver(streams, nbytes)
+        self.assertEqual(4, streams.limit)
+
+        # Shrinks when throughput drops, and halves on errors
+        self._deliver(streams, 1000)
+        self.assertEqual(3, streams.limit)
+        self._deliver(streams, 0, success=False)
+        self.assertEqual(1, streams.limit)
+
+        # Doesn't grow if not all streams were in use
+        streams.set_max_streams(8)
+        self._deliver(streams, 1000)
+        self.assertEqual(2, streams.limit)
+        self._deliver(streams, 2000, parallel=False)
+        self.assertEqual(2, streams.limit)
+        streams.set_max_streams(1)
+        self.assertEqual(1, streams.limit)